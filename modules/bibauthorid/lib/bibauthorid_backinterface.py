@@ -111,12 +111,19 @@ def compare_personid_tables_easy(suffix='_copy', filename='/tmp/pid_comparison')
     f.close()
 
 def filter_bibrecs_outside(all_papers):
+    '''
+    Removes the papers which are not in ALL_PAPERS.
+    @return: the names of the signatures removed.
+    '''
     all_bibrecs = get_all_papers()
 
     to_remove = list(frozenset(all_bibrecs) - frozenset(all_papers))
     chunk = 1000
     separated = [to_remove[i: i + chunk] for i in range(0, len(to_remove), chunk)]
 
+    names = set()
     for sep in separated:
+        names |= get_names_of_papers(sep)
         remove_papers(sep)
+    return names
 
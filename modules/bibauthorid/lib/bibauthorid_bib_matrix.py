@@ -3,12 +3,24 @@ import os
 import shutil
 from cPickle import dump, load, UnpicklingError
 from invenio.bibauthorid_dbinterface import get_db_time
-import h5py
+import numpy
 
 
 class Bib_matrix(object):
     '''
     Contains the sparse matrix and encapsulates it.
+
+    Only the computed pairs of bibs are stored, as packed records of the
+    indices of both bibs and the two values of the comparison, sorted by
+    entry (see _resolve_entry), so that matrices are merged and read in
+    a single pass.  The pairs which are not stored are None.
+
+    The stored matrix is mapped in memory read-only; the new values are
+    kept in sorted runs, in memory or, when they grow too big, in
+    temporary files, which are merged into the stored matrix by store().
+    Since the entries are sorted by their second bib first, the records
+    of a run are found with the offsets of the rows of each second bib,
+    so that only O(bibs) is kept in memory for the runs on disk.
     '''
     # please increment this value every time you
     # change the output of the comparison functions
@@ -18,11 +30,16 @@ class Bib_matrix(object):
     special_symbols = dict((x[0], x[1]) for x in __special_items)
     special_numbers = dict((x[1], x[0]) for x in __special_items)
 
+    record_type = numpy.dtype([('first', '<u4'), ('second', '<u4'),
+                               ('prob', '<f4'), ('cert', '<f4')])
+    # number of records handled at once when merging runs or reading
+    # a stored matrix
+    chunk_records = 1 << 20
+    # spill the runs to disk when they hold more records than this
+    max_records_in_memory = 1 << 22
+
     def __init__(self, name, cluster_set=None, storage_dir_override=None):
         self.name = name
-        self._f = None
-        self._matrix = None
-        self._use_temporary_file = True
         self._size = None
 
         self._storage_dir_override = storage_dir_override
@@ -34,41 +51,189 @@ class Bib_matrix(object):
         else:
             self._bibmap = dict()
 
-        self._matrix = None
+        self._clear_runs()
         self.creation_time = get_db_time()
 
-    def _initialize_matrix(self):
-        self.open_h5py_file()
-        self._matrix = self._f.create_dataset("array", (self._size, 2), 'f')
-        self._matrix[...] = self.special_symbols[None]
+    def _clear_runs(self):
+        # the stored matrix, and the newer sorted runs, as (offsets, records)
+        # where the records of the second bib i are records[offsets[i]:offsets[i + 1]]
+        self._base = self._empty_run()
+        self._runs = list()
+        self._spilled = list()
+        # the latest values set one at a time, as entry -> record
+        self._pending = dict()
 
-    def _resolve_entry(self, bibs):
+    def _empty_run(self):
+        return (numpy.zeros(len(self._bibmap) + 1, dtype=numpy.int64),
+                numpy.zeros(0, dtype=self.record_type))
+
+    def _get_offsets(self, counts):
+        '''
+        @param counts: the number of records of each second bib.
+        @return: the offsets of the rows of each second bib.
+        '''
+        offsets = numpy.zeros(len(self._bibmap) + 1, dtype=numpy.int64)
+        numpy.cumsum(counts, out=offsets[1:])
+        return offsets
+
+    def _count_rows(self, records):
+        return numpy.bincount(records['second'], minlength=len(self._bibmap))
+
+    def _resolve_pair(self, bibs):
         first, second = bibs
         first, second = self._bibmap[first], self._bibmap[second]
         if first > second:
             first, second = second, first
+        return first, second
+
+    def _resolve_entry(self, bibs):
+        first, second = self._resolve_pair(bibs)
         return first + (second * second + second) / 2
 
+    @staticmethod
+    def _get_keys(records):
+        second = records['second'].astype(numpy.int64)
+        return records['first'].astype(numpy.int64) + (second * second + second) / 2
+
     def __setitem__(self, bibs, val):
-        entry = self._resolve_entry(bibs)
-        try:
-            self._matrix[entry] = Bib_matrix.special_symbols.get(val, val)
-        except TypeError:
-            self._initialize_matrix()
-            self._matrix[entry] = Bib_matrix.special_symbols.get(val, val)
+        first, second = self._resolve_pair(bibs)
+        val = Bib_matrix.special_symbols.get(val, val)
+        if isinstance(val, float):
+            val = (val, val)
+        self._pending[first + (second * second + second) / 2] = (first, second, val[0], val[1])
+        if len(self._pending) >= self.chunk_records:
+            self._flush_pending()
 
     def __getitem__(self, bibs):
-        entry = self._resolve_entry(bibs)
-        try:
-            ret = self._matrix[entry]
-        except TypeError:
-            self._initialize_matrix()
-            ret = self._matrix[entry]
+        ret = self.getitem_numeric(bibs)
         return Bib_matrix.special_numbers.get(ret[0], ret)
 
-
     def getitem_numeric(self, bibs):
-        return self._matrix[self._resolve_entry(bibs)]
+        first, second = self._resolve_pair(bibs)
+        try:
+            return numpy.array(self._pending[first + (second * second + second) / 2][2:],
+                               dtype=numpy.float32)
+        except KeyError:
+            pass
+        for offsets, records in reversed([self._base] + self._runs):
+            start, end = offsets[second], offsets[second + 1]
+            if start < end:
+                pos = start + records['first'][start:end].searchsorted(first)
+                if pos < end and records['first'][pos] == first:
+                    record = records[pos]
+                    return numpy.array((record['prob'], record['cert']), dtype=numpy.float32)
+        return numpy.array((self.special_symbols[None],) * 2, dtype=numpy.float32)
+
+    def set_pairs(self, second, first, values):
+        '''
+        Sets the values of many pairs at once.
+        @param second, first: the indices of the bibs of each pair, in
+        the order of get_ordered_keys, with first <= second.
+        @param values: an array of the (prob, cert) values of each pair.
+        '''
+        records = numpy.zeros(len(second), dtype=self.record_type)
+        records['first'] = first
+        records['second'] = second
+        records['prob'] = values[:, 0]
+        records['cert'] = values[:, 1]
+        self._add_run(records)
+
+    def _flush_pending(self):
+        if self._pending:
+            records = numpy.array(self._pending.values(), dtype=self.record_type)
+            self._pending = dict()
+            self._add_run(records)
+
+    def _add_run(self, records):
+        if not len(records):
+            return
+        records = records[self._get_keys(records).argsort(kind='mergesort')]
+        self._runs.append((self._get_offsets(self._count_rows(records)), records))
+        in_memory = sum(len(records) for offsets, records in self._runs
+                        if not isinstance(records, numpy.memmap))
+        if in_memory > self.max_records_in_memory:
+            self._spill()
+
+    def _spill(self):
+        '''
+        Merges the runs held in memory into a temporary file.
+        '''
+        self._prepare_destination_directory()
+        on_disk = [run for run in self._runs if isinstance(run[1], numpy.memmap)]
+        in_memory = [run for run in self._runs if not isinstance(run[1], numpy.memmap)]
+        path = "%s.run%d" % (self.get_matrix_path(), len(self._spilled))
+        self._spilled.append(path)
+        with open(path, 'wb') as fp:
+            offsets = self._merge_runs(in_memory, fp, keep_none=True)
+        self._runs = on_disk + [(offsets, self._map_records(path))]
+
+    def _map_records(self, path):
+        if not os.path.getsize(path):
+            return numpy.zeros(0, dtype=self.record_type)
+        return numpy.memmap(path, dtype=self.record_type, mode='r')
+
+    def _merge_runs(self, runs, fp, keep_none=False):
+        '''
+        Merges the sorted RUNS, the latest ones overriding the oldest ones,
+        and writes the records to the file FP, a chunk of rows at a time.
+        @param keep_none: whether to write the None values, which are
+        needed to override older runs.
+        @return: the offsets of the rows of the records written.
+        '''
+        runs = [run for run in runs if len(run[1])]
+        counts = numpy.zeros(len(self._bibmap), dtype=numpy.int64)
+        if not runs:
+            return self._get_offsets(counts)
+        # the rows are split where the largest run reaches a multiple of
+        # chunk_records records
+        largest = max(runs, key=lambda run: len(run[1]))[0]
+        bounds = numpy.unique(largest.searchsorted(
+            numpy.arange(self.chunk_records, largest[-1], self.chunk_records)))
+        bounds = list(bounds[bounds < len(self._bibmap)]) + [len(self._bibmap)]
+        start_row = 0
+        for end_row in bounds:
+            records = numpy.concatenate([
+                numpy.asarray(run_records[run_offsets[start_row]:run_offsets[end_row]])
+                for run_offsets, run_records in runs])
+            start_row = end_row
+            keys = self._get_keys(records)
+            order = keys.argsort(kind='mergesort')
+            keys, records = keys[order], records[order]
+            # the latest value of every entry
+            latest = numpy.ones(len(keys), dtype=bool)
+            latest[:-1] = keys[1:] != keys[:-1]
+            if not keep_none:
+                latest &= records['prob'] != self.special_symbols[None]
+            records = records[latest]
+            records.tofile(fp)
+            counts += self._count_rows(records)
+        return self._get_offsets(counts)
+
+    def reuse(self, old_matrix, bibs):
+        '''
+        Copies the values of the pairs of BIBS computed in OLD_MATRIX,
+        reading its records in order, a chunk at a time.
+        @return: the number of values copied.
+        '''
+        old_bibmap = old_matrix._bibmap
+        old_to_new = numpy.zeros(max(old_bibmap.values() or [0]) + 1, dtype=numpy.int64) - 1
+        for bib in bibs:
+            if bib in old_bibmap and bib in self._bibmap:
+                old_to_new[old_bibmap[bib]] = self._bibmap[bib]
+
+        copied = 0
+        old_records = old_matrix._base[1]
+        for start in xrange(0, len(old_records), self.chunk_records):
+            records = numpy.array(old_records[start:start + self.chunk_records])
+            first = old_to_new[records['first']]
+            second = old_to_new[records['second']]
+            kept = (first >= 0) & (second >= 0)
+            records = records[kept]
+            records['first'] = numpy.minimum(first[kept], second[kept])
+            records['second'] = numpy.maximum(first[kept], second[kept])
+            self._add_run(records)
+            copied += len(records)
+        return copied
 
     def __contains__(self, bib):
         return bib in self._bibmap
@@ -76,6 +241,12 @@ class Bib_matrix(object):
     def get_keys(self):
         return self._bibmap.keys()
 
+    def get_ordered_keys(self):
+        '''
+        Returns the bibs in the order of their indices in the matrix.
+        '''
+        return [bib for bib, dummy in sorted(self._bibmap.iteritems(), key=lambda x: x[1])]
+
     def get_file_dir(self):
         if self._storage_dir_override:
             return self._storage_dir_override
@@ -89,32 +260,13 @@ class Bib_matrix(object):
         return "%s%s-bibmap.pickle" % (self.get_file_dir(), self.name)
 
     def get_matrix_path(self):
-        path = "%s%s.hdf5" % (self.get_file_dir(), self.name)
-        if self._use_temporary_file:
-            path = path + '.tmp'
-        return path
-
-    def open_h5py_file(self, create_empty_on_failure=True):
-        self._prepare_destination_directory()
-        path = self.get_matrix_path()
-
-        try:
-            self._f = h5py.File(path)
-        except IOError, e:
-            #If the file is corrupted h5py fails with IOErorr.
-            #Give it a second try with an empty file before raising.
-            if create_empty_on_failure:
-                os.remove(path)
-                self._f = h5py.File(path)
-            else:
-                raise e
+        return "%s%s.matrix" % (self.get_file_dir(), self.name)
 
     def load(self):
-        self._use_temporary_file = False
         files_dir = self.get_file_dir()
         if not os.path.isdir(files_dir):
             self._bibmap = dict()
-            self._matrix = None
+            self._clear_runs()
             return False
 
         try:
@@ -125,33 +277,16 @@ class Bib_matrix(object):
 #                    # you can use negative version to recalculate
 #                    Bib_matrix.current_comparison_version < 0):
 #                    self._bibmap = dict()
-            self._use_temporary_file = False
-            if self._f:
-                self._f.close()
-            self.open_h5py_file(create_empty_on_failure=False)
-            self._matrix = self._f['array']
-
-        except (IOError, UnpicklingError, KeyError, OSError), e:
+            self._clear_runs()
+            records = self._map_records(self.get_matrix_path())
+            counts = numpy.zeros(len(self._bibmap), dtype=numpy.int64)
+            for start in xrange(0, len(records), self.chunk_records):
+                counts += self._count_rows(records[start:start + self.chunk_records])
+            self._base = (self._get_offsets(counts), records)
+
+        except (IOError, UnpicklingError, KeyError, OSError, ValueError), e:
             print 'Bib_matrix: error occurred while loading bibmap, cleaning... ', str(type(e)), str(e)
-            self._bibmap = dict()
-            self._matrix = None
-
-            try:
-                os.remove(self.get_map_path())
-            except OSError:
-                pass
-            try:
-                os.remove(self.get_matrix_path())
-            except OSError:
-                pass
-            self._use_temporary_file = True
-            try:
-                os.remove(self.get_matrix_path())
-            except OSError:
-                pass
-            self._bibmap = dict()
-            self._matrix = None
-            self._use_temporary_file = True
+            self.destroy()
             return False
         return True
 
@@ -174,26 +309,40 @@ class Bib_matrix(object):
             with open(self.get_map_path(), 'w') as fp:
                 dump(bibmap_v, fp)
 
-            if not self._matrix:
-                self._initialize_matrix()
-
-            if self._f:
-                self._f.close()
+            self._flush_pending()
+            if self._runs or not os.path.exists(self.get_matrix_path()):
+                path = self.get_matrix_path()
+                with open(path + '.tmp', 'wb') as fp:
+                    offsets = self._merge_runs([self._base] + self._runs, fp)
+                os.rename(path + '.tmp', path)
+                self._remove_spilled()
+                self._remove_legacy_matrix()
+                self._runs = list()
+                self._base = (offsets, self._map_records(path))
+
+    def _remove_legacy_matrix(self):
+        '''
+        Removes the matrix stored in the former HDF5 format, if any.
+        '''
+        path = "%s%s.hdf5" % (self.get_file_dir(), self.name)
+        for legacy_path in (path, path + '.tmp'):
+            try:
+                os.remove(legacy_path)
+            except OSError:
+                pass
 
-                if self._use_temporary_file:
-                    curpath = self.get_matrix_path()
-                    self._use_temporary_file = False
-                    finalpath = self.get_matrix_path()
-                    try:
-                        os.rename(curpath, finalpath)
-                    except OSError, e:
-                        raise e
+    def _remove_spilled(self):
+        for path in self._spilled:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        self._spilled = list()
 
     def duplicate_existing(self, name, newname):
         '''
         Make sure the original Bib_matrix have been store()-ed before calling this!
         '''
-        self._use_temporary_file = False
         self.name = name
         srcmap = self.get_map_path()
         srcmat = self.get_matrix_path()
@@ -205,20 +354,13 @@ class Bib_matrix(object):
         shutil.copy(srcmat, dstmat)
 
     def destroy(self):
-        if self._f:
-            self._f.close()
-        try:
-            os.remove(self.get_map_path())
-        except OSError:
-            pass
-        try:
-            os.remove(self.get_matrix_path())
-        except OSError:
-            pass
-        self._use_temporary_file = True
-        try:
-            os.remove(self.get_matrix_path())
-        except OSError:
-            pass
+        for path in (self.get_map_path(), self.get_matrix_path(),
+                     self.get_matrix_path() + '.tmp'):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        self._remove_spilled()
+        self._remove_legacy_matrix()
         self._bibmap = dict()
-        self._matrix = None
+        self._clear_runs()
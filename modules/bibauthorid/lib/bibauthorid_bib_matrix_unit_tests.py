@@ -25,6 +25,10 @@ __revision__ = \
 from invenio.testutils import InvenioTestCase, make_test_suite, \
     run_test_suite, nottest
 
+import os
+
+import numpy
+
 from invenio.bibauthorid_cluster_set import ClusterSet
 from invenio.bibauthorid_bib_matrix import Bib_matrix
 
@@ -132,6 +136,65 @@ class TestBibMatrix(InvenioTestCase):
         self.assertTrue(self.bmcs0.getitem_numeric([0,1])[0] == -1)
         self.assertTrue(self.bmcs0.getitem_numeric([0,2])[0] == -3)
 
+    def test_store_and_reuse(self):
+        '''
+        Only the computed pairs are stored, and they can be reused by a new matrix
+        '''
+        self.bmcs0[0,1] = (0.5, 0.25)
+        self.bmcs0[0,2] = '-'
+        self.bmcs0[3,2] = (0.75, 1.)
+        self.bmcs0.set_pairs([5, 6], [4, 4], numpy.array([[0.25, 0.5], [1., 1.]]))
+        self.bmcs0[0,2] = None
+        self.bmcs0.store()
+        loaded = Bib_matrix('testname2', storage_dir_override='/tmp/')
+        self.assertTrue(loaded.load())
+        self.assertEqual(tuple(loaded[1,0]), (0.5, 0.25))
+        self.assertTrue(loaded[0,2] is None)
+        self.assertEqual(tuple(loaded[2,3]), (0.75, 1.))
+        self.assertEqual(tuple(loaded[4,6]), (1., 1.))
+        self.assertEqual(len(loaded._base[1]), 4)
+
+        newcss = ClusterSet()
+        newcss.clusters = [ClusterSet.Cluster([6, 3, 2, 1, 0, 100])]
+        newcss.update_bibs()
+        reused = Bib_matrix('testname3', newcss, storage_dir_override='/tmp/')
+        self.assertEqual(reused.reuse(loaded, [0, 1, 2, 3, 4, 6]), 2)
+        self.assertEqual(tuple(reused[1,0]), (0.5, 0.25))
+        self.assertEqual(tuple(reused[2,3]), (0.75, 1.))
+        self.assertTrue(reused[6,100] is None)
+        loaded.destroy()
+        reused.destroy()
+
+    def test_runs_on_disk(self):
+        '''
+        Values spilled to disk and merged a few rows at a time are found back
+        '''
+        old_values = Bib_matrix.chunk_records, Bib_matrix.max_records_in_memory
+        Bib_matrix.chunk_records, Bib_matrix.max_records_in_memory = 7, 20
+        try:
+            open('/tmp/testname2.hdf5', 'w').close()
+            pairs = [(i, j) for i in range(100) for j in range(i + 1) if (i * j) % 3 == 0]
+            for n, (i, j) in enumerate(pairs):
+                self.bmcs0[i, j] = (n / 1000., 0.5)
+            self.failUnless(self.bmcs0._spilled)
+            for n, (i, j) in enumerate(pairs[:50]):
+                self.bmcs0[i, j] = '+'
+            self.bmcs0.store()
+            self.failIf(self.bmcs0._spilled)
+            self.failIf(os.path.exists('/tmp/testname2.hdf5'))
+            loaded = Bib_matrix('testname2', storage_dir_override='/tmp/')
+            self.assertTrue(loaded.load())
+            self.assertEqual(len(loaded._base[1]), len(pairs))
+            self.assertEqual(len(loaded._base[0]), 101)
+            for n, (i, j) in enumerate(pairs):
+                if n < 50:
+                    self.assertEqual(loaded[j, i], '+')
+                else:
+                    self.assertAlmostEqual(loaded[j, i][0], n / 1000., 5)
+            self.assertTrue(loaded[1, 2] is None)
+        finally:
+            Bib_matrix.chunk_records, Bib_matrix.max_records_in_memory = old_values
+
 TEST_SUITE = make_test_suite(TestBibMatrix)
 
 if __name__ == "__main__":
@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+##
+## This file is part of Invenio.
+## Copyright (C) 2014 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+'''
+bibauthorid_blocking
+    Candidate pairs of signatures for the probability matrix.
+
+    Instead of comparing all the pairs of signatures of a last name, only
+    the pairs which may plausibly belong to the same author are compared:
+
+        * the signatures sharing a band of their MinHash signature over
+          the coauthors and keywords of their papers (locality sensitive
+          hashing, i.e. similar sets have a high probability to share a
+          band), or
+        * the signatures without coauthors nor keywords, with all the
+          other ones, or
+        * the signatures on the same paper, so that wedge still knows
+          they belong to different authors,
+
+    as long as their first initials are compatible.  The other pairs are
+    left as None in the matrix, which wedge treats as unknown.
+
+    Pairs are returned as two arrays (second, first) of indices of the
+    signatures, with first < second, sorted in the order of the entries
+    of the matrix.
+'''
+
+import numpy
+
+import invenio.bibauthorid_config as bconfig
+from invenio.bibauthorid_comparison import _find_coauthors, _find_key_words, \
+    cached_get_name_by_bibrecref
+from invenio.bibauthorid_name_utils import split_name_parts
+from invenio.bibauthorid_features import SetFeature, get_block_rows, \
+    create_synthetic_block
+
+# Large prime for the universal hash functions of MinHash.
+MINHASH_PRIME = (1 << 31) - 1
+NO_INITIAL = -1
+
+
+def get_first_initial(name):
+    '''
+    Returns the first initial of NAME as a number, or NO_INITIAL.
+    '''
+    if not name:
+        return NO_INITIAL
+    initials = split_name_parts(name)[1]
+    if not initials:
+        return NO_INITIAL
+    return ord(initials[0][0].lower())
+
+
+def get_minhashes(tokens, num_hashes, seed=0):
+    '''
+    Returns the len(TOKENS.sizes) x NUM_HASHES matrix of the MinHash
+    signatures of the sets of TOKENS (a SetFeature).  The rows of the
+    empty sets are undefined.
+    '''
+    rand = numpy.random.RandomState(seed)
+    a = rand.randint(1, MINHASH_PRIME, size=num_hashes).astype(numpy.int64)
+    b = rand.randint(0, MINHASH_PRIME, size=num_hashes).astype(numpy.int64)
+    size = len(tokens.sizes)
+    ret = numpy.zeros((size, num_hashes), dtype=numpy.int64)
+    not_empty = numpy.nonzero(tokens.sizes)[0]
+    # by chunks of signatures, to bound the memory used by the hashes
+    chunk = max(1, 1000000 / num_hashes)
+    start = 0
+    while start < len(not_empty):
+        sigs = not_empty[start:start + chunk]
+        first, last = tokens.indptr[sigs[0]], tokens.indptr[sigs[-1] + 1]
+        hashes = (tokens.indices[first:last, None] * a[None, :] + b[None, :]) % MINHASH_PRIME
+        ret[sigs] = numpy.minimum.reduceat(hashes, tokens.indptr[sigs] - first, axis=0)
+        start += chunk
+    return ret
+
+
+def _pairs_in_groups(keys, members):
+    '''
+    Returns the pairs of MEMBERS having the same KEYS, as two arrays
+    (second, first) with first < second.
+    '''
+    order = numpy.lexsort((members, keys))
+    keys, members = keys[order], members[order]
+    bounds = numpy.nonzero(numpy.diff(keys))[0] + 1
+    starts = numpy.concatenate(([0], bounds))
+    ends = numpy.concatenate((bounds, [len(keys)]))
+    seconds, firsts = [], []
+    for start, end in zip(starts[ends - starts > 1], ends[ends - starts > 1]):
+        group = members[start:end]
+        second, first = numpy.tril_indices(len(group), -1)
+        seconds.append(group[second])
+        firsts.append(group[first])
+    if not seconds:
+        return numpy.zeros(0, dtype=numpy.int64), numpy.zeros(0, dtype=numpy.int64)
+    return numpy.concatenate(seconds), numpy.concatenate(firsts)
+
+
+def get_candidate_pairs(token_sets, initials, records,
+                        bands=bconfig.TORTOISE_BLOCKING_BANDS,
+                        rows=bconfig.TORTOISE_BLOCKING_ROWS):
+    '''
+    Returns the candidate pairs of signatures (see the module docstring).
+
+    @param token_sets: the SetFeature objects used for the MinHash, e.g.
+        the coauthors and the keywords.
+    @param initials: the first initial of each signature, see
+        get_first_initial.
+    @param records: the record of each signature.
+    @param bands, rows: the MinHash signatures are made of BANDS bands of
+        ROWS hashes.  The probability that two sets of Jaccard similarity
+        s become candidates is 1 - (1 - s ** ROWS) ** BANDS.
+    @return: two arrays (second, first).
+    '''
+    initials = numpy.asarray(initials, dtype=numpy.int64)
+    records = numpy.asarray(records, dtype=numpy.int64)
+    size = len(initials)
+    entries = []
+
+    def add_pairs(second, first):
+        # only the pairs of compatible initials are kept, as matrix entries
+        compatible = (initials[second] == initials[first]) | \
+                     (initials[second] == NO_INITIAL) | (initials[first] == NO_INITIAL) | \
+                     (records[second] == records[first])
+        second, first = second[compatible], first[compatible]
+        entries.append(numpy.unique(first + (second * (second + 1)) / 2))
+
+    sizes = numpy.zeros(size, dtype=numpy.int64)
+    for tokens in token_sets:
+        sizes += tokens.sizes
+    not_empty = numpy.nonzero(sizes)[0]
+    if len(not_empty):
+        # the items of all the sets, as one set
+        offset = 0
+        merged = list()
+        for tokens in token_sets:
+            merged.append([set(tokens.indices[tokens.indptr[i]:tokens.indptr[i + 1]] + offset)
+                           for i in xrange(size)])
+            offset += tokens.vocabulary_size
+        merged = SetFeature([set.union(*sets) for sets in zip(*merged)])
+        minhashes = get_minhashes(merged, bands * rows)[not_empty]
+        for band in xrange(bands):
+            band_hashes = minhashes[:, band * rows:(band + 1) * rows]
+            keys = numpy.zeros(len(not_empty), dtype=numpy.int64)
+            for column in band_hashes.T:
+                keys = keys * MINHASH_PRIME + column
+            add_pairs(*_pairs_in_groups(keys, not_empty))
+
+    # the signatures without any item are compared with all the others, by
+    # chunks of signatures to bound the memory used by the pairs which are
+    # not compatible
+    empty = numpy.nonzero(sizes == 0)[0]
+    others = numpy.arange(size, dtype=numpy.int64)
+    chunk = max(1, bconfig.TORTOISE_VECTORIZED_BLOCK_SIZE / max(1, size))
+    for start in xrange(0, len(empty), chunk):
+        pair_empty, pair_other = numpy.nonzero(
+            (empty[start:start + chunk, None] != others[None, :]) &
+            ((sizes[None, :] > 0) | (others[None, :] < empty[start:start + chunk, None])))
+        pair_empty = empty[start:start + chunk][pair_empty]
+        add_pairs(numpy.maximum(pair_empty, pair_other),
+                  numpy.minimum(pair_empty, pair_other))
+
+    # the signatures on the same paper
+    add_pairs(*_pairs_in_groups(records, numpy.arange(size, dtype=numpy.int64)))
+
+    entries = numpy.unique(numpy.concatenate(entries))
+    # back from the matrix entries to the pairs
+    second = ((numpy.sqrt(8. * entries + 1) - 1) / 2).astype(numpy.int64)
+    # fix the rounding of the square root
+    second[(second * (second + 1)) / 2 > entries] -= 1
+    second[((second + 1) * (second + 2)) / 2 <= entries] += 1
+    first = entries - (second * (second + 1)) / 2
+    return second, first
+
+
+def get_candidate_pairs_for_bibs(bibs, **kwargs):
+    '''
+    Returns the candidate pairs of the signatures BIBS, in this order,
+    using their coauthors, keywords and names.
+    '''
+    token_sets = [SetFeature([_find_coauthors(bib) for bib in bibs]),
+                  SetFeature([_find_key_words(bib) for bib in bibs])]
+    initials = [get_first_initial(cached_get_name_by_bibrecref(bib)) for bib in bibs]
+    records = [bib[2] for bib in bibs]
+    return get_candidate_pairs(token_sets, initials, records, **kwargs)
+
+
+def measure_recall(features, second, first, threshold=bconfig.WEDGE_THRESHOLD,
+                   block_size=bconfig.TORTOISE_VECTORIZED_BLOCK_SIZE):
+    '''
+    Compares the candidate pairs (SECOND, FIRST) to all the pairs of
+    signatures of FEATURES (a SignatureFeatures), as compared by the
+    exhaustive computation of the matrix.
+
+    @param threshold: the pairs of probability above THRESHOLD, i.e.
+        likely to be joined by wedge, or on the same paper, are the ones
+        which should be candidates.
+    @return: a dictionary with the number of pairs, of candidate pairs,
+        of pairs which should be candidates and the recall; and, if the
+        authors of the signatures are known (see create_synthetic_block),
+        the number of pairs of the same author and their recall.
+    '''
+    candidates = numpy.unique(first + (second * (second + 1)) / 2)
+    authors = getattr(features, 'authors', None)
+    stats = {'pairs': 0, 'candidates': len(candidates),
+             'relevant': 0, 'found': 0, 'same_author': 0, 'same_author_found': 0}
+
+    def count(mask, j0, total, found):
+        rows, cols = numpy.nonzero(mask)
+        rows += j0
+        entries = cols + (rows * (rows + 1)) / 2
+        stats[total] += len(entries)
+        if len(candidates):
+            positions = numpy.searchsorted(candidates, entries)
+            positions[positions == len(candidates)] = 0
+            stats[found] += int((candidates[positions] == entries).sum())
+
+    j0 = 0
+    while j0 < features.size:
+        j1 = get_block_rows(j0, features.size, block_size)
+        values = features.compare_block(j0, j1)
+        lower = numpy.arange(j1)[None, :] < numpy.arange(j0, j1)[:, None]
+        count(lower & ((values[..., 0] > threshold) | (values[..., 0] == -1.)),
+              j0, 'relevant', 'found')
+        if authors is not None:
+            count(lower & (authors[j0:j1, None] == authors[None, :j1]),
+                  j0, 'same_author', 'same_author_found')
+        stats['pairs'] += ((j1 * (j1 - 1)) - (j0 * (j0 - 1))) / 2
+        j0 = j1
+
+    stats['recall'] = stats['relevant'] and float(stats['found']) / stats['relevant'] or 1.
+    if authors is not None:
+        stats['same_author_recall'] = stats['same_author'] and \
+            float(stats['same_author_found']) / stats['same_author'] or 1.
+    return stats
+
+
+def measure_synthetic_recall(nb_signatures=2000, **kwargs):
+    '''
+    Measures the recall of the candidate pairs on a synthetic surname
+    block, see create_synthetic_block.
+    '''
+    features = create_synthetic_block(nb_signatures)
+    dummy, names, coauthors, keywords = features.features
+    initials = numpy.array([ord(names.names[i].split()[1][0]) for i in names.ids],
+                           dtype=numpy.int64)
+    second, first = get_candidate_pairs([coauthors, keywords], initials,
+                                        features.records, **kwargs)
+    return measure_recall(features, second, first)
+
+
+if __name__ == '__main__':
+    for size in (1000, 5000):
+        stats = measure_synthetic_recall(size)
+        print ("%d signatures: %d candidate pairs out of %d (%.1f%%), recall %.3f, "
+               "same author recall %.3f"
+               % (size, stats['candidates'], stats['pairs'],
+                  100. * stats['candidates'] / stats['pairs'], stats['recall'],
+                  stats['same_author_recall']))
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+##
+## This file is part of Invenio.
+## Copyright (C) 2014 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""Unit tests for the candidate pairs of signatures."""
+
+__revision__ = \
+    "$Id$"
+
+from invenio.testutils import InvenioTestCase, make_test_suite, run_test_suite
+
+import invenio.bibauthorid_config as bconfig
+
+from invenio.bibauthorid_features import SetFeature, create_synthetic_block
+from invenio.bibauthorid_blocking import get_candidate_pairs, \
+    measure_synthetic_recall, NO_INITIAL
+
+class TestCandidatePairs(InvenioTestCase):
+
+    def test_candidate_pairs(self):
+        """bibauthorid - candidate pairs of similar, empty and same paper signatures"""
+        coauthors = SetFeature([set('abcd'), set('abcd'), set('wxyz'), set(), set('abce'), set('mn')])
+        keywords = SetFeature([set()] * 6)
+        initials = [ord('j'), ord('j'), ord('j'), NO_INITIAL, ord('k'), ord('p')]
+        records = [1, 2, 3, 4, 5, 1]
+        second, first = get_candidate_pairs([coauthors, keywords], initials, records)
+        pairs = zip(second.tolist(), first.tolist())
+        self.assertEqual(pairs, sorted(pairs, key=lambda x: (x[0], x[1])))
+        # identical sets
+        self.failUnless((1, 0) in pairs)
+        # no initial
+        self.failUnless((3, 0) in pairs and (4, 3) in pairs)
+        # same paper, even if the initials differ
+        self.failUnless((5, 0) in pairs)
+        # different initials
+        self.failIf((4, 0) in pairs)
+        # nothing in common
+        self.failIf((2, 0) in pairs)
+
+    def test_empty_by_chunks(self):
+        """bibauthorid - signatures without items are paired by chunks"""
+        coauthors = SetFeature([set(), set('ab'), set(), set('ab'), set(), set('xy')])
+        keywords = SetFeature([set()] * 6)
+        initials = [ord('j'), ord('j'), NO_INITIAL, ord('k'), ord('k'), ord('j')]
+        records = [1, 2, 3, 4, 5, 6]
+        pairs = zip(*get_candidate_pairs([coauthors, keywords], initials, records))
+        old_block_size = bconfig.TORTOISE_VECTORIZED_BLOCK_SIZE
+        try:
+            for block_size in (1, 7, 13):
+                bconfig.TORTOISE_VECTORIZED_BLOCK_SIZE = block_size
+                self.assertEqual(zip(*get_candidate_pairs([coauthors, keywords], initials,
+                                                          records)), pairs)
+        finally:
+            bconfig.TORTOISE_VECTORIZED_BLOCK_SIZE = old_block_size
+        self.assertEqual([(s, f) for s, f in pairs if 0 in (s, f) or 4 in (s, f)],
+                         [(1, 0), (2, 0), (4, 2), (4, 3), (5, 0)])
+
+    def test_compare_pairs(self):
+        """bibauthorid - comparing pairs gives the same values as blocks"""
+        features = create_synthetic_block(100, nb_authors=5)
+        values = features.compare_block(0, 100)
+        second, first = get_candidate_pairs([features.features[2]], [NO_INITIAL] * 100,
+                                            features.records)
+        self.assertEqual(features.compare_pairs(second, first).tolist(),
+                         values[second, first].tolist())
+
+    def test_recall(self):
+        """bibauthorid - recall of the candidate pairs on a synthetic block"""
+        stats = measure_synthetic_recall(500)
+        self.failUnless(stats['same_author_recall'] > 0.9)
+        self.failUnless(stats['candidates'] < stats['pairs'] / 2)
+
+TEST_SUITE = make_test_suite(TestCandidatePairs)
+
+if __name__ == "__main__":
+    run_test_suite(TEST_SUITE, warn_user=True)
@@ -198,6 +198,13 @@ def compare_bibrefrecs(bibref1, bibref2):
         assert r == '?' or (r <= 1 and r>=0), 'COMPARISON %s returned %s for %s' % (fname, str(r),str(len(results)))
         results.append((r, weight))
 
+    return combine_comparisons(results)
+
+def combine_comparisons(results):
+    '''
+    Combines the results of the comparison functions, as a list of
+    (result, weight) pairs, into the value returned by compare_bibrefrecs.
+    '''
     total_weights = sum(res[1] for res in results)
 
     metadata_comparison_print("Final comparison vector: %s." % str(results))
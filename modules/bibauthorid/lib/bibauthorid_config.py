@@ -40,7 +40,8 @@ try:
         CFG_BIBAUTHORID_UI_SKIP_ARXIV_STUB_PAGE, \
         CFG_INSPIRE_SITE, \
         CFG_ADS_SITE, \
-        CFG_BIBAUTHORID_ENABLED_REMOTE_LOGIN_SYSTEMS
+        CFG_BIBAUTHORID_ENABLED_REMOTE_LOGIN_SYSTEMS, \
+        CFG_CACHEDIR
 
 except ImportError:
     GLOBAL_CONFIG = False
@@ -173,6 +174,25 @@ DEBUG_CHECKS = False
 
 TORTOISE_FILES_PATH = '/opt/tortoise_cache/'
 
+# Compute the probability matrix by blocks of pairs of signatures with
+# numpy (see bibauthorid_features) instead of one pair at a time.
+# The comparison functions without a vectorized version fall back to
+# the pairwise computation.
+TORTOISE_VECTORIZED_COMPARISON = True
+# Number of pairs of signatures compared at once; every pair takes a
+# few tens of bytes of memory per comparison function.
+TORTOISE_VECTORIZED_BLOCK_SIZE = 1000000
+
+# Compare only the candidate pairs of signatures found by blocking
+# (see bibauthorid_blocking) instead of all the pairs of a last name.
+# The other pairs are unknown to wedge.
+TORTOISE_BLOCKING = False
+# The MinHash signatures used for blocking have TORTOISE_BLOCKING_BANDS
+# bands of TORTOISE_BLOCKING_ROWS hashes: more bands or less rows give
+# more candidates, and a better recall.
+TORTOISE_BLOCKING_BANDS = 20
+TORTOISE_BLOCKING_ROWS = 1
+
 ## force skip ui arxiv stub page (specific for inspire)
 BIBAUTHORID_UI_SKIP_ARXIV_STUB_PAGE = True
 
@@ -209,6 +229,17 @@ MATCHING_QGRAMS_PERCENTAGE = 0.8
 MAX_T_OCCURANCE_RESULT_LIST_CARDINALITY = 35
 MIN_T_OCCURANCE_RESULT_LIST_CARDINALITY = 10
 NAME_SCORE_COEFFICIENT = 0.5
+# At most this many names, the ones sharing the most q-grams with the query,
+# are scored by the search engine.
+MAX_SCORED_NAMES = 500
+
+# The search engine index is also written to this file, which the processes
+# serving searches map in memory, instead of querying aidINVERTEDLISTS and
+# aidDENSEINDEX.  They reload it when it is written again.
+if GLOBAL_CONFIG:
+    SEARCH_ENGINE_INDEX_PATH = "%s/bibauthorid/search_engine_index" % CFG_CACHEDIR
+else:
+    SEARCH_ENGINE_INDEX_PATH = None
 
 # List that contains the existing remote systems that a user can logged in via them in Inspire
 CFG_BIBAUTHORID_EXISTING_REMOTE_LOGIN_SYSTEMS = ['arXiv', 'orcid']
@@ -219,3 +250,28 @@ if GLOBAL_CONFIG and not set(CFG_BIBAUTHORID_ENABLED_REMOTE_LOGIN_SYSTEMS ) <= s
 CFG_BIBAUTHORID_REMOTE_LOGIN_SYSTEMS_IDENTIFIERS = {'arxivid': '037', 'doi': 'doi' }
 CFG_BIBAUTHORID_REMOTE_LOGIN_SYSTEMS_LINKS = {'arXiv': 'invalid', 'invalid': 'invalid' }
 CFG_BIBAUTHORID_REMOTE_LOGIN_SYSTEMS_IDENTIFIER_TYPES = {'arXiv': 'arxivid', 'orcid': 'doi' }
+
+# Memory available to the tortoise jobs run by a worker of the job queue
+# (see bibauthorid_scheduler.run_jobs), as a fraction of the memory of
+# its host.
+TORTOISE_JOBS_MEMORY_FRACTION = 0.8
+# Seconds between two polls of the job queue by a worker, which also
+# refreshes the heartbeat of its running jobs.
+TORTOISE_JOBS_POLL_INTERVAL = 10
+# A running job whose heartbeat is older than this many seconds belongs
+# to a dead worker, and is given back to the queue, at most
+# TORTOISE_JOBS_MAX_ATTEMPTS times.  The failed jobs are run again when
+# the run is started again, until they have been attempted that many times.
+TORTOISE_JOBS_TIMEOUT = 600
+TORTOISE_JOBS_MAX_ATTEMPTS = 3
+
+# Keep the name -> authors mapping used by rabbit (see RABBIT_USE_CACHED_PID)
+# in this file between runs, updating only the names of the signatures
+# modified since the previous run.  Set to None to build the whole mapping
+# on every run.
+RABBIT_NAME_INDEX_PATH = TORTOISE_FILES_PATH + 'rabbit_name_index'
+# The index is built again from scratch when it is older than this many
+# days, or when more than this fraction of its names changed since the
+# previous run.
+RABBIT_NAME_INDEX_MAX_AGE = 7
+RABBIT_NAME_INDEX_MAX_UPDATE = 0.2
@@ -33,6 +33,7 @@ from invenio.bibauthorid_backinterface import get_db_time
 from invenio.bibauthorid_backinterface import get_authors_of_claimed_paper
 from invenio.bibauthorid_backinterface import get_claimed_papers_from_papers
 from invenio.bibauthorid_backinterface import get_all_valid_papers
+from invenio.bibauthorid_name_index import remove_papers
 
 
 #python 2.4 compatibility
@@ -89,6 +90,12 @@ Examples:
       --from-scratch        Ignores the current information in the personid
                             tables and disambiguates everything from scratch.
 
+      --run-name=NAME       Runs the disambiguation through the job queue of
+                            the database under the name NAME. The same command
+                            can be run on several hosts sharing the database
+                            and the tortoise files directory, and an interrupted
+                            run resumes where it stopped.
+
     There are no options for the merger.
 """,
         version="Invenio Bibauthorid v%s" % bconfig.VERSION,
@@ -100,7 +107,8 @@ Examples:
              "update-search-index",
              "all-records",
              "update-personid",
-             "from-scratch"
+             "from-scratch",
+             "run-name="
             ]),
         task_submit_elaborate_specific_parameter_fnc=_task_submit_elaborate_specific_parameter,
         task_submit_check_options_fnc=_task_submit_check_options,
@@ -132,6 +140,8 @@ def _task_submit_elaborate_specific_parameter(key, value, opts, args):
         bibtask.task_set_option("update_search_index", True)
     elif key in ("--from-scratch",):
         bibtask.task_set_option("from_scratch", True)
+    elif key in ("--run-name",):
+        bibtask.task_set_option("run_name", value)
     else:
         return False
 
@@ -154,7 +164,8 @@ def _task_run_core():
 
     if bibtask.task_get_option("disambiguate"):
         bibtask.task_update_progress('Performing full disambiguation...')
-        run_tortoise(bool(bibtask.task_get_option("from_scratch")))
+        run_tortoise(bool(bibtask.task_get_option("from_scratch")),
+                     bibtask.task_get_option("run_name"))
         bibtask.task_update_progress('Full disambiguation finished!')
 
     if bibtask.task_get_option("merge"):
@@ -182,6 +193,7 @@ def _task_submit_check_options():
     record_ids = bibtask.task_get_option("record_ids")
     all_records = bibtask.task_get_option("all_records")
     from_scratch = bibtask.task_get_option("from_scratch")
+    run_name = bibtask.task_get_option("run_name")
 
     commands =( bool(update_personid) + bool(disambiguate) +
                 bool(merge) + bool(update_search_index) )
@@ -200,7 +212,7 @@ def _task_submit_check_options():
     assert commands == 1
 
     if update_personid:
-        if any((from_scratch,)):
+        if any((from_scratch, run_name)):
             bibtask.write_message("ERROR: The only options which can be specified "
                                   "with --update-personid are --record-ids and "
                                   "--all-records"
@@ -223,13 +235,14 @@ def _task_submit_check_options():
 
     if disambiguate:
         if any((record_ids, all_records)):
-            bibtask.write_message("ERROR: The only option which can be specified "
-                                  "with --disambiguate is from-scratch"
+            bibtask.write_message("ERROR: The only options which can be specified "
+                                  "with --disambiguate are --from-scratch and "
+                                  "--run-name"
                                   , stream=sys.stdout, verbose=0)
             return False
 
     if merge:
-        if any((record_ids, all_records, from_scratch)):
+        if any((record_ids, all_records, from_scratch, run_name)):
             bibtask.write_message("ERROR: There are no options which can be "
                                   "specified along with --merge"
                                   , stream=sys.stdout, verbose=0)
@@ -284,7 +297,11 @@ def run_rabbit(paperslist, all_records=False):
 
         if len(last_log) >= 1:
             #select only the most recent papers
-            recently_modified = get_modified_papers_since(since=last_log[0][2])
+            modified = get_modified_papers_since(since=last_log[0][2], only_valid=False)
+            recently_modified = modified & frozenset(get_all_valid_papers())
+            # only the papers modified since the last run can have become
+            # invalid, so there is no need to check all of them
+            remove_papers(list(modified - recently_modified))
             if not recently_modified:
                 bibtask.write_message("update_personID_table_from_paper: "
                                       "All person entities up to date.",
@@ -292,7 +309,7 @@ def run_rabbit(paperslist, all_records=False):
             else:
                 bibtask.write_message("update_personID_table_from_paper: Running on: " +
                                       str(recently_modified), stream=sys.stdout, verbose=0)
-                rabbit_with_log(recently_modified, True, 'bibauthorid_daemon, run_personid_fast_assign_papers on '
+                rabbit_with_log(recently_modified, False, 'bibauthorid_daemon, run_personid_fast_assign_papers on '
                                                  + str([paperslist, all_records, recently_modified]))
         else:
             rabbit_with_log(None, True, 'bibauthorid_daemon, update_personid on all papers')
@@ -300,11 +317,11 @@ def run_rabbit(paperslist, all_records=False):
         rabbit_with_log(paperslist, True, 'bibauthorid_daemon, personid_fast_assign_papers on ' + str(paperslist), partial=True)
 
 
-def run_tortoise(from_scratch):
+def run_tortoise(from_scratch, run_name=None):
     from invenio.bibauthorid_tortoise import tortoise, tortoise_from_scratch
 
     if from_scratch:
-        tortoise_from_scratch()
+        tortoise_from_scratch(run_name)
     else:
         start_time = get_db_time()
         tortoise_db_name = 'tortoise'
@@ -314,7 +331,7 @@ def run_tortoise(from_scratch):
             modified = get_modified_papers_since(last_run[0][2])
         else:
             modified = []
-        tortoise(modified)
+        tortoise(modified, run_name=run_name)
 
     insert_user_log(tortoise_db_name, '-1', '', '', '', timestamp=start_time)
 
@@ -1286,6 +1286,95 @@ def get_name_to_authors_mapping():   ### get_name_string_to_pid_dictionary
     return mapping
 
 
+def get_names_of_modified_signatures(since):
+    '''
+    Gets the names of the signatures which have been added or modified since
+    the specified date.
+
+    @param since: consider only signatures modified after this date
+    @type since: datetime.datetime
+
+    @return: names
+    @rtype: set set(str,)
+    '''
+    return set(row[0] for row in run_sql("""select distinct name
+                                           from aidPERSONIDPAPERS
+                                           where last_updated >= %s""",
+                                           (since,) ))
+
+
+def get_names_of_papers(recs):
+    '''
+    Gets the names of the signatures of the given papers.
+
+    @param recs: paper identifiers
+    @type recs: list [int,]
+
+    @return: names
+    @rtype: set set(str,)
+    '''
+    names = set()
+    recs = list(recs)
+    chunk = 1000
+
+    for i in range(0, len(recs), chunk):
+        names |= set(row[0] for row in run_sql("""select distinct name
+                                                  from aidPERSONIDPAPERS
+                                                  where bibrec in %s"""
+                                                  % _get_sqlstr_from_set(recs[i: i + chunk])))
+
+    return names
+
+
+def author_has_name(pid, name):
+    '''
+    Examines if the given author carries the given name on some paper.
+
+    @param pid: author identifier
+    @type pid: int
+    @param name: name
+    @type name: str
+
+    @return: author carries the name
+    @rtype: bool
+    '''
+    return bool(run_sql("""select personid
+                           from aidPERSONIDPAPERS
+                           where personid=%s
+                           and name=%s
+                           limit 1""",
+                           (pid, name) ))
+
+
+def get_name_to_authors_mapping_of_names(names):
+    '''
+    Gets a mapping which associates the specified names with the set of
+    authors who carry each name. Names which nobody carries are left out.
+
+    @param names: names
+    @type names: iterable [str,]
+
+    @return: mapping
+    @rtype: dict {str: set(int,)}
+    '''
+    mapping = dict()
+    names = list(names)
+    chunk = 1000
+
+    for i in range(0, len(names), chunk):
+        names_chunk = names[i: i + chunk]
+        authors = run_sql("""select personid, name
+                             from aidPERSONIDPAPERS
+                             where name in (%s)"""
+                             % ", ".join(repeat("%s", len(names_chunk))),
+                             tuple(names_chunk) )
+
+        for pid, name in authors:
+            mapping.setdefault(name, set()).add(pid)
+
+    return mapping
+
+
 def get_confirmed_name_to_authors_mapping():
     '''
     Gets a mapping which associates confirmed names with the set of authors who
@@ -3028,6 +3117,220 @@ def duplicated_tortoise_results_exist():   ### check_results
     return duplicated_tortoise_results_not_found
 
 
+##########################################################################################
+###                                                                                    ###
+###                           aidTORTOISEJOBS table                                    ###
+###                                                                                    ###
+##########################################################################################
+
+# ********** setters **********#
+
+def add_tortoise_jobs(run, stage, jobs):
+    '''
+    Adds the jobs of a stage of a disambiguation run to the job queue. The
+    jobs which are already in the queue are kept as they are, so that an
+    interrupted run can be resumed.
+
+    @param run: name of the run
+    @type run: str
+    @param stage: name of the stage (e.g. 'matrix', 'wedge')
+    @type stage: str
+    @param jobs: surnames and sizes of the jobs
+    @type jobs: list [(str, int),]
+    '''
+    for surname, size in jobs:
+        run_sql("""insert ignore into aidTORTOISEJOBS
+                   (run, stage, surname, size)
+                   values (%s, %s, %s, %s)""",
+                   (run, stage, surname, size) )
+
+
+def claim_tortoise_job(job_id, host, pid):
+    '''
+    Claims a pending job for the worker process pid of the given host. Only
+    one worker can claim a job.
+
+    @param job_id: job identifier
+    @type job_id: int
+    @param host: host name
+    @type host: str
+    @param pid: process identifier of the worker
+    @type pid: int
+
+    @return: whether the job has been claimed
+    @rtype: bool
+    '''
+    return bool(run_sql("""update aidTORTOISEJOBS
+                           set status='running', host=%s, pid=%s, heartbeat=now(),
+                               attempts=attempts+1, message=NULL
+                           where id=%s
+                           and status='pending'""",
+                           (host, pid, job_id) ))
+
+
+def update_tortoise_jobs_heartbeat(job_ids):
+    '''
+    Signals that the specified running jobs are alive.
+
+    @param job_ids: job identifiers
+    @type job_ids: list [int,]
+    '''
+    if not job_ids:
+        return
+
+    run_sql("""update aidTORTOISEJOBS
+               set heartbeat=now()
+               where id in (%s)
+               and status='running'"""
+               % ", ".join(repeat("%s", len(job_ids))), tuple(job_ids) )
+
+
+def finish_tortoise_job(job_id, peak_memory):
+    '''
+    Marks a running job as done.
+
+    @param job_id: job identifier
+    @type job_id: int
+    @param peak_memory: peak resident memory of the job in kB
+    @type peak_memory: int
+    '''
+    run_sql("""update aidTORTOISEJOBS
+               set status='done', finished=now(), peak_memory=%s
+               where id=%s""",
+               (peak_memory, job_id) )
+
+
+def fail_tortoise_job(job_id, message, only_status=None):
+    '''
+    Marks a job as failed.
+
+    @param job_id: job identifier
+    @type job_id: int
+    @param message: why the job failed (e.g. the traceback)
+    @type message: str
+    @param only_status: fail the job only if it has this status
+    @type only_status: str
+    '''
+    query = """update aidTORTOISEJOBS
+               set status='failed', finished=now(), message=%s
+               where id=%s"""
+    args = [message, job_id]
+    if only_status:
+        query += " and status=%s"
+        args.append(only_status)
+
+    run_sql(query, tuple(args) )
+
+
+def requeue_failed_tortoise_jobs(run, stage, max_attempts):
+    '''
+    Gives the failed jobs of a stage of a disambiguation run which have been
+    attempted less than max_attempts times back to the queue. Their number
+    of attempts is kept, so that a job failing every time is not run again
+    forever.
+
+    @param run: name of the run
+    @type run: str
+    @param stage: name of the stage
+    @type stage: str
+    @param max_attempts: maximum number of attempts of a job
+    @type max_attempts: int
+    '''
+    run_sql("""update aidTORTOISEJOBS
+               set status='pending'
+               where run=%s
+               and stage=%s
+               and status='failed'
+               and attempts < %s""",
+               (run, stage, max_attempts) )
+
+
+def requeue_stale_tortoise_jobs(run, stage, timeout, max_attempts):
+    '''
+    Gives the running jobs whose heartbeat is older than the timeout, i.e.
+    whose worker is dead, back to the queue. The jobs which have already
+    been attempted max_attempts times are marked as failed instead.
+
+    @param run: name of the run
+    @type run: str
+    @param stage: name of the stage
+    @type stage: str
+    @param timeout: timeout in seconds
+    @type timeout: int
+    @param max_attempts: maximum number of attempts of a job
+    @type max_attempts: int
+    '''
+    run_sql("""update aidTORTOISEJOBS
+               set status=if(attempts < %s, 'pending', 'failed'),
+                   message=concat('No heartbeat from ', host, ':', pid)
+               where run=%s
+               and stage=%s
+               and status='running'
+               and heartbeat < now() - interval %s second""",
+               (max_attempts, run, stage, timeout) )
+
+# ********** getters **********#
+
+def get_pending_tortoise_jobs(run, stage):
+    '''
+    Gets the pending jobs of a stage of a disambiguation run.
+
+    @param run: name of the run
+    @type run: str
+    @param stage: name of the stage
+    @type stage: str
+
+    @return: jobs ((job_id, surname, size),)
+    @rtype: tuple ((int, str, int),)
+    '''
+    return run_sql("""select id, surname, size
+                      from aidTORTOISEJOBS
+                      where run=%s
+                      and stage=%s
+                      and status='pending'""",
+                      (run, stage) )
+
+
+def get_tortoise_jobs_status(run, stage):
+    '''
+    Gets the number of jobs of a stage of a disambiguation run by status.
+
+    @param run: name of the run
+    @type run: str
+    @param stage: name of the stage
+    @type stage: str
+
+    @return: number of jobs by status {status: count}
+    @rtype: dict {str: int}
+    '''
+    return dict(run_sql("""select status, count(*)
+                           from aidTORTOISEJOBS
+                           where run=%s
+                           and stage=%s
+                           group by status""",
+                           (run, stage) ))
+
+
+def get_tortoise_jobs_peak_memory(stage):
+    '''
+    Gets the peak memory measured by the done jobs of a stage in all the
+    disambiguation runs, the most recent first.
+
+    @param stage: name of the stage
+    @type stage: str
+
+    @return: measures ((surname, size, peak_memory),)
+    @rtype: tuple ((str, int, int),)
+    '''
+    return run_sql("""select surname, size, peak_memory
+                      from aidTORTOISEJOBS
+                      where stage=%s
+                      and status='done'
+                      and peak_memory is not NULL
+                      order by finished desc""",
+                      (stage,) )
+
+
 ##########################################################################################
 ###                                                                                    ###
 ###                           aidUSERINPUTLOG table                                    ###
@@ -3396,13 +3699,15 @@ def _get_doi_for_paper(recid, recstruct=None):   ### get_doi_from_rec
 
 
 
-def get_modified_papers_since(since):   ### get_recently_modified_record_ids
+def get_modified_papers_since(since, only_valid=True):   ### get_recently_modified_record_ids
     '''
     Gets the papers which have modification date more recent than the specified
     one.
 
     @param since: consider only papers which are modified after this date
     @type since: datetime.datetime
+    @param only_valid: consider only valid papers
+    @type only_valid: bool
 
     @return: paper identifiers
     @rtype: frozenset frozenset(int,)
@@ -3412,6 +3717,9 @@ def get_modified_papers_since(since):   ### get_recently_modified_record_ids
                                (since,) )
     modified_recs = frozenset(rec[0] for rec in modified_recs)
 
+    if not only_valid:
+        return modified_recs
+
     return modified_recs & frozenset(get_all_valid_papers())
 
 
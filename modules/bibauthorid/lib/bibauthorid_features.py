@@ -0,0 +1,442 @@
+# -*- coding: utf-8 -*-
+##
+## This file is part of Invenio.
+## Copyright (C) 2014 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+'''
+bibauthorid_features
+    Vectorized version of compare_bibrefrecs.
+
+    The metadata used by the comparison functions (affiliations, names,
+    coauthors, keywords, citations...) is extracted once per signature,
+    and a whole block of pairs of signatures is then compared at once
+    with numpy, giving the same values as compare_bibrefrecs:
+
+        >>> features = SignatureFeatures(bibs)
+        >>> values = features.compare_block(0, 100)
+
+    Sets are compared with jaccard() by counting the common items of all
+    the pairs of a block through the inverted index of the items, i.e.
+    by multiplying the sparse signature x item incidence matrices.
+'''
+
+from math import sqrt
+from time import time
+import random
+
+import numpy
+
+from invenio.bibauthorid_comparison import cbrr_func_weight, \
+    _compare_affiliations, _compare_unified_affiliations, _find_affiliation, \
+    _compare_inspireid, _find_inspireid, _compare_email, _find_email, \
+    _compare_names, cached_get_name_by_bibrecref, cached_compare_names, \
+    _compare_key_words, _find_key_words, \
+    _compare_collaboration, _find_collaboration, \
+    _compare_coauthors, _find_coauthors, \
+    _compare_citations, _find_citations, \
+    _compare_citations_by, _find_citations_by, \
+    combine_comparisons, jaccard
+
+# Encoding of the special values, as in Bib_matrix.
+NOT_COMPUTED = -3.
+DIFFERENT = -1.
+
+
+class SetFeature(object):
+    '''
+    A set of items per signature, compared with jaccard().
+    '''
+    def __init__(self, sets):
+        vocabulary = dict()
+        tokens = [[vocabulary.setdefault(item, len(vocabulary)) for item in items]
+                  for items in sets]
+        self.sizes = numpy.array([len(t) for t in tokens], dtype=numpy.int64)
+        self.indptr = numpy.zeros(len(tokens) + 1, dtype=numpy.int64)
+        numpy.cumsum(self.sizes, out=self.indptr[1:])
+        if tokens:
+            self.indices = numpy.array([tok for t in tokens for tok in t], dtype=numpy.int64)
+        else:
+            self.indices = numpy.zeros(0, dtype=numpy.int64)
+        # inverted index: item -> signatures having it, sorted
+        signatures = numpy.repeat(numpy.arange(len(tokens), dtype=numpy.int64), self.sizes)
+        order = numpy.lexsort((signatures, self.indices))
+        self.postings = signatures[order]
+        self.postings_ptr = numpy.zeros(len(vocabulary) + 1, dtype=numpy.int64)
+        numpy.cumsum(numpy.bincount(self.indices, minlength=len(vocabulary)),
+                     out=self.postings_ptr[1:])
+        # (signature, item) pairs, encoded and sorted for lookups
+        self.vocabulary_size = max(1, len(vocabulary))
+        self.keys = numpy.sort(signatures * self.vocabulary_size + self.indices)
+
+    def intersections(self, j0, j1, ncols):
+        '''
+        Returns the (j1 - j0) x ncols matrix of the number of items
+        the signatures j0..j1-1 have in common with the signatures
+        0..ncols-1.
+        '''
+        nrows = j1 - j0
+        start, end = self.indptr[j0], self.indptr[j1]
+        items = self.indices[start:end]
+        rows = numpy.repeat(numpy.arange(nrows, dtype=numpy.int64), self.sizes[j0:j1])
+        starts = self.postings_ptr[items]
+        lengths = self.postings_ptr[items + 1] - starts
+        total = lengths.sum()
+        rows = numpy.repeat(rows, lengths)
+        offsets = numpy.repeat(starts - (numpy.cumsum(lengths) - lengths), lengths) + \
+                  numpy.arange(total, dtype=numpy.int64)
+        cols = self.postings[offsets]
+        keep = cols < ncols
+        return numpy.bincount(rows[keep] * ncols + cols[keep],
+                              minlength=nrows * ncols).reshape(nrows, ncols)
+
+    def compare(self, j0, j1, ncols):
+        sizes1 = self.sizes[j0:j1, None]
+        sizes2 = self.sizes[None, :ncols]
+        valid = (sizes1 > 0) & (sizes2 > 0)
+        match = self.intersections(j0, j1, ncols)
+        union = sizes1 + sizes2 - match
+        union[~valid] = 1
+        return valid, match / union.astype(numpy.float64)
+
+    def pair_intersections(self, first, second):
+        '''
+        Returns the number of items the signatures FIRST[k] and SECOND[k]
+        have in common, for every k.
+        '''
+        lengths = self.sizes[first]
+        total = lengths.sum()
+        pairs = numpy.repeat(numpy.arange(len(first), dtype=numpy.int64), lengths)
+        offsets = numpy.repeat(self.indptr[first] - (numpy.cumsum(lengths) - lengths), lengths) + \
+                  numpy.arange(total, dtype=numpy.int64)
+        queries = second[pairs] * self.vocabulary_size + self.indices[offsets]
+        found = numpy.searchsorted(self.keys, queries)
+        found[found == len(self.keys)] = 0
+        hits = self.keys[found] == queries if len(self.keys) else numpy.zeros(0, dtype=bool)
+        return numpy.bincount(pairs[hits], minlength=len(first))
+
+    def compare_pairs(self, first, second):
+        sizes1 = self.sizes[first]
+        sizes2 = self.sizes[second]
+        valid = (sizes1 > 0) & (sizes2 > 0)
+        match = self.pair_intersections(first, second)
+        union = sizes1 + sizes2 - match
+        union[~valid] = 1
+        return valid, match / union.astype(numpy.float64)
+
+
+class UniqueValueFeature(object):
+    '''
+    A set of values per signature, compared only when both signatures
+    have exactly one value: EQUAL if it is the same, DIFFERENT otherwise.
+    '''
+    def __init__(self, sets, equal, different):
+        vocabulary = dict()
+        ids = list()
+        for items in sets:
+            if len(items) == 1:
+                ids.append(vocabulary.setdefault(list(items)[0], len(vocabulary)))
+            else:
+                ids.append(-1)
+        self.ids = numpy.array(ids, dtype=numpy.int64)
+        self.equal = equal
+        self.different = different
+
+    def compare(self, j0, j1, ncols):
+        ids1 = self.ids[j0:j1, None]
+        ids2 = self.ids[None, :ncols]
+        valid = (ids1 >= 0) & (ids2 >= 0)
+        return valid, numpy.where(ids1 == ids2, float(self.equal), float(self.different))
+
+    def compare_pairs(self, first, second):
+        ids1 = self.ids[first]
+        ids2 = self.ids[second]
+        valid = (ids1 >= 0) & (ids2 >= 0)
+        return valid, numpy.where(ids1 == ids2, float(self.equal), float(self.different))
+
+
+class NameFeature(object):
+    '''
+    The name of each signature, compared with COMPARE_FUNCTION once per
+    pair of distinct names.
+    '''
+    def __init__(self, names, compare_function):
+        vocabulary = dict()
+        self.names = list()
+        ids = list()
+        for name in names:
+            if name:
+                if name not in vocabulary:
+                    vocabulary[name] = len(self.names)
+                    self.names.append(name)
+                ids.append(vocabulary[name])
+            else:
+                ids.append(-1)
+        self.ids = numpy.array(ids, dtype=numpy.int64)
+        self.compare_function = compare_function
+
+    def compare(self, j0, j1, ncols):
+        ids1 = self.ids[j0:j1]
+        ids2 = self.ids[:ncols]
+        valid = (ids1[:, None] >= 0) & (ids2[None, :] >= 0)
+        unique1 = numpy.unique(ids1[ids1 >= 0])
+        unique2 = numpy.unique(ids2[ids2 >= 0])
+        values = numpy.zeros((len(unique1) + 1, len(unique2) + 1))
+        for i, id1 in enumerate(unique1):
+            name1 = self.names[id1]
+            for j, id2 in enumerate(unique2):
+                values[i, j] = self.compare_function(name1, self.names[id2])
+        # signatures without name point to the last (unused) row/column
+        pos1 = numpy.where(ids1 >= 0, numpy.searchsorted(unique1, ids1), len(unique1))
+        pos2 = numpy.where(ids2 >= 0, numpy.searchsorted(unique2, ids2), len(unique2))
+        return valid, values[pos1[:, None], pos2[None, :]]
+
+    def compare_pairs(self, first, second):
+        ids1 = self.ids[first]
+        ids2 = self.ids[second]
+        valid = (ids1 >= 0) & (ids2 >= 0)
+        values = numpy.zeros(len(first))
+        # compare every pair of names only once
+        keys = ids1[valid] * len(self.names) + ids2[valid]
+        unique_keys, positions = numpy.unique(keys, return_inverse=True)
+        unique_values = numpy.array([self.compare_function(self.names[key // len(self.names)],
+                                                           self.names[key % len(self.names)])
+                                     for key in unique_keys], dtype=numpy.float64)
+        values[valid] = unique_values[positions]
+        return valid, values
+
+
+# How to extract the features of the signatures BIBS for each
+# comparison function.
+FEATURE_EXTRACTORS = {
+    _compare_affiliations: lambda bibs: SetFeature([_find_affiliation(b) for b in bibs]),
+    # _compare_unified_affiliations compares _find_affiliation too
+    _compare_unified_affiliations: lambda bibs: SetFeature([_find_affiliation(b) for b in bibs]),
+    _compare_inspireid: lambda bibs: UniqueValueFeature([_find_inspireid(b) for b in bibs], 1, 0),
+    _compare_email: lambda bibs: UniqueValueFeature([_find_email(b) for b in bibs], 1.0, 0.3),
+    _compare_names: lambda bibs: NameFeature([cached_get_name_by_bibrecref(b) for b in bibs],
+                                             cached_compare_names),
+    _compare_key_words: lambda bibs: SetFeature([_find_key_words(b) for b in bibs]),
+    _compare_collaboration: lambda bibs: UniqueValueFeature([_find_collaboration(b) for b in bibs], 1., 0.),
+    _compare_coauthors: lambda bibs: SetFeature([_find_coauthors(b) for b in bibs]),
+    _compare_citations: lambda bibs: SetFeature([_find_citations(b) for b in bibs]),
+    _compare_citations_by: lambda bibs: SetFeature([_find_citations_by(b) for b in bibs]),
+}
+
+
+def is_vectorizable(func_weight=None):
+    '''
+    Tells whether all the comparison functions of FUNC_WEIGHT (by default
+    those used by compare_bibrefrecs) have a vectorized version.
+    '''
+    if func_weight is None:
+        func_weight = cbrr_func_weight
+    return all(func in FEATURE_EXTRACTORS for func, dummy, dummy in func_weight)
+
+
+class SignatureFeatures(object):
+    '''
+    The features of a list of signatures (bibrefrecs), used to compute
+    compare_bibrefrecs for all their pairs by blocks.
+    '''
+    def __init__(self, bibs, features=None, weights=None):
+        '''
+        @param bibs: the signatures, in the order of the matrix.
+        @param features, weights: the features and their weights, extracted
+            by default for the comparison functions of compare_bibrefrecs.
+        '''
+        self.size = len(bibs)
+        self.records = numpy.array([b[2] for b in bibs], dtype=numpy.int64)
+        if features is None:
+            features = [FEATURE_EXTRACTORS[func](bibs) for func, dummy, dummy in cbrr_func_weight]
+            weights = [weight for dummy, weight, dummy in cbrr_func_weight]
+        self.features = features
+        self.weights = weights
+        self.total_weights = sum(weights)
+
+    def compare_block(self, j0, j1, ncols=None):
+        '''
+        Compares the signatures j0..j1-1 to the signatures 0..ncols-1
+        (by default 0..j1-1).
+
+        @return: a (j1 - j0) x ncols x 2 array of the values that
+            compare_bibrefrecs returns, with '-' encoded as DIFFERENT.
+        '''
+        if ncols is None:
+            ncols = j1
+        comparisons = [feature.compare(j0, j1, ncols) for feature in self.features]
+        same_paper = self.records[j0:j1, None] == self.records[None, :ncols]
+        return self._combine(comparisons, same_paper, (j1 - j0, ncols))
+
+    def compare_pairs(self, first, second):
+        '''
+        Compares the signatures FIRST[k] and SECOND[k], for every k.
+
+        @return: a len(FIRST) x 2 array of the values that
+            compare_bibrefrecs returns, with '-' encoded as DIFFERENT.
+        '''
+        first = numpy.asarray(first, dtype=numpy.int64)
+        second = numpy.asarray(second, dtype=numpy.int64)
+        comparisons = [feature.compare_pairs(first, second) for feature in self.features]
+        same_paper = self.records[first] == self.records[second]
+        return self._combine(comparisons, same_paper, (len(first),))
+
+    def _combine(self, comparisons, same_paper, shape):
+        '''
+        Combines the (valid, value) arrays of each feature like
+        combine_comparisons does.
+        '''
+        cert = numpy.zeros(shape)
+        prob = numpy.zeros(shape)
+        # same order of operations as combine_comparisons
+        for (valid, value), weight in zip(comparisons, self.weights):
+            cert += numpy.where(valid, value * weight, 0.)
+            prob += numpy.where(valid, float(weight), 0.)
+        ret = numpy.zeros(shape + (2,))
+        computed = prob > 0
+        ret[..., 0][computed] = cert[computed] / prob[computed]
+        ret[..., 1][computed] = prob[computed] / self.total_weights
+        ret[same_paper] = DIFFERENT
+        return ret
+
+    def compare_pair(self, i, j):
+        '''
+        Compares the signatures i and j one feature at a time, the way
+        compare_bibrefrecs does.  Used for testing and benchmarking.
+        '''
+        if self.records[i] == self.records[j]:
+            return '-'
+        results = list()
+        for feature, weight in zip(self.features, self.weights):
+            if isinstance(feature, SetFeature):
+                set1 = set(feature.indices[feature.indptr[i]:feature.indptr[i + 1]])
+                set2 = set(feature.indices[feature.indptr[j]:feature.indptr[j + 1]])
+                results.append((jaccard(set1, set2), weight))
+            elif isinstance(feature, UniqueValueFeature):
+                if feature.ids[i] < 0 or feature.ids[j] < 0:
+                    results.append(('?', weight))
+                elif feature.ids[i] == feature.ids[j]:
+                    results.append((feature.equal, weight))
+                else:
+                    results.append((feature.different, weight))
+            else:
+                if feature.ids[i] < 0 or feature.ids[j] < 0:
+                    results.append(('?', weight))
+                else:
+                    results.append((feature.compare_function(feature.names[feature.ids[i]],
+                                                             feature.names[feature.ids[j]]), weight))
+        return combine_comparisons(results)
+
+
+def get_block_rows(j0, size, block_size):
+    '''
+    Returns the end of the block of rows starting at J0 such that the
+    block, of rows j0..j1-1 and columns 0..j1-1, has about BLOCK_SIZE
+    pairs.
+    '''
+    # (j1 - j0) * j1 <= block_size
+    nrows = int((sqrt(j0 * j0 + 4. * block_size) - j0) / 2)
+    return min(size, j0 + max(1, nrows))
+
+
+def create_synthetic_block(nb_signatures, nb_authors=None, seed=0):
+    '''
+    Creates the features of a synthetic surname block of NB_SIGNATURES
+    signatures of NB_AUTHORS different authors, each having a few
+    affiliations, name variants, usual coauthors and keywords of their
+    own.  The author of each signature is kept in the authors attribute.
+    '''
+    rand = random.Random(seed)
+    if nb_authors is None:
+        nb_authors = max(1, nb_signatures / 20)
+    names, affiliations, coauthors, keywords, records, authors = [], [], [], [], [], []
+    for dummy in xrange(nb_signatures):
+        author = rand.randrange(nb_authors)
+        initial = chr(65 + author % 26)
+        authors.append(author)
+        names.append(rand.choice(["Wang, %s." % initial, "Wang, %s%d" % (initial, author),
+                                  "Wang, %s%d %s." % (initial, author, chr(65 + rand.randrange(3)))]))
+        affiliations.append(set(rand.sample(xrange(author * 3, author * 3 + 5), rand.randrange(3))))
+        coauthors.append(set(rand.sample(xrange(author * 10, author * 10 + 10), rand.randrange(4, 9))) |
+                         set(rand.randrange(10 ** 6) for dummy in xrange(rand.randrange(0, 3))))
+        keywords.append(set(rand.sample(xrange(author * 10, author * 10 + 20), rand.randrange(0, 5))))
+        records.append(rand.randrange(nb_signatures * 3 / 4 + 1))
+
+    def compare_synthetic_names(name1, name2):
+        if name1 == name2:
+            return 1.
+        if name1.split()[1][0] == name2.split()[1][0]:
+            return .5
+        return 0.
+
+    bibs = [(100, i, rec) for i, rec in enumerate(records)]
+    ret = SignatureFeatures(bibs,
+                            features=[SetFeature(affiliations),
+                                      NameFeature(names, compare_synthetic_names),
+                                      SetFeature(coauthors),
+                                      SetFeature(keywords)],
+                            weights=[.3, 1., .1, .1])
+    ret.authors = numpy.array(authors, dtype=numpy.int64)
+    return ret
+
+
+def benchmark_synthetic_block(nb_signatures=2000, block_size=1000000, nb_sample_pairs=20000):
+    '''
+    Compares all the pairs of a synthetic surname block of NB_SIGNATURES
+    signatures by blocks, and a sample of the pairs one by one, and
+    checks that the results are the same.
+
+    @return: a dictionary with the number of pairs per second compared
+        each way, and the speedup.
+    '''
+    features = create_synthetic_block(nb_signatures)
+    start = time()
+    nb_pairs, j0 = 0, 0
+    blocks = dict()
+    while j0 < nb_signatures:
+        j1 = get_block_rows(j0, nb_signatures, block_size)
+        blocks[j0] = (j1, features.compare_block(j0, j1))
+        nb_pairs += (j1 - j0) * j1
+        j0 = j1
+    vectorized_time = time() - start
+
+    rand = random.Random(1)
+    pairs = [tuple(sorted(rand.sample(xrange(nb_signatures), 2))) for dummy in xrange(nb_sample_pairs)]
+    start = time()
+    expected = [features.compare_pair(j, i) for i, j in pairs]
+    pairwise_time = time() - start
+
+    block_starts = sorted(blocks)
+    for (i, j), value in zip(pairs, expected):
+        j0 = block_starts[numpy.searchsorted(block_starts, j, side='right') - 1]
+        got = blocks[j0][1][j - j0, i]
+        if value == '-':
+            assert got[0] == DIFFERENT, (i, j, value, got)
+        else:
+            assert tuple(got) == tuple(float(v) for v in value), (i, j, value, got)
+
+    ret = {'signatures': nb_signatures,
+           'vectorized_pairs_per_second': nb_pairs / max(vectorized_time, 1e-9),
+           'pairwise_pairs_per_second': nb_sample_pairs / max(pairwise_time, 1e-9)}
+    ret['speedup'] = ret['vectorized_pairs_per_second'] / ret['pairwise_pairs_per_second']
+    return ret
+
+
+if __name__ == '__main__':
+    for size in (1000, 5000):
+        print ("%(signatures)d signatures: vectorized %(vectorized_pairs_per_second).0f pairs/s, "
+               "pairwise %(pairwise_pairs_per_second).0f pairs/s, speedup x%(speedup).1f"
+               % benchmark_synthetic_block(size))
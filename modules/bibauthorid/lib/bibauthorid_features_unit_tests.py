@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+##
+## This file is part of Invenio.
+## Copyright (C) 2014 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""Unit tests for the vectorized comparison of signatures."""
+
+__revision__ = \
+    "$Id$"
+
+from invenio.testutils import InvenioTestCase, make_test_suite, run_test_suite
+
+from invenio.bibauthorid_features import SetFeature, UniqueValueFeature, \
+    create_synthetic_block, get_block_rows, DIFFERENT
+
+class TestSignatureFeatures(InvenioTestCase):
+
+    def test_set_feature(self):
+        """bibauthorid - jaccard of sets by blocks"""
+        feature = SetFeature([set(['a', 'b']), set(), set(['b', 'c', 'd']), set(['a', 'b'])])
+        valid, values = feature.compare(1, 4, 4)
+        self.assertEqual(valid.tolist(), [[False] * 4,
+                                          [True, False, True, True],
+                                          [True, False, True, True]])
+        self.assertEqual(values[1].tolist()[0], 1 / 4.)
+        self.assertEqual(values[2].tolist(), [1., 0., 1 / 4., 1.])
+
+    def test_unique_value_feature(self):
+        """bibauthorid - comparison of unique values by blocks"""
+        feature = UniqueValueFeature([set(['x']), set(['x', 'y']), set(['y']), set(['x'])], 1., .3)
+        valid, values = feature.compare(2, 4, 4)
+        self.assertEqual(valid.tolist(), [[True, False, True, True],
+                                          [True, False, True, True]])
+        self.assertEqual(values[0, 0], .3)
+        self.assertEqual(values[1, 0], 1.)
+
+    def test_same_as_pairwise(self):
+        """bibauthorid - blocks give the same values as pairwise comparisons"""
+        size = 150
+        features = create_synthetic_block(size, nb_authors=10)
+        first = 0
+        while first < size:
+            last = get_block_rows(first, size, 2000)
+            self.failUnless(last > first)
+            values = features.compare_block(first, last)
+            for j in range(first, last):
+                for i in range(j):
+                    expected = features.compare_pair(i, j)
+                    if expected == '-':
+                        self.assertEqual(tuple(values[j - first, i]), (DIFFERENT, DIFFERENT))
+                    else:
+                        self.assertEqual(tuple(values[j - first, i]), tuple(map(float, expected)))
+            first = last
+
+TEST_SUITE = make_test_suite(TestSignatureFeatures)
+
+if __name__ == "__main__":
+    run_test_suite(TEST_SUITE, warn_user=True)
@@ -28,6 +28,7 @@ from invenio.bibauthorid_name_utils import split_name_parts  # emitting #pylint:
 from invenio.bibauthorid_name_utils import soft_compare_names
 from invenio.bibauthorid_name_utils import create_normalized_name  # emitting #pylint: disable-msg=W0611
 from invenio.bibauthorid_search_engine import find_personids_by_name
+from invenio.bibauthorid_search_engine import get_search_index
 import invenio.bibauthorid_dbinterface as dbinter
 from cgi import escape
 
@@ -243,7 +244,7 @@ def person_search_engine_query(query_string):
     '''
     personid_names_list = list()
 
-    search_engine_status = dbinter.search_engine_is_operating()
+    search_engine_status = get_search_index() is not None or dbinter.search_engine_is_operating()
 
     personids_list = list()
     if search_engine_status:
@@ -1,5 +1,7 @@
 from bibauthorid_prob_matrix import Bib_matrix
 
+cdef float SP_NONE = Bib_matrix.special_symbols[None]
+
 def meld_edges(p1, p2):
     '''
     Creates one out_edges set from two.
@@ -20,7 +22,7 @@ def meld_edges(p1, p2):
 
     result = list()
     for i in xrange(size):
-        result.append(median(out_edges1[i][0], out_edges1[i][1], out_edges2[i][0], out_edges1[i][1],
+        result.append(median(out_edges1[i][0], out_edges1[i][1], out_edges2[i][0], out_edges2[i][1],
                              verts1, verts2, invsum))
 
     return (result, vsum)
@@ -30,6 +32,17 @@ cdef tuple median(float e10,float e11, float e20, float e21, int verts1, int ver
 
     cdef float i1, i2, inter_cert, inter_prob
 
+    # The pairs which were not compared (e.g. not selected by the blocking)
+    # tell nothing: they count as a certainty of 0, and never hide a
+    # quarrel or a confirmation.
+    if e10 == SP_NONE:
+        if e20 < 0:
+            return (e20,e21)
+        e10 = e11 = 0.
+    elif e20 == SP_NONE:
+        if e10 < 0:
+            return (e10,e11)
+        e20 = e21 = 0.
     if e10 < 0:
         return (e10,e11)
     if e20 < 0:
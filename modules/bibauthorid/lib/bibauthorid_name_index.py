@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+##
+## This file is part of Invenio.
+## Copyright (C) 2014 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+'''
+bibauthorid_name_index
+    The persistent index of the authors carrying each (normalized) name,
+    used by rabbit to find the authors of the new signatures.
+
+    Instead of reading all of aidPERSONIDPAPERS on every run, the index is
+    kept in a file and brought up to date by querying again only the names
+    which may have changed:
+
+        * the names of the signatures added or modified since the previous
+          run, which covers the new signatures and the signatures moved
+          from an author to another, and
+        * the names invalidated by the caller, e.g. the names of the
+          signatures it removed, or by another process through
+          invalidate_names(), e.g. by remove_papers().
+
+    An author may still be found under a name which none of the signatures
+    of the author carries any more, e.g. when they were removed without
+    telling the index, so the callers check the authors they find with
+    author_has_name().
+'''
+
+import os
+from datetime import datetime, timedelta
+from msgpack import packb as serialize
+from msgpack import unpackb as deserialize
+from msgpack import Unpacker
+
+import invenio.bibauthorid_config as bconfig
+from invenio.bibauthorid_backinterface import get_db_time
+from invenio.bibauthorid_backinterface import get_name_to_authors_mapping
+from invenio.bibauthorid_backinterface import get_names_of_modified_signatures
+from invenio.bibauthorid_backinterface import get_name_to_authors_mapping_of_names
+from invenio.bibauthorid_backinterface import get_names_of_papers
+from invenio.bibauthorid_backinterface import remove_papers as _remove_papers
+
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def _get_invalidated_path(path):
+    '''
+    Returns the path of the file of the names invalidated since the index
+    in PATH was stored.
+    '''
+    return path + '.invalidated'
+
+
+def invalidate_names(names, path=bconfig.RABBIT_NAME_INDEX_PATH):
+    '''
+    Marks the authors of NAMES as possibly stale in the index stored in
+    PATH, without loading it: they are queried again by its next update.
+    '''
+    if not names or not path:
+        return
+    files_dir = os.path.dirname(path)
+    if files_dir and not os.path.isdir(files_dir):
+        os.makedirs(files_dir)
+    fp = open(_get_invalidated_path(path), 'ab')
+    try:
+        for name in names:
+            fp.write(serialize(name))
+    finally:
+        fp.close()
+
+
+def remove_papers(recs, path=bconfig.RABBIT_NAME_INDEX_PATH):
+    '''
+    Deletes all data about the given papers from all authors, invalidating
+    the names of their signatures in the index stored in PATH.
+    '''
+    if recs:
+        invalidate_names(get_names_of_papers(recs), path)
+        _remove_papers(recs)
+
+
+class NameIndex(object):
+    '''
+    The mapping of every name to the set of authors carrying it.
+    '''
+    # please increment this value every time you
+    # change the format of the file
+    version = 1
+
+    def __init__(self, path=bconfig.RABBIT_NAME_INDEX_PATH,
+                 max_age=bconfig.RABBIT_NAME_INDEX_MAX_AGE,
+                 max_update=bconfig.RABBIT_NAME_INDEX_MAX_UPDATE):
+        self.path = path
+        self.max_age = timedelta(days=max_age)
+        self.max_update = max_update
+        self.names = dict()
+        # when the index was built from scratch, and the date of the
+        # oldest modification it may not know about
+        self.built = None
+        self.watermark = None
+        self._invalidated = set()
+
+    def __getitem__(self, name):
+        return self.names[name]
+
+    def __len__(self):
+        return len(self.names)
+
+    def add(self, name, pid):
+        self.names.setdefault(name, set()).add(pid)
+
+    def invalidate(self, name):
+        '''
+        Marks the authors of NAME as possibly stale: they are queried
+        again by the next update.
+        '''
+        self._invalidated.add(name)
+
+    def build(self):
+        '''
+        Builds the whole index from aidPERSONIDPAPERS.
+        '''
+        now = get_db_time()
+        self.names = get_name_to_authors_mapping()
+        self.built = self.watermark = now
+        self._invalidated = set()
+
+    def update(self):
+        '''
+        Queries again the authors of the names which may have changed since
+        the last update, or builds the whole index if they are too many.
+        @return: the number of names queried again.
+        '''
+        now = get_db_time()
+        names = get_names_of_modified_signatures(self.watermark) | self._invalidated
+        if len(names) > self.max_update * len(self.names):
+            self.build()
+            return len(self.names)
+
+        mapping = get_name_to_authors_mapping_of_names(names)
+        for name in names:
+            if name in mapping:
+                self.names[name] = mapping[name]
+            else:
+                self.names.pop(name, None)
+        self.watermark = now
+        self._invalidated = set()
+        return len(names)
+
+    def _load_invalidated(self):
+        '''
+        Reads the names invalidated by invalidate_names(). They are
+        forgotten by the next store().
+        '''
+        try:
+            fp = open(_get_invalidated_path(self.path), 'rb')
+        except IOError:
+            return
+        try:
+            unpacker = Unpacker(fp)
+            try:
+                for name in unpacker:
+                    self._invalidated.add(name)
+            except ValueError:
+                # the end of the file is broken, e.g. by a crash
+                pass
+        finally:
+            fp.close()
+
+    def load(self):
+        '''
+        Loads the index from its file, and brings it up to date. The index
+        is built from scratch if the file is missing, broken, outdated or
+        too old.
+        @return: whether the index has been loaded from the file.
+        '''
+        try:
+            fp = open(self.path, 'rb')
+            try:
+                data = deserialize(fp.read())
+            finally:
+                fp.close()
+            if data['version'] != self.version:
+                raise ValueError("Name index version %s" % data['version'])
+            built = datetime.strptime(data['built'], TIME_FORMAT)
+            watermark = datetime.strptime(data['watermark'], TIME_FORMAT)
+            names = dict((name, set(pids)) for name, pids in data['names'].iteritems())
+        except (IOError, OSError, ValueError, KeyError, TypeError, AttributeError):
+            self.build()
+            return False
+
+        if get_db_time() - built > self.max_age:
+            self.build()
+            return False
+
+        self.names = names
+        self.built = built
+        self.watermark = watermark
+        self._load_invalidated()
+        self.update()
+        return True
+
+    def store(self):
+        '''
+        Writes the index to its file.
+        '''
+        files_dir = os.path.dirname(self.path)
+        if files_dir and not os.path.isdir(files_dir):
+            os.makedirs(files_dir)
+
+        data = {'version': self.version,
+                'built': self.built.strftime(TIME_FORMAT),
+                'watermark': self.watermark.strftime(TIME_FORMAT),
+                'names': dict((name, list(pids)) for name, pids in self.names.iteritems())}
+        fp = open(self.path + '.tmp', 'wb')
+        try:
+            fp.write(serialize(data))
+        finally:
+            fp.close()
+        os.rename(self.path + '.tmp', self.path)
+        if os.path.exists(_get_invalidated_path(self.path)):
+            os.remove(_get_invalidated_path(self.path))
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+##
+## This file is part of Invenio.
+## Copyright (C) 2014 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""Unit tests for the name index of rabbit."""
+
+__revision__ = \
+    "$Id$"
+
+import os
+import shutil
+import tempfile
+from datetime import datetime, timedelta
+
+from invenio.testutils import InvenioTestCase, make_test_suite, run_test_suite
+from invenio import bibauthorid_name_index
+from invenio.bibauthorid_name_index import NameIndex, invalidate_names, \
+    remove_papers
+
+
+class TestNameIndex(InvenioTestCase):
+    """The index kept up to date with a fake aidPERSONIDPAPERS."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'rabbit_name_index')
+        self.now = datetime(2014, 1, 2)
+        # (personid, name, bibrec, last_updated)
+        self.rows = [(1, 'Ellis, J', 10, datetime(2014, 1, 1)),
+                     (2, 'Ellis, J', 11, datetime(2014, 1, 1)),
+                     (3, 'Smith, A', 12, datetime(2014, 1, 1))]
+
+        def mapping_of(rows):
+            mapping = dict()
+            for pid, name, rec, last_updated in rows:
+                mapping.setdefault(name, set()).add(pid)
+            return mapping
+
+        def remove_papers_from_rows(recs):
+            self.rows = [row for row in self.rows if row[2] not in recs]
+
+        self.patch_attributes(bibauthorid_name_index, (
+                ('get_db_time', lambda: self.now),
+                ('get_name_to_authors_mapping', lambda: mapping_of(self.rows)),
+                ('get_names_of_modified_signatures',
+                 lambda since: set(row[1] for row in self.rows if row[3] >= since)),
+                ('get_name_to_authors_mapping_of_names',
+                 lambda names: mapping_of([row for row in self.rows if row[1] in names])),
+                ('get_names_of_papers',
+                 lambda recs: set(row[1] for row in self.rows if row[2] in recs)),
+                ('_remove_papers', remove_papers_from_rows)))
+
+    def tearDown(self):
+        self.restore_attributes()
+        shutil.rmtree(self.tmpdir)
+
+    def make_index(self, **kwargs):
+        kwargs.setdefault('max_age', 7)
+        kwargs.setdefault('max_update', 1)
+        return NameIndex(self.path, **kwargs)
+
+    def add_row(self, pid, name, rec):
+        self.now += timedelta(hours=1)
+        self.rows.append((pid, name, rec, self.now))
+
+    def test_build(self):
+        """bibauthorid - name index built from scratch"""
+        index = self.make_index()
+        index.build()
+        self.assertEqual(index.names, {'Ellis, J': set([1, 2]), 'Smith, A': set([3])})
+        self.assertEqual(index.built, self.now)
+        self.assertEqual(index.watermark, self.now)
+
+    def test_update(self):
+        """bibauthorid - name index updated with the modified names only"""
+        index = self.make_index()
+        index.build()
+        self.add_row(4, 'Smith, A', 13)
+        self.assertEqual(index.update(), 1)
+        self.assertEqual(index['Smith, A'], set([3, 4]))
+        self.assertEqual(index.watermark, self.now)
+        self.assertEqual(index.update(), 1)
+
+    def test_update_invalidated(self):
+        """bibauthorid - name index updated with the invalidated names"""
+        index = self.make_index()
+        index.build()
+        self.rows = [row for row in self.rows if row[0] != 3]
+        self.now += timedelta(hours=1)
+        index.update()
+        self.assertEqual(index['Smith, A'], set([3]))
+        index.invalidate('Smith, A')
+        index.update()
+        self.failIf('Smith, A' in index.names)
+
+    def test_update_too_many(self):
+        """bibauthorid - name index built again when too many names changed"""
+        index = self.make_index(max_update=0.5)
+        index.build()
+        for i in range(3):
+            self.add_row(10 + i, 'Doe, %d' % i, 20 + i)
+        self.assertEqual(index.update(), 5)
+        self.assertEqual(index.built, self.now)
+        self.assertEqual(len(index), 5)
+
+    def test_store_and_load(self):
+        """bibauthorid - name index stored and loaded back"""
+        index = self.make_index()
+        index.build()
+        index.store()
+        self.add_row(4, 'Doe, J', 13)
+        loaded = self.make_index()
+        self.assertTrue(loaded.load())
+        self.assertEqual(loaded.names, {'Ellis, J': set([1, 2]), 'Smith, A': set([3]),
+                                        'Doe, J': set([4])})
+        self.assertEqual(loaded.built, index.built)
+        self.assertEqual(loaded.watermark, self.now)
+
+    def test_load_missing_broken_or_old(self):
+        """bibauthorid - name index built when it cannot be loaded"""
+        self.failIf(self.make_index().load())
+        open(self.path, 'wb').write('garbage')
+        self.failIf(self.make_index().load())
+        index = self.make_index(max_age=1)
+        index.build()
+        index.store()
+        self.now += timedelta(days=2)
+        self.failIf(self.make_index(max_age=1).load())
+
+    def test_remove_papers(self):
+        """bibauthorid - names of removed papers invalidated in the stored index"""
+        index = self.make_index()
+        index.build()
+        index.store()
+        remove_papers([10, 12], self.path)
+        invalidate_names(['Nobody, X'], self.path)
+        self.assertEqual([row[0] for row in self.rows], [2])
+        index = self.make_index()
+        self.assertTrue(index.load())
+        self.assertEqual(index.names, {'Ellis, J': set([2])})
+        index.store()
+        self.failIf(os.path.exists(self.path + '.invalidated'))
+
+
+TEST_SUITE = make_test_suite(TestNameIndex)
+
+if __name__ == "__main__":
+    run_test_suite(TEST_SUITE, warn_user=True)
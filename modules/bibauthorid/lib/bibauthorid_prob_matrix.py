@@ -19,8 +19,12 @@
 
 
 import gc
+import numpy
 import invenio.bibauthorid_config as bconfig
 from invenio.bibauthorid_comparison import compare_bibrefrecs
+from invenio.bibauthorid_features import SignatureFeatures, is_vectorizable, \
+                                        get_block_rows
+from invenio.bibauthorid_blocking import get_candidate_pairs_for_bibs
 from invenio.bibauthorid_comparison import clear_all_caches as clear_comparison_caches
 from invenio.bibauthorid_backinterface import get_modified_papers_before
 from invenio.bibauthorid_general_utils import bibauthor_print \
@@ -84,30 +88,137 @@ class ProbabilityMatrix(object):
         @param cluster_set: A cluster set object, used to initialize
         the matrix.
         '''
-        last_cleaned = 0
-        self._bib_matrix.store()
-        try:
-            old_matrix = Bib_matrix(self._bib_matrix.name+'copy')
-            old_matrix.duplicate_existing(self._bib_matrix.name, self._bib_matrix.name+'copy')
-            old_matrix.load()
-            cached_bibs = self.__get_up_to_date_bibs(old_matrix)
-            have_cached_bibs = bool(cached_bibs)
-        except IOError:
-            old_matrix.destroy()
-            cached_bibs = None
-            have_cached_bibs = False
+        if bconfig.TORTOISE_VECTORIZED_COMPARISON and is_vectorizable():
+            self._recalculate_vectorized(cluster_set)
+        else:
+            self._recalculate_pairwise(cluster_set)
 
+    def _recalculate_vectorized(self, cluster_set):
+        '''
+        Constructs the probability matrix by blocks of rows, comparing
+        all the pairs of a block at once (see bibauthorid_features).
+        Computing a whole block is cheaper than looking up the pairs
+        which did not change in the old matrix, so nothing is reused.
+        With TORTOISE_BLOCKING, only the candidate pairs are compared,
+        by chunks of TORTOISE_VECTORIZED_BLOCK_SIZE pairs.
+        '''
         self._bib_matrix.destroy()
         self._bib_matrix = Bib_matrix(cluster_set.last_name, cluster_set=cluster_set)
 
+        bibs = self._bib_matrix.get_ordered_keys()
+        size = len(bibs)
+        bib_index = dict((bib, idx) for idx, bib in enumerate(bibs))
+        cluster_index = dict((id(cl), idx) for idx, cl in enumerate(cluster_set.clusters))
+        nclusters = len(cluster_set.clusters)
+
+        # the cluster of each bib and the pairs of hating clusters
+        bib_clusters = numpy.zeros(size, dtype=numpy.int64)
+        hated = []
+        for cl in cluster_set.clusters:
+            idx = cluster_index[id(cl)]
+            for bib in cl.bibs:
+                bib_clusters[bib_index[bib]] = idx
+            hated.extend(idx * nclusters + cluster_index[id(h)] for h in cl.hate)
+        hated = numpy.unique(numpy.array(hated, dtype=numpy.int64))
+
+        def to_compute(pair_rows, pair_cols):
+            '''The pairs of bibs of different, not hating, clusters.'''
+            row_clusters = bib_clusters[pair_rows]
+            col_clusters = bib_clusters[pair_cols]
+            keep = row_clusters != col_clusters
+            if len(hated):
+                keep &= ~numpy.in1d(row_clusters * nclusters + col_clusters, hated)
+            return pair_rows[keep], pair_cols[keep]
+
+        features = SignatureFeatures(bibs)
+        if bconfig.TORTOISE_BLOCKING:
+            candidates = get_candidate_pairs_for_bibs(bibs)
+            ncandidates = len(candidates[0])
+            bibauthor_print("Prob matrix: %d candidate pairs out of %d."
+                            % (ncandidates, (size * (size - 1)) / 2))
+            for start in xrange(0, ncandidates, bconfig.TORTOISE_VECTORIZED_BLOCK_SIZE):
+                end = min(start + bconfig.TORTOISE_VECTORIZED_BLOCK_SIZE, ncandidates)
+                update_status(float(start) / ncandidates,
+                              "Prob matrix: pairs %d-%d of %d." % (start, end, ncandidates))
+                pair_rows, pair_cols = to_compute(candidates[0][start:end],
+                                                  candidates[1][start:end])
+                self._bib_matrix.set_pairs(pair_rows, pair_cols,
+                                           features.compare_pairs(pair_rows, pair_cols))
+        else:
+            expected = max(1, (size * (size + 1)) / 2)
+            first = 0
+            while first < size:
+                last = get_block_rows(first, size, bconfig.TORTOISE_VECTORIZED_BLOCK_SIZE)
+                update_status(float((first * first + first) / 2) / expected,
+                              "Prob matrix: rows %d-%d of %d." % (first, last, size))
+                pair_rows, pair_cols = numpy.nonzero(numpy.arange(last)[None, :] <
+                                                     numpy.arange(first, last)[:, None])
+                pair_rows, pair_cols = to_compute(pair_rows + first, pair_cols)
+                values = features.compare_block(first, last)[pair_rows - first, pair_cols]
+                self._bib_matrix.set_pairs(pair_rows, pair_cols, values)
+                first = last
+
+        clear_comparison_caches()
+        update_status_final("Matrix done. %d rows." % size)
+
+    @staticmethod
+    def _all_pairs(cluster_set):
+        '''
+        Yields all the pairs of bibs of different, not hating, clusters.
+        '''
+        for cl1 in cluster_set.clusters:
+            for cl2 in cluster_set.clusters:
+                if id(cl1) < id(cl2) and not cl1.hates(cl2):
+                    for bib1 in cl1.bibs:
+                        for bib2 in cl2.bibs:
+                            yield bib1, bib2
+
+    @staticmethod
+    def _candidate_pairs(cluster_set, bibs):
+        '''
+        Yields the candidate pairs of BIBS (see bibauthorid_blocking)
+        which are of different, not hating, clusters.
+        '''
+        bib_clusters = dict()
+        for cl in cluster_set.clusters:
+            for bib in cl.bibs:
+                bib_clusters[bib] = cl
+        second, first = get_candidate_pairs_for_bibs(bibs)
+        for idx2, idx1 in zip(second.tolist(), first.tolist()):
+            bib1, bib2 = bibs[idx1], bibs[idx2]
+            cl1, cl2 = bib_clusters[bib1], bib_clusters[bib2]
+            if cl1 is not cl2 and not cl1.hates(cl2):
+                yield bib1, bib2
+
+    def _recalculate_pairwise(self, cluster_set):
+        '''
+        Constructs the probability matrix one pair at a time, reusing
+        the values of the old matrix for the bibs which did not change.
+        The old matrix is read once, in order, instead of being copied.
+        With TORTOISE_BLOCKING, only the candidate pairs are visited.
+        '''
+        last_cleaned = 0
+        old_matrix = self._bib_matrix
+        self._bib_matrix = Bib_matrix(cluster_set.last_name, cluster_set=cluster_set)
+
+        cached_bibs = self.__get_up_to_date_bibs(old_matrix)
+        have_cached_bibs = bool(self._bib_matrix.reuse(old_matrix, cached_bibs))
+        old_matrix.destroy()
+
         ncl = cluster_set.num_all_bibs
         expected = ((ncl * (ncl - 1)) / 2)
         if expected == 0:
             expected = 1
 
+        if bconfig.TORTOISE_BLOCKING:
+            pairs = self._candidate_pairs(cluster_set, self._bib_matrix.get_ordered_keys())
+        else:
+            pairs = self._all_pairs(cluster_set)
+
+        val = None
         try:
             cur_calc, opti, prints_counter = 0, 0, 0
-            for cl1 in cluster_set.clusters:
+            for bib1, bib2 in pairs:
 
                 if cur_calc+opti - prints_counter > 100000 or cur_calc == 0:
                     update_status((float(opti) + cur_calc) / expected, "Prob matrix: calc %d, opti %d." % (cur_calc, opti))
@@ -119,26 +230,20 @@ class ProbabilityMatrix(object):
     #                clear_comparison_caches()
                     last_cleaned = cur_calc
 
-                for cl2 in cluster_set.clusters:
-                    if id(cl1) < id(cl2) and not cl1.hates(cl2):
-                        for bib1 in cl1.bibs:
-                            for bib2 in cl2.bibs:
-                                if have_cached_bibs:
-                                    try:
-                                        val = old_matrix[bib1, bib2]
-                                        opti += 1
-                                        if bconfig.DEBUG_CHECKS:
-                                            assert _debug_is_eq_v(val, compare_bibrefrecs(bib1, bib2))
-                                    except KeyError:
-                                        cur_calc += 1
-                                        val = compare_bibrefrecs(bib1, bib2)
-                                    if not val:
-                                        cur_calc += 1
-                                        val = compare_bibrefrecs(bib1, bib2)
-                                else:
-                                    cur_calc += 1
-                                    val = compare_bibrefrecs(bib1, bib2)
-                                self._bib_matrix[bib1, bib2] = val
+                if have_cached_bibs and bib1 in cached_bibs and bib2 in cached_bibs:
+                    val = self._bib_matrix[bib1, bib2]
+                    if val is None:
+                        cur_calc += 1
+                        val = compare_bibrefrecs(bib1, bib2)
+                    else:
+                        opti += 1
+                        if bconfig.DEBUG_CHECKS:
+                            assert _debug_is_eq_v(val, compare_bibrefrecs(bib1, bib2))
+                        continue
+                else:
+                    cur_calc += 1
+                    val = compare_bibrefrecs(bib1, bib2)
+                self._bib_matrix[bib1, bib2] = val
 
         except Exception, e:
             raise Exception("""Error happened in prob_matrix.recalculate with
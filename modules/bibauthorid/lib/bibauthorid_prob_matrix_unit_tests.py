@@ -17,22 +17,109 @@
 ## along with Invenio; if not, write to the Free Software Foundation, Inc.,
 ## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
 
-"""Unit tests for the search engine."""
+"""Unit tests for the probability matrix."""
 
 __revision__ = \
     "$Id$"
 
-from itertools import chain
+import numpy
 
 from invenio.testutils import InvenioTestCase, make_test_suite, run_test_suite
+import invenio.bibauthorid_config as bconfig
+from invenio import bibauthorid_prob_matrix
+from invenio.bibauthorid_prob_matrix import ProbabilityMatrix
 from invenio.bibauthorid_cluster_set import ClusterSet
 
+
+class _FakeBibMatrix(object):
+    """Records the pairs set by the vectorized computation."""
+
+    def __init__(self, name, cluster_set=None):
+        self.bibs = cluster_set and sorted(cluster_set.all_bibs()) or []
+        self.pairs = set()
+
+    def get_ordered_keys(self):
+        return self.bibs
+
+    def destroy(self):
+        pass
+
+    def set_pairs(self, second, first, values):
+        self.pairs.update((self.bibs[s], self.bibs[f])
+                          for s, f in zip(second.tolist(), first.tolist()))
+
+
+class _FakeFeatures(object):
+    """Compares all the pairs as 0."""
+
+    def __init__(self, bibs):
+        pass
+
+    def compare_block(self, first, last):
+        return numpy.zeros((last - first, last, 2))
+
+    def compare_pairs(self, second, first):
+        return numpy.zeros((len(second), 2))
+
+
 class TestProbabilityMatrix(InvenioTestCase):
 
     def setUp(self):
-        pass
+        self.cluster_set = ClusterSet()
+        self.cluster_set.last_name = 'Ellis'
+        clusters = [ClusterSet.Cluster([('100', i, i) for i in bibs])
+                    for bibs in ([1, 2], [3], [4, 5], [6])]
+        clusters[0].quarrel(clusters[2])
+        self.cluster_set.clusters = clusters
+        self.cluster_set.update_bibs()
+        bibs = sorted(self.cluster_set.all_bibs())
+        # the pairs of different, not hating, clusters
+        self.expected = set([(bibs[s], bibs[f]) for s, f in
+                             ((2, 0), (2, 1), (5, 0), (5, 1), (3, 2), (4, 2),
+                              (5, 2), (5, 3), (5, 4))])
+        self.candidates = numpy.tril_indices(len(bibs), -1)
+        self.patch_attributes(bibauthorid_prob_matrix, (
+                ('get_candidate_pairs_for_bibs', lambda bibs: self.candidates),
+                ('Bib_matrix', _FakeBibMatrix),
+                ('SignatureFeatures', _FakeFeatures)))
+        self.patch_attributes(bconfig, (
+                ('TORTOISE_BLOCKING', False),
+                ('TORTOISE_VECTORIZED_BLOCK_SIZE', 4)))
+
+    def tearDown(self):
+        self.restore_attributes()
+
+    def normalized(self, pairs):
+        return set([(max(bib1, bib2), min(bib1, bib2)) for bib1, bib2 in pairs])
+
+    def test_all_pairs(self):
+        """bibauthorid - pairs of different, not hating, clusters"""
+        self.assertEqual(self.normalized(ProbabilityMatrix._all_pairs(self.cluster_set)),
+                         self.expected)
+
+    def test_candidate_pairs(self):
+        """bibauthorid - only the candidate pairs of different, not hating, clusters"""
+        bibs = sorted(self.cluster_set.all_bibs())
+        self.assertEqual(self.normalized(ProbabilityMatrix._candidate_pairs(
+            self.cluster_set, bibs)), self.expected)
+        self.candidates = (numpy.array([1, 2, 4]), numpy.array([0, 0, 3]))
+        self.assertEqual(list(ProbabilityMatrix._candidate_pairs(self.cluster_set, bibs)),
+                         [(bibs[0], bibs[2])])
+
+    def test_vectorized(self):
+        """bibauthorid - vectorized computation of the pairs, with and without blocking"""
+        matrix = ProbabilityMatrix('Ellis')
+        matrix._recalculate_vectorized(self.cluster_set)
+        self.assertEqual(matrix._bib_matrix.pairs, self.expected)
+        bconfig.TORTOISE_BLOCKING = True
+        matrix._recalculate_vectorized(self.cluster_set)
+        self.assertEqual(matrix._bib_matrix.pairs, self.expected)
+        self.candidates = (numpy.array([2, 4]), numpy.array([0, 0]))
+        matrix._recalculate_vectorized(self.cluster_set)
+        bibs = sorted(self.cluster_set.all_bibs())
+        self.assertEqual(matrix._bib_matrix.pairs, set([(bibs[2], bibs[0])]))
 
-TEST_SUITE = make_test_suite()
+TEST_SUITE = make_test_suite(TestProbabilityMatrix)
 
 if __name__ == "__main__":
     run_test_suite(TEST_SUITE, warn_user=True)
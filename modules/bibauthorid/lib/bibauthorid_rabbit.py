@@ -54,6 +54,8 @@ from invenio.bibauthorid_backinterface import get_author_by_external_id
 from invenio.bibauthorid_backinterface import get_name_to_authors_mapping
 from invenio.bibauthorid_backinterface import get_free_author_id
 from invenio.bibauthorid_backinterface import remove_empty_authors
+from invenio.bibauthorid_backinterface import author_has_name
+from invenio.bibauthorid_name_index import NameIndex
 USE_EXT_IDS = bconfig.RABBIT_USE_EXTERNAL_IDS
 USE_INSPIREID = bconfig.RABBIT_USE_EXTERNAL_ID_INSPIREID
 
@@ -75,8 +77,14 @@ def rabbit(bibrecs, check_invalid_papers=False, personids_to_update_extids=None,
             verb = 1
         write_message(msg, verbose=verb)
 
+    names_index = None
     if bconfig.RABBIT_USE_CACHED_PID:
-        PID_NAMES_CACHE = get_name_to_authors_mapping()
+        if bconfig.RABBIT_NAME_INDEX_PATH:
+            names_index = NameIndex()
+            names_index.load()
+            PID_NAMES_CACHE = names_index.names
+        else:
+            PID_NAMES_CACHE = get_name_to_authors_mapping()
 
         def find_pids_by_exact_names_cache(name):
             try:
@@ -84,6 +92,13 @@ def rabbit(bibrecs, check_invalid_papers=False, personids_to_update_extids=None,
             except KeyError:
                 return []
 
+        def pid_has_name_using_names_cache(pid, name):
+            # the cache may still know authors who lost the name
+            if author_has_name(pid, name):
+                return True
+            PID_NAMES_CACHE[name].discard(pid)
+            return False
+
         def add_signature_using_names_cache(sig, name, pid):
             try:
                 PID_NAMES_CACHE[name].add(pid)
@@ -99,10 +114,12 @@ def rabbit(bibrecs, check_invalid_papers=False, personids_to_update_extids=None,
         add_signature = add_signature_using_names_cache
         new_person_from_signature = new_person_from_signature_using_names_cache
         find_pids_by_exact_name = find_pids_by_exact_names_cache
+        pid_has_name = pid_has_name_using_names_cache
     else:
         add_signature = _add_signature
         new_person_from_signature = _new_person_from_signature
         find_pids_by_exact_name = _find_pids_by_exact_name
+        pid_has_name = lambda pid, name: True
 
     compare_names = cached_sym(lambda x: x)(comp_names)
     # fast assign threshold
@@ -115,7 +132,10 @@ def rabbit(bibrecs, check_invalid_papers=False, personids_to_update_extids=None,
             bibrecs = all_bibrecs
 
         if check_invalid_papers:
-            filter_bibrecs_outside(all_bibrecs)
+            removed_names = filter_bibrecs_outside(all_bibrecs)
+            if names_index is not None:
+                for name in removed_names:
+                    names_index.invalidate(name)
 
     if (bconfig.RABBIT_USE_CACHED_GET_GROUPED_RECORDS and
         len(bibrecs) > bconfig.RABBIT_USE_CACHED_GET_GROUPED_RECORDS_THRESHOLD):
@@ -139,6 +159,9 @@ def rabbit(bibrecs, check_invalid_papers=False, personids_to_update_extids=None,
 
         if rec in deleted:
             logwrite(" - Record was deleted, removing from pid and continuing with next record", True)
+            if names_index is not None:
+                for row in get_signatures_of_paper(rec):
+                    names_index.invalidate(row[4])
             remove_papers([rec])
             continue
 
@@ -176,6 +199,10 @@ def rabbit(bibrecs, check_invalid_papers=False, personids_to_update_extids=None,
 
         remove_signatures(tuple(list(old) + [rec]) for old in old_signatures)
 
+        if names_index is not None:
+            for old in old_signatures:
+                names_index.invalidate(personidrefs_names[old])
+
         not_matched = frozenset(new_signatures) - frozenset(map(itemgetter(0), best_match))
 
         pids_having_rec = set([int(row[0]) for row in get_signatures_of_paper(rec)])
@@ -202,6 +229,8 @@ def rabbit(bibrecs, check_invalid_papers=False, personids_to_update_extids=None,
 
             matched_pids = find_pids_by_exact_name(name)
             matched_pids = [p for p in matched_pids if int(p[0]) not in used_pids]
+            while matched_pids and not pid_has_name(matched_pids[0][0], name):
+                matched_pids.pop(0)
 
             if not matched_pids or int(matched_pids[0][0]) in pids_having_rec:
                 new_pid = new_person_from_signature(list(sig) + [rec], name)
@@ -228,3 +257,7 @@ def rabbit(bibrecs, check_invalid_papers=False, personids_to_update_extids=None,
         destroy_partial_marc_caches()
 
     remove_empty_authors()
+
+    if names_index is not None:
+        names_index.update()
+        names_index.store()
@@ -19,16 +19,27 @@
 
 
 #############################################################################################
-#This has been temporarily deprecated, please use schedule_workes from general utils instead#
+#schedule has been temporarily deprecated, please use schedule_workes from general utils or #
+#run_jobs instead                                                                           #
 #############################################################################################
 
 import re
 import os
 import sys
+import socket
+import time
+import traceback
+import numpy
 from itertools import dropwhile, chain
 from invenio.bibauthorid_general_utils import print_tortoise_memory_log
 from invenio import bibauthorid_config as bconfig
 from invenio.bibauthorid_general_utils import is_eq, update_status, update_status_final
+from invenio.bibauthorid_least_squares import to_function
+from invenio.bibauthorid_backinterface import add_tortoise_jobs, \
+    claim_tortoise_job, update_tortoise_jobs_heartbeat, finish_tortoise_job, \
+    fail_tortoise_job, requeue_failed_tortoise_jobs, requeue_stale_tortoise_jobs, \
+    get_pending_tortoise_jobs, get_tortoise_jobs_status, \
+    get_tortoise_jobs_peak_memory
 
 #python2.4 compatibility
 from invenio.bibauthorid_general_utils import bai_all as all
@@ -169,3 +180,199 @@ def schedule(jobs, sizs, estimator, memfile_path=None):
     assert all(stat != None for stat in ret_status)
 
     return ret_status
+
+
+class MemoryEstimator(object):
+    '''
+    Estimates the peak memory of the jobs of a stage, in kB, from the peak
+    memory measured by the jobs of the same stage in previous runs.
+
+    A surname measured before is expected to take as much memory as the
+    last time, grown with the model if its size grew.  The model is a
+    polynomial fitted to the last measure of every surname, or the default
+    one while there are too few measures.
+    '''
+    def __init__(self, measures, default_coefs, power=2):
+        '''
+        @param measures: the (surname, size, peak memory) of the previous
+            jobs, the most recent first.
+        @param default_coefs: the polynomial of the default model.
+        '''
+        self.last = dict()
+        for surname, size, peak in measures:
+            if surname not in self.last:
+                self.last[surname] = (size, peak)
+
+        coefs = default_coefs
+        self.minimum = 0.
+        if self.last:
+            sizes, peaks = zip(*self.last.values())
+            # a process never takes less memory than the smallest measure
+            self.minimum = float(min(peaks))
+            if len(set(sizes)) > 2 * power:
+                try:
+                    coefs = list(numpy.polyfit(sizes, peaks, power)[::-1])
+                except (numpy.linalg.LinAlgError, ValueError):
+                    pass
+        self.model = to_function(coefs)
+
+    def __call__(self, surname, size):
+        if surname in self.last:
+            last_size, peak = self.last[surname]
+            peak = float(peak)
+            if size > last_size:
+                peak *= max(1., self.model(size) / max(self.model(last_size), 1.))
+            return peak
+        return max(self.model(size), self.minimum)
+
+
+def select_job(jobs, available, running):
+    '''
+    Chooses the next job to start.
+
+    @param jobs: the (estimated memory, ...) of the pending jobs, sorted by
+        decreasing estimate.
+    @param available: the memory available.
+    @param running: whether other jobs are running.
+    @return: the index of the biggest job fitting in the available memory;
+        if none fits and nothing else runs, the smallest one, which will
+        then run alone; otherwise -1.
+    '''
+    for idx, job in enumerate(jobs):
+        if job[0] <= available:
+            return idx
+    if jobs and not running:
+        return len(jobs) - 1
+    return -1
+
+
+def _run_job(job_id, function, argument):
+    '''
+    Runs a claimed job in a forked process and records its outcome.
+    '''
+    status = os.EX_SOFTWARE
+    try:
+        try:
+            function(argument)
+            finish_tortoise_job(job_id, get_peak_mem()[1])
+            status = os.EX_OK
+        except Exception:
+            fail_tortoise_job(job_id, traceback.format_exc())
+    finally:
+        os._exit(status)
+
+
+def _reap_jobs(running):
+    '''
+    Collects the jobs of RUNNING (pid -> (job_id, estimate)) which exited.
+    The jobs which died without recording their outcome, e.g. killed by
+    the kernel because the memory ran out, are marked as failed.
+    @return: the number of jobs which exited.
+    '''
+    reaped = 0
+    while running:
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except OSError:
+            break
+        if pid == 0:
+            break
+        if pid not in running:
+            continue
+        job_id = running.pop(pid)[0]
+        reaped += 1
+        if os.WIFSIGNALED(status):
+            fail_tortoise_job(job_id, "Killed by signal %d" % os.WTERMSIG(status), 'running')
+        elif os.WEXITSTATUS(status) != os.EX_OK:
+            fail_tortoise_job(job_id, "Exited with status %d" % os.WEXITSTATUS(status), 'running')
+    return reaped
+
+
+def run_jobs(run, stage, function, jobs, default_coefs=matrix_coefs, max_workers=None):
+    '''
+    Runs the jobs of a stage of a disambiguation run through the job queue
+    of the database (aidTORTOISEJOBS).
+
+    The same run can be started on several hosts sharing the database and
+    TORTOISE_FILES_PATH: every host adds the jobs to the queue, where they
+    are added only once, claims pending jobs and runs them in forked
+    processes as long as their estimated peak memory (see MemoryEstimator)
+    fits in its memory, and returns when no job of the stage is pending or
+    running on any host.  The jobs done by an interrupted run are not run
+    again when the run is started again; the failed ones are, until they
+    have been attempted TORTOISE_JOBS_MAX_ATTEMPTS times.
+
+    @param run: the name of the run.
+    @param stage: the name of the stage, e.g. 'matrix' or 'wedge'.
+    @param function: the function run on the argument of every job.
+    @param jobs: the (surname, size, argument) of every job.
+    @param default_coefs: the polynomial estimating the peak memory of a
+        job from its size, until there are enough measures.
+    @param max_workers: the number of jobs run at once, by default the
+        number of cores.
+    @return: the number of failed jobs.
+    '''
+    if max_workers is None:
+        max_workers = get_cores_count()
+    host = socket.gethostname()
+    arguments = dict((surname, argument) for surname, dummy, argument in jobs)
+
+    add_tortoise_jobs(run, stage, [(surname, size) for surname, size, dummy in jobs])
+    requeue_failed_tortoise_jobs(run, stage, bconfig.TORTOISE_JOBS_MAX_ATTEMPTS)
+    estimate = MemoryEstimator(get_tortoise_jobs_peak_memory(stage), default_coefs)
+    budget = get_total_memory() * bconfig.TORTOISE_JOBS_MEMORY_FRACTION
+    # pid -> (job_id, estimate)
+    running = dict()
+    idle_since = None
+
+    while True:
+        requeue_stale_tortoise_jobs(run, stage, bconfig.TORTOISE_JOBS_TIMEOUT,
+                                    bconfig.TORTOISE_JOBS_MAX_ATTEMPTS)
+        pending = get_pending_tortoise_jobs(run, stage)
+        runnable = sorted(((estimate(surname, size), job_id, surname)
+                           for job_id, surname, size in pending
+                           if surname in arguments), reverse=True)
+        available = budget - sum(job[1] for job in running.itervalues())
+
+        while runnable and len(running) < max_workers:
+            idx = select_job(runnable, available, bool(running))
+            if idx == -1:
+                break
+            job_estimate, job_id, surname = runnable.pop(idx)
+            if not claim_tortoise_job(job_id, host, os.getpid()):
+                # claimed by another worker
+                continue
+            pid = os.fork()
+            if pid == 0: # child
+                _run_job(job_id, function, arguments[surname])
+            running[pid] = (job_id, job_estimate)
+            available -= job_estimate
+
+        status = get_tortoise_jobs_status(run, stage)
+        total = sum(status.itervalues())
+        finished = status.get('done', 0) + status.get('failed', 0)
+        update_status(float(finished) / max(total, 1), "%d / %d" % (finished, total))
+
+        if not running and not status.get('running'):
+            if not status.get('pending'):
+                break
+            # the jobs left are unknown to this host: they are failed if
+            # no other host claims them in time
+            if idle_since is None:
+                idle_since = time.time()
+            elif time.time() - idle_since > bconfig.TORTOISE_JOBS_TIMEOUT:
+                for job_id, surname, dummy in pending:
+                    if surname not in arguments:
+                        fail_tortoise_job(job_id, "Unknown surname on %s" % host, 'pending')
+                idle_since = None
+        else:
+            idle_since = None
+
+        update_tortoise_jobs_heartbeat([job[0] for job in running.itervalues()])
+        for dummy in xrange(bconfig.TORTOISE_JOBS_POLL_INTERVAL):
+            if _reap_jobs(running):
+                break
+            time.sleep(1)
+
+    update_status_final("%d / %d" % (finished, total))
+    return status.get('failed', 0)
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+##
+## This file is part of Invenio.
+## Copyright (C) 2014 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""Unit tests for the memory admission of the tortoise job queue."""
+
+__revision__ = \
+    "$Id$"
+
+from invenio.testutils import InvenioTestCase, make_test_suite, \
+    run_test_suite
+
+from invenio.bibauthorid_scheduler import MemoryEstimator, select_job
+
+
+class TestMemoryEstimator(InvenioTestCase):
+
+    def test_default_model(self):
+        '''
+        Without measures, the default polynomial is used.
+        '''
+        estimate = MemoryEstimator([], [1000., 500., 0.])
+        self.assertEqual(estimate('ellis', 10), 6000.)
+
+    def test_last_measure_of_surname(self):
+        '''
+        The last peak of a surname is used, grown with the model.
+        '''
+        measures = [('ellis', 10, 9000), ('smith', 20, 50000), ('ellis', 10, 7000)]
+        estimate = MemoryEstimator(measures, [0., 100., 0.])
+        self.assertEqual(estimate('ellis', 10), 9000.)
+        self.assertEqual(estimate('ellis', 5), 9000.)
+        self.assertEqual(estimate('ellis', 20), 18000.)
+        # never below the smallest measure
+        self.assertEqual(estimate('jones', 1), 9000.)
+
+    def test_fitted_model(self):
+        '''
+        With enough measures, the model is fitted to them.
+        '''
+        measures = [('name%d' % size, size, 1000 + 2 * size * size)
+                    for size in range(1, 10)]
+        estimate = MemoryEstimator(measures, [0., 0., 0.])
+        self.assertAlmostEqual(estimate('other', 100), 21000., 3)
+
+
+class TestSelectJob(InvenioTestCase):
+
+    def setUp(self):
+        self.jobs = [(300, 'a'), (200, 'b'), (100, 'c')]
+
+    def test_biggest_fitting(self):
+        self.assertEqual(select_job(self.jobs, 1000, True), 0)
+        self.assertEqual(select_job(self.jobs, 250, True), 1)
+        self.assertEqual(select_job(self.jobs, 50, True), -1)
+
+    def test_too_big_alone(self):
+        self.assertEqual(select_job(self.jobs, 50, False), 2)
+        self.assertEqual(select_job([], 50, False), -1)
+
+
+TEST_SUITE = make_test_suite(TestMemoryEstimator, TestSelectJob)
+
+if __name__ == "__main__":
+    run_test_suite(TEST_SUITE, warn_user=True)
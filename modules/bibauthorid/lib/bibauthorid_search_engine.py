@@ -21,11 +21,14 @@
 
 from invenio.bibauthorid_config import QGRAM_LEN, MATCHING_QGRAMS_PERCENTAGE, \
         MAX_T_OCCURANCE_RESULT_LIST_CARDINALITY, MIN_T_OCCURANCE_RESULT_LIST_CARDINALITY, \
-        NAME_SCORE_COEFFICIENT
+        NAME_SCORE_COEFFICIENT, MAX_SCORED_NAMES, SEARCH_ENGINE_INDEX_PATH
 
+import os
+import numpy
 from Queue import Queue
 from threading import Thread
 from operator import itemgetter
+from itertools import chain
 from msgpack import packb as serialize
 from msgpack import unpackb as deserialize
 
@@ -33,7 +36,23 @@ from invenio.textutils import translate_to_ascii
 from invenio.intbitset import intbitset
 from invenio.bibauthorid_name_utils import create_indexable_name, distance, split_name_parts
 from bibauthorid_dbinterface import get_confirmed_name_to_authors_mapping, get_authors_data_from_indexable_name_ids, get_inverted_lists, \
-                                    set_inverted_lists_ready, set_dense_index_ready, populate_table, search_engine_is_operating
+                                    set_inverted_lists_ready, set_dense_index_ready, populate_table
+from bibauthorid_dbinterface import search_engine_is_operating as db_search_engine_is_operating
+
+# The search engine index file is made of sections, aligned on 8 bytes,
+# described by its header: the magic string, then the version, QGRAM_LEN,
+# the number of sections and the offset and length of every section.
+SEARCH_INDEX_MAGIC = 'AIDQGRAM'
+SEARCH_INDEX_VERSION = 1
+SEARCH_INDEX_SECTIONS = (('qgrams', 'S%d' % QGRAM_LEN),
+                         ('qgram_offsets', '<i8'),
+                         ('postings', '<i4'),
+                         ('name_offsets', '<i8'),
+                         ('names', 'u1'),
+                         ('pid_offsets', '<i8'),
+                         ('pids', '<i8'))
+# (stat of the file, SearchIndex) of the loaded index
+_SEARCH_INDEX = [None, None]
 
 
 def get_qgrams_from_string(string, q):
@@ -189,6 +208,216 @@ def create_bibauthorid_indexer():
     for t in threads:
         t.join()
 
+    if SEARCH_ENGINE_INDEX_PATH:
+        write_search_index(SEARCH_ENGINE_INDEX_PATH, indexable_name_pids_dict, indexable_names_list)
+
+
+def write_search_index(path, name_pids_dict, names_list):
+    '''
+    It writes the index of the search engine to a file, which can be mapped in
+    memory (see SearchIndex). The name ids are the positions in names_list, as
+    in the database tables.
+
+    @param path: the file
+    @type path: str
+    @param name_pids_dict: the name and the personids of every indexable name
+    @type name_pids_dict: dict
+    @param names_list: the indexable names
+    @type names_list: list
+    '''
+    inverted_lists = dict()
+    for name_id, name in enumerate(names_list):
+        for qgram in set(get_qgrams_from_string(name, QGRAM_LEN)):
+            inverted_lists.setdefault(qgram, list()).append(name_id)
+
+    qgrams = sorted(inverted_lists.keys())
+    person_names = [name_pids_dict[name][0] for name in names_list]
+    personids = [sorted(name_pids_dict[name][1]) for name in names_list]
+
+    def offsets(lists):
+        ret = numpy.zeros(len(lists) + 1, dtype=numpy.int64)
+        ret[1:] = numpy.cumsum([len(x) for x in lists])
+        return ret
+
+    sections = dict(qgrams=numpy.array(qgrams, dtype='S%d' % QGRAM_LEN),
+                    qgram_offsets=offsets([inverted_lists[qgram] for qgram in qgrams]),
+                    postings=list(chain.from_iterable(inverted_lists[qgram] for qgram in qgrams)),
+                    name_offsets=offsets(person_names),
+                    names=numpy.frombuffer(''.join(person_names), dtype=numpy.uint8),
+                    pid_offsets=offsets(personids),
+                    pids=list(chain.from_iterable(personids)))
+    sections = [numpy.asarray(sections[name], dtype=dtype) for name, dtype in SEARCH_INDEX_SECTIONS]
+
+    header = numpy.zeros(3 + 2 * len(sections), dtype='<i8')
+    header[:3] = (SEARCH_INDEX_VERSION, QGRAM_LEN, len(sections))
+    offset = len(SEARCH_INDEX_MAGIC) + header.nbytes
+    for idx, section in enumerate(sections):
+        header[3 + 2 * idx: 5 + 2 * idx] = (offset, len(section))
+        offset += (section.nbytes + 7) & ~7
+
+    files_dir = os.path.dirname(path)
+    if files_dir and not os.path.isdir(files_dir):
+        os.makedirs(files_dir)
+
+    fp = open(path + '.tmp', 'wb')
+    try:
+        fp.write(SEARCH_INDEX_MAGIC)
+        header.tofile(fp)
+        for section in sections:
+            section.tofile(fp)
+            fp.write('\0' * (-section.nbytes % 8))
+    finally:
+        fp.close()
+    # the processes which mapped the previous file keep it until they reload
+    os.rename(path + '.tmp', path)
+
+
+def count_occurences(lists, T):
+    '''
+    It solves the 'T-occurence problem' on sorted lists of ids: it finds the ids which
+    appear in at least T of the lists, and how many times they appear.
+
+    Every answer appears in at least one of the len(lists) - T + 1 shortest lists, so
+    only those are merged; the candidates are then looked up in the longer lists by
+    binary search, and dropped as soon as they cannot appear T times any more.
+
+    @param lists: sorted arrays of ids
+    @type lists: list [numpy.array,]
+    @param T: the minimum number of occurences
+    @type T: int
+
+    @return: the answers and their number of occurences
+    @rtype: tuple (numpy.array, numpy.array)
+    '''
+    lists = sorted(lists, key=len)
+    short_lists = len(lists) - T + 1
+    # numpy.unique(..., return_counts=True) needs numpy 1.9
+    merged = numpy.sort(numpy.concatenate(lists[:short_lists]))
+    if len(merged):
+        starts = numpy.concatenate(([0], numpy.flatnonzero(numpy.diff(merged)) + 1))
+        ids = merged[starts]
+        counts = numpy.diff(numpy.concatenate((starts, [len(merged)])))
+    else:
+        ids, counts = merged, numpy.zeros(0, dtype=numpy.int64)
+
+    for idx in range(short_lists, len(lists)):
+        inverted_list = lists[idx]
+        if len(inverted_list):
+            positions = inverted_list.searchsorted(ids)
+            positions[positions == len(inverted_list)] = 0
+            counts += inverted_list[positions] == ids
+        possible = counts + (len(lists) - idx - 1) >= T
+        ids, counts = ids[possible], counts[possible]
+
+    return ids, counts
+
+
+class SearchIndex(object):
+    '''
+    The index of the search engine mapped in memory from its file (see
+    write_search_index), so that it is shared by all the processes serving searches.
+    '''
+
+    def __init__(self, path):
+        data = numpy.memmap(path, dtype=numpy.uint8, mode='r')
+        if data[:len(SEARCH_INDEX_MAGIC)].tostring() != SEARCH_INDEX_MAGIC:
+            raise ValueError("%s is not a search engine index" % path)
+
+        start = len(SEARCH_INDEX_MAGIC)
+        version, qgram_len, nsections = data[start:start + 24].view('<i8')
+        if (version, qgram_len, nsections) != (SEARCH_INDEX_VERSION, QGRAM_LEN, len(SEARCH_INDEX_SECTIONS)):
+            raise ValueError("%s is an incompatible search engine index" % path)
+
+        header = data[start + 24:start + 24 + 16 * nsections].view('<i8')
+        for idx, (name, dtype) in enumerate(SEARCH_INDEX_SECTIONS):
+            offset, length = header[2 * idx: 2 * idx + 2]
+            dtype = numpy.dtype(dtype)
+            setattr(self, name, data[offset:offset + length * dtype.itemsize].view(dtype))
+
+    def get_inverted_list(self, qgram):
+        pos = self.qgrams.searchsorted(qgram)
+        if pos < len(self.qgrams) and self.qgrams[pos] == qgram:
+            return self.postings[self.qgram_offsets[pos]:self.qgram_offsets[pos + 1]]
+        return None
+
+    def solve_T_occurence_problem(self, query_string):
+        '''
+        See solve_T_occurence_problem. The name ids are those appearing in
+        at least T inverted lists, where T is the same fraction of the number of
+        lists; if there are too many, those sharing the most qgrams with the query
+        string are kept.
+
+        @param query_string:
+        @type query_string: str
+
+        @return: T_occurence_problem answers
+        @rtype: numpy.array
+        '''
+        inverted_lists = [self.get_inverted_list(qgram)
+                          for qgram in set(get_qgrams_from_string(query_string, QGRAM_LEN))]
+        inverted_lists = [inverted_list for inverted_list in inverted_lists if inverted_list is not None]
+        if not inverted_lists:
+            return None
+
+        T = max(1, int(MATCHING_QGRAMS_PERCENTAGE * len(inverted_lists)))
+        nameids, counts = count_occurences(inverted_lists, T)
+
+        for T in range(T + 1, len(inverted_lists) + 1):
+            if len(nameids) < MAX_T_OCCURANCE_RESULT_LIST_CARDINALITY:
+                break
+            more_occurences = counts >= T
+            if more_occurences.sum() > MIN_T_OCCURANCE_RESULT_LIST_CARDINALITY:
+                nameids, counts = nameids[more_occurences], counts[more_occurences]
+            else:
+                break
+
+        if len(nameids) > MAX_SCORED_NAMES:
+            nameids = nameids[numpy.argsort(-counts, kind='mergesort')[:MAX_SCORED_NAMES]]
+
+        return nameids
+
+    def get_authors_data(self, nameids):
+        '''
+        Gets the real author name and the author identifiers associated to each of
+        the specified indexable name identifiers, as get_authors_data_from_indexable_name_ids.
+
+        @return: ((name, pids),)
+        @rtype: list [(str, tuple (int,)),]
+        '''
+        ret = list()
+        for name_id in nameids:
+            name = self.names[self.name_offsets[name_id]:self.name_offsets[name_id + 1]].tostring()
+            pids = self.pids[self.pid_offsets[name_id]:self.pid_offsets[name_id + 1]]
+            ret.append((name, tuple(int(pid) for pid in pids)))
+        return ret
+
+
+def get_search_index():
+    '''
+    Gets the search engine index mapped in memory, reloading it if its file
+    has been written again since it was loaded.
+
+    @return: the index or None if there is no index file
+    @rtype: SearchIndex
+    '''
+    if not SEARCH_ENGINE_INDEX_PATH:
+        return None
+
+    try:
+        stat = os.stat(SEARCH_ENGINE_INDEX_PATH)
+    except OSError:
+        return None
+
+    stat = (stat.st_ino, stat.st_mtime, stat.st_size)
+    if _SEARCH_INDEX[0] != stat:
+        try:
+            index = SearchIndex(SEARCH_ENGINE_INDEX_PATH)
+        except (IOError, ValueError):
+            index = None
+        _SEARCH_INDEX[:] = [stat, index]
+
+    return _SEARCH_INDEX[1]
+
 
 def solve_T_occurence_problem(query_string):
     '''
@@ -261,7 +490,7 @@ def calculate_name_score1(query_string, nameids):
 
     return name_score_list
 
-def calculate_name_score(query_string, nameids):
+def calculate_name_score(query_string, nameids, search_index=None):
     '''
     docstring
 
@@ -269,11 +498,17 @@ def calculate_name_score(query_string, nameids):
     @type query_string:
     @param nameids:
     @type nameids:
+    @param search_index: the index mapped in memory, or None to use the database
+    @type search_index: SearchIndex
 
     @return:
     @rtype:
     '''
-    name_personids_list = get_authors_data_from_indexable_name_ids(nameids)
+    if search_index is None:
+        name_personids_list = [(name, deserialize(personids)) for name, personids
+                               in get_authors_data_from_indexable_name_ids(nameids)]
+    else:
+        name_personids_list = search_index.get_authors_data(nameids)
     query_last_name = split_name_parts(query_string)[0]
     query_last_name_len = len(query_last_name)
     name_score_list = list()
@@ -286,7 +521,7 @@ def calculate_name_score(query_string, nameids):
             limit = min([query_last_name_len, current_last_name_len])
             name_score = sum([1/float(2**(i+1)) for i in range(limit) if query_last_name[i] == current_last_name[i]])/(dist + 1)
             if name_score > 0.5:
-                name_score_list.append((name, name_score, deserialize(personids)))
+                name_score_list.append((name, name_score, personids))
 
     return name_score_list
 
@@ -337,8 +572,8 @@ def find_personids_by_name1(query_string):
     @return: personids which own a signature similar to the query string
     @rtype: list
     '''
-    search_engine_is_functioning = search_engine_is_operating()
-    if not search_engine_is_functioning:
+    search_index = get_search_index()
+    if search_index is None and not db_search_engine_is_operating():
         return list()
 
     asciified_query_string = translate_to_ascii(query_string)[0]
@@ -353,22 +588,20 @@ def find_personids_by_name1(query_string):
     #if not indexable_query_string and not indexable_query_string_surname:
     #    return list()
 
-    s1 = solve_T_occurence_problem(indexable_query_string)
-
-    if not s1:
-        s1 = intbitset()
-
-    nameids = solve_T_occurence_problem(indexable_query_string)
+    if search_index is None:
+        nameids = solve_T_occurence_problem(indexable_query_string)
+    else:
+        nameids = search_index.solve_T_occurence_problem(indexable_query_string)
 
     #s2 = solve_T_occurence_problem(indexable_query_string_surname)
     #if not s2:
     #    s2 = intbitset()
 
     #nameids = s1 | s2
-    if not nameids:
+    if nameids is None or not len(nameids):
         return list()
 
-    name_score_list = calculate_name_score(asciified_query_string, nameids)
+    name_score_list = calculate_name_score(asciified_query_string, nameids, search_index)
     
     return name_score_list
     #name_ranking_list = sorted(name_score_list, key=itemgetter(1), reverse=True)
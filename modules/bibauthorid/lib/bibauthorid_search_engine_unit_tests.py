@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+##
+## This file is part of Invenio.
+## Copyright (C) 2014 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""Unit tests for the in-memory index of the author search engine."""
+
+__revision__ = \
+    "$Id$"
+
+import os
+import numpy
+from tempfile import mkstemp
+
+from invenio.testutils import InvenioTestCase, make_test_suite, \
+    run_test_suite
+
+from invenio.bibauthorid_search_engine import count_occurences, \
+    write_search_index, SearchIndex
+
+
+class TestCountOccurences(InvenioTestCase):
+
+    def test_count_occurences(self):
+        lists = [numpy.array(l, dtype=numpy.int32) for l in
+                 ([1, 2, 3, 8], [2, 3, 9], [3, 4], [0, 2, 3, 4, 5, 6, 7])]
+        ids, counts = count_occurences(lists, 2)
+        self.assertEqual(ids.tolist(), [2, 3, 4])
+        self.assertEqual(counts.tolist(), [3, 4, 2])
+        ids, counts = count_occurences(lists, 4)
+        self.assertEqual(ids.tolist(), [3])
+        ids, counts = count_occurences(lists, 1)
+        self.assertEqual(ids.tolist(), range(10))
+
+
+class TestSearchIndex(InvenioTestCase):
+
+    def setUp(self):
+        fd, self.path = mkstemp()
+        os.close(fd)
+        names = ['ellis john', 'ellis', 'smith']
+        name_pids = {'ellis john': ('Ellis, John', set([7, 3])),
+                     'ellis': ('Ellis', set([7, 3, 5])),
+                     'smith': ('Smith', set([9]))}
+        write_search_index(self.path, name_pids, names)
+        self.index = SearchIndex(self.path)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_authors_data(self):
+        self.assertEqual(self.index.get_authors_data([0, 2]),
+                         [('Ellis, John', (3, 7)), ('Smith', (9,))])
+
+    def test_inverted_lists(self):
+        self.assertEqual(self.index.get_inverted_list('el').tolist(), [0, 1])
+        self.assertEqual(self.index.get_inverted_list('th').tolist(), [2])
+        self.assertTrue(self.index.get_inverted_list('zz') is None)
+
+    def test_T_occurence_problem(self):
+        self.assertEqual(sorted(self.index.solve_T_occurence_problem('ellis')), [0, 1])
+        self.assertTrue(self.index.solve_T_occurence_problem('zz') is None)
+
+
+TEST_SUITE = make_test_suite(TestCountOccurences, TestSearchIndex)
+
+if __name__ == "__main__":
+    run_test_suite(TEST_SUITE, warn_user=True)
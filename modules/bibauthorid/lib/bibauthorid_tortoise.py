@@ -57,6 +57,8 @@ from invenio.bibauthorid_least_squares import to_function as create_approx_func
 
 
 from invenio.bibauthorid_general_utils import schedule_workers
+from invenio.bibauthorid_scheduler import run_jobs, matrix_coefs, wedge_coefs
+from invenio.bibauthorid_backinterface import get_tortoise_jobs_status
 
 #python2.4 compatibility
 from invenio.bibauthorid_general_utils import bai_all as all
@@ -82,30 +84,60 @@ from invenio.bibauthorid_general_utils import bai_all as all
         may also be used to fix a broken last name
         cluster. It does not involve multiprocessing
         so it is convinient to debug with pdb.
+
+    When a run_name is given to tortoise or
+    tortoise_from_scratch, the last name groups
+    are run through the job queue of the database
+    (see bibauthorid_scheduler.run_jobs): the same
+    call can be made on several hosts sharing the
+    database and TORTOISE_FILES_PATH, and an
+    interrupted run resumes where it stopped.
 '''
 
 # Exit codes:
 # The standard ones are not well documented
 # so we are using random numbers.
 
-def tortoise_from_scratch():
+def schedule_stage(function, delayed_cluster_sets, run_name=None,
+                   stage=None, coefs=matrix_coefs):
+    '''
+    Runs function on every delayed cluster set, with schedule_workers or,
+    if run_name is given, through the job queue.
+    '''
+    cluster_sets, lnames, sizes = delayed_cluster_sets
+    if run_name is None:
+        schedule_workers(function, cluster_sets)
+    else:
+        failed = run_jobs(run_name, stage, function,
+                          zip(lnames, sizes, cluster_sets), coefs)
+        if failed:
+            bibauthor_print("%d jobs of the %s stage of %s failed, see aidTORTOISEJOBS."
+                            % (failed, stage, run_name))
+
+
+def tortoise_from_scratch(run_name=None):
     bibauthor_print("Preparing cluster sets.")
-    cluster_sets, _lnames, sizes = delayed_cluster_sets_from_marktables()
+    cluster_sets = delayed_cluster_sets_from_marktables()
     bibauthor_print("Building all matrices.")
-    schedule_workers(lambda x: force_create_matrix(x, force=True), cluster_sets)
+    schedule_stage(lambda x: force_create_matrix(x, force=True), cluster_sets,
+                   run_name, 'matrix', matrix_coefs)
 
-    empty_tortoise_results_table()
+    # the hosts joining a run after the disambiguation started
+    # must not lose its results
+    if run_name is None or not get_tortoise_jobs_status(run_name, 'wedge'):
+        empty_tortoise_results_table()
 
     bibauthor_print("Preparing cluster sets.")
-    cluster_sets, _lnames, sizes = delayed_cluster_sets_from_marktables()
+    cluster_sets = delayed_cluster_sets_from_marktables()
     bibauthor_print("Starting disambiguation.")
-    schedule_workers(wedge, cluster_sets)
+    schedule_stage(wedge, cluster_sets, run_name, 'wedge', wedge_coefs)
 
 
 def tortoise(pure=False,
              force_matrix_creation=False,
              skip_matrix_creation=False,
-             last_run=None):
+             last_run=None,
+             run_name=None):
     assert not force_matrix_creation or not skip_matrix_creation
     # The computation must be forced in case we want
     # to compute pure results
@@ -113,14 +145,15 @@ def tortoise(pure=False,
 
     if not skip_matrix_creation:
         bibauthor_print("Preparing cluster sets.")
-        clusters, _lnames, sizes = delayed_cluster_sets_from_personid(pure, last_run)
+        clusters = delayed_cluster_sets_from_personid(pure, last_run)
         bibauthor_print("Building all matrices.")
-        schedule_workers(lambda x: force_create_matrix(x, force=force_matrix_creation), clusters)
+        schedule_stage(lambda x: force_create_matrix(x, force=force_matrix_creation),
+                       clusters, run_name, 'matrix', matrix_coefs)
 
     bibauthor_print("Preparing cluster sets.")
-    clusters, _lnames, sizes = delayed_cluster_sets_from_personid(pure, last_run)
+    clusters = delayed_cluster_sets_from_personid(pure, last_run)
     bibauthor_print("Starting disambiguation.")
-    schedule_workers(wedge_and_store, clusters)
+    schedule_stage(wedge_and_store, clusters, run_name, 'wedge', wedge_coefs)
 
 
 def tortoise_last_name(name, from_mark=True, pure=False):
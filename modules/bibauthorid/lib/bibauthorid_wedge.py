@@ -43,6 +43,7 @@ SP_NUMBERS = Bib_matrix.special_numbers
 SP_SYMBOLS = Bib_matrix.special_symbols
 SP_CONFIRM = Bib_matrix.special_symbols['+']
 SP_QUARREL = Bib_matrix.special_symbols['-']
+SP_NONE = Bib_matrix.special_symbols[None]
 
 eps = 0.01
 edge_cut_prob = ''
@@ -129,6 +130,12 @@ def _compare_to(cl1, cl2):
     pointers = [cl1_out_edges[v] for v in cl2.bibs]
 
     assert pointers, PID()+"Wedge: no edges between clusters!"
+    # The pairs which were not compared (e.g. not selected by the blocking)
+    # tell nothing about the clusters.
+    pointers = [pointer for pointer in pointers if pointer[0] != SP_NONE]
+    if not pointers:
+        wedge_print("Wedge: _compare_to: no compared pairs, returning 0")
+        return 0.
     vals, probs = zip(*pointers)
 
     wedge_print("Wedge: _compare_to: vals = %s, probs = %s" % (str(vals), str(probs)))
@@ -451,7 +458,8 @@ def group_sort_edges(cs, original_process_id):
                 minus_count += 1
                 minus_fp.write(_pack_vals((bib1, bib2, default_val)))
             else:
-                assert val[0] == Bib_matrix.special_symbols[None], "Invalid Edge"
+                # not compared: not an edge
+                assert val[0] == SP_NONE, "Invalid Edge"
 
     update_status_final("Finished with the edge grouping.")
 
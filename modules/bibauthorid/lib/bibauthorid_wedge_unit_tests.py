@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+##
+## This file is part of Invenio.
+## Copyright (C) 2014 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""Unit tests for the wedge algorithm."""
+
+__revision__ = \
+    "$Id$"
+
+import os
+import shutil
+import tempfile
+
+import numpy
+
+from invenio.testutils import InvenioTestCase, make_test_suite, run_test_suite
+import invenio.bibauthorid_config as bconfig
+from invenio import bibauthorid_wedge
+from invenio.bibauthorid_wedge import meld_edges, wedge
+from invenio.bibauthorid_cluster_set import ClusterSet
+from invenio.bibauthorid_bib_matrix import Bib_matrix
+
+
+class _FakeProbabilityMatrix(object):
+    """The pairs which are not given were not compared, as if they had not
+    been selected by the blocking."""
+
+    def __init__(self, values):
+        self.values = dict((frozenset(pair), value)
+                           for pair, value in values.items())
+
+    def load(self):
+        pass
+
+    def getitem_numeric(self, bibs):
+        value = self.values.get(frozenset(bib[1] for bib in bibs))
+        value = Bib_matrix.special_symbols.get(value, value)
+        if isinstance(value, float):
+            value = (value, value)
+        return numpy.array(value, dtype=numpy.float32)
+
+
+class TestMeldEdges(InvenioTestCase):
+
+    def test_not_compared(self):
+        """bibauthorid - pairs not compared do not change the melded edges"""
+        edges, verts = meld_edges(([(-3., -3.), (0.8, 0.5), (-3., -3.), (-3., -3.)], 1),
+                                  ([(-1., -1.), (-3., -3.), (0.4, 0.5), (-3., -3.)], 1))
+        self.assertEqual(verts, 2)
+        self.assertEqual(edges[0], (-1., -1.))
+        self.assertAlmostEqual(edges[1][0], 0.8, 5)
+        self.assertAlmostEqual(edges[1][1], 0.25, 5)
+        self.assertAlmostEqual(edges[2][0], 0.4, 5)
+        self.assertEqual(edges[3], (-3., -3.))
+        edges, verts = meld_edges(([(0.8, 0.5)], 1), ([(-3., -3.)], 1))
+        self.assertAlmostEqual(edges[0][1], 0.25, 5)
+
+
+class TestWedge(InvenioTestCase):
+    """Wedge on the probabilities left by the blocking."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.matrix = _FakeProbabilityMatrix({
+            (0, 6): '-',
+            (1, 6): (0.95, 0.9),
+            (3, 4): (0.9, 0.9),
+            (4, 5): (0.9, 0.9),
+            (2, 3): (0.1, 0.9)})
+        self.patch_attributes(bibauthorid_wedge, (
+                ('ProbabilityMatrix', lambda name: self.matrix),))
+        self.patch_attributes(bconfig, (
+                ('TORTOISE_BLOCKING', True),
+                ('TORTOISE_FILES_PATH', self.tmpdir + '/')))
+
+    def tearDown(self):
+        self.restore_attributes()
+        shutil.rmtree(self.tmpdir)
+
+    def test_not_compared(self):
+        """bibauthorid - wedge with pairs not selected by the blocking"""
+        cluster_set = ClusterSet()
+        cluster_set.last_name = 'Ellis'
+        cluster_set.clusters = [ClusterSet.Cluster([('100', i, i) for i in bibs])
+                                for bibs in ([0, 1, 2], [3], [4], [5], [6])]
+        cluster_set.update_bibs()
+        wedge(cluster_set)
+        self.assertEqual(sorted(sorted(bib[1] for bib in cluster.bibs)
+                                for cluster in cluster_set.clusters),
+                         [[0, 1, 2], [3, 4, 5], [6]])
+        self.assertEqual(os.listdir(self.tmpdir), [])
+
+
+TEST_SUITE = make_test_suite(TestMeldEdges, TestWedge)
+
+if __name__ == "__main__":
+    run_test_suite(TEST_SUITE, warn_user=True)
@@ -30,6 +30,8 @@ This module IS NOT standalone safe - it should never be run so.
 import sys
 import time
 import os
+import signal
+from itertools import imap
 
 from invenio import bibclassify_config as bconfig
 from invenio import bibclassify_text_extractor
@@ -41,6 +43,7 @@ from invenio.dbquery import run_sql
 from invenio.intbitset import intbitset
 from invenio.search_engine import get_collection_reclist
 from invenio.bibdocfile import BibRecDocs
+from invenio.config import CFG_BIBCLASSIFY_DAEMON_PROCESSES
 
 # Global variables allowing to retain the progress of the task.
 _INDEX = 0
@@ -57,18 +60,22 @@ def bibclassify_daemon():
             "task.\nExamples:\n"
             "    $ bibclassify\n"
             "    $ bibclassify -i 79 -k HEP\n"
-            "    $ bibclassify -c 'Articles' -k HEP\n",
+            "    $ bibclassify -c 'Articles' -k HEP\n"
+            "    $ bibclassify -c 'Articles' -k HEP -p 8\n",
         help_specific_usage="  -i, --recid\t\tkeywords are extracted from "
         "this record\n"
         "  -c, --collection\t\tkeywords are extracted from this collection\n"
-        "  -k, --taxonomy\t\tkeywords are based on that reference",
+        "  -k, --taxonomy\t\tkeywords are based on that reference\n"
+        "  -p, --processes\t\tnumber of processes extracting the keywords "
+        "[%d]" % CFG_BIBCLASSIFY_DAEMON_PROCESSES,
         version="Invenio BibClassify v%s" % bconfig.VERSION,
-        specific_params=("i:c:k:f",
+        specific_params=("i:c:k:fp:",
             [
              "recid=",
              "collection=",
              "taxonomy=",
-             "force"
+             "force",
+             "processes="
             ]),
         task_submit_elaborate_specific_parameter_fnc=
             _task_submit_elaborate_specific_parameter,
@@ -218,6 +225,15 @@ def _task_submit_elaborate_specific_parameter(key, value, opts, args):
         bibtask.task_set_option("taxonomy", value)
     elif key in ("-f", "--force"):
         bibtask.task_set_option("force", True)
+    elif key in ("-p", "--processes"):
+        try:
+            value = int(value)
+        except ValueError:
+            bibtask.write_message("ERROR: The value specified for --processes "
+                "must be a valid integer, not '%s'." % value,
+                stream=sys.stderr, verbose=0)
+            return False
+        bibtask.task_set_option("processes", value)
     else:
         return False
 
@@ -328,58 +344,133 @@ def _analyze_documents(records, taxonomy_name, collection,
             collection, stream=sys.stderr, verbose=2)
         return False
 
-    # Process records:
-    output = []
+    start = time.time()
+    # The documents are listed here, as the processes analyzing them do
+    # not use the database.
+    jobs = []
     for record in records:
         bibdocfiles = BibRecDocs(record).list_latest_files() # TODO: why this doesn't call list_all_files() ?
-        keywords = {}
-        akws = {}
-        acro = {}
-        single_keywords = composite_keywords = author_keywords = acronyms = None
-
-
-        for doc in bibdocfiles:
-            # Get the keywords for all PDF documents contained in the record.
-            if bibclassify_text_extractor.is_pdf(doc.get_full_path()):
-                bibtask.write_message('INFO: Generating keywords for record %d.' %
-                    record, stream=sys.stderr, verbose=3)
-                fulltext = doc.get_path()
-
-                single_keywords, composite_keywords, author_keywords, acronyms = \
-                    bibclassify_engine.get_keywords_from_local_file(fulltext,
-                    taxonomy_name, with_author_keywords=True, output_mode="raw",
-                    output_limit=output_limit, match_mode='partial')
-            else:
-                bibtask.write_message('WARNING: BibClassify does not know how to process \
-                    doc: %s (type: %s) -- ignoring it.' %
-                    (doc.fullpath, doc.doctype), stream=sys.stderr, verbose=3)
-
-            if single_keywords or composite_keywords:
-                cleaned_single = bibclassify_engine.clean_before_output(single_keywords)
-                cleaned_composite = bibclassify_engine.clean_before_output(composite_keywords)
-                # merge the groups into one
-                keywords.update(cleaned_single)
-                keywords.update(cleaned_composite)
-            acro.update(acronyms)
-            akws.update(author_keywords)
-
-        if len(keywords):
-            output.append('<record>')
-            output.append('<controlfield tag="001">%s</controlfield>' % record)
-            output.append(bibclassify_engine._output_marc(keywords.items(), (), akws, acro,
-                                                      spires=bconfig.CFG_SPIRES_FORMAT))
-            output.append('</record>')
-        else:
-            bibtask.write_message('WARNING: No keywords found for record %d.' %
-                    record, stream=sys.stderr, verbose=0)
-
-        _INDEX += 1
+        docs = [(doc.get_full_path(), doc.get_path(), doc.doctype)
+                for doc in bibdocfiles]
+        jobs.append((record, docs, taxonomy_name, output_limit))
+    listing_time = time.time() - start
+
+    # Load the taxonomy before forking, so that all the processes share it.
+    bibclassify_engine.load_taxonomy(taxonomy_name)
+
+    processes = bibtask.task_get_option('processes')
+    if processes is None:
+        processes = CFG_BIBCLASSIFY_DAEMON_PROCESSES
+    processes = min(processes, len(jobs))
+    pool = None
+    if processes > 1:
+        from multiprocessing import Pool
+        pool = Pool(processes, _init_worker)
+        results = pool.imap(_analyze_record, jobs)
+    else:
+        results = imap(_analyze_record, jobs)
 
-        bibtask.task_update_progress('Done %d out of %d.' % (_INDEX, _RECIDS_NUMBER))
-        bibtask.task_sleep_now_if_required(can_stop_too=False)
+    # Process records:
+    output = []
+    extraction_time = keywords_time = 0.0
+    try:
+        for record, xml, messages, record_extraction_time, record_keywords_time \
+                in results:
+            for message, verbose in messages:
+                bibtask.write_message(message, stream=sys.stderr, verbose=verbose)
+            extraction_time += record_extraction_time
+            keywords_time += record_keywords_time
+
+            if xml:
+                output.append(xml)
+            else:
+                bibtask.write_message('WARNING: No keywords found for record %d.' %
+                        record, stream=sys.stderr, verbose=0)
+
+            _INDEX += 1
+
+            bibtask.task_update_progress('Done %d out of %d.' % (_INDEX, _RECIDS_NUMBER))
+            bibtask.task_sleep_now_if_required(can_stop_too=False)
+    except:
+        # Do not wait for the records still being analyzed.
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+        raise
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+    bibtask.write_message("INFO: %d records analyzed in %.1f sec. with %d "
+        "processes: listing the documents %.1f sec., text extraction %.1f "
+        "sec., keyword extraction %.1f sec." % (len(jobs),
+        time.time() - start, max(processes, 1), listing_time,
+        extraction_time, keywords_time), stream=sys.stderr, verbose=2)
 
     return '\n'.join(output)
 
+def _init_worker():
+    """Leave the signals (e.g. of BibSched) to the parent process."""
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    for signame in ('SIGUSR1', 'SIGUSR2', 'SIGTSTP', 'SIGCONT', 'SIGHUP'):
+        if hasattr(signal, signame):
+            signal.signal(getattr(signal, signame), signal.SIG_DFL)
+
+def _analyze_record(job):
+    """Extracts the keywords of the documents of a record. It does not use
+    the database, and can be run in any process.
+    @var job: (recid, [(full path, path, doctype) of the documents],
+        taxonomy name, output limit)
+    @return: (recid, marcxml output or None, [(message, verbose)], time
+        spent extracting the texts, time spent extracting the keywords)
+    """
+    record, docs, taxonomy_name, output_limit = job
+    keywords = {}
+    akws = {}
+    acro = {}
+    messages = []
+    extraction_time = keywords_time = 0.0
+    single_keywords = composite_keywords = author_keywords = acronyms = None
+
+    for full_path, path, doctype in docs:
+        # Get the keywords for all PDF documents contained in the record.
+        if bibclassify_text_extractor.is_pdf(full_path):
+            messages.append(('INFO: Generating keywords for record %d.' %
+                record, 3))
+            start = time.time()
+            text_lines = bibclassify_text_extractor.text_lines_from_local_file(path)
+            extraction_time += time.time() - start
+
+            start = time.time()
+            single_keywords, composite_keywords, author_keywords, acronyms = \
+                bibclassify_engine.get_keywords_from_text(text_lines,
+                taxonomy_name, with_author_keywords=True, output_mode="raw",
+                output_limit=output_limit, match_mode='partial')
+            keywords_time += time.time() - start
+        else:
+            messages.append(('WARNING: BibClassify does not know how to process \
+                doc: %s (type: %s) -- ignoring it.' % (full_path, doctype), 3))
+
+        if single_keywords or composite_keywords:
+            cleaned_single = bibclassify_engine.clean_before_output(single_keywords)
+            cleaned_composite = bibclassify_engine.clean_before_output(composite_keywords)
+            # merge the groups into one
+            keywords.update(cleaned_single)
+            keywords.update(cleaned_composite)
+        acro.update(acronyms)
+        akws.update(author_keywords)
+
+    xml = None
+    if len(keywords):
+        xml = '\n'.join(['<record>',
+            '<controlfield tag="001">%s</controlfield>' % record,
+            bibclassify_engine._output_marc(keywords.items(), (), akws, acro,
+                                            spires=bconfig.CFG_SPIRES_FORMAT),
+            '</record>'])
+
+    return record, xml, messages, extraction_time, keywords_time
+
 def _task_submit_check_options():
     """Required by bibtask. Checks the options."""
     recids = bibtask.task_get_option('recids')
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+##
+## This file is part of Invenio.
+## Copyright (C) 2014 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""Unit tests for the BibClassify daemon."""
+
+__revision__ = "$Id$"
+
+from invenio.testutils import InvenioTestCase, make_test_suite, \
+    run_test_suite
+from invenio import bibclassify_daemon
+
+
+class _FakeDocFile(object):
+    """A document of a record."""
+
+    def __init__(self, recid, name):
+        self.name = name
+        self.doctype = 'Main'
+
+    def get_full_path(self):
+        return '/docs/%s' % self.name
+
+    def get_path(self):
+        return '/docs/%s' % self.name
+
+
+class _FakeBibRecDocs(object):
+    """Records 1 to 9 have a PDF, and the even ones a text file too."""
+
+    def __init__(self, recid):
+        self.recid = recid
+
+    def list_latest_files(self):
+        files = [_FakeDocFile(self.recid, 'paper-%d.pdf' % self.recid)]
+        if self.recid % 2 == 0:
+            files.append(_FakeDocFile(self.recid, 'notes-%d.txt' % self.recid))
+        return files
+
+
+class _FakeTextExtractor(object):
+    """Reads the name of the document as its text."""
+
+    @staticmethod
+    def is_pdf(path):
+        return path.endswith('.pdf')
+
+    @staticmethod
+    def text_lines_from_local_file(path):
+        return [path]
+
+
+class _FakeEngine(object):
+    """Finds the numbers of the text as keywords."""
+
+    @staticmethod
+    def load_taxonomy(taxonomy_name):
+        pass
+
+    @staticmethod
+    def get_keywords_from_text(text_lines, taxonomy_name, **kwargs):
+        number = text_lines[0].split('-')[1].split('.')[0]
+        return {'single %s' % number: 1}, {'composite %s' % number: 2}, \
+            {'author %s' % number: 1}, {}
+
+    @staticmethod
+    def clean_before_output(keywords):
+        return keywords
+
+    @staticmethod
+    def _output_marc(keywords, composite, author_keywords, acronyms, spires):
+        return '%s %s' % (sorted(keywords), sorted(author_keywords.items()))
+
+
+class _FakeBibTask(object):
+    """Options of the task, and its messages."""
+
+    def __init__(self, processes):
+        self.processes = processes
+        self.messages = []
+
+    def task_get_option(self, name):
+        if name == 'processes':
+            return self.processes
+
+    def write_message(self, message, stream=None, verbose=1):
+        self.messages.append(message)
+
+    def task_update_progress(self, message):
+        pass
+
+    def task_sleep_now_if_required(self, can_stop_too=False):
+        pass
+
+
+class AnalyzeDocumentsTest(InvenioTestCase):
+    """Keywords extracted in the daemon process or in a pool."""
+
+    def setUp(self):
+        self.patch_attributes(bibclassify_daemon, (
+            ('BibRecDocs', _FakeBibRecDocs),
+            ('bibclassify_text_extractor', _FakeTextExtractor),
+            ('bibclassify_engine', _FakeEngine),
+            ('_RECIDS_NUMBER', 9),
+            ('_INDEX', 0)))
+
+    def tearDown(self):
+        self.restore_attributes()
+
+    def analyze(self, processes):
+        """Runs the analysis of records 1 to 9 with PROCESSES processes."""
+        bibtask = _FakeBibTask(processes)
+        self.patch_attributes(bibclassify_daemon, (('bibtask', bibtask),
+                                                   ('_INDEX', 0)))
+        xml = bibclassify_daemon._analyze_documents(range(1, 10), 'HEP',
+                                                    'Articles')
+        return xml, [message for message in bibtask.messages
+                     if not message.startswith('INFO: 9 records analyzed')]
+
+    def test_same_output(self):
+        """bibclassify - same output with and without processes"""
+        xml, messages = self.analyze(0)
+        self.assertEqual(xml.count('<record>'), 9)
+        self.assertTrue('<controlfield tag="001">1</controlfield>' in xml)
+        self.assertTrue("('single 9', 1)" in xml)
+        self.assertTrue("does not know how to process" in ''.join(messages))
+        self.assertEqual(self.analyze(2), (xml, messages))
+
+
+TEST_SUITE = make_test_suite(AnalyzeDocumentsTest)
+
+if __name__ == "__main__":
+    run_test_suite(TEST_SUITE)
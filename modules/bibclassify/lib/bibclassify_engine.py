@@ -165,15 +165,12 @@ def get_keywords_from_text(text_lines, taxonomy_name, output_mode="text",
     """
 
     start_time = time.time()
-    cache = reader.get_cache(taxonomy_name)
-    if not cache:
-        reader.set_cache(taxonomy_name, reader.get_regular_expressions(taxonomy_name,
-                rebuild=rebuild_cache, no_cache=no_cache))
-        cache = reader.get_cache(taxonomy_name)
-
+    cache = load_taxonomy(taxonomy_name, rebuild_cache=rebuild_cache,
+                          no_cache=no_cache)
 
     _skw = cache[0]
     _ckw = cache[1]
+    _matcher = cache[2]
 
     text_lines = normalizer.cut_references(text_lines)
     fulltext = normalizer.normalize_fulltext("\n".join(text_lines))
@@ -183,14 +180,14 @@ def get_keywords_from_text(text_lines, taxonomy_name, output_mode="text",
 
     author_keywords = None
     if with_author_keywords:
-        author_keywords = extract_author_keywords(_skw, _ckw, fulltext)
+        author_keywords = extract_author_keywords(_skw, _ckw, fulltext, _matcher)
 
     acronyms = {}
     if extract_acronyms:
         acronyms = extract_abbreviations(fulltext)
 
 
-    single_keywords = extract_single_keywords(_skw, fulltext)
+    single_keywords = extract_single_keywords(_skw, fulltext, _matcher)
     composite_keywords = extract_composite_keywords(_ckw, fulltext, single_keywords)
 
 
@@ -218,17 +215,33 @@ def get_keywords_from_text(text_lines, taxonomy_name, output_mode="text",
 
 
 
-def extract_single_keywords(skw_db, fulltext):
+def load_taxonomy(taxonomy_name, rebuild_cache=False, no_cache=False):
+    """Loads the taxonomy into the memory of the process, unless it is
+    there already. Processes forked afterwards share it.
+    @var taxonomy_name: string, name of the taxonomy
+    @keyword rebuild_cache: boolean
+    @keyword no_cache: boolean, means loaded definitions will not be saved
+    @return: (single keywords, composite keywords, matcher)
+    """
+    cache = reader.get_cache(taxonomy_name)
+    if not cache:
+        reader.set_cache(taxonomy_name, reader.get_regular_expressions(taxonomy_name,
+                rebuild=rebuild_cache, no_cache=no_cache))
+        cache = reader.get_cache(taxonomy_name)
+    return cache
+
+def extract_single_keywords(skw_db, fulltext, matcher=None):
     """Find single keywords in the fulltext
     @var skw_db: list of KeywordToken objects
     @var fulltext: string, which will be searched
+    @keyword matcher: KeywordMatcher of skw_db (or None)
     @return : dictionary of matches in a format {
             <keyword object>, [[position, position...], ],
             ..
             }
             or empty {}
     """
-    return keyworder.get_single_keywords(skw_db, fulltext) or {}
+    return keyworder.get_single_keywords(skw_db, fulltext, matcher) or {}
 
 def extract_composite_keywords(ckw_db, fulltext, skw_spans):
     """Returns a list of composite keywords bound with the number of
@@ -258,7 +271,7 @@ def extract_abbreviations(fulltext):
         acronyms[K(k, type='acronym')] = v
     return acronyms
 
-def extract_author_keywords(skw_db, ckw_db, fulltext):
+def extract_author_keywords(skw_db, ckw_db, fulltext, matcher=None):
     """Finds out human defined keyowrds in a text string. Searches for
     the string "Keywords:" and its declinations and matches the
     following words.
@@ -266,6 +279,7 @@ def extract_author_keywords(skw_db, ckw_db, fulltext):
     @var skw_db: list single kw object
     @var ckw_db: list of composite kw objects
     @var fulltext: utf-8 string
+    @keyword matcher: KeywordMatcher of skw_db (or None)
     @return: dictionary of matches in a formt {
           <keyword object>, [matched skw or ckw object, ....]
           }
@@ -273,7 +287,7 @@ def extract_author_keywords(skw_db, ckw_db, fulltext):
     """
     akw = {}
     K = reader.KeywordToken
-    for k, v in keyworder.get_author_keywords(skw_db, ckw_db, fulltext).items():
+    for k, v in keyworder.get_author_keywords(skw_db, ckw_db, fulltext, matcher).items():
         akw[K(k, type='author-kw')] = v
     return akw
 
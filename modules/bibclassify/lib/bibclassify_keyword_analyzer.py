@@ -38,11 +38,12 @@ _MAXIMUM_SEPARATOR_LENGTH = max([len(_separator)
     for _separator in bconfig.CFG_BIBCLASSIFY_VALID_SEPARATORS])
 
 
-# XXX - rebuild this whole thing
-def get_single_keywords(skw_db, fulltext):
+def get_single_keywords(skw_db, fulltext, matcher=None):
     """Find single keywords in the fulltext
     @var skw_db: list of KeywordToken objects
     @var fulltext: string, which will be searched
+    @keyword matcher: KeywordMatcher of skw_db, if given only the
+        regular expressions which may match the fulltext are run
     @return : dictionary of matches in a format {
             <keyword object>, [[position, position...], ],
             ..
@@ -50,39 +51,38 @@ def get_single_keywords(skw_db, fulltext):
     """
     timer_start = time.clock()
 
-    # single keyword -> [spans]
+    candidates = None
+    if matcher is not None:
+        candidates = matcher.get_candidates(fulltext)
+
+    # (span, single keyword) in the order they are found
     records = []
 
     for single_keyword in skw_db.values():
-        for regex in single_keyword.regex:
+        for index, regex in enumerate(single_keyword.regex):
+            if candidates is not None:
+                key = (single_keyword.short_id, index)
+                if key in matcher.regexes and key not in candidates:
+                    continue
             for match in regex.finditer(fulltext):
                 # Modify the right index to put it on the last letter
                 # of the word.
                 span = (match.span()[0], match.span()[1] - 1)
+                records.append((span, single_keyword))
 
-                # FIXME: expensive!!!
-                # Remove the previous records contained by this span
-                records = [record for record in records
-                                  if not _contains_span(span, record[0])]
-
-                add = True
-                for previous_record in records:
-                    if ((span, single_keyword) == previous_record or
-                        _contains_span(previous_record[0], span)):
-                        # Match is contained by a previous match.
-                        add = False
-                        break
-
-                if add:
-                    records.append((span, single_keyword))
-
-    # TODO - change to the requested format (I will return to it later)
+    # Only the matches which are not contained by another one are kept.
+    maximal_spans = _get_maximal_spans([span for span, single_keyword
+                                        in records])
 
     # List of single_keywords: {spans: single keyword}
     single_keywords = {}
-    for span, single_keyword in records:
-        single_keywords.setdefault(single_keyword, [[]])
-        single_keywords[single_keyword][0].append(span)
+    added = set()
+    for record in records:
+        span, single_keyword = record
+        if span in maximal_spans and record not in added:
+            added.add(record)
+            single_keywords.setdefault(single_keyword, [[]])
+            single_keywords[single_keyword][0].append(span)
 
     log.info("Matching single keywords... %d keywords found "
             "in %.1f sec." % (len(single_keywords), time.clock() - timer_start),
@@ -240,7 +240,7 @@ def get_composite_keywords(ckw_db, fulltext, skw_spans):
 
 
 
-def get_author_keywords(skw_db, ckw_db, fulltext):
+def get_author_keywords(skw_db, ckw_db, fulltext, matcher=None):
     """Finds out human defined keyowrds in a text string. Searches for
     the string "Keywords:" and its declinations and matches the
     following words."""
@@ -274,7 +274,7 @@ def get_author_keywords(skw_db, ckw_db, fulltext):
 
         # First try with the keyword as such, then lower it.
         kw_with_spaces = ' %s ' % kw
-        matching_skw = get_single_keywords(skw_db, kw_with_spaces)
+        matching_skw = get_single_keywords(skw_db, kw_with_spaces, matcher)
         matching_ckw = get_composite_keywords(ckw_db, kw_with_spaces,
             matching_skw)
 
@@ -284,7 +284,7 @@ def get_author_keywords(skw_db, ckw_db, fulltext):
 
         lowkw = kw.lower()
 
-        matching_skw = get_single_keywords(skw_db, ' %s ' % lowkw)
+        matching_skw = get_single_keywords(skw_db, ' %s ' % lowkw, matcher)
         matching_ckw = get_composite_keywords(ckw_db, ' %s ' % lowkw,
             matching_skw)
 
@@ -314,6 +314,20 @@ def _get_ckw_span(fulltext, spans):
     # There is no inclusion.
     return None
 
+def _get_maximal_spans(spans):
+    """Returns the set of the spans which are not contained by another
+    span of the list."""
+    maximal_spans = set()
+    # Sorted by start, and by decreasing end for the same start: a span is
+    # contained by another one if and only if one of the spans before it
+    # ends after it.
+    last_end = None
+    for span in sorted(set(spans), key=lambda span: (span[0], -span[1])):
+        if last_end is None or span[1] > last_end:
+            maximal_spans.add(span)
+            last_end = span[1]
+    return maximal_spans
+
 def _contains_span(span0, span1):
     """Return true if span0 contains span1, False otherwise."""
     if (span0 == span1 or
@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+##
+## This file is part of Invenio.
+## Copyright (C) 2014 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""
+BibClassify keyword matcher.
+
+Running every regular expression of the taxonomy over the fulltext is what
+makes the extraction of the single keywords slow, while only a tiny part
+of them matches a given text. The matcher takes from every regular
+expression a piece of text which must appear in any of its matches, and
+builds an Aho-Corasick automaton of all of them. A single pass of the
+automaton over the (lowercased) fulltext then tells which regular
+expressions may match it: the others are not run at all.
+
+The matcher is built together with the taxonomy cache and saved in it.
+
+This module is STANDALONE safe
+"""
+
+import sre_constants
+import sre_parse
+
+from invenio import bibclassify_config as bconfig
+log = bconfig.get_logger("bibclassify.keyword_matcher")
+
+# The literals are cut to this length: a shorter literal is as safe and
+# keeps the automaton small, at the cost of a few more regular expressions
+# to run.
+_MAXIMUM_LITERAL_LENGTH = 8
+# Regular expressions whose literal is shorter than this are always run.
+_MINIMUM_LITERAL_LENGTH = 2
+
+# Transitions of the automaton are stored in a single dictionary, keyed
+# by state * _ALPHABET_SIZE + character.
+_ALPHABET_SIZE = 0x110000
+
+
+class KeywordMatcher(object):
+    """Multi-pattern prefilter of the regular expressions of the single
+    keywords. The regular expressions are identified by the pair
+    (short_id of the keyword, index in keyword.regex)."""
+
+    def __init__(self, single_keywords):
+        """@var single_keywords: dictionary of KeywordToken objects, as
+            built by the ontology reader"""
+        # all the regular expressions known to the matcher
+        self.regexes = set()
+        # regular expressions without a usable literal
+        self.unfiltered = set()
+        literals = {}
+        for single_keyword in single_keywords.values():
+            for index, regex in enumerate(single_keyword.regex):
+                key = (single_keyword.short_id, index)
+                literal = get_required_literal(regex.pattern, regex.flags)
+                if literal is None or len(literal) < _MINIMUM_LITERAL_LENGTH:
+                    self.unfiltered.add(key)
+                else:
+                    literal = literal[:_MAXIMUM_LITERAL_LENGTH]
+                    literals.setdefault(literal, []).append(key)
+                self.regexes.add(key)
+
+        self._build(literals)
+        log.debug("Keyword matcher built: %d literals, %d states, %d "
+            "regular expressions always run." % (len(literals),
+            len(self._fail), len(self.unfiltered)))
+
+    def _build(self, literals):
+        """Builds the trie of the literals and its failure links."""
+        goto = {}
+        fail = [0]
+        # keys of the literal ending at a state
+        keys = {}
+        children = [[]]
+
+        for literal, literal_keys in literals.iteritems():
+            state = 0
+            for char in literal:
+                code = state * _ALPHABET_SIZE + ord(char)
+                if code in goto:
+                    state = goto[code]
+                else:
+                    goto[code] = len(fail)
+                    children[state].append((ord(char), len(fail)))
+                    state = len(fail)
+                    fail.append(0)
+                    children.append([])
+            keys[state] = tuple(literal_keys)
+
+        # Breadth first, to have the failure link of every state before
+        # the ones of its children. The output link of a state is the
+        # closest state on its failure chain where a literal ends.
+        output = {}
+        queue = [child for char, child in children[0]]
+        for state in queue:
+            for char, child in children[state]:
+                queue.append(child)
+                target = fail[state]
+                while target and target * _ALPHABET_SIZE + char not in goto:
+                    target = fail[target]
+                fail[child] = goto.get(target * _ALPHABET_SIZE + char, 0)
+            if fail[state] in keys:
+                output[state] = fail[state]
+            elif fail[state] in output:
+                output[state] = output[fail[state]]
+
+        self._goto = goto
+        self._fail = fail
+        self._keys = keys
+        self._output = output
+
+    def __getstate__(self):
+        """The state is made of builtin types only, so that it can be saved
+        with marshal in the taxonomy cache."""
+        return (self.regexes, self.unfiltered, self._goto, self._fail,
+                self._keys, self._output)
+
+    def __setstate__(self, state):
+        (self.regexes, self.unfiltered, self._goto, self._fail, self._keys,
+         self._output) = state
+
+    def get_candidates(self, fulltext):
+        """Returns the set of the regular expressions of the matcher which
+        may match the text. The others certainly do not."""
+        if isinstance(fulltext, str):
+            # The regular expressions compare characters by their code, and
+            # this keeps the code of every byte.
+            fulltext = fulltext.decode('latin-1')
+
+        goto = self._goto
+        fail = self._fail
+        keys = self._keys
+        output = self._output
+        found = set()
+        candidates = set(self.unfiltered)
+        state = 0
+        for char in fulltext.lower():
+            char = ord(char)
+            while True:
+                next_state = goto.get(state * _ALPHABET_SIZE + char)
+                if next_state is not None:
+                    state = next_state
+                    break
+                if not state:
+                    break
+                state = fail[state]
+
+            if state in keys:
+                reported = state
+            else:
+                reported = output.get(state)
+            while reported is not None and reported not in found:
+                found.add(reported)
+                candidates.update(keys[reported])
+                reported = output.get(reported)
+
+        return candidates
+
+
+def get_required_literal(pattern, flags=0):
+    """Returns the longest lowercase literal which appears in every match
+    of the regular expression, or None if it cannot be found out.
+    @var pattern: string, the regular expression
+    @keyword flags: int, the flags the expression is compiled with"""
+    try:
+        parsed = sre_parse.parse(pattern, flags)
+    except (sre_constants.error, OverflowError, RuntimeError):
+        return None
+
+    literals = _get_literals(parsed)
+    if not literals:
+        return None
+    return max(literals, key=len)
+
+
+def _get_literals(items):
+    """Returns the literals of a parsed regular expression which are
+    required by any of its matches."""
+    literals = []
+    current = []
+    for op, av in items:
+        char = None
+        if op == sre_constants.LITERAL:
+            char = unichr(av).lower()
+        elif op == sre_constants.IN:
+            # [xX] is the only set generated by bibclassify, but any set
+            # of letters differing only by their case will do.
+            if set([inop for inop, value in av]) == set([sre_constants.LITERAL]):
+                chars = set([unichr(value).lower() for inop, value in av])
+                if len(chars) == 1:
+                    char = chars.pop()
+
+        if char is not None:
+            current.append(char)
+            continue
+
+        literals.append(u"".join(current))
+        current = []
+        if op == sre_constants.SUBPATTERN:
+            literals.extend(_get_literals(av[-1]))
+        elif op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT):
+            if av[0] >= 1:
+                literals.extend(_get_literals(av[2]))
+    literals.append(u"".join(current))
+
+    return [literal for literal in literals if literal]
@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+##
+## This file is part of Invenio.
+## Copyright (C) 2014 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""Unit tests for the BibClassify keyword matcher."""
+
+__revision__ = "$Id$"
+
+import cPickle
+import cStringIO
+import gc
+import random
+import re
+import sys
+import time
+
+from invenio.testutils import InvenioTestCase, make_test_suite, \
+    run_test_suite
+from invenio.bibclassify_ontology_reader import KeywordToken, \
+    _write_cache, _read_cache
+from invenio.bibclassify_keyword_matcher import KeywordMatcher, \
+    get_required_literal
+from invenio.bibclassify_keyword_analyzer import get_single_keywords, \
+    _get_maximal_spans
+
+
+class TestKeywordMatcher(InvenioTestCase):
+    """Keyword matcher."""
+
+    def setUp(self):
+        self.single_keywords = {}
+        for label in ('photon', 'gauge', 'gauge theory', 'QCD',
+                      'non-abelian', 'Higgs particle'):
+            keyword = KeywordToken(label)
+            self.single_keywords[keyword.short_id] = keyword
+        keyword = KeywordToken('lepton')
+        keyword.regex.append(re.compile(r'[^\w-]\w+-lepton[^\w-]'))
+        keyword.regex.append(re.compile(r'[^\w-](e|mu)[^\w-]'))
+        self.single_keywords[keyword.short_id] = keyword
+        self.matcher = cPickle.loads(cPickle.dumps(
+            KeywordMatcher(self.single_keywords), 1))
+
+    def test_required_literal(self):
+        """bibclassify - literal required by the keyword regexes"""
+        self.assertEqual(get_required_literal(r'[^\w-][pP]hotons?[^\w-]'),
+                         u'photon')
+        self.assertEqual(get_required_literal(
+            r'[^\w-][nN]on-?[aA]belians?[^\w-]'), u'abelian')
+        self.assertEqual(get_required_literal(r'(?i)[^\w-]QCD[^\w-]'),
+                         u'qcd')
+        self.assertEqual(get_required_literal(r'[^\w-](e|mu)[^\w-]'), None)
+
+    def test_candidates(self):
+        """bibclassify - regexes which may match a text"""
+        candidates = self.matcher.get_candidates(
+            ' Hard PHOTONS in qcd and tau-lepton decays ')
+        self.assertTrue(('photon', 0) in candidates)
+        self.assertTrue(('QCD', 0) in candidates)
+        self.assertTrue(('lepton', 1) in candidates)
+        self.assertTrue(('lepton', 2) in candidates)
+        self.assertFalse(('gauge', 0) in candidates)
+        self.assertFalse(('Higgs particle', 0) in candidates)
+
+    def test_same_keywords(self):
+        """bibclassify - same single keywords with and without matcher"""
+        for text in (' Photons and a non-abelian gauge theory, gauge. ',
+                     ' QCD: the tau-lepton and e, mu gauge theories ',
+                     u' Higgs particles decay to photons ', ' nothing '):
+            self.assertEqual(
+                get_single_keywords(self.single_keywords, text, self.matcher),
+                get_single_keywords(self.single_keywords, text))
+
+    def test_contained_matches(self):
+        """bibclassify - matches contained by another one are removed"""
+        text = ' a gauge theory and a gauge '
+        found = get_single_keywords(self.single_keywords, text, self.matcher)
+        self.assertEqual(found, {self.single_keywords['gauge theory']: [[(2, 15)]],
+                                 self.single_keywords['gauge']: [[(21, 27)]]})
+        self.assertEqual(_get_maximal_spans([(2, 8), (0, 8), (0, 8), (9, 9),
+                                             (1, 3), (8, 10)]),
+                         set([(0, 8), (8, 10)]))
+
+    def test_taxonomy_cache(self):
+        """bibclassify - keywords and matcher read from the cache"""
+        composite = KeywordToken('gauge photon')
+        composite.compositeof = ['gauge', 'photon']
+        filestream = cStringIO.StringIO()
+        _write_cache(filestream, {'single': self.single_keywords,
+                                  'composite': {composite.short_id: composite},
+                                  'matcher': KeywordMatcher(self.single_keywords),
+                                  'creation_time': time.gmtime(),
+                                  'version_info': {'bibclassify': '0'}})
+        filestream.seek(0)
+        cached_data = _read_cache(filestream)
+
+        single_keywords = cached_data['single']
+        self.assertEqual(sorted(single_keywords), sorted(self.single_keywords))
+        self.assertEqual(single_keywords['lepton'].regex[1].pattern,
+                         r'[^\w-]\w+-lepton[^\w-]')
+        self.assertEqual(cached_data['composite']['gauge photon'].compositeof,
+                         ['gauge', 'photon'])
+        text = ' the gauge theory of e and mu-lepton photons '
+        self.assertEqual(
+            get_single_keywords(single_keywords, text, cached_data['matcher']),
+            get_single_keywords(self.single_keywords, text))
+
+    def test_taxonomy_cache_gc(self):
+        """bibclassify - garbage collector left as it was by the cache"""
+        filestream = cStringIO.StringIO()
+        _write_cache(filestream, {'single': self.single_keywords,
+                                  'composite': {},
+                                  'matcher': KeywordMatcher(self.single_keywords),
+                                  'creation_time': time.gmtime(),
+                                  'version_info': {'bibclassify': '0'}})
+        gc_enabled = gc.isenabled()
+        try:
+            for enabled in (False, True):
+                if enabled:
+                    gc.enable()
+                else:
+                    gc.disable()
+                filestream.seek(0)
+                _read_cache(filestream)
+                self.assertEqual(gc.isenabled(), enabled)
+        finally:
+            if gc_enabled:
+                gc.enable()
+            else:
+                gc.disable()
+
+
+def benchmark(keywords=2000, words=5000, runs=5):
+    """Prints the time the extraction of the single keywords of a synthetic
+    vocabulary takes with and without the keyword matcher.
+
+    The vocabulary is made of KEYWORDS labels of one to three random words,
+    and the text of WORDS random words with a label every 50 words.
+    """
+    generator = random.Random(0)
+
+    def random_word():
+        return ''.join(generator.choice('abcdefghijklmnopqrstuvwxyz')
+                       for dummy in range(generator.randint(3, 10)))
+
+    labels = set()
+    while len(labels) < keywords:
+        labels.add(' '.join(random_word()
+                            for dummy in range(generator.randint(1, 3))))
+    single_keywords = {}
+    for label in labels:
+        keyword = KeywordToken(label)
+        single_keywords[keyword.short_id] = keyword
+    labels = sorted(labels)
+    text = []
+    for index in range(words):
+        if index % 50 == 0:
+            text.append(generator.choice(labels))
+        else:
+            text.append(random_word())
+    text = ' %s ' % ' '.join(text)
+
+    start = time.time()
+    matcher = KeywordMatcher(single_keywords)
+    build_time = time.time() - start
+    candidates = len(matcher.get_candidates(text))
+
+    def median_time(matcher):
+        timings = []
+        for dummy in range(runs):
+            start = time.time()
+            found = get_single_keywords(single_keywords, text, matcher)
+            timings.append(time.time() - start)
+        timings.sort()
+        return timings[len(timings) // 2], found
+
+    without_matcher, expected = median_time(None)
+    with_matcher, found = median_time(matcher)
+
+    print "%d keywords (%d regexes), text of %d kB, %d runs:" % \
+        (keywords, len(matcher.regexes), len(text) // 1024, runs)
+    print "  matcher built in %.3f s, %d regexes run" % (build_time, candidates)
+    print "  without matcher: median %.3f s" % without_matcher
+    print "  with matcher: median %.3f s" % with_matcher
+    print "  same keywords: %s" % (found == expected)
+
+
+TEST_SUITE = make_test_suite(TestKeywordMatcher)
+
+if __name__ == "__main__":
+    if 'benchmark' in sys.argv:
+        benchmark()
+    else:
+        run_test_suite(TEST_SUITE)
@@ -35,7 +35,8 @@ This module is standalone safe.
 """
 
 from datetime import datetime, timedelta
-import cPickle
+import gc
+import marshal
 import os
 import re
 import sys
@@ -55,6 +56,7 @@ except ImportError:
     rdflib_exceptions_Error = None
 
 from invenio import bibclassify_config as bconfig
+from invenio.bibclassify_keyword_matcher import KeywordMatcher
 log = bconfig.get_logger("bibclassify.ontology_reader")
 from invenio import config
 
@@ -74,6 +76,10 @@ _split_by_punctuation = re.compile("(\W+)")
 
 
 
+# The cache file starts with this line. Please increment the number every
+# time you change the format of the file.
+_CACHE_HEADER = "BIBCLASSIFY TAXONOMY CACHE 1\n"
+
 _CACHE = {}
 
 def get_cache(taxonomy_id):
@@ -120,7 +126,9 @@ def set_cache(taxonomy_id, contents):
 
 def get_regular_expressions(taxonomy_name, rebuild=False, no_cache=False):
     """Returns a list of patterns compiled from the RDF/SKOS ontology.
-    Uses cache if it exists and if the taxonomy hasn't changed."""
+    Uses cache if it exists and if the taxonomy hasn't changed.
+    @return: (single_keywords, composite_keywords, matcher of the
+        single keywords)"""
 
     # Translate the ontology name into a local path. Check if the name
     # relates to an existing ontology.
@@ -291,7 +299,25 @@ def _discover_ontology(ontology_name):
     log.debug("No taxonomy with pattern '%s' found" % ontology_name)
 
 
-class KeywordToken:
+class _LazyRegex(object):
+    """Regular expression compiled the first time it is used. Compiling
+    the regular expressions of a big taxonomy takes much more time than
+    loading it, and most of them are never run thanks to the matcher."""
+
+    def __init__(self, pattern, flags=0):
+        self.pattern = pattern
+        self.flags = flags
+        self._regex = None
+
+    def __getattr__(self, name):
+        if name.startswith('__') or name == '_regex':
+            raise AttributeError(name)
+        if self._regex is None:
+            self._regex = re.compile(self.pattern, self.flags)
+        return getattr(self._regex, name)
+
+
+class KeywordToken(object):
     # this tells pickle that the class we are pickling is coming from
     # module 'bibclassify_ontology_reader' instead of invenio.bibclassify_ontology_reader
     #__module__ = os.path.splitext(os.path.basename(__file__))[0]
@@ -454,6 +480,25 @@ class KeywordToken:
 
 
 
+    def __getstate__(self):
+        """Returns the keyword as a tuple of builtin types, the regular
+        expressions being replaced by their patterns."""
+        if isinstance(self.id, str):
+            subject = self.id
+        else:
+            subject = unicode(self.id)
+        return (subject, self.type, self.short_id, self.concept,
+                [(regex.pattern, regex.flags) for regex in self.regex],
+                self.nostandalone, self.spires, self.fieldcodes,
+                self.compositeof, self.core, self._composite)
+
+    def __setstate__(self, state):
+        (self.id, self.type, self.short_id, self.concept, patterns,
+         self.nostandalone, self.spires, self.fieldcodes, self.compositeof,
+         self.core, self._composite) = state
+        self.regex = [_LazyRegex(pattern, flags) for pattern, flags in patterns]
+        self.__hash = hash(self.short_id)
+
     def isComposite(self):
         return self._composite
 
@@ -503,7 +548,7 @@ def _build_cache(source_file, skip_cache=False):
     vocabulary file.
     @var source_file: source file of the taxonomy, RDF file
     @keyword skip_cache: boolean, if True, build cache will not be
-        saved (pickled) - it is saved as <source_file.db> """
+        saved - it is saved as <source_file.db> """
 
     if rdflib:
         if rdflib.__version__ >= '2.3.2':
@@ -594,6 +639,7 @@ def _build_cache(source_file, skip_cache=False):
     cached_data = {}
     cached_data["single"] = single_keywords
     cached_data["composite"] = composite_keywords
+    cached_data["matcher"] = KeywordMatcher(single_keywords)
     cached_data["creation_time"] = time.gmtime()
     cached_data["version_info"] = {'rdflib': rdflib and rdflib.__version__, 'bibclassify': bconfig.VERSION}
 
@@ -622,7 +668,7 @@ def _build_cache(source_file, skip_cache=False):
                     log.error(msg)
                 else:
                     log.debug("Writing cache to file %s" % cache_path)
-                    cPickle.dump(cached_data, filestream, 1)
+                    _write_cache(filestream, cached_data)
                 if filestream:
                     filestream.close()
 
@@ -632,8 +678,8 @@ def _build_cache(source_file, skip_cache=False):
             raise Exception("Cache directory does not exist (and could not be created): %s" % cache_dir)
 
     # now when the whole taxonomy was parsed, find sub-components of the composite kws
-    # it is important to keep this call after the taxonomy was saved, because we don't
-    # want to pickle regexes multiple times (as they are must be re-compiled at load time)
+    # it is important to keep this call after the taxonomy was saved, because only
+    # the ids of the components are saved
     for kt in composite_keywords.values():
         kt.refreshCompositeOf(single_keywords, composite_keywords,
                               store=store, namespace=namespace)
@@ -642,7 +688,7 @@ def _build_cache(source_file, skip_cache=False):
     if store:
         store.close()
 
-    return (single_keywords, composite_keywords)
+    return (single_keywords, composite_keywords, cached_data["matcher"])
 
 
 
@@ -712,24 +758,24 @@ def _convert_word(word):
     return _capitalize_first_letter(word + "s?")
 
 def _get_cache(cache_file, source_file=None):
-    """Get the cached taxonomy using the cPickle module. No check is done at
+    """Get the cached taxonomy written by _write_cache. No check is done at
     that stage.
-    @var cache_file: fullpath to the file holding pickled data
+    @var cache_file: fullpath to the file holding the cached data
     @keyword source_file: if we discover the cache is obsolete, we
         will build a new cache, therefore we need the source path
         of the cache
-    @return: (single_keywords, composite_keywords)"""
+    @return: (single_keywords, composite_keywords, matcher)"""
     timer_start = time.clock()
 
+    cached_data = None
     filestream = open(cache_file, "rb")
     try:
-        #bibclassify_ontology_reader = sys.modules['bibclassify_ontology_reader']
-        cached_data = cPickle.load(filestream)
+        cached_data = _read_cache(filestream)
 
         if cached_data['version_info']['rdflib'] != (rdflib and rdflib.__version__) or \
            cached_data['version_info']['bibclassify'] != bconfig.VERSION:
             raise KeyError
-    except (cPickle.UnpicklingError, AttributeError, DeprecationWarning, EOFError), e:
+    except (ValueError, TypeError, AttributeError, DeprecationWarning, EOFError), e:
         log.warning("The existing cache in %s is not readable. "
             "Removing and rebuilding it." % cache_file)
         filestream.close()
@@ -746,10 +792,13 @@ def _get_cache(cache_file, source_file=None):
             log.error("The cache contains obsolete data (and it was deleted), \
             however I can't build a new cache, the source does not exist or is inaccessible! - %s" %
             source_file)
+            if cached_data is None:
+                raise Exception("The cache %s was written in an older format." % cache_file)
     filestream.close()
 
     single_keywords = cached_data["single"]
     composite_keywords = cached_data["composite"]
+    matcher = cached_data["matcher"]
 
     # the cache contains only keys of the composite keywords, not the objects
     # so now let's resolve them into objects
@@ -763,7 +812,60 @@ def _get_cache(cache_file, source_file=None):
         (len(single_keywords) + len(composite_keywords),
         time.clock() - timer_start))
 
-    return (single_keywords, composite_keywords)
+    return (single_keywords, composite_keywords, matcher)
+
+def _write_cache(filestream, cached_data):
+    """Writes the cached taxonomy into the file. The keywords and the
+    matcher are written as builtin types with the marshal module, which
+    loads them much faster than cPickle loads the objects.
+
+    The file is not memory-mapped: the keywords are used as Python objects
+    and dictionaries, so a mapped array of the tables would have to be
+    decoded into objects on every load anyway."""
+    data = {}
+    data["single"] = [kw.__getstate__() for kw in cached_data["single"].values()]
+    data["composite"] = [kw.__getstate__() for kw in cached_data["composite"].values()]
+    data["matcher"] = cached_data["matcher"].__getstate__()
+    data["creation_time"] = tuple(cached_data["creation_time"])
+    data["version_info"] = cached_data["version_info"]
+
+    filestream.write(_CACHE_HEADER)
+    filestream.write(marshal.dumps(data, 2))
+
+def _read_cache(filestream):
+    """Reads the cached taxonomy written by _write_cache.
+    @raise KeyError: if the file was written in another format
+    @raise ValueError: if the file is not a cache"""
+    header = filestream.readline()
+    if header != _CACHE_HEADER:
+        if header.startswith(_CACHE_HEADER.rsplit(" ", 1)[0]):
+            raise KeyError(header)
+        raise ValueError("Not a taxonomy cache")
+
+    # the garbage collector would run many times while the objects are
+    # created, for nothing
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        data = marshal.loads(filestream.read())
+
+        cached_data = {}
+        for kind in ("single", "composite"):
+            keywords = {}
+            for state in data[kind]:
+                kw = KeywordToken.__new__(KeywordToken)
+                kw.__setstate__(state)
+                keywords[kw.short_id] = kw
+            cached_data[kind] = keywords
+        matcher = KeywordMatcher.__new__(KeywordMatcher)
+        matcher.__setstate__(data["matcher"])
+    finally:
+        if gc_enabled:
+            gc.enable()
+    cached_data["matcher"] = matcher
+    cached_data["creation_time"] = data["creation_time"]
+    cached_data["version_info"] = data["version_info"]
+    return cached_data
 
 def _get_cache_path(source_file):
     """Returns the path where the cache of this taxonomy should
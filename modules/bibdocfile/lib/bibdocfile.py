@@ -57,6 +57,7 @@ import cPickle
 import base64
 import binascii
 import cgi
+import fcntl
 import sys
 
 if sys.hexversion < 0x2060000:
@@ -64,6 +65,12 @@ if sys.hexversion < 0x2060000:
 else:
     from hashlib import md5 # pylint: disable=E0611
 
+try:
+    from hashlib import sha256 # pylint: disable=E0611
+except ImportError:
+    ## Python 2.4: the content-addressed store is not available
+    sha256 = None
+
 try:
     import magic
     if hasattr(magic, "open"):
@@ -110,10 +117,14 @@ from invenio.config import CFG_SITE_URL, \
     CFG_TMPDIR, CFG_TMPSHAREDDIR, CFG_PATH_MD5SUM, \
     CFG_WEBSUBMIT_STORAGEDIR, \
     CFG_BIBDOCFILE_USE_XSENDFILE, \
+    CFG_BIBDOCFILE_XSENDFILE_HEADER, \
+    CFG_BIBDOCFILE_XACCEL_REDIRECT_LOCATION, \
+    CFG_BIBDOCFILE_XSENDFILE_MIN_SIZE, \
     CFG_BIBDOCFILE_MD5_CHECK_PROBABILITY, \
     CFG_SITE_RECORD, CFG_PYLIBDIR, \
     CFG_BIBUPLOAD_FFT_ALLOWED_EXTERNAL_URLS, \
     CFG_BIBDOCFILE_ENABLE_BIBDOCFSINFO_CACHE, \
+    CFG_BIBDOCFILE_CONTENT_ADDRESSED_STORAGE, \
     CFG_BIBDOCFILE_ADDITIONAL_KNOWN_MIMETYPES, \
     CFG_BIBDOCFILE_PREFERRED_MIMETYPES_MAPPING, \
     CFG_BIBCATALOG_SYSTEM
@@ -155,6 +166,14 @@ bibdocfile_templates = invenio.template.load('bibdocfile')
 
 CFG_ENABLE_HTTP_RANGE_REQUESTS = False
 
+#: for how many seconds the validators (ETag, Last-Modified) of a public
+#: file are trusted to answer conditional requests without loading its
+#: document (see check_stream_validators()).
+CFG_BIBDOCFILE_STREAM_VALIDATORS_TIMEOUT = 60
+
+#: how many files at most have their validators remembered in a process.
+CFG_BIBDOCFILE_STREAM_VALIDATORS_CACHE_SIZE = 10000
+
 #: block size when performing I/O.
 CFG_BIBDOCFILE_BLOCK_SIZE = 1024 * 8
 
@@ -164,6 +183,15 @@ CFG_BIBDOCFILE_MD5_THRESHOLD = 256 * 1024
 #: chunks loaded by the Python MD5 algorithm.
 CFG_BIBDOCFILE_MD5_BUFFER = 1024 * 1024
 
+#: where the content-addressed store keeps the content of the files.
+CFG_BIBDOCFILE_CONTENT_STORE_DIR = os.path.join(CFG_BIBDOCFILE_FILEDIR, 'content')
+
+#: how old an interrupted ingest in the content store must be to be removed.
+CFG_BIBDOCFILE_CONTENT_STORE_STALE_INGEST = 24 * 3600
+
+#: how many documents or records to retrieve per query when loading in bulk.
+CFG_BIBDOCFILE_BULK_LOAD_CHUNK_SIZE = 500
+
 #: whether to normalize e.g. ".JPEG" and ".jpg" into .jpeg.
 CFG_BIBDOCFILE_STRONG_FORMAT_NORMALIZATION = False
 
@@ -835,12 +863,58 @@ class BibRecDocs(object):
             res = run_sql("""SELECT brbd.id_bibdoc, brbd.docname, brbd.type FROM bibrec_bibdoc as brbd JOIN
                          bibdoc as bd ON bd.id=brbd.id_bibdoc WHERE brbd.id_bibrec=%s AND
                          bd.status<>'DELETED' ORDER BY brbd.docname ASC""", (self.id,))
+        data = BibDoc._retrieve_data_bulk([row[0] for row in res])
         for row in res:
             cur_doc = BibDoc.create_instance(docid=row[0], recid=self.id,
-                                             human_readable=self.human_readable)
+                                             human_readable=self.human_readable,
+                                             initial_data=data.get(row[0]))
             self._bibdocs[row[1]] = (cur_doc, row[2])
         self.dirty = False
 
+    @staticmethod
+    def bulk_load(recids, deleted_too=False, human_readable=False):
+        """
+        Instantiate the BibRecDocs of several records at once, retrieving
+        the information about all their documents with a few queries
+        (e.g. to display the fulltext links of a page of search results).
+
+        The files of the documents are only read from the database when
+        CFG_BIBDOCFILE_ENABLE_BIBDOCFSINFO_CACHE is set: otherwise the
+        folder of each document is still listed.
+
+        @param recids: the record identifiers.
+        @type recids: iterable of integer
+        @param deleted_too: see L{BibRecDocs}.
+        @type deleted_too: bool
+        @param human_readable: see L{BibRecDocs}.
+        @type human_readable: bool
+        @return: the BibRecDocs of each record.
+        @rtype: dict of recid -> BibRecDocs
+        """
+        recids = [int(recid) for recid in recids]
+        ret = {}
+        for recid in recids:
+            bibrecdocs = BibRecDocs(recid, deleted_too=deleted_too,
+                                    human_readable=human_readable)
+            bibrecdocs._bibdocs = {}
+            bibrecdocs.dirty = False
+            ret[recid] = bibrecdocs
+        for i in xrange(0, len(recids), CFG_BIBDOCFILE_BULK_LOAD_CHUNK_SIZE):
+            chunk = tuple(recids[i:i + CFG_BIBDOCFILE_BULK_LOAD_CHUNK_SIZE])
+            query = """SELECT brbd.id_bibrec, brbd.id_bibdoc, brbd.docname, brbd.type FROM bibrec_bibdoc as brbd JOIN
+                       bibdoc as bd ON bd.id=brbd.id_bibdoc WHERE brbd.id_bibrec IN (%s)""" % \
+                       ', '.join(['%s'] * len(chunk))
+            if not deleted_too:
+                query += " AND bd.status<>'DELETED'"
+            res = run_sql(query + " ORDER BY brbd.docname ASC", chunk) # kwalitee: disable=sql
+            data = BibDoc._retrieve_data_bulk(set([row[1] for row in res]))
+            for recid, docid, docname, doctype in res:
+                cur_doc = BibDoc.create_instance(docid=docid, recid=recid,
+                                                 human_readable=human_readable,
+                                                 initial_data=data.get(docid))
+                ret[recid]._bibdocs[docname] = (cur_doc, doctype)
+        return ret
+
     def list_bibdocs_by_names(self, doctype=None):
         """
         Returns the dictionary of all bibdocs object belonging to a recid.
@@ -1328,7 +1402,7 @@ class BibRecDocs(object):
                         versions[version] = {}
                     new_name = 'FIXING-%s-%s' % (str(counter), name)
                     try:
-                        shutil.move('%s/%s' % (bibdoc.basedir, filename), '%s/%s' % (bibdoc.basedir, new_name))
+                        rename_file('%s/%s' % (bibdoc.basedir, filename), '%s/%s' % (bibdoc.basedir, new_name))
                     except Exception, e:
                         register_exception()
                         raise InvenioBibDocFileError, "Error in renaming '%s' to '%s': '%s'" % ('%s/%s' % (bibdoc.basedir, filename), '%s/%s' % (bibdoc.basedir, new_name), e)
@@ -1370,7 +1444,7 @@ class BibRecDocs(object):
                 for docformat, filename in formats.iteritems():
                     destination = '%s%s;%i' % (docname, docformat, version)
                     try:
-                        shutil.move('%s/%s' % (bibdoc.basedir, filename), '%s/%s' % (bibdoc.basedir, destination))
+                        rename_file('%s/%s' % (bibdoc.basedir, filename), '%s/%s' % (bibdoc.basedir, destination))
                     except Exception, e:
                         register_exception()
                         raise InvenioBibDocFileError, "Error in renaming '%s' to '%s': '%s'" % ('%s/%s' % (bibdoc.basedir, filename), '%s/%s' % (bibdoc.basedir, destination), e)
@@ -1475,7 +1549,7 @@ class BibRecDocs(object):
                 except ValueError:
                     register_exception(alert_admin=True, prefix= "Strange file '%s' is stored in %s" % (filename, bibdoc.basedir))
                 else:
-                    os.rename(os.path.join(bibdoc.basedir, filename), os.path.join(bibdoc.basedir, '%s%s;%i' % (docname, docformat, version)))
+                    rename_file(os.path.join(bibdoc.basedir, filename), os.path.join(bibdoc.basedir, '%s%s;%i' % (docname, docformat, version)))
         Md5Folder(bibdoc.basedir).update()
         bibdoc.touch('rename')
 
@@ -1624,15 +1698,14 @@ class BibDoc(object):
         attaching newly created document to a record
         """
         # docid is known, the document already exists
-        res2 = run_sql("SELECT id_bibrec, type, docname FROM bibrec_bibdoc WHERE id_bibdoc=%s", (docid,))
-        self.bibrec_types = [(r[0], r[1], r[2]) for r in res2 ] # just in case the result was behaving like tuples but was something else
-        if not res2:
-            # fake attachment
-            self.bibrec_types = [(0, None, "fake_name_for_unattached_document")]
-
         if initial_data is None:
             initial_data = BibDoc._retrieve_data(docid)
 
+        self.bibrec_types = [(link["recid"], link["doctype"], link["docname"]) for link in initial_data["bibrec_links"]]
+        if not self.bibrec_types:
+            # fake attachment
+            self.bibrec_types = [(0, None, "fake_name_for_unattached_document")]
+
         self._docfiles = []
         self.__md5s = None
         self._related_files = {}
@@ -1647,8 +1720,10 @@ class BibDoc(object):
         self.basedir = initial_data["basedir"]
         self.doctype = initial_data["doctype"]
         self.storagename = initial_data["storagename"] # the old docname -> now used as a storage name for old records
+        ## inventory of the files, if read from bibdocfsinfo
+        self._initial_files = initial_data.get("files")
 
-        self.more_info = BibDocMoreInfo(self.id)
+        self.more_info = BibDocMoreInfo(self.id, cached_data=initial_data.get("more_info"))
         self.dirty = True
         self.dirty_related_files = True
         self.last_action = 'init'
@@ -1713,46 +1788,81 @@ class BibDoc(object):
         """
            Filling information about a document from the database entry
         """
-        container = {}
-        container["bibrec_links"] = []
-        container["id"] = docid
-        container["basedir"] = _make_base_dir(container["id"])
-
-        # retrieving links betwen records and documents
-
-        res = run_sql("SELECT id_bibrec, type, docname FROM bibrec_bibdoc WHERE id_bibdoc=%s", (str(docid),), 1)
-        if res:
-            for r in res:
-                container["bibrec_links"].append({"recid": r[0], "doctype": r[1], "docname": r[2]})
-
-        # gather the other information
-        res = run_sql("SELECT status, creation_date, modification_date, text_extraction_date, doctype, docname FROM bibdoc WHERE id=%s LIMIT 1", (docid,), 1)
-
-        if res:
-            container["status"] = res[0][0]
-            container["cd"] = res[0][1]
-            container["md"] = res[0][2]
-            container["td"] = res[0][3]
-            container["doctype"] = res[0][4]
-            container["storagename"] = res[0][5]
-        else:
+        container = BibDoc._retrieve_data_bulk([docid]).get(int(docid))
+        if container is None:
             # this bibdoc doesn't exist
             raise InvenioBibDocFileError, "The docid %s does not exist." % docid
+        container["id"] = docid
+        return container
+
+    @staticmethod
+    def _retrieve_data_bulk(docids):
+        """
+        Filling information about several documents from the database,
+        with a few queries for all of them.  When
+        CFG_BIBDOCFILE_ENABLE_BIBDOCFSINFO_CACHE is set, this includes the
+        inventory of their files, so that the filesystem is not accessed.
+
+        @param docids: the document identifiers.
+        @type docids: iterable of integer
+        @return: the information about each existing document (see
+            L{_retrieve_data}).
+        @rtype: dict of docid -> dict
+        """
+        containers = {}
+        docids = list(docids)
+        for i in xrange(0, len(docids), CFG_BIBDOCFILE_BULK_LOAD_CHUNK_SIZE):
+            chunk = tuple(docids[i:i + CFG_BIBDOCFILE_BULK_LOAD_CHUNK_SIZE])
+            placeholders = ', '.join(['%s'] * len(chunk))
+            res = run_sql("SELECT id, status, creation_date, modification_date, text_extraction_date, doctype, docname FROM bibdoc WHERE id IN (%s)" % placeholders, chunk, 1) # kwalitee: disable=sql
+            for docid, status, cd, md, td, doctype, storagename in res:
+                containers[docid] = {"id": docid,
+                                     "basedir": _make_base_dir(docid),
+                                     "bibrec_links": [],
+                                     "status": status,
+                                     "cd": cd,
+                                     "md": md,
+                                     "td": td,
+                                     "doctype": doctype,
+                                     "storagename": storagename,
+                                     "more_info": []}
+            if not res:
+                continue
+
+            # retrieving links betwen records and documents
+            for docid, recid, doctype, docname in run_sql("SELECT id_bibdoc, id_bibrec, type, docname FROM bibrec_bibdoc WHERE id_bibdoc IN (%s)" % placeholders, chunk): # kwalitee: disable=sql
+                if docid in containers:
+                    containers[docid]["bibrec_links"].append({"recid": recid, "doctype": doctype, "docname": docname})
+
+            # comments, descriptions and flags (see BibDocMoreInfo)
+            for docid, namespace, data_key, data_value in run_sql("SELECT id_bibdoc, namespace, data_key, data_value FROM bibdocmoreinfo WHERE id_bibdoc IN (%s) AND version IS NULL AND format IS NULL AND id_rel IS NULL" % placeholders, chunk): # kwalitee: disable=sql
+                if docid in containers:
+                    containers[docid]["more_info"].append((namespace, data_key, data_value))
+
+            if CFG_BIBDOCFILE_ENABLE_BIBDOCFSINFO_CACHE:
+                ## The inventory of the files is taken from the DB.
+                for container in containers.itervalues():
+                    container.setdefault("files", [])
+                for docid, version, docformat, cd, md, checksum, filesize, mime in run_sql("SELECT id_bibdoc, version, format, cd, md, checksum, filesize, mime FROM bibdocfsinfo WHERE id_bibdoc IN (%s)" % placeholders, chunk): # kwalitee: disable=sql
+                    if docid in containers:
+                        containers[docid]["files"].append((version, docformat, cd, md, checksum, filesize, mime))
 
         # retreiving all available formats
-        fprefix = container["storagename"] or "content"
-        if CFG_BIBDOCFILE_ENABLE_BIBDOCFSINFO_CACHE:
-            ## We take all extensions from the existing formats in the DB.
-            container["extensions"] = set([ext[0] for ext in run_sql("SELECT format FROM bibdocfsinfo WHERE id_bibdoc=%s", (docid, ))])
-        else:
-            ## We take all the extensions by listing the directory content, stripping name
-            ## and version.
-            container["extensions"] = set([fname[len(fprefix):].rsplit(";", 1)[0] for fname in filter(lambda x: x.startswith(fprefix), os.listdir(container["basedir"]))])
-        return container
+        for container in containers.itervalues():
+            if CFG_BIBDOCFILE_ENABLE_BIBDOCFSINFO_CACHE:
+                ## We take all extensions from the existing formats in the DB.
+                container["extensions"] = set([afile[1] for afile in container["files"]])
+            else:
+                ## We take all the extensions by listing the directory content, stripping name
+                ## and version.
+                fprefix = container["storagename"] or "content"
+                container["extensions"] = set([fname[len(fprefix):].rsplit(";", 1)[0] for fname in filter(lambda x: x.startswith(fprefix), os.listdir(container["basedir"]))])
+        return containers
 
     @staticmethod
     def create_instance(docid=None, recid=None, docname=None,
-                        doctype='Fulltext', a_type = 'Main', human_readable=False):
+                        doctype='Fulltext', a_type = 'Main', human_readable=False,
+                        initial_data=None):
         """
         Parameters of an attachement to the record:
         a_type, recid, docname
@@ -1761,13 +1871,18 @@ class BibDoc(object):
 
         @param doctype Type of the document itself (by default Fulltext)
         @type doctype String
+
+        @param initial_data The information about the existing document
+                            C{docid}, if already retrieved (see
+                            L{_retrieve_data_bulk})
+        @type initial_data dict
         """
 
         # first try to retrieve existing record based on obtained data
         data = None
         extensions = []
         if docid is not None:
-            data = BibDoc._retrieve_data(docid)
+            data = initial_data or BibDoc._retrieve_data(docid)
             doctype = data["doctype"]
             extensions = data["extensions"]
 
@@ -1987,8 +2102,9 @@ class BibDoc(object):
             destination = self.get_filepath(docformat, myversion)
             if run_sql("SELECT id_bibdoc FROM bibdocfsinfo WHERE id_bibdoc=%s AND version=%s AND format=%s", (self.id, myversion, docformat)):
                 raise InvenioBibDocFileError("According to the database a file of format %s is already attached to the docid %s" % (docformat, self.id))
+            md5folder = Md5Folder(self.basedir)
             try:
-                shutil.copyfile(filename, destination)
+                checksum = store_file(filename, destination)
                 os.chmod(destination, 0644)
                 if modification_date: # if the modification time of the file needs to be changed
                     update_modification_date_of_file(destination, modification_date)
@@ -2013,7 +2129,7 @@ class BibDoc(object):
         else:
             raise InvenioBibDocFileError("'%s' does not exists!" % filename)
         self.touch('newversion')
-        Md5Folder(self.basedir).update()
+        md5folder.set_checksum(os.path.basename(destination), checksum)
         just_added_file = self.get_file(docformat, myversion)
         run_sql("INSERT INTO bibdocfsinfo(id_bibdoc, version, format, last_version, cd, md, checksum, filesize, mime) VALUES(%s, %s, %s, true, %s, %s, %s, %s, %s)", (self.id, myversion, docformat, just_added_file.cd, just_added_file.md, just_added_file.get_checksum(), just_added_file.get_size(), just_added_file.mime))
         run_sql("UPDATE bibdocfsinfo SET last_version=false WHERE id_bibdoc=%s AND version<%s", (self.id, myversion))
@@ -2056,8 +2172,9 @@ class BibDoc(object):
             destination = self.get_filepath(docformat, version)
             if os.path.exists(destination):
                 raise InvenioBibDocFileError, "A file for docid '%s' already exists for the format '%s'" % (str(self.id), docformat)
+            md5folder = Md5Folder(self.basedir)
             try:
-                shutil.copyfile(filename, destination)
+                checksum = store_file(filename, destination)
                 os.chmod(destination, 0644)
                 if modification_date: # if the modification time of the file needs to be changed
                     update_modification_date_of_file(destination, modification_date)
@@ -2075,7 +2192,7 @@ class BibDoc(object):
                     self.more_info.set_flag(flag, docformat, version)
         else:
             raise InvenioBibDocFileError, "'%s' does not exists!" % filename
-        Md5Folder(self.basedir).update()
+        md5folder.set_checksum(os.path.basename(destination), checksum)
         self.touch('newformat')
         just_added_file = self.get_file(docformat, version)
         run_sql("INSERT INTO bibdocfsinfo(id_bibdoc, version, format, last_version, cd, md, checksum, filesize, mime) VALUES(%s, %s, %s, true, %s, %s, %s, %s, %s)", (self.id, version, docformat, just_added_file.cd, just_added_file.md, just_added_file.get_checksum(), just_added_file.get_size(), just_added_file.mime))
@@ -2099,7 +2216,7 @@ class BibDoc(object):
             if bibdocfile.get_format() == oldformat:
                 # change format -> rename x.oldformat -> x.newformat
                 dirname, base, docformat, version = decompose_file_with_version(bibdocfile.get_full_path())
-                os.rename(bibdocfile.get_full_path(), os.path.join(dirname, '%s%s;%i' %(base, newformat, version)))
+                rename_file(bibdocfile.get_full_path(), os.path.join(dirname, '%s%s;%i' %(base, newformat, version)))
                 Md5Folder(self.basedir).update()
                 self.touch('rename')
                 self._sync_to_db()
@@ -2694,26 +2811,33 @@ class BibDoc(object):
 
         if context != ('init', 'init_from_disk'):
             previous_file_list = list(self._docfiles)
-        res = run_sql("SELECT status, creation_date,"
-            "modification_date FROM bibdoc WHERE id=%s", (self.id,))
+        if context != 'init':
+            ## In init context the constructor has just read these.
+            res = run_sql("SELECT status, creation_date,"
+                "modification_date FROM bibdoc WHERE id=%s", (self.id,))
 
-        self.cd = res[0][1]
-        self.md = res[0][2]
-        self.status = res[0][0]
+            self.cd = res[0][1]
+            self.md = res[0][2]
+            self.status = res[0][0]
 
-        self.more_info = BibDocMoreInfo(self.id)
+            self.more_info = BibDocMoreInfo(self.id)
         self._docfiles = []
 
 
         if CFG_BIBDOCFILE_ENABLE_BIBDOCFSINFO_CACHE and context == 'init':
             ## In normal init context we read from DB
-            res = run_sql("SELECT version, format, cd, md, checksum, filesize FROM bibdocfsinfo WHERE id_bibdoc=%s", (self.id, ))
-            for version, docformat, cd, md, checksum, size in res:
+            if self._initial_files is not None:
+                res = self._initial_files
+                self._initial_files = None
+            else:
+                res = run_sql("SELECT version, format, cd, md, checksum, filesize, mime FROM bibdocfsinfo WHERE id_bibdoc=%s", (self.id, ))
+            for version, docformat, cd, md, checksum, size, mime in res:
                 filepath = self.get_filepath(docformat, version)
                 self._docfiles.append(BibDocFile(
                     filepath, self.bibrec_types,
                     version, docformat,  self.id, self.status, checksum,
-                    self.more_info, human_readable=self.human_readable, cd=cd, md=md, size=size, bibdoc=self))
+                    self.more_info, human_readable=self.human_readable, cd=cd, md=md, size=size, bibdoc=self,
+                    mime=mime))
         else:
             if os.path.exists(self.basedir):
                 files = os.listdir(self.basedir)
@@ -2826,18 +2950,9 @@ class BibDoc(object):
     def register_download(self, ip_address, version, docformat, userid=0, recid=0):
         """Register the information about a download of a particular file."""
 
-        docformat = normalize_format(docformat)
-        if docformat[:1] == '.':
-            docformat = docformat[1:]
-        docformat = docformat.upper()
         if not version:
             version = self.get_latest_version()
-        return run_sql("INSERT DELAYED INTO rnkDOWNLOADS "
-            "(id_bibrec,id_bibdoc,file_version,file_format,"
-            "id_user,client_host,download_time) VALUES "
-            "(%s,%s,%s,%s,%s,INET_ATON(%s),NOW())",
-            (recid, self.id, version, docformat,
-            userid, ip_address,))
+        return register_file_download(self.id, ip_address, version, docformat, userid, recid)
 
     def get_incoming_relations(self, rel_type=None):
         """Return all relations in which this BibDoc appears on target position
@@ -2904,7 +3019,7 @@ class BibDocFile(object):
     """This class represents a physical file in the Invenio filesystem.
     It should never be instantiated directly"""
 
-    def __init__(self, fullpath, recid_doctypes, version, docformat, docid, status, checksum, more_info=None, human_readable=False, cd=None, md=None, size=None, bibdoc = None):
+    def __init__(self, fullpath, recid_doctypes, version, docformat, docid, status, checksum, more_info=None, human_readable=False, cd=None, md=None, size=None, bibdoc = None, mime=None):
         self.fullpath = os.path.abspath(fullpath)
 
         self.docid = docid
@@ -2932,13 +3047,12 @@ class BibDocFile(object):
         if docformat:
             self.recids_doctypes = [(a,b,c+self.superformat) for (a,b,c) in self.recids_doctypes]
 
-        self.mime, self.encoding = _mimes.guess_type(self.recids_doctypes[0][2])
-        if self.mime is None:
-            self.mime = "application/octet-stream"
+        guessed_mime, self.encoding = _mimes.guess_type(self.recids_doctypes[0][2])
+        self.mime = mime or guessed_mime or "application/octet-stream"
         self.more_info = more_info
         self.hidden = 'HIDDEN' in self.flags
         self.size = size or os.path.getsize(fullpath)
-        self.md = md or datetime.fromtimestamp(os.path.getmtime(fullpath))
+        self.md = md or datetime.fromtimestamp(get_file_mtime(fullpath))
         try:
             self.cd = cd or datetime.fromtimestamp(os.path.getctime(fullpath))
         except OSError:
@@ -3341,100 +3455,187 @@ def stream_file(req, fullpath, fullname=None, mime=None, encoding=None, etag=Non
     g = _RE_BAD_MSIE.search(headers.get('user-agent', "MSIE 6.0"))
     bad_msie = g and float(g.group(1)) < 9.0
 
-    if CFG_BIBDOCFILE_USE_XSENDFILE:
-        ## If XSendFile is supported by the server, let's use it.
-        if os.path.exists(fullpath):
-            if fullname is None:
-                fullname = os.path.basename(fullpath)
-            if bad_msie:
-                ## IE is confused by quotes
-                req.headers_out["Content-Disposition"] = 'attachment; filename=%s' % fullname.replace('"', '\\"')
-            elif download:
-                req.headers_out["Content-Disposition"] = 'attachment; filename="%s"' % fullname.replace('"', '\\"')
-            else:
-                ## IE is confused by inline
-                req.headers_out["Content-Disposition"] = 'inline; filename="%s"' % fullname.replace('"', '\\"')
-            req.headers_out["X-Sendfile"] = fullpath
-            if mime is None:
-                (mime, encoding) = _mimes.guess_type(fullpath)
-                if mime is None:
-                    mime = "application/octet-stream"
-            if not bad_msie:
-                ## IE is confused by not supported mimetypes
-                req.content_type = mime
-            return ""
-        else:
-            raise apache.SERVER_RETURN, apache.HTTP_NOT_FOUND
-
     if headers['if-match']:
         if etag is not None and etag not in headers['if-match']:
             raise apache.SERVER_RETURN, apache.HTTP_PRECONDITION_FAILED
 
-    if os.path.exists(fullpath):
-        mtime = os.path.getmtime(fullpath)
-        if fullname is None:
-            fullname = os.path.basename(fullpath)
-        if mime is None:
-            (mime, encoding) = _mimes.guess_type(fullpath)
-            if mime is None:
-                mime = "application/octet-stream"
-        if location is None:
-            location = req.uri
-        if not bad_msie:
-            ## IE is confused by not supported mimetypes
-            req.content_type = mime
-        req.encoding = encoding
-        req.filename = fullname
-        req.headers_out["Last-Modified"] = time.strftime('%a, %d %b %Y %X GMT', time.gmtime(mtime))
-        if CFG_ENABLE_HTTP_RANGE_REQUESTS:
-            req.headers_out["Accept-Ranges"] = "bytes"
-        else:
-            req.headers_out["Accept-Ranges"] = "none"
-        req.headers_out["Content-Location"] = location
-        if etag is not None:
-            req.headers_out["ETag"] = etag
-        if md5str is not None:
-            req.headers_out["Content-MD5"] = base64.encodestring(binascii.unhexlify(md5str.upper()))[:-1]
-        if bad_msie:
-            ## IE is confused by quotes
-            req.headers_out["Content-Disposition"] = 'attachment; filename=%s' % fullname.replace('"', '\\"')
-        elif download:
-            req.headers_out["Content-Disposition"] = 'attachment; filename="%s"' % fullname.replace('"', '\\"')
-        else:
-            ## IE is confused by inline
-            req.headers_out["Content-Disposition"] = 'inline; filename="%s"' % fullname.replace('"', '\\"')
-        size = os.path.getsize(fullpath)
-        if not size:
-            try:
-                raise Exception, '%s exists but is empty' % fullpath
-            except Exception:
-                register_exception(req=req, alert_admin=True)
-            raise apache.SERVER_RETURN, apache.HTTP_NOT_FOUND
-        if headers['if-modified-since'] and headers['if-modified-since'] >= mtime:
+    if not os.path.exists(fullpath):
+        raise apache.SERVER_RETURN, apache.HTTP_NOT_FOUND
+
+    mtime = get_file_mtime(fullpath)
+    req.headers_out["Last-Modified"] = format_http_date(mtime)
+    if etag is not None:
+        req.headers_out["ETag"] = etag
+    ## Conditional requests are answered before anything else is done.
+    if headers['if-none-match']:
+        if etag is not None and etag in headers['if-none-match']:
             raise apache.SERVER_RETURN, apache.HTTP_NOT_MODIFIED
-        if headers['if-none-match']:
-            if etag is not None and etag in headers['if-none-match']:
-                raise apache.SERVER_RETURN, apache.HTTP_NOT_MODIFIED
-        if headers['unless-modified-since'] and headers['unless-modified-since'] < mtime:
+    elif headers['if-modified-since'] and headers['if-modified-since'] >= mtime:
+        raise apache.SERVER_RETURN, apache.HTTP_NOT_MODIFIED
+
+    size = os.path.getsize(fullpath)
+    if not size:
+        try:
+            raise Exception, '%s exists but is empty' % fullpath
+        except Exception:
+            register_exception(req=req, alert_admin=True)
+        raise apache.SERVER_RETURN, apache.HTTP_NOT_FOUND
+    if fullname is None:
+        fullname = os.path.basename(fullpath)
+    if mime is None:
+        (mime, encoding) = _mimes.guess_type(fullpath)
+        if mime is None:
+            mime = "application/octet-stream"
+    if not bad_msie:
+        ## IE is confused by not supported mimetypes
+        req.content_type = mime
+    if bad_msie:
+        ## IE is confused by quotes
+        req.headers_out["Content-Disposition"] = 'attachment; filename=%s' % fullname.replace('"', '\\"')
+    elif download:
+        req.headers_out["Content-Disposition"] = 'attachment; filename="%s"' % fullname.replace('"', '\\"')
+    else:
+        ## IE is confused by inline
+        req.headers_out["Content-Disposition"] = 'inline; filename="%s"' % fullname.replace('"', '\\"')
+
+    if CFG_BIBDOCFILE_USE_XSENDFILE and size >= CFG_BIBDOCFILE_XSENDFILE_MIN_SIZE:
+        ## If XSendFile is supported by the server, let's use it.
+        xsendfile_header = get_xsendfile_header(fullpath)
+        if xsendfile_header is not None:
+            req.headers_out[xsendfile_header[0]] = xsendfile_header[1]
+            return ""
+
+    if location is None:
+        location = req.uri
+    req.encoding = encoding
+    req.filename = fullname
+    if CFG_ENABLE_HTTP_RANGE_REQUESTS:
+        req.headers_out["Accept-Ranges"] = "bytes"
+    else:
+        req.headers_out["Accept-Ranges"] = "none"
+    req.headers_out["Content-Location"] = location
+    if md5str is not None:
+        req.headers_out["Content-MD5"] = base64.encodestring(binascii.unhexlify(md5str.upper()))[:-1]
+    if headers['unless-modified-since'] and headers['unless-modified-since'] < mtime:
+        return normal_streaming(size)
+    if CFG_ENABLE_HTTP_RANGE_REQUESTS and headers['range']:
+        try:
+            if headers['if-range']:
+                if etag is None or etag not in headers['if-range']:
+                    return normal_streaming(size)
+            ranges = fix_ranges(headers['range'], size)
+        except:
             return normal_streaming(size)
-        if CFG_ENABLE_HTTP_RANGE_REQUESTS and headers['range']:
-            try:
-                if headers['if-range']:
-                    if etag is None or etag not in headers['if-range']:
-                        return normal_streaming(size)
-                ranges = fix_ranges(headers['range'], size)
-            except:
-                return normal_streaming(size)
-            if len(ranges) > 1:
-                return multiple_ranges(size, ranges, mime)
-            elif ranges:
-                return single_range(size, ranges[0])
-            else:
-                raise apache.SERVER_RETURN, apache.HTTP_RANGE_NOT_SATISFIABLE
+        if len(ranges) > 1:
+            return multiple_ranges(size, ranges, mime)
+        elif ranges:
+            return single_range(size, ranges[0])
         else:
-            return normal_streaming(size)
+            raise apache.SERVER_RETURN, apache.HTTP_RANGE_NOT_SATISFIABLE
     else:
-        raise apache.SERVER_RETURN, apache.HTTP_NOT_FOUND
+        return normal_streaming(size)
+
+def format_http_date(timestamp):
+    """@return: TIMESTAMP formatted as an HTTP date (e.g. for Last-Modified)."""
+    return time.strftime('%a, %d %b %Y %X GMT', time.gmtime(timestamp))
+
+def get_xsendfile_header(fullpath):
+    """
+    @return: the header (name, value) asking the web server to stream
+        FULLPATH (see CFG_BIBDOCFILE_XSENDFILE_HEADER), or None if the
+        web server can not stream it.
+    @rtype: tuple or None
+    """
+    if CFG_BIBDOCFILE_XSENDFILE_HEADER.lower() != 'x-accel-redirect':
+        return (CFG_BIBDOCFILE_XSENDFILE_HEADER, fullpath)
+    ## nginx only knows about the internal location mapped to FILEDIR
+    filedir = os.path.join(os.path.realpath(CFG_BIBDOCFILE_FILEDIR), '')
+    realpath = os.path.realpath(fullpath)
+    if not realpath.startswith(filedir):
+        return None
+    return (CFG_BIBDOCFILE_XSENDFILE_HEADER,
+            os.path.join(CFG_BIBDOCFILE_XACCEL_REDIRECT_LOCATION,
+                         urllib.quote(realpath[len(filedir):])))
+
+## key -> (etag, Last-Modified, fullpath, file mtime, folder mtime, timestamp,
+##         docid, version, format)
+_STREAM_VALIDATORS = {}
+
+def remember_stream_validators(key, docfile):
+    """
+    Remember the validators of DOCFILE, that was streamed for the request
+    identified by KEY (e.g. a tuple of the record, the file name and the
+    arguments).  DOCFILE must be visible to everybody who can see its
+    record, since the validators are then used by check_stream_validators()
+    without checking the restrictions of the file.
+    """
+    if len(_STREAM_VALIDATORS) >= CFG_BIBDOCFILE_STREAM_VALIDATORS_CACHE_SIZE:
+        _STREAM_VALIDATORS.clear()
+    try:
+        mtime = get_file_mtime(docfile.fullpath)
+        _STREAM_VALIDATORS[key] = (docfile.etag, format_http_date(mtime),
+                                   docfile.fullpath, mtime,
+                                   os.path.getmtime(os.path.dirname(docfile.fullpath)),
+                                   time.time(), docfile.docid,
+                                   docfile.get_version(), docfile.get_format())
+    except OSError:
+        _STREAM_VALIDATORS.pop(key, None)
+
+def forget_stream_validators(key):
+    """Forget the validators remembered for KEY, if any."""
+    _STREAM_VALIDATORS.pop(key, None)
+
+def check_stream_validators(req, key, uid=None):
+    """
+    Answer "304 Not Modified" to conditional requests (If-None-Match,
+    If-Modified-Since) for the file last streamed for KEY, without
+    loading its document, if the client already has the latest version.
+    The caller must have checked that the user can see the record.
+
+    The validators are trusted for CFG_BIBDOCFILE_STREAM_VALIDATORS_TIMEOUT
+    seconds, as long as no file was added to or removed from the folder
+    of the document (i.e. no new version or format was added) and the
+    document is still not restricted.
+
+    @param uid: if not None, the download of the file by this user is
+        registered, as when the file is streamed.
+    @raise apache.SERVER_RETURN: with apache.HTTP_NOT_MODIFIED.
+    """
+    validators = _STREAM_VALIDATORS.get(key)
+    if validators is None:
+        return
+    etag, last_modified, fullpath, mtime, folder_mtime, timestamp, \
+        docid, version, docformat = validators
+    if time.time() - timestamp > CFG_BIBDOCFILE_STREAM_VALIDATORS_TIMEOUT:
+        forget_stream_validators(key)
+        return
+    if_none_match = req.headers_in.get('if-none-match')
+    if_modified_since = req.headers_in.get('if-modified-since')
+    if if_none_match:
+        not_modified = etag in [tag.strip() for tag in if_none_match.split(',')]
+    elif if_modified_since:
+        ## browsers send back the Last-Modified header they were given
+        not_modified = if_modified_since.split(';')[0].strip() == last_modified
+    else:
+        return
+    if not not_modified:
+        return
+    try:
+        up_to_date = get_file_mtime(fullpath) == mtime and \
+            os.path.getmtime(os.path.dirname(fullpath)) == folder_mtime
+    except OSError:
+        up_to_date = False
+    if up_to_date:
+        res = run_sql("SELECT status FROM bibdoc WHERE id=%s", (docid, ))
+        up_to_date = res and not res[0][0]
+    if not up_to_date:
+        forget_stream_validators(key)
+        return
+    if uid is not None:
+        register_file_download(docid, str(req.remote_ip), version, docformat, uid)
+    req.headers_out["Last-Modified"] = last_modified
+    req.headers_out["ETag"] = etag
+    raise apache.SERVER_RETURN, apache.HTTP_NOT_MODIFIED
 
 def stream_restricted_icon(req):
     """Return the content of the "Restricted Icon" file."""
@@ -3452,6 +3653,20 @@ def stream_restricted_icon(req):
 #    versions.reverse()
 #    return versions
 
+def register_file_download(docid, ip_address, version, docformat, userid=0, recid=0):
+    """Register the information about a download of a particular file
+    (see BibDoc.register_download())."""
+    docformat = normalize_format(docformat)
+    if docformat[:1] == '.':
+        docformat = docformat[1:]
+    docformat = docformat.upper()
+    return run_sql("INSERT DELAYED INTO rnkDOWNLOADS "
+        "(id_bibrec,id_bibdoc,file_version,file_format,"
+        "id_user,client_host,download_time) VALUES "
+        "(%s,%s,%s,%s,%s,INET_ATON(%s),NOW())",
+        (recid, docid, version, docformat,
+        userid, ip_address,))
+
 def _make_base_dir(docid):
     """Given a docid it returns the complete path that should host its files."""
     group = "g" + str(int(int(docid) / CFG_BIBDOCFILE_FILESYSTEM_BIBDOC_GROUP_LIMIT))
@@ -3519,6 +3734,12 @@ class Md5Folder(object):
                     raise InvenioBibDocFileError("Encountered an exception while loading '%s': '%s'" % (os.path.join(self.folder, filename), e))
             return True
 
+    def set_checksum(self, filename, md5hash):
+        """Record the already known checksum of a physical file (e.g. as
+        returned by store_file()), and store .md5."""
+        self.md5s[filename] = md5hash
+        self.update()
+
     def get_checksum(self, filename):
         """Return the checksum of a physical file."""
         md5hash = self.md5s.get(filename, None)
@@ -3565,6 +3786,235 @@ def calculate_md5(filename, force_internal=False):
     else:
         return calculate_md5_external(filename)
 
+def copy_file_with_checksums(source, destination):
+    """
+    Copy SOURCE to DESTINATION, computing the checksums of the content
+    while copying, so that it is read only once.
+
+    An existing DESTINATION is unlinked first rather than overwritten,
+    since it might share its content with other files (see store_file()).
+
+    @return: the MD5 and, if available, the SHA-256 of the content.
+    @rtype: tuple of (string, string)
+    """
+    if os.path.lexists(destination):
+        os.remove(destination)
+    computed_md5 = md5()
+    computed_sha256 = sha256 and sha256()
+    to_be_read = open(source, "rb")
+    try:
+        to_be_written = open(destination, "wb")
+        try:
+            while True:
+                buf = to_be_read.read(CFG_BIBDOCFILE_MD5_BUFFER)
+                if not buf:
+                    break
+                computed_md5.update(buf)
+                if computed_sha256:
+                    computed_sha256.update(buf)
+                to_be_written.write(buf)
+        finally:
+            to_be_written.close()
+    finally:
+        to_be_read.close()
+    return computed_md5.hexdigest(), computed_sha256 and computed_sha256.hexdigest()
+
+def get_content_store_path(content_hash):
+    """Return the path where the content-addressed store keeps the content
+    having the given SHA-256."""
+    return os.path.join(CFG_BIBDOCFILE_CONTENT_STORE_DIR, content_hash[:2],
+                        content_hash[2:4], content_hash)
+
+def _make_content_store_dir(dirname):
+    """Create DIRNAME in the content store, if needed.  Another process
+    might be creating it at the same time."""
+    if not os.path.isdir(dirname):
+        try:
+            os.makedirs(dirname)
+        except OSError:
+            if not os.path.isdir(dirname):
+                raise
+
+def store_file(source, destination, deduplicate=None):
+    """
+    Copy SOURCE to DESTINATION, reading it only once.
+
+    When DEDUPLICATE is set (by default, when
+    CFG_BIBDOCFILE_CONTENT_ADDRESSED_STORAGE is), the content is kept
+    once in the content-addressed store, named after its SHA-256, and
+    DESTINATION becomes a hard link to it.  The number of links of the
+    stored content is then its reference count: removing DESTINATION
+    (as done by purge, expunge, etc.) only drops a reference, and
+    content without references left is removed by content_store_gc().
+    Where hard links are not possible (e.g. on AFS, or when the store
+    is on another filesystem) DESTINATION is a plain copy.
+
+    Since hard links share their modification time, the one of a
+    deduplicated DESTINATION is recorded in its folder instead (see
+    get_file_mtime()).
+
+    @return: the MD5 of the content.
+    @rtype: string
+    """
+    if deduplicate is None:
+        deduplicate = CFG_BIBDOCFILE_CONTENT_ADDRESSED_STORAGE
+    if not deduplicate or sha256 is None:
+        return copy_file_with_checksums(source, destination)[0]
+
+    _make_content_store_dir(CFG_BIBDOCFILE_CONTENT_STORE_DIR)
+    tmpfd, tmppath = tempfile.mkstemp(prefix='.ingest_', dir=CFG_BIBDOCFILE_CONTENT_STORE_DIR)
+    os.close(tmpfd)
+    try:
+        md5hash, content_hash = copy_file_with_checksums(source, tmppath)
+        os.chmod(tmppath, 0644)
+        if os.path.lexists(destination):
+            os.remove(destination)
+        stored_path = get_content_store_path(content_hash)
+        try:
+            os.link(stored_path, destination)
+            record_file_mtime(destination, time.time())
+            return md5hash
+        except OSError:
+            ## Not stored yet (or just collected, or having too many links)
+            pass
+        try:
+            os.link(tmppath, destination)
+        except OSError:
+            ## No hard links here
+            shutil.copyfile(tmppath, destination)
+            return md5hash
+        record_file_mtime(destination, time.time())
+        _make_content_store_dir(os.path.dirname(stored_path))
+        try:
+            os.link(tmppath, stored_path)
+        except OSError:
+            ## Stored meanwhile by another process
+            pass
+        return md5hash
+    finally:
+        if os.path.exists(tmppath):
+            os.remove(tmppath)
+
+def _load_recorded_mtimes(folder):
+    """Return the modification times recorded in FOLDER, as a
+    dictionary {filename: seconds since the epoch}."""
+    mtimes = {}
+    try:
+        for row in open(os.path.join(folder, ".mtimes")):
+            mtime, filename = row.rstrip('\n').split(' *', 1)
+            mtimes[filename] = float(mtime)
+    except IOError:
+        pass
+    return mtimes
+
+def record_file_mtime(fullpath, mtime):
+    """
+    Record MTIME (in seconds since the epoch) as the modification time
+    of FULLPATH, in the .mtimes file of its folder.  Only the records
+    of the existing files are kept.
+    """
+    folder, filename = os.path.split(fullpath)
+    ## Concurrent updates of the same folder would lose each other's
+    ## records: the whole update is done under a lock.
+    lock_file = open(os.path.join(folder, ".mtimes.lock"), "a")
+    fcntl.flock(lock_file, fcntl.LOCK_EX)
+    try:
+        mtimes = _load_recorded_mtimes(folder)
+        mtimes[filename] = mtime
+        tmpfd, tmppath = tempfile.mkstemp(prefix='.mtimes_', dir=folder)
+        mtimes_file = os.fdopen(tmpfd, "w")
+        try:
+            for filename, mtime in mtimes.iteritems():
+                if os.path.exists(os.path.join(folder, filename)):
+                    mtimes_file.write('%.6f *%s\n' % (mtime, filename))
+        finally:
+            mtimes_file.close()
+        os.chmod(tmppath, 0644)
+        os.rename(tmppath, os.path.join(folder, ".mtimes"))
+    finally:
+        fcntl.flock(lock_file, fcntl.LOCK_UN)
+        lock_file.close()
+
+def get_file_mtime(fullpath):
+    """
+    Return the modification time of FULLPATH, in seconds since the epoch.
+
+    A deduplicated file shares its inode, and hence its modification
+    time on the filesystem, with all the files having the same content
+    (see store_file()): its own is the one recorded for it in the
+    .mtimes file of its folder, if any.
+    """
+    stat = os.stat(fullpath)
+    if stat.st_nlink > 1:
+        mtime = _load_recorded_mtimes(os.path.dirname(fullpath)).get(os.path.basename(fullpath))
+        if mtime is not None:
+            return mtime
+    return stat.st_mtime
+
+def rename_file(source, destination):
+    """Move SOURCE to DESTINATION, keeping its modification time
+    (see get_file_mtime())."""
+    recorded = os.stat(source).st_nlink > 1
+    mtime = get_file_mtime(source)
+    shutil.move(source, destination)
+    if recorded:
+        record_file_mtime(destination, mtime)
+
+def _walk_content_store():
+    """Yield the path and the os.stat() of each stored content."""
+    for dirpath, dummy_dirnames, filenames in os.walk(CFG_BIBDOCFILE_CONTENT_STORE_DIR):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            try:
+                yield path, os.lstat(path)
+            except OSError:
+                ## Removed meanwhile
+                continue
+
+def content_store_gc(dry_run=False):
+    """
+    Remove from the content-addressed store the content no longer
+    referenced by any document, as well as the leftovers of interrupted
+    ingests.
+
+    @param dry_run: if True, only count what would be removed.
+    @return: the number of removed files and of freed bytes.
+    @rtype: tuple of (integer, integer)
+    """
+    removed = freed = 0
+    now = time.time()
+    for path, stat in _walk_content_store():
+        if os.path.basename(path).startswith('.'):
+            if now - stat.st_mtime < CFG_BIBDOCFILE_CONTENT_STORE_STALE_INGEST:
+                continue
+        elif stat.st_nlink > 1:
+            continue
+        if not dry_run:
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+        removed += 1
+        freed += stat.st_size
+    return removed, freed
+
+def get_content_store_statistics():
+    """
+    @return: the number of contents in the content-addressed store, the
+        number of document files referencing them, the bytes they use on
+        disk and the bytes saved by not storing the same content twice.
+    @rtype: dict
+    """
+    stats = {'contents': 0, 'references': 0, 'stored_size': 0, 'saved_size': 0}
+    for path, stat in _walk_content_store():
+        if os.path.basename(path).startswith('.'):
+            continue
+        references = stat.st_nlink - 1
+        stats['contents'] += 1
+        stats['references'] += references
+        stats['stored_size'] += stat.st_size
+        stats['saved_size'] += stat.st_size * max(references - 1, 0)
+    return stats
 
 def bibdocfile_url_to_bibrecdocs(url):
     """Given an URL in the form CFG_SITE_[SECURE_]URL/CFG_SITE_RECORD/xxx/files/... it returns
@@ -3945,7 +4395,8 @@ class MoreInfo(object):
        """
 
     def __init__(self, docid = None, version = None, docformat = None,
-                 relation = None, cache_only = False, cache_reads = True, initial_data = None):
+                 relation = None, cache_only = False, cache_reads = True, initial_data = None,
+                 cached_data = None):
         """
         @param cache_only Determines if MoreInfo object should be created in
                           memory only or reflected in the database
@@ -3964,6 +4415,12 @@ class MoreInfo(object):
                              instance from serialised value
         @type initial_data string
 
+        @param cached_data The rows (namespace, data_key, data_value) of the
+                           database for this MoreInfo, when they have already
+                           been read (e.g. together with the ones of other
+                           documents), so that they are not read again
+        @type cached_data list
+
         """
         self.docid = docid
         self.version = version
@@ -3983,7 +4440,9 @@ class MoreInfo(object):
 
         self.cache_reads = cache_reads
 
-        if not self.cache_only:
+        if cached_data is not None:
+            self._populate_from_rows(cached_data)
+        elif not self.cache_only:
             self.populate_from_database()
 
     @staticmethod
@@ -4004,14 +4463,16 @@ class MoreInfo(object):
         """Retrieves all values of MoreInfo and places them in the cache"""
         where_str, where_args = self._generate_where_query_args()
         query_str = "SELECT namespace, data_key, data_value FROM bibdocmoreinfo WHERE %s" % (where_str, )
-        res = run_sql(query_str, where_args)
-        if res:
-            for row in res:
-                namespace, data_key, data_value_ser = row
-                data_value = cPickle.loads(data_value_ser)
-                if not namespace in self.cache:
-                    self.cache[namespace] = {}
-                self.cache[namespace][data_key] = data_value
+        self._populate_from_rows(run_sql(query_str, where_args))
+
+    def _populate_from_rows(self, rows):
+        """Places the values of rows read from the database in the cache"""
+        for row in rows:
+            namespace, data_key, data_value_ser = row
+            data_value = cPickle.loads(data_value_ser)
+            if not namespace in self.cache:
+                self.cache[namespace] = {}
+            self.cache[namespace][data_key] = data_value
 
     def _mark_dirty(self, namespace, data_key):
         """Marks a data key dirty - that should be saved into the database"""
@@ -4278,10 +4739,11 @@ class BibDocMoreInfo(MoreInfo):
     @note: this class will be extended in the future to hold all the new auxiliary
     information about a document.
     """
-    def __init__(self, docid, cache_only = False, initial_data = None):
+    def __init__(self, docid, cache_only = False, initial_data = None, cached_data = None):
         if not (type(docid) in (long, int) and docid > 0):
             raise ValueError("docid is not a positive integer, but %s." % docid)
-        MoreInfo.__init__(self, docid, cache_only = cache_only, initial_data = initial_data)
+        MoreInfo.__init__(self, docid, cache_only = cache_only, initial_data = initial_data,
+                          cached_data = cached_data)
 
         if 'descriptions' not in self:
             self['descriptions'] = {}
@@ -4859,4 +5321,8 @@ def update_modification_date_of_file(filepath, modification_date):
         modif_date_in_seconds = 0
     if modif_date_in_seconds:
         statinfo = os.stat(filepath) # we need to keep the same access time
-        os.utime(filepath, (statinfo.st_atime, modif_date_in_seconds)) #update the modification time
+        if statinfo.st_nlink > 1:
+            ## The content is shared with other files (see store_file())
+            record_file_mtime(filepath, modif_date_in_seconds)
+        else:
+            os.utime(filepath, (statinfo.st_atime, modif_date_in_seconds)) #update the modification time
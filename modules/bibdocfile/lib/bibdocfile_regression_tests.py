@@ -29,6 +29,7 @@ from invenio.bibdocfile import BibRecDocs, BibRelation, MoreInfo, \
     check_bibdoc_authorization, bibdocfile_url_p, guess_format_from_url, CFG_HAS_MAGIC, \
     Md5Folder, calculate_md5, calculate_md5_external
 from invenio.dbquery import run_sql
+from invenio import bibdocfile
 
 from invenio.access_control_config import CFG_WEBACCESS_WARNING_MSGS
 from invenio.config import \
@@ -66,6 +67,30 @@ class BibDocFsInfoTest(InvenioTestCase):
         self.assertEqual(run_sql("SELECT MAX(version) FROM bibdocfsinfo WHERE id_bibdoc=%s", (self.my_bibdoc_id, ))[0][0], 1)
         self.assertEqual(run_sql("SELECT last_version FROM bibdocfsinfo WHERE id_bibdoc=%s AND version=1 AND format='.jpg'", (self.my_bibdoc_id, ))[0][0], True)
 
+class ContentAddressedStorageTest(InvenioTestCase):
+    """Regression tests about attaching deduplicated files"""
+    def setUp(self):
+        self.content_addressed_storage = bibdocfile.CFG_BIBDOCFILE_CONTENT_ADDRESSED_STORAGE
+        bibdocfile.CFG_BIBDOCFILE_CONTENT_ADDRESSED_STORAGE = 1
+        self.my_bibrecdoc = BibRecDocs(2)
+        self.unique_name = self.my_bibrecdoc.propose_unique_docname('file')
+        self.my_bibdoc = self.my_bibrecdoc.add_new_file(CFG_PREFIX + '/lib/webtest/invenio/test.jpg', docname=self.unique_name, modification_date=datetime(2001, 2, 3, 4, 5, 6))
+
+    def tearDown(self):
+        bibdocfile.CFG_BIBDOCFILE_CONTENT_ADDRESSED_STORAGE = self.content_addressed_storage
+        self.my_bibdoc.expunge()
+
+    def test_same_content_twice(self):
+        """bibdocfile - modification date of the same content attached twice"""
+        before = datetime.fromtimestamp(int(time.time()))
+        self.my_bibdoc.add_file_new_version(CFG_PREFIX + '/lib/webtest/invenio/test.jpg')
+        first = self.my_bibdoc.get_file('.jpg', 1)
+        second = self.my_bibdoc.get_file('.jpg', 2)
+        self.assertEqual(first.md, datetime(2001, 2, 3, 4, 5, 6))
+        self.failUnless(second.md >= before)
+        self.assertEqual(os.stat(first.get_full_path()).st_ino, os.stat(second.get_full_path()).st_ino)
+        self.assertEqual(run_sql("SELECT md FROM bibdocfsinfo WHERE id_bibdoc=%s AND version=1", (self.my_bibdoc.id, ))[0][0], datetime(2001, 2, 3, 4, 5, 6))
+
 class BibDocFileGuessFormat(InvenioTestCase):
     """Regression tests for guess_format_from_url"""
 
@@ -210,6 +235,23 @@ class BibRecDocsTest(InvenioTestCase):
         my_bibrecdoc.delete_bibdoc('file')
         my_bibrecdoc.delete_bibdoc('test')
 
+class BibRecDocsBulkLoadTest(InvenioTestCase):
+    """regression tests about loading several BibRecDocs at once"""
+
+    def test_bulk_load(self):
+        """bibdocfile - BibRecDocs.bulk_load is equivalent to BibRecDocs"""
+        recids = range(1, 20)
+        loaded = BibRecDocs.bulk_load(recids)
+        self.assertEqual(sorted(loaded.keys()), recids)
+        for recid in recids:
+            expected = BibRecDocs(recid)
+            self.assertEqual(sorted(loaded[recid].get_bibdoc_names()),
+                             sorted(expected.get_bibdoc_names()))
+            self.assertEqual(sorted([(afile.get_url(), afile.get_checksum(), afile.get_size(), afile.get_description())
+                                     for afile in loaded[recid].list_latest_files()]),
+                             sorted([(afile.get_url(), afile.get_checksum(), afile.get_size(), afile.get_description())
+                                     for afile in expected.list_latest_files()]))
+
 class BibDocsTest(InvenioTestCase):
     """regression tests about BibDocs"""
 
@@ -599,6 +641,7 @@ class BibDocFileMd5FolderTests(InvenioTestCase):
 
 TEST_SUITE = make_test_suite(BibDocFileMd5FolderTests,
                              BibRecDocsTest,
+                             BibRecDocsBulkLoadTest,
                              BibDocsTest,
                              BibDocFilesTest,
                              MoreInfoTest,
@@ -606,6 +649,7 @@ TEST_SUITE = make_test_suite(BibDocFileMd5FolderTests,
                              BibDocFileURLTest,
                              CheckBibDocAuthorizationTest,
                              BibDocFsInfoTest,
+                             ContentAddressedStorageTest,
                              BibDocFileGuessFormat)
 if __name__ == "__main__":
     run_test_suite(TEST_SUITE, warn_user=True)
@@ -0,0 +1,299 @@
+## This file is part of Invenio.
+## Copyright (C) 2014 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""
+BibDocFile text extraction queue.
+
+Extracts the text of documents (e.g. with pdftotext or OCR) in a pool of
+processes, so that the fulltext indexer does not wait for one document at
+a time:
+
+    >>> queue = TextExtractionQueue()
+    >>> for docid in docids:
+    ...     queue.schedule(docid)
+    >>> queue.wait(docids[0])  ## the text of docids[0] is now up to date
+    >>> queue.close()
+    >>> for line in queue.format_statistics():
+    ...     write_message(line)
+
+The extracted texts are also kept in a cache keyed by the checksum of the
+file they were extracted from, so that the same content is never
+extracted twice (e.g. when a file is attached to several documents, or
+when a document is reverted to a previous version).  The texts no longer
+used by any document are removed by text_cache_gc() (see inveniogc -c).
+"""
+
+__revision__ = "$Id$"
+
+import os
+import time
+import signal
+import shutil
+
+from invenio.config import CFG_BIBDOCFILE_FILEDIR, \
+    CFG_BIBDOCFILE_TEXT_EXTRACTION_PROCESSES
+from invenio.bibdocfile import BibDoc
+from invenio.errorlib import register_exception
+
+#: where the texts extracted from the files are cached.
+CFG_BIBDOCFILE_TEXT_CACHE_DIR = os.path.join(CFG_BIBDOCFILE_FILEDIR, 'text')
+
+def get_text_cache_path(checksum, perform_ocr=False, ln='en'):
+    """
+    @return: the path where the text extracted from the content having
+        the MD5 CHECKSUM is cached.  The text extracted with OCR depends
+        on the language LN given as a hint to it.
+    @rtype: string
+    """
+    if perform_ocr:
+        filename = '%s-ocr-%s.txt' % (checksum, ln)
+    else:
+        filename = '%s.txt' % checksum
+    return os.path.join(CFG_BIBDOCFILE_TEXT_CACHE_DIR, checksum[:2], filename)
+
+def _link_or_copy(source, destination):
+    """Make DESTINATION a hard link to SOURCE, or a copy of it where hard
+    links are not possible."""
+    if os.path.lexists(destination):
+        os.remove(destination)
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copyfile(source, destination)
+
+def get_cached_text(checksum, perform_ocr, destination, ln='en'):
+    """
+    Put in DESTINATION the text already extracted from the content having
+    the MD5 CHECKSUM, if any.
+
+    @return: True if the text was in the cache.
+    @rtype: bool
+    """
+    cache_path = get_text_cache_path(checksum, perform_ocr, ln)
+    if not os.path.exists(cache_path):
+        return False
+    try:
+        _link_or_copy(cache_path, destination)
+        ## the text is now up to date (see BibTextDoc.has_text)
+        os.utime(destination, None)
+    except (IOError, OSError):
+        register_exception()
+        return False
+    return True
+
+def cache_text(checksum, perform_ocr, text_path, ln='en'):
+    """Cache the text in TEXT_PATH as extracted from the content having
+    the MD5 CHECKSUM."""
+    cache_path = get_text_cache_path(checksum, perform_ocr, ln)
+    try:
+        if not os.path.isdir(os.path.dirname(cache_path)):
+            try:
+                os.makedirs(os.path.dirname(cache_path))
+            except OSError:
+                ## created meanwhile by another process?
+                if not os.path.isdir(os.path.dirname(cache_path)):
+                    raise
+        _link_or_copy(text_path, cache_path)
+    except (IOError, OSError):
+        register_exception()
+
+def text_cache_gc(max_age):
+    """
+    Remove from the cache the texts that are no longer the text of any
+    document (i.e. that are not linked from any document folder) and
+    that were not used for MAX_AGE seconds.
+
+    @return: the number of removed texts and of freed bytes.
+    @rtype: tuple of (integer, integer)
+    """
+    removed = freed = 0
+    now = time.time()
+    for dirpath, dummy_dirnames, filenames in os.walk(CFG_BIBDOCFILE_TEXT_CACHE_DIR):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            try:
+                stat = os.lstat(path)
+                if stat.st_nlink > 1 or now - stat.st_mtime < max_age:
+                    continue
+                os.remove(path)
+            except OSError:
+                ## Removed meanwhile
+                continue
+            removed += 1
+            freed += stat.st_size
+    return removed, freed
+
+def _init_worker():
+    """Leave the signals (e.g. of BibSched) to the parent process."""
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    for signame in ('SIGUSR1', 'SIGUSR2', 'SIGTSTP', 'SIGCONT', 'SIGHUP'):
+        if hasattr(signal, signame):
+            signal.signal(getattr(signal, signame), signal.SIG_DFL)
+
+def extract_text_of_document(docid, perform_ocr=None, force=False):
+    """
+    Extract the text of the document DOCID, unless it is up to date.
+
+    @param perform_ocr: whether to perform OCR.  If None, OCR is performed
+        when the document requires it (see CFG_BIBINDEX_PERFORM_OCR_ON_DOCNAMES).
+    @param force: whether to extract the text even if it is up to date.
+    @return: the docid, the extractor used (e.g. ".pdf", ".pdf OCR",
+        "cache", or None if nothing was done), the time spent and an error
+        message or None.
+    @rtype: tuple
+    """
+    start = time.time()
+    extractor = None
+    try:
+        bibdoc = BibDoc.create_instance(docid)
+        if hasattr(bibdoc, 'extract_text') and \
+                (force or not bibdoc.has_text(require_up_to_date=True)):
+            if perform_ocr is None:
+                perform_ocr = hasattr(bibdoc, 'is_ocr_required') and bibdoc.is_ocr_required()
+            extractor = bibdoc.extract_text(perform_ocr=perform_ocr)
+    except Exception, err:
+        register_exception(prefix="Error in extracting text from bibdoc %s" % docid)
+        return docid, extractor or 'unknown', time.time() - start, str(err)
+    return docid, extractor, time.time() - start, None
+
+class TextExtractionQueue(object):
+    """
+    Extract the text of documents in a pool of PROCESSES processes (in the
+    current process, when scheduled, if PROCESSES is 0).
+    """
+
+    def __init__(self, processes=CFG_BIBDOCFILE_TEXT_EXTRACTION_PROCESSES):
+        self.processes = processes
+        self.pool = None
+        ## docid -> AsyncResult, or arguments if there is no pool
+        self.pending = {}
+        ## docids already processed
+        self.done = set()
+        ## extractor -> [count, errors, busy time]
+        self.statistics = {}
+        self.first_start = None
+        self.last_end = None
+
+    def schedule(self, docid, perform_ocr=None, force=False):
+        """Start extracting the text of DOCID, if not already scheduled
+        (or, unless FORCE is set, done)."""
+        if docid in self.pending or (docid in self.done and not force):
+            return
+        if self.first_start is None:
+            self.first_start = time.time()
+        if self.processes > 0:
+            if self.pool is None:
+                from multiprocessing import Pool
+                self.pool = Pool(self.processes, _init_worker)
+            self.pending[docid] = self.pool.apply_async(extract_text_of_document,
+                                                        (docid, perform_ocr, force))
+        else:
+            self.pending[docid] = (docid, perform_ocr, force)
+
+    def pending_p(self, docid):
+        """@return: True if the text of DOCID is still to be waited for."""
+        return docid in self.pending
+
+    def wait(self, docid):
+        """
+        Wait for the text of DOCID to be extracted, if it was scheduled.
+
+        @return: the result of the extraction (see
+            L{extract_text_of_document}), or None if it was not scheduled.
+        @rtype: tuple or None
+        """
+        if docid not in self.pending:
+            return None
+        pending = self.pending.pop(docid)
+        self.done.add(docid)
+        if isinstance(pending, tuple):
+            result = extract_text_of_document(*pending)
+        else:
+            result = pending.get()
+        self._account(result)
+        return result
+
+    def join(self):
+        """Wait for all the scheduled extractions."""
+        for docid in list(self.pending):
+            self.wait(docid)
+
+    def close(self):
+        """Wait for all the scheduled extractions and stop the processes."""
+        self.join()
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+    def _account(self, result):
+        """Update the statistics with the RESULT of an extraction."""
+        dummy_docid, extractor, elapsed, error = result
+        self.last_end = time.time()
+        if extractor is None:
+            extractor = 'up to date'
+        stats = self.statistics.setdefault(extractor, [0, 0, 0.0])
+        stats[0] += 1
+        if error:
+            stats[1] += 1
+        stats[2] += elapsed
+
+    def reset_statistics(self):
+        """Start the statistics afresh (e.g. for the next index)."""
+        self.statistics = {}
+        self.first_start = None
+        self.last_end = None
+
+    def get_statistics(self):
+        """
+        @return: for each extractor, the number of documents and errors,
+            the average time per document, and the throughput (documents
+            per second of wall-clock time since the first extraction was
+            scheduled).
+        @rtype: dict of extractor -> dict
+        """
+        elapsed = 0.0
+        if self.first_start is not None and self.last_end is not None:
+            elapsed = self.last_end - self.first_start
+        ret = {}
+        for extractor, (count, errors, busy) in self.statistics.iteritems():
+            ret[extractor] = {'extractor': extractor,
+                              'count': count,
+                              'errors': errors,
+                              'avg_time': count and busy / count or 0.0,
+                              'throughput': elapsed and count / elapsed or 0.0}
+        return ret
+
+    def format_statistics(self):
+        """
+        @return: one human readable line of statistics per extractor.
+        @rtype: list of string
+        """
+        return ["text extraction with %(extractor)s: %(count)d documents "
+                "(%(errors)d errors), %(avg_time).2fs per document, "
+                "%(throughput).2f documents/s" % stats
+                for dummy, stats in sorted(self.get_statistics().items())]
+
+_TEXT_EXTRACTION_QUEUE = None
+
+def get_text_extraction_queue():
+    """@return: the text extraction queue shared within this process."""
+    global _TEXT_EXTRACTION_QUEUE
+    if _TEXT_EXTRACTION_QUEUE is None:
+        _TEXT_EXTRACTION_QUEUE = TextExtractionQueue()
+    return _TEXT_EXTRACTION_QUEUE
@@ -0,0 +1,145 @@
+## This file is part of Invenio.
+## Copyright (C) 2014 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""Unit tests for the BibDocFile text extraction queue."""
+
+__revision__ = "$Id$"
+
+import os
+import shutil
+import tempfile
+
+from invenio.testutils import InvenioTestCase
+from invenio.testutils import make_test_suite, run_test_suite
+
+from invenio import bibdocfile_textextraction
+
+class _FakeBibDoc(object):
+    """A document whose text extraction is instantaneous, or fails."""
+
+    def __init__(self, docid):
+        self.id = docid
+
+    @staticmethod
+    def create_instance(docid):
+        return _FakeBibDoc(docid)
+
+    def has_text(self, require_up_to_date=False):
+        return self.id % 5 == 0
+
+    def extract_text(self, perform_ocr=False):
+        if self.id == 7:
+            raise ValueError("cannot extract text")
+        return perform_ocr and '.pdf OCR' or '.pdf'
+
+class TextExtractionQueueTest(InvenioTestCase):
+    """Test extracting texts with a fake BibDoc."""
+
+    def setUp(self):
+        self.bibdoc = bibdocfile_textextraction.BibDoc
+        self.register_exception = bibdocfile_textextraction.register_exception
+        bibdocfile_textextraction.BibDoc = _FakeBibDoc
+        bibdocfile_textextraction.register_exception = lambda *args, **kwargs: None
+
+    def tearDown(self):
+        bibdocfile_textextraction.BibDoc = self.bibdoc
+        bibdocfile_textextraction.register_exception = self.register_exception
+
+    def _check_queue(self, processes):
+        """Extract the text of documents 1 to 10 with PROCESSES processes."""
+        queue = bibdocfile_textextraction.TextExtractionQueue(processes)
+        for docid in range(1, 11):
+            queue.schedule(docid, perform_ocr=docid == 3)
+        queue.schedule(1)
+        self.failUnless(queue.pending_p(2))
+        self.assertEqual(queue.wait(2)[1:2], ('.pdf',))
+        self.failIf(queue.pending_p(2))
+        self.assertEqual(queue.wait(2), None)
+        self.assertEqual(queue.wait(7)[3], "cannot extract text")
+        queue.close()
+        stats = queue.get_statistics()
+        self.assertEqual(stats['.pdf']['count'], 6)
+        self.assertEqual(stats['.pdf OCR']['count'], 1)
+        self.assertEqual(stats['up to date']['count'], 2)
+        self.assertEqual(stats['unknown']['errors'], 1)
+        self.assertEqual(len(queue.format_statistics()), 4)
+        ## already done documents are not scheduled again
+        queue.schedule(2)
+        self.failIf(queue.pending_p(2))
+        queue.reset_statistics()
+        self.assertEqual(queue.get_statistics(), {})
+
+    def test_in_process(self):
+        """bibdocfile - text extraction without processes"""
+        self._check_queue(0)
+
+    def test_pool(self):
+        """bibdocfile - text extraction in a pool of processes"""
+        self._check_queue(2)
+
+class TextCacheTest(InvenioTestCase):
+    """Test the cache of extracted texts."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cache_dir = bibdocfile_textextraction.CFG_BIBDOCFILE_TEXT_CACHE_DIR
+        bibdocfile_textextraction.CFG_BIBDOCFILE_TEXT_CACHE_DIR = os.path.join(self.tmpdir, 'text')
+
+    def tearDown(self):
+        bibdocfile_textextraction.CFG_BIBDOCFILE_TEXT_CACHE_DIR = self.cache_dir
+        shutil.rmtree(self.tmpdir)
+
+    def test_cache(self):
+        """bibdocfile - texts are cached by checksum"""
+        checksum = 'd41d8cd98f00b204e9800998ecf8427e'
+        text_path = os.path.join(self.tmpdir, '.text;1')
+        other_path = os.path.join(self.tmpdir, '.text;2')
+        self.failIf(bibdocfile_textextraction.get_cached_text(checksum, False, other_path))
+        open(text_path, 'w').write('Some text')
+        bibdocfile_textextraction.cache_text(checksum, False, text_path)
+        self.failIf(bibdocfile_textextraction.get_cached_text(checksum, True, other_path))
+        self.failUnless(bibdocfile_textextraction.get_cached_text(checksum, False, other_path))
+        self.assertEqual(open(other_path).read(), 'Some text')
+
+    def test_ocr_language(self):
+        """bibdocfile - texts extracted with OCR are cached by language"""
+        checksum = 'd41d8cd98f00b204e9800998ecf8427e'
+        text_path = os.path.join(self.tmpdir, '.text;1')
+        other_path = os.path.join(self.tmpdir, '.text;2')
+        open(text_path, 'w').write('Some text')
+        bibdocfile_textextraction.cache_text(checksum, True, text_path, 'fr')
+        self.failIf(bibdocfile_textextraction.get_cached_text(checksum, True, other_path, 'en'))
+        self.failUnless(bibdocfile_textextraction.get_cached_text(checksum, True, other_path, 'fr'))
+
+    def test_gc(self):
+        """bibdocfile - only unused cached texts are collected"""
+        used_path = os.path.join(self.tmpdir, '.text;1')
+        unused_path = os.path.join(self.tmpdir, '.text;2')
+        open(used_path, 'w').write('Some text')
+        open(unused_path, 'w').write('Other text')
+        bibdocfile_textextraction.cache_text('a' * 32, False, used_path)
+        bibdocfile_textextraction.cache_text('b' * 32, False, unused_path)
+        self.assertEqual(bibdocfile_textextraction.text_cache_gc(0), (0, 0))
+        os.remove(unused_path)
+        self.assertEqual(bibdocfile_textextraction.text_cache_gc(3600), (0, 0))
+        self.assertEqual(bibdocfile_textextraction.text_cache_gc(0), (1, 10))
+        self.failUnless(os.path.exists(bibdocfile_textextraction.get_text_cache_path('a' * 32)))
+
+TEST_SUITE = make_test_suite(TextExtractionQueueTest, TextCacheTest)
+
+if __name__ == "__main__":
+    run_test_suite(TEST_SUITE)
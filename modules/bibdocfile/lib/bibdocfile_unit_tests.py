@@ -0,0 +1,245 @@
+## This file is part of Invenio.
+## Copyright (C) 2014 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""Unit tests for the content-addressed store and the streaming of BibDocFile."""
+
+__revision__ = "$Id$"
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from datetime import datetime
+
+from invenio.testutils import InvenioTestCase
+from invenio.testutils import make_test_suite, run_test_suite
+
+from invenio import bibdocfile
+from invenio import webinterface_handler_config as apache
+
+class ContentStoreTest(InvenioTestCase):
+    """Test storing files in a temporary content-addressed store."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.store_dir = bibdocfile.CFG_BIBDOCFILE_CONTENT_STORE_DIR
+        bibdocfile.CFG_BIBDOCFILE_CONTENT_STORE_DIR = os.path.join(self.tmpdir, 'content')
+        self.source = os.path.join(self.tmpdir, 'source.txt')
+        open(self.source, 'w').write('Some content ' * 1000)
+
+    def tearDown(self):
+        bibdocfile.CFG_BIBDOCFILE_CONTENT_STORE_DIR = self.store_dir
+        shutil.rmtree(self.tmpdir)
+
+    def test_plain_copy(self):
+        """bibdocfile - store_file without deduplication"""
+        destination = os.path.join(self.tmpdir, 'copy.txt;1')
+        md5hash = bibdocfile.store_file(self.source, destination, deduplicate=False)
+        self.assertEqual(md5hash, bibdocfile.calculate_md5(self.source, force_internal=True))
+        self.assertEqual(open(destination).read(), open(self.source).read())
+        self.failIf(os.path.exists(bibdocfile.CFG_BIBDOCFILE_CONTENT_STORE_DIR))
+
+    def test_deduplication(self):
+        """bibdocfile - identical files are stored once"""
+        first = os.path.join(self.tmpdir, 'first.txt;1')
+        second = os.path.join(self.tmpdir, 'second.txt;1')
+        md5hash = bibdocfile.store_file(self.source, first, deduplicate=True)
+        self.assertEqual(bibdocfile.store_file(self.source, second, deduplicate=True), md5hash)
+        self.assertEqual(os.stat(first).st_ino, os.stat(second).st_ino)
+        stats = bibdocfile.get_content_store_statistics()
+        self.assertEqual(stats['contents'], 1)
+        self.assertEqual(stats['references'], 2)
+        self.assertEqual(stats['saved_size'], os.path.getsize(self.source))
+
+    def test_gc(self):
+        """bibdocfile - only unreferenced content is collected"""
+        first = os.path.join(self.tmpdir, 'first.txt;1')
+        second = os.path.join(self.tmpdir, 'second.txt;1')
+        bibdocfile.store_file(self.source, first, deduplicate=True)
+        bibdocfile.store_file(self.source, second, deduplicate=True)
+        os.remove(first)
+        self.assertEqual(bibdocfile.content_store_gc(), (0, 0))
+        os.remove(second)
+        self.assertEqual(bibdocfile.content_store_gc(),
+                         (1, os.path.getsize(self.source)))
+        self.assertEqual(bibdocfile.get_content_store_statistics()['contents'], 0)
+
+    def test_overwrite_does_not_alter_shared_content(self):
+        """bibdocfile - replacing a deduplicated file keeps the other copies"""
+        first = os.path.join(self.tmpdir, 'first.txt;1')
+        second = os.path.join(self.tmpdir, 'second.txt;1')
+        other = os.path.join(self.tmpdir, 'other.txt')
+        open(other, 'w').write('Other content')
+        bibdocfile.store_file(self.source, first, deduplicate=True)
+        bibdocfile.store_file(self.source, second, deduplicate=True)
+        bibdocfile.store_file(other, second, deduplicate=False)
+        self.assertEqual(open(first).read(), open(self.source).read())
+        self.assertEqual(open(second).read(), 'Other content')
+
+    def test_deduplicated_mtime(self):
+        """bibdocfile - deduplicated files keep their own modification time"""
+        first = os.path.join(self.tmpdir, 'first.txt;1')
+        second = os.path.join(self.tmpdir, 'second.txt;1')
+        bibdocfile.store_file(self.source, first, deduplicate=True)
+        bibdocfile.update_modification_date_of_file(first, datetime(2001, 2, 3, 4, 5, 6))
+        before = time.time()
+        bibdocfile.store_file(self.source, second, deduplicate=True)
+        self.assertEqual(os.stat(first).st_ino, os.stat(second).st_ino)
+        self.assertEqual(datetime.fromtimestamp(bibdocfile.get_file_mtime(first)),
+                         datetime(2001, 2, 3, 4, 5, 6))
+        self.failUnless(bibdocfile.get_file_mtime(second) >= int(before))
+        renamed = os.path.join(self.tmpdir, 'renamed.txt;1')
+        bibdocfile.rename_file(first, renamed)
+        self.assertEqual(datetime.fromtimestamp(bibdocfile.get_file_mtime(renamed)),
+                         datetime(2001, 2, 3, 4, 5, 6))
+
+    def test_concurrent_mtimes(self):
+        """bibdocfile - concurrent updates of the recorded mtimes are kept"""
+        paths = [os.path.join(self.tmpdir, 'file%d.txt;1' % i) for i in range(40)]
+        for path in paths:
+            open(path, 'w').write('')
+
+        def record(paths):
+            for path in paths:
+                bibdocfile.record_file_mtime(path, 1000000000.0)
+
+        threads = [threading.Thread(target=record, args=(paths[i::4], ))
+                   for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        mtimes = bibdocfile._load_recorded_mtimes(self.tmpdir)
+        self.assertEqual(sorted(mtimes), sorted(os.path.basename(path) for path in paths))
+
+class FakeDocFile(object):
+    """The attributes of a BibDocFile needed to stream it."""
+    def __init__(self, fullpath, etag):
+        self.fullpath = fullpath
+        self.etag = etag
+        self.docid = 1
+
+    def get_version(self):
+        return 1
+
+    def get_format(self):
+        return '.pdf'
+
+class FakeRequest(object):
+    """The attributes of a request needed to answer conditional requests."""
+    def __init__(self, headers_in):
+        self.headers_in = headers_in
+        self.headers_out = {}
+        self.remote_ip = '127.0.0.1'
+
+class StreamValidatorsTest(InvenioTestCase):
+    """Test answering conditional requests from the remembered validators."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.fullpath = os.path.join(self.tmpdir, 'file.pdf;1')
+        open(self.fullpath, 'w').write('%PDF')
+        self.docfile = FakeDocFile(self.fullpath, '"1.pdf1"')
+        self.key = (1, 'file.pdf', '', '', '', '')
+        bibdocfile.remember_stream_validators(self.key, self.docfile)
+        self.last_modified = bibdocfile.format_http_date(os.path.getmtime(self.fullpath))
+        ## the status of the document, and the registered downloads
+        self.status = ''
+        self.downloads = []
+        self.run_sql = bibdocfile.run_sql
+        self.register_file_download = bibdocfile.register_file_download
+        bibdocfile.run_sql = lambda query, params: ((self.status, ), )
+        bibdocfile.register_file_download = lambda *args: self.downloads.append(args)
+
+    def tearDown(self):
+        bibdocfile.run_sql = self.run_sql
+        bibdocfile.register_file_download = self.register_file_download
+        bibdocfile.forget_stream_validators(self.key)
+        shutil.rmtree(self.tmpdir)
+
+    def assertNotModified(self, headers_in, uid=None):
+        """Check that the request with HEADERS_IN is answered 304."""
+        req = FakeRequest(headers_in)
+        try:
+            bibdocfile.check_stream_validators(req, self.key, uid)
+        except apache.SERVER_RETURN, status:
+            self.assertEqual(int(str(status)), apache.HTTP_NOT_MODIFIED)
+            self.assertEqual(req.headers_out['ETag'], '"1.pdf1"')
+        else:
+            self.fail("%s not answered with 304" % headers_in)
+
+    def test_not_modified(self):
+        """bibdocfile - conditional requests answered from the validators"""
+        self.assertNotModified({'if-none-match': '"0.pdf1", "1.pdf1"'})
+        self.assertNotModified({'if-modified-since': self.last_modified})
+        self.assertEqual(self.downloads, [])
+
+    def test_download_registered(self):
+        """bibdocfile - revalidated downloads are registered"""
+        self.assertNotModified({'if-none-match': '"1.pdf1"'}, uid=5)
+        self.assertEqual(self.downloads, [(1, '127.0.0.1', 1, '.pdf', 5)])
+
+    def test_restricted(self):
+        """bibdocfile - a document restricted meanwhile is checked again"""
+        self.status = 'restricted'
+        bibdocfile.check_stream_validators(FakeRequest({'if-none-match': '"1.pdf1"'}), self.key)
+        self.failIf(self.key in bibdocfile._STREAM_VALIDATORS)
+
+    def test_modified(self):
+        """bibdocfile - other requests are left to the full handler"""
+        for headers_in in ({}, {'if-none-match': '"1.pdf2"'},
+                           {'if-none-match': '"1.pdf2"',
+                            'if-modified-since': self.last_modified}):
+            bibdocfile.check_stream_validators(FakeRequest(headers_in), self.key)
+        bibdocfile.check_stream_validators(FakeRequest({'if-none-match': '"1.pdf1"'}),
+                                           (2, 'file.pdf', '', '', '', ''))
+
+    def test_new_version(self):
+        """bibdocfile - a new file in the folder invalidates the validators"""
+        os.utime(self.tmpdir, (0, 0))
+        bibdocfile.remember_stream_validators(self.key, self.docfile)
+        open(os.path.join(self.tmpdir, 'file.pdf;2'), 'w').write('%PDF')
+        bibdocfile.check_stream_validators(FakeRequest({'if-none-match': '"1.pdf1"'}), self.key)
+        self.failIf(self.key in bibdocfile._STREAM_VALIDATORS)
+
+    def test_xaccel_redirect(self):
+        """bibdocfile - X-Accel-Redirect only for files in the file directory"""
+        header = bibdocfile.CFG_BIBDOCFILE_XSENDFILE_HEADER
+        filedir = bibdocfile.CFG_BIBDOCFILE_FILEDIR
+        location = bibdocfile.CFG_BIBDOCFILE_XACCEL_REDIRECT_LOCATION
+        try:
+            bibdocfile.CFG_BIBDOCFILE_XSENDFILE_HEADER = 'X-Accel-Redirect'
+            bibdocfile.CFG_BIBDOCFILE_FILEDIR = os.path.dirname(self.tmpdir)
+            bibdocfile.CFG_BIBDOCFILE_XACCEL_REDIRECT_LOCATION = '/internal/'
+            self.assertEqual(bibdocfile.get_xsendfile_header(self.fullpath),
+                             ('X-Accel-Redirect', '/internal/%s/file.pdf%%3B1' %
+                              os.path.basename(self.tmpdir)))
+            self.assertEqual(bibdocfile.get_xsendfile_header('/etc/passwd'), None)
+            bibdocfile.CFG_BIBDOCFILE_XSENDFILE_HEADER = 'X-Sendfile'
+            self.assertEqual(bibdocfile.get_xsendfile_header('/etc/passwd'),
+                             ('X-Sendfile', '/etc/passwd'))
+        finally:
+            bibdocfile.CFG_BIBDOCFILE_XSENDFILE_HEADER = header
+            bibdocfile.CFG_BIBDOCFILE_FILEDIR = filedir
+            bibdocfile.CFG_BIBDOCFILE_XACCEL_REDIRECT_LOCATION = location
+
+TEST_SUITE = make_test_suite(ContentStoreTest, StreamValidatorsTest)
+
+if __name__ == "__main__":
+    run_test_suite(TEST_SUITE)
@@ -52,7 +52,8 @@ from invenio.search_engine import \
      is_user_owner_of_record
 from invenio.bibdocfile import BibRecDocs, normalize_format, file_strip_ext, \
     stream_restricted_icon, BibDoc, InvenioBibDocFileError, \
-    get_subformat_from_format
+    get_subformat_from_format, check_stream_validators, \
+    remember_stream_validators
 from invenio.errorlib import register_exception
 from invenio.websearchadminlib import get_detailed_page_tabs, get_detailed_page_tabs_counts
 import invenio.template
@@ -84,6 +85,10 @@ class WebInterfaceFilesPages(WebInterfaceDirectory):
             args = wash_urlargd(form, bibdocfile_templates.files_default_urlargd)
             ln = args['ln']
 
+            validators_key = (self.recid, filename, args['docname'],
+                              args['format'], args['subformat'],
+                              args['version'])
+
             _ = gettext_set_language(ln)
 
             uid = getUid(req)
@@ -128,6 +133,13 @@ class WebInterfaceFilesPages(WebInterfaceDirectory):
 
             readonly = CFG_ACCESS_CONTROL_LEVEL_SITE == 1
 
+            ## Clients revalidating a public file they already have are
+            ## answered before the documents of the record are loaded.
+            if readonly:
+                check_stream_validators(req, validators_key)
+            else:
+                check_stream_validators(req, validators_key, uid)
+
             # From now on: either the user provided a specific file
             # name (and a possible version), or we return a list of
             # all the available files. In no case are the docids
@@ -220,6 +232,10 @@ class WebInterfaceFilesPages(WebInterfaceDirectory):
                                 if not readonly:
                                     ip = str(req.remote_ip)
                                     doc.register_download(ip, docfile.get_version(), docformat, uid)
+                                if user_info['email'] == 'guest' and not auth_code and \
+                                        not docfile.get_status():
+                                    ## the file can be seen by everybody
+                                    remember_stream_validators(validators_key, docfile)
                                 try:
                                     return docfile.stream(req, download=is_download)
                                 except InvenioBibDocFileError, msg:
@@ -40,7 +40,8 @@ from invenio.config import CFG_SITE_URL, CFG_BIBDOCFILE_FILEDIR, \
 from invenio.bibdocfile import BibRecDocs, BibDoc, InvenioBibDocFileError, \
     nice_size, check_valid_url, clean_url, get_docname_from_url, \
     guess_format_from_url, KEEP_OLD_VALUE, decompose_bibdocfile_fullpath, \
-    bibdocfile_url_to_bibdoc, decompose_bibdocfile_url, CFG_BIBDOCFILE_AVAILABLE_FLAGS
+    bibdocfile_url_to_bibdoc, decompose_bibdocfile_url, CFG_BIBDOCFILE_AVAILABLE_FLAGS, \
+    content_store_gc, get_content_store_statistics
 
 from invenio.intbitset import intbitset
 from invenio.search_engine import perform_request_search
@@ -49,6 +50,7 @@ from invenio.dbquery import run_sql
 from invenio.bibtask import task_low_level_submission
 from invenio.textutils import encode_for_xml
 from invenio.websubmit_file_converter import can_perform_ocr
+from invenio.bibdocfile_textextraction import TextExtractionQueue
 from invenio.shellutils import retry_mkstemp
 
 def _xml_mksubfield(key, subfield, fft):
@@ -564,6 +566,8 @@ Examples:
     housekeeping_options.add_option("--fix-format", action='store_const', const='fix-format', dest='action', help='fix format related inconsistences')
     housekeeping_options.add_option("--fix-duplicate-docnames", action='store_const', const='fix-duplicate-docnames', dest='action', help='fix duplicate docnames associated with the same record')
     housekeeping_options.add_option("--fix-bibdocfsinfo-cache", action='store_const', const='fix-bibdocfsinfo-cache', dest='action', help='fix bibdocfsinfo cache related inconsistences')
+    housekeeping_options.add_option("--gc-content-store", action='store_const', const='gc-content-store', dest='action', help='remove from the content-addressed store the content no longer used by any document')
+    housekeeping_options.add_option("--get-content-store-stats", action='store_const', const='get-content-store-stats', dest='action', help='print how much space the content-addressed store saves')
     parser.add_option_group(housekeeping_options)
 
     experimental_options = OptionGroup(parser, 'Experimental options (do not expect to find them in the next release)')
@@ -743,20 +747,25 @@ def cli_textify(options):
         additional = ' using OCR (this might take some time)'
     else:
         additional = ''
+    ## the documents are extracted in parallel, and reported in order
+    queue = TextExtractionQueue()
+    docids = []
     for docid in cli_docids_iterator(options):
-        bibdoc = BibDoc.create_instance(docid)
+        queue.schedule(docid, perform_ocr=perform_ocr, force=force)
+        docids.append(docid)
+    for docid in docids:
         print 'Extracting text for docid %s%s...' % (docid, additional),
         sys.stdout.flush()
-        #pylint: disable=E1103
-        if force or (hasattr(bibdoc, "has_text") and not bibdoc.has_text(require_up_to_date=True)):
-            try:
-                #pylint: disable=E1103
-                bibdoc.extract_text(perform_ocr=perform_ocr)
-                print "DONE"
-            except InvenioBibDocFileError, e:
-                print >> sys.stderr, "WARNING: %s" % e
+        dummy, extractor, dummy, error = queue.wait(docid)
+        if error:
+            print >> sys.stderr, "WARNING: %s" % error
+        elif extractor:
+            print "DONE"
         else:
             print "not needed"
+    queue.close()
+    print wrap_text_in_a_box('\n\n'.join(queue.format_statistics()) or 'no text extracted',
+                             style='conclusion')
 
 def cli_rename(options):
     """Rename a docname within a recid."""
@@ -1051,6 +1060,25 @@ def cli_get_history(options):
 
             print_info(docid, row)
 
+def cli_gc_content_store(options):
+    """Remove the unused content of the content-addressed store."""
+    removed, freed = content_store_gc()
+    if getattr(options, 'human_readable', None):
+        freed = nice_size(freed)
+    print wrap_text_in_a_box('removed files: %s\n\nfreed space: %s'
+        % (removed, freed), style='conclusion')
+
+def cli_get_content_store_stats(options):
+    """Print the usage of the content-addressed store."""
+    stats = get_content_store_statistics()
+    if getattr(options, 'human_readable', None):
+        stats['stored_size'] = nice_size(stats['stored_size'])
+        stats['saved_size'] = nice_size(stats['saved_size'])
+    print wrap_text_in_a_box('stored contents: %(contents)s\n\n'
+        'referencing files: %(references)s\n\n'
+        'stored size: %(stored_size)s\n\n'
+        'saved size: %(saved_size)s' % stats, style='conclusion')
+
 def cli_get_disk_usage(options):
     """Print the space usage of a docid_set."""
     human_readable = getattr(options, 'human_readable', None)
@@ -1249,6 +1277,10 @@ def main():
             cli_fix_bibdocfsinfo_cache(options)
         elif getattr(options, 'action', None) == 'get-stats':
             cli_get_stats(options)
+        elif getattr(options, 'action', None) == 'gc-content-store':
+            cli_gc_content_store(options)
+        elif getattr(options, 'action', None) == 'get-content-store-stats':
+            cli_get_content_store_stats(options)
         else:
             print >> sys.stderr, "ERROR: Action %s is not valid" % getattr(options, 'action', None)
             sys.exit(1)
@@ -84,10 +84,16 @@ class BibTextDoc(BibDoc):
             procedure.
         @type ln: string
         @raise InvenioBibDocFileError: in case of error.
+        @return: the extractor used: the format the text was extracted from
+            (e.g. ".pdf" or ".pdf OCR"), or "cache" if the same content had
+            already been extracted, or None if there is nothing to extract
+            from.
+        @rtype: string
         @note: the text is extracted and cached for later use. Use L{get_text}
             to retrieve it.
         """
         from invenio.websubmit_file_converter import get_best_format_to_extract_text_from, convert_file, InvenioWebSubmitFileConverterError
+        from invenio.bibdocfile_textextraction import get_cached_text, cache_text
         if version is None:
             version = self.get_latest_version()
         docfiles = self.list_version_files(version)
@@ -101,15 +107,33 @@ class BibTextDoc(BibDoc):
             try:
                 filename = get_best_format_to_extract_text_from(filenames)
             except InvenioWebSubmitFileConverterError:
-                open(os.path.join(self.basedir, '.text;%i' % version), 'w').write('')
-                return
+                text_path = os.path.join(self.basedir, '.text;%i' % version)
+                if os.path.lexists(text_path):
+                    ## it might be shared with the cache
+                    os.remove(text_path)
+                open(text_path, 'w').write('')
+                return None
+        text_path = os.path.join(self.basedir, '.text;%i' % version)
+        source = [docfile for docfile in docfiles if docfile.get_full_path() == filename][0]
+        checksum = source.get_checksum()
+        extractor = source.get_format()
+        if perform_ocr:
+            extractor += ' OCR'
         try:
-            convert_file(filename, os.path.join(self.basedir, '.text;%i' % version), '.txt', perform_ocr=perform_ocr, ln=ln)
+            if get_cached_text(checksum, perform_ocr, text_path, ln):
+                extractor = 'cache'
+            else:
+                if os.path.lexists(text_path):
+                    ## it might be shared with the cache
+                    os.remove(text_path)
+                convert_file(filename, text_path, '.txt', perform_ocr=perform_ocr, ln=ln)
+                cache_text(checksum, perform_ocr, text_path, ln)
             if version == self.get_latest_version():
                 run_sql("UPDATE bibdoc SET text_extraction_date=NOW() WHERE id=%s", (self.id, ))
         except InvenioWebSubmitFileConverterError, e:
             register_exception(alert_admin=True, prefix="Error in extracting text from bibdoc %i, version %i" % (self.id, version))
             raise InvenioBibDocFileError, str(e)
+        return extractor
 
     def pdf_a_p(self):
         """
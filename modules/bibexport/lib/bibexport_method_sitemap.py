@@ -27,16 +27,18 @@ this exporting method.
 
 from datetime import datetime
 from urllib import quote
-from ConfigParser import ConfigParser
+from ConfigParser import ConfigParser, Error as ConfigParserError
 import os
 import gzip
+import glob
 import time
+import cPickle
 
 from invenio.bibdocfile import BibRecDocs
 from invenio.search_engine import get_collection_reclist
 from invenio.dbquery import run_sql
 from invenio.config import CFG_SITE_URL, CFG_WEBDIR, CFG_ETCDIR, \
-    CFG_SITE_RECORD, CFG_SITE_LANGS, CFG_TMPSHAREDDIR
+    CFG_SITE_RECORD, CFG_SITE_LANGS, CFG_TMPSHAREDDIR, CFG_CACHEDIR
 from invenio.intbitset import intbitset
 from invenio.websearch_webcoll import Collection
 from invenio.bibtask import write_message, task_update_progress, task_sleep_now_if_required
@@ -67,8 +69,19 @@ DEFAULT_CHANGEFREQ_COLLECTIONS = 'hourly'
 MAX_RECORDS = 50000
 MAX_SIZE = 10000000
 
+## Records are split in sitemaps by ranges of RECORDS_PER_SITEMAP recids.
+## Each record has up to 4 URLs (record, files, comments, reviews), hence
+## at most MAX_RECORDS / 4 records fit in a sitemap.
+RECORDS_PER_SITEMAP = 10000
+
+## number of recids per query
+CHUNK_SIZE = 500
+
 _CFG_FORCE_RECRAWLING_TIMESTAMP_PATH = os.path.join(CFG_TMPSHAREDDIR, "bibexport_sitemap_force_recrawling_timestamp.txt")
 
+## Where the sitemaps of the records are described between two runs.
+_CFG_SITEMAP_MANIFEST_PATH = os.path.join(CFG_CACHEDIR, "bibexport_sitemap_manifest.pickle")
+
 def get_minimum_timestamp():
     """
     Return the minimum timestamp to be used when exporting.
@@ -83,12 +96,24 @@ def get_all_public_records(collections):
     accessible collection.
     returns list of (recid, last_modification) tuples
     """
+    recids = get_all_public_recids(collections)
+    return get_records_last_modification(recids)
+
+def get_all_public_recids(collections):
+    """Return the intbitset of the records in the given COLLECTIONS."""
     recids = intbitset()
-    minimum_timestamp = get_minimum_timestamp()
     for collection in collections:
         recids += get_collection_reclist(collection)
-    query = 'SELECT id, modification_date FROM bibrec'
-    res = run_sql(query)
+    return recids
+
+def get_records_last_modification(recids):
+    """Return the list of (recid, last_modification) tuples of RECIDS
+    (an intbitset), sorted by recid."""
+    if not recids:
+        return []
+    minimum_timestamp = get_minimum_timestamp()
+    query = 'SELECT id, modification_date FROM bibrec WHERE id BETWEEN %s AND %s ORDER BY id'
+    res = run_sql(query, (recids[0], recids[-1]))
     return [(recid, max(lastmod, minimum_timestamp)) for (recid, lastmod) in res if recid in recids]
 
 def get_all_public_collections(base_collections):
@@ -96,80 +121,84 @@ def get_all_public_collections(base_collections):
     collections and subcollections of base_collections
     """
     minimum_timestamp = get_minimum_timestamp()
-    def get_collection_last_modification(collection):
-        """ last modification = modification date fo latest added record """
-        last_mod = None
-        query_last_mod = "SELECT modification_date FROM bibrec WHERE id=%s"
-        try:
-            latest_recid = collection.reclist.tolist()[-1]
-        except IndexError:
-            # this collection is empty
-            return last_mod
-        res = run_sql(query_last_mod, (latest_recid,))
-
-        if res and res[0][0]:
-            last_mod = res[0][0]
-        return max(minimum_timestamp, last_mod)
-
-    output = []
+    collections = []
     for coll_name in base_collections:
         mother_collection = Collection(coll_name)
         if not mother_collection.restricted_p():
-            last_mod = get_collection_last_modification(mother_collection)
-            output.append((coll_name, last_mod))
+            collections.append(mother_collection)
             for descendant in mother_collection.get_descendants(type='r'):
                 if not descendant.restricted_p():
-                    last_mod = get_collection_last_modification(descendant)
-                    output.append((descendant.name, last_mod))
+                    collections.append(descendant)
             for descendant in mother_collection.get_descendants(type='v'):
                 if not descendant.restricted_p():
-                    last_mod = get_collection_last_modification(descendant)
-                    output.append((descendant.name, last_mod))
+                    collections.append(descendant)
+
+    ## last modification = modification date of the latest added record,
+    ## fetched for all the collections at once
+    latest_recids = {}
+    for collection in collections:
+        if collection.reclist:
+            latest_recids[collection.name] = collection.reclist[-1]
+    last_modifications = {}
+    recids = sorted(set(latest_recids.values()))
+    for i in xrange(0, len(recids), CHUNK_SIZE):
+        chunk = tuple(recids[i:i + CHUNK_SIZE])
+        query = "SELECT id, modification_date FROM bibrec WHERE id IN (%s)" % \
+                ', '.join(['%s'] * len(chunk))
+        last_modifications.update(run_sql(query, chunk))
+
+    output = []
+    for collection in collections:
+        last_mod = last_modifications.get(latest_recids.get(collection.name))
+        if last_mod:
+            last_mod = max(minimum_timestamp, last_mod)
+        output.append((collection.name, last_mod))
     return output
 
 def filter_fulltexts(recids, fulltext_type=None):
     """ returns list of records having a fulltext of type fulltext_type.
     If fulltext_type is empty, return all records having a fulltext"""
     recids = dict(recids)
+    if not recids:
+        return []
     minimum_timestamp = get_minimum_timestamp()
+    query = """SELECT id_bibrec, max(modification_date)
+               FROM bibrec_bibdoc
+               LEFT JOIN bibdoc ON bibrec_bibdoc.id_bibdoc=bibdoc.id
+               WHERE id_bibrec BETWEEN %s AND %s AND status<>'DELETED'"""
+    params = (min(recids), max(recids))
     if fulltext_type:
-        query = """SELECT id_bibrec, max(modification_date)
-                   FROM bibrec_bibdoc
-                   LEFT JOIN bibdoc ON bibrec_bibdoc.id_bibdoc=bibdoc.id
-                   WHERE type=%s
-                   GROUP BY id_bibrec"""
-        res = run_sql(query, (fulltext_type,))
-    else:
-        query = """SELECT id_bibrec, max(modification_date)
-                   FROM bibrec_bibdoc
-                   LEFT JOIN bibdoc ON bibrec_bibdoc.id_bibdoc=bibdoc.id
-                   GROUP BY id_bibrec"""
-        res = run_sql(query)
-    return [(recid, max(lastmod, minimum_timestamp)) for (recid, lastmod) in res if recid in recids and BibRecDocs(recid).list_latest_files(list_hidden=False)]
-
-
-def filter_comments(recids):
-    """ Retrieve recids having a comment. return (recid, last_review_date)"""
-    minimum_timestamp = get_minimum_timestamp()
+        query += " AND type=%s"
+        params += (fulltext_type,)
+    res = [(recid, lastmod) for (recid, lastmod) in
+           run_sql(query + " GROUP BY id_bibrec ORDER BY id_bibrec", params)
+           if recid in recids]
+    ## only the records having visible files are kept
+    bibrecdocs = BibRecDocs.bulk_load([recid for (recid, lastmod) in res])
+    return [(recid, max(lastmod, minimum_timestamp)) for (recid, lastmod) in res if bibrecdocs[recid].list_latest_files(list_hidden=False)]
+
+def _filter_comments(recids, reviews):
+    """Retrieve recids having a comment (or a review, if REVIEWS).
+    return (recid, last_comment_date)"""
     recids = dict(recids)
+    if not recids:
+        return []
+    minimum_timestamp = get_minimum_timestamp()
     query = """SELECT id_bibrec, max(date_creation)
                FROM cmtRECORDCOMMENT
-               WHERE star_score=0
-               GROUP BY id_bibrec"""
-    res = run_sql(query)
-    return [(recid, max(minimum_timestamp, lastmod)) for (recid, lastmod) in res if recid in recids]
+               WHERE id_bibrec BETWEEN %%s AND %%s AND star_score%s0
+               GROUP BY id_bibrec
+               ORDER BY id_bibrec""" % (reviews and '>' or '=')
+    res = run_sql(query, (min(recids), max(recids)))
+    return [(recid, max(lastmod, minimum_timestamp)) for (recid, lastmod) in res if recid in recids]
 
+def filter_comments(recids):
+    """ Retrieve recids having a comment. return (recid, last_review_date)"""
+    return _filter_comments(recids, reviews=False)
 
 def filter_reviews(recids):
     """ Retrieve recids having a review. return (recid, last_review_date)"""
-    minimum_timestamp = get_minimum_timestamp()
-    recids = dict(recids)
-    query = """SELECT id_bibrec, max(date_creation)
-               FROM cmtRECORDCOMMENT
-               WHERE star_score>0
-               GROUP BY id_bibrec"""
-    res = run_sql(query)
-    return [(recid, max(lastmod, minimum_timestamp)) for (recid, lastmod) in res if recid in recids]
+    return _filter_comments(recids, reviews=True)
 
 
 SITEMAP_HEADER = """\
@@ -186,14 +215,17 @@ SITEMAP_FOOTER = '\n</urlset>\n'
 class SitemapWriter(object):
     """ Writer for sitemaps"""
 
-    def __init__(self, sitemap_id):
+    def __init__(self, sitemap_id, name=None):
         """ Constructor.
-        name: path to the sitemap file to be created
+        name: path to the sitemap file to be created (by default
+        sitemap-<sitemap_id>.xml.gz in CFG_WEBDIR)
         """
         self.header = SITEMAP_HEADER
         self.footer = SITEMAP_FOOTER
         self.sitemap_id = sitemap_id
-        self.name = os.path.join(CFG_WEBDIR, 'sitemap-%02d.xml.gz' % sitemap_id)
+        if name is None:
+            name = os.path.join(CFG_WEBDIR, 'sitemap-%02d.xml.gz' % sitemap_id)
+        self.name = name
         self.filedescriptor = gzip.open(self.name + '.part', 'w')
         self.num_urls = 0
         self.file_size = 0
@@ -202,7 +234,10 @@ class SitemapWriter(object):
 
     def add_url(self, url, lastmod=datetime(1900, 1, 1), changefreq="", priority="", alternate=False):
         """ create a new url node. Returns the number of url nodes in sitemap"""
-        self.num_urls += 1
+        return self.add_url_node(self.make_url_node(url, lastmod, changefreq, priority, alternate))
+
+    def make_url_node(self, url, lastmod=datetime(1900, 1, 1), changefreq="", priority="", alternate=False):
+        """ Return the url node to be added with add_url_node() """
         canonical_url, alternate_urls = get_canonical_and_alternates_urls(url, drop_ln=not alternate)
         url_node = u"""
   <url>
@@ -225,10 +260,22 @@ class SitemapWriter(object):
                 optional += u"""
     <xhtml:link rel="alternate" hreflang="%s" href="%s" />""" % (ln, encode_for_xml(alternate_url, quote=True))
         url_node %= (encode_for_xml(canonical_url), optional)
+        return url_node
+
+    def add_url_node(self, url_node):
+        """ Add the URL_NODE made by make_url_node(). Returns the number
+        of url nodes in sitemap"""
+        self.num_urls += 1
         self.file_size += len(url_node)
         self.filedescriptor.write(url_node)
         return self.num_urls
 
+    def can_add_url_node(self, url_node):
+        """ Whether URL_NODE fits without going over the 50'000 URLs and
+        10MB limits of a sitemap """
+        return self.num_urls < MAX_RECORDS and \
+               self.get_size() + len(url_node) <= MAX_SIZE
+
     def get_size(self):
         """ File size. Should not be > 10MB """
         return self.file_size + len(self.footer)
@@ -245,11 +292,16 @@ class SitemapWriter(object):
         """ Returns the sitemap URL"""
         return CFG_SITE_URL + '/' + os.path.basename(self.name)
 
-    def __del__(self):
+    def close(self):
         """ Writes the whole sitemap """
-        self.filedescriptor.write(self.footer)
-        self.filedescriptor.close()
-        os.rename(self.name + '.part', self.name)
+        if self.filedescriptor is not None:
+            self.filedescriptor.write(self.footer)
+            self.filedescriptor.close()
+            self.filedescriptor = None
+            os.rename(self.name + '.part', self.name)
+
+    def __del__(self):
+        self.close()
 
 SITEMAP_INDEX_HEADER = \
 '<?xml version="1.0" encoding="UTF-8"?>\n' \
@@ -277,34 +329,106 @@ class SitemapIndexWriter(object):
         self.filedescriptor.write(self.header)
         self.file_size += len(self.footer)
 
-    def add_url(self, url):
+    def add_url(self, url, lastmod=None):
         """ create a new url node. Returns the number of url nodes in sitemap"""
         self.num_urls += 1
         url_node = u"""
   <sitemap>
     <loc>%s</loc>%s
   </sitemap>"""
+        if lastmod:
+            lastmod = lastmod.strftime('%Y-%m-%dT%H:%M:%S' + DEFAULT_TIMEZONE)
+        else:
+            lastmod = time.strftime('%Y-%m-%dT%H:%M:%S' + DEFAULT_TIMEZONE)
         optional = u"""
-    <lastmod>%s</lastmod>""" % time.strftime('%Y-%m-%dT%H:%M:%S' +\
-                                            DEFAULT_TIMEZONE)
+    <lastmod>%s</lastmod>""" % lastmod
         url_node %= (url, optional)
         self.file_size += len(url_node)
         self.filedescriptor.write(url_node)
         return self.num_urls
 
-    def __del__(self):
+    def close(self):
         """ Writes the whole sitemap """
-        self.filedescriptor.write(self.footer)
-        self.filedescriptor.close()
-        os.rename(self.name + '.part', self.name)
+        if self.filedescriptor is not None:
+            self.filedescriptor.write(self.footer)
+            self.filedescriptor.close()
+            self.filedescriptor = None
+            os.rename(self.name + '.part', self.name)
 
-def generate_sitemaps(sitemap_index_writer, collection_names, fulltext_filter=''):
+    def __del__(self):
+        self.close()
+
+def get_record_sitemap_name(shard, part=0):
+    """Return the path of the sitemap of the records of the given SHARD.
+    When the URLs of a shard do not fit in one sitemap, they are split in
+    several PARTs, the first one keeping the name of the whole shard."""
+    if part:
+        return os.path.join(CFG_WEBDIR, 'sitemap-records-%04d-%02d.xml.gz' % (shard, part))
+    return os.path.join(CFG_WEBDIR, 'sitemap-records-%04d.xml.gz' % shard)
+
+def get_record_sitemap_names(shard, sitemap):
+    """Return the paths of the sitemaps of the given SHARD, described in
+    the manifest by SITEMAP."""
+    return [get_record_sitemap_name(shard, part)
+            for part in xrange(sitemap.get('parts', 1))]
+
+def remove_record_sitemaps(shard, first_part=0):
+    """Remove the sitemaps of the given SHARD, starting at FIRST_PART."""
+    for name in glob.glob(os.path.join(CFG_WEBDIR, 'sitemap-records-%04d*.xml.gz' % shard)):
+        numbers = os.path.basename(name)[len('sitemap-records-'):-len('.xml.gz')].split('-')
+        try:
+            if int(numbers[0]) == shard and len(numbers) <= 2 and \
+                   int((numbers[1:] or ['0'])[0]) >= first_part:
+                os.remove(name)
+        except ValueError:
+            pass
+
+def get_modified_recids(since):
+    """Return the intbitset of the records modified since the datetime
+    SINCE, including the records whose files, comments or reviews were."""
+    recids = intbitset(run_sql("SELECT id FROM bibrec WHERE modification_date>=%s", (since,)))
+    recids += intbitset(run_sql("""SELECT DISTINCT id_bibrec FROM bibrec_bibdoc
+                                   JOIN bibdoc ON bibrec_bibdoc.id_bibdoc=bibdoc.id
+                                   WHERE bibdoc.modification_date>=%s""", (since,)))
+    recids += intbitset(run_sql("""SELECT DISTINCT id_bibrec FROM cmtRECORDCOMMENT
+                                   WHERE date_creation>=%s""", (since,)))
+    return recids
+
+def load_sitemap_manifest():
     """
-    Generate sitemaps themselves. Return list of generated sitemaps files
+    Return the manifest describing the sitemaps of the records written
+    by the previous run, or None if there is none.  The manifest is a
+    dictionary with keys:
+        - last_run: when the previous run started;
+        - parameters: the parameters of the previous run;
+        - public: the intbitset (dumped) of the records that were public;
+        - sitemaps: the dictionary shard -> {'records', 'urls', 'lastmod',
+          'parts'} of the sitemaps written, the records of the shard being
+          the ones between shard * records_per_sitemap and
+          (shard + 1) * records_per_sitemap - 1, and their URLs being
+          split in 'parts' sitemaps when they do not fit in one.
+    """
+    if not os.path.exists(_CFG_SITEMAP_MANIFEST_PATH):
+        return None
+    try:
+        return cPickle.load(open(_CFG_SITEMAP_MANIFEST_PATH))
+    except Exception, err:
+        write_message("WARNING: cannot read sitemap manifest %s: %s" % (_CFG_SITEMAP_MANIFEST_PATH, err))
+        return None
+
+def store_sitemap_manifest(manifest):
+    """Store MANIFEST (see load_sitemap_manifest) for the next run."""
+    cPickle.dump(manifest, open(_CFG_SITEMAP_MANIFEST_PATH + '.part', 'w'), cPickle.HIGHEST_PROTOCOL)
+    os.rename(_CFG_SITEMAP_MANIFEST_PATH + '.part', _CFG_SITEMAP_MANIFEST_PATH)
+
+def generate_static_sitemaps(collection_names):
+    """
+    Generate the sitemaps of the home page and of the collections.
+    Return the list of their URLs.
     """
     sitemap_id = 1
     writer = SitemapWriter(sitemap_id)
-    sitemap_index_writer.add_url(writer.get_sitemap_url())
+    writers = [writer]
     nb_urls = 0
     for lang in CFG_SITE_LANGS:
         writer.add_url(CFG_SITE_URL + '/?ln=%s' % lang,
@@ -312,22 +436,6 @@ def generate_sitemaps(sitemap_index_writer, collection_names, fulltext_filter=''
                        changefreq=DEFAULT_CHANGEFREQ_HOME,
                        priority=DEFAULT_PRIORITY_HOME)
         nb_urls += 1
-    write_message("... Getting all public records...")
-    recids = get_all_public_records(collection_names)
-    write_message("... Generating urls for %s records..." % len(recids))
-    task_sleep_now_if_required(can_stop_too=True)
-    for i, (recid, lastmod) in enumerate(recids):
-        if nb_urls % 100 == 0 and (writer.get_size() >= MAX_SIZE or nb_urls >= MAX_RECORDS):
-            sitemap_id += 1
-            writer = SitemapWriter(sitemap_id)
-            sitemap_index_writer.add_url(writer.get_sitemap_url())
-        nb_urls = writer.add_url(CFG_SITE_URL + '/%s/%s' % (CFG_SITE_RECORD, recid),
-                                lastmod = lastmod,
-                                changefreq = DEFAULT_CHANGEFREQ_RECORDS,
-                                priority = DEFAULT_PRIORITY_RECORDS)
-        if i % 100 == 0:
-            task_update_progress("Sitemap for recid %s/%s" % (i + 1, len(recids)))
-            task_sleep_now_if_required(can_stop_too=True)
     write_message("... Generating urls for collections...")
     collections = get_all_public_collections(collection_names)
     for i, (collection, lastmod) in enumerate(collections):
@@ -335,7 +443,7 @@ def generate_sitemaps(sitemap_index_writer, collection_names, fulltext_filter=''
             if nb_urls % 100 == 0 and (writer.get_size() >= MAX_SIZE or nb_urls >= MAX_RECORDS):
                 sitemap_id += 1
                 writer = SitemapWriter(sitemap_id)
-                sitemap_index_writer.add_url(writer.get_sitemap_url())
+                writers.append(writer)
             nb_urls = writer.add_url('%s/collection/%s?ln=%s' % (CFG_SITE_URL, quote(collection), lang),
                         lastmod = lastmod,
                         changefreq = DEFAULT_CHANGEFREQ_COLLECTIONS,
@@ -344,60 +452,137 @@ def generate_sitemaps(sitemap_index_writer, collection_names, fulltext_filter=''
         if i % 100 == 0:
             task_update_progress("Sitemap for collection %s/%s" % (i + 1, len(collections)))
             task_sleep_now_if_required(can_stop_too=True)
-    write_message("... Generating urls for fulltexts...")
-    recids = filter_fulltexts(recids, fulltext_filter)
-    for i, (recid, lastmod) in enumerate(recids):
-        if nb_urls % 100 == 0 and (writer.get_size() >= MAX_SIZE or nb_urls >= MAX_RECORDS):
-            sitemap_id += 1
-            writer = SitemapWriter(sitemap_id)
-            sitemap_index_writer.add_url(writer.get_sitemap_url())
-        nb_urls = writer.add_url(CFG_SITE_URL + '/%s/%s/files' % (CFG_SITE_RECORD, recid),
-                                 lastmod = lastmod,
-                                 changefreq = DEFAULT_CHANGEFREQ_FULLTEXTS,
-                                 priority = DEFAULT_PRIORITY_FULLTEXTS)
-        if i % 100 == 0:
-            task_update_progress("Sitemap for files page %s/%s" % (i, len(recids)))
-            task_sleep_now_if_required(can_stop_too=True)
+    for writer in writers:
+        writer.close()
+    ## sitemaps left over by a previous run
+    for name in glob.glob(os.path.join(CFG_WEBDIR, 'sitemap-[0-9]*.xml.gz')):
+        try:
+            if int(os.path.basename(name)[len('sitemap-'):-len('.xml.gz')]) > sitemap_id:
+                os.remove(name)
+        except ValueError:
+            pass
+    return [writer.get_sitemap_url() for writer in writers]
 
-    write_message("... Generating urls for comments...")
-    recids = filter_comments(recids)
-    for i, (recid, lastmod) in enumerate(recids):
-        if nb_urls % 100 == 0 and (writer.get_size() >= MAX_SIZE or nb_urls >= MAX_RECORDS):
-            sitemap_id += 1
-            writer = SitemapWriter(sitemap_id)
-            sitemap_index_writer.add_url(writer.get_sitemap_url())
-        nb_urls = writer.add_url(CFG_SITE_URL + '/%s/%s/comments' % (CFG_SITE_RECORD, recid),
-                                 lastmod = lastmod,
-                                 changefreq = DEFAULT_CHANGEFREQ_COMMENTS,
-                                 priority = DEFAULT_PRIORITY_COMMENTS)
-        if i % 100 == 0:
-            task_update_progress("Sitemap for comments page %s/%s" % (i, len(recids)))
-            task_sleep_now_if_required(can_stop_too=True)
-    write_message("... Generating urls for reviews")
-    recids = filter_reviews(recids)
-    for i, (recid, lastmod) in enumerate(recids):
-        if nb_urls % 100 == 0 and (writer.get_size() >= MAX_SIZE or nb_urls >= MAX_RECORDS):
-            sitemap_id += 1
-            write_message("")
-            writer = SitemapWriter(sitemap_id)
-            sitemap_index_writer.add_url(writer.get_sitemap_url())
-        nb_urls = writer.add_url(CFG_SITE_URL + '/%s/%s/reviews' % (CFG_SITE_RECORD, recid),
-                                 lastmod = lastmod,
-                                 changefreq = DEFAULT_CHANGEFREQ_REVIEWS,
-                                 priority = DEFAULT_PRIORITY_REVIEWS)
-        if i % 100 == 0:
-            task_update_progress("Sitemap for reviews page %s/%s" % (i, len(recids)))
-            task_sleep_now_if_required(can_stop_too=True)
+def generate_record_sitemap(shard, recids, fulltext_filter=''):
+    """
+    Generate the sitemap of the records RECIDS of the given SHARD,
+    split in several parts if needed to keep each of them within
+    MAX_RECORDS URLs and MAX_SIZE bytes.
+    Return the dictionary {'records', 'urls', 'lastmod', 'parts'}
+    describing it.
+    """
+    writer = SitemapWriter(shard, get_record_sitemap_name(shard))
+    writers = [writer]
+    records = get_records_last_modification(recids)
+    last_modification = datetime(1970, 1, 1)
+    for url_suffix, changefreq, priority, urls in (
+            ('', DEFAULT_CHANGEFREQ_RECORDS, DEFAULT_PRIORITY_RECORDS, records),
+            ('/files', DEFAULT_CHANGEFREQ_FULLTEXTS, DEFAULT_PRIORITY_FULLTEXTS,
+             filter_fulltexts(records, fulltext_filter)),
+            ('/comments', DEFAULT_CHANGEFREQ_COMMENTS, DEFAULT_PRIORITY_COMMENTS,
+             filter_comments(records)),
+            ('/reviews', DEFAULT_CHANGEFREQ_REVIEWS, DEFAULT_PRIORITY_REVIEWS,
+             filter_reviews(records))):
+        for recid, lastmod in urls:
+            url_node = writer.make_url_node(CFG_SITE_URL + '/%s/%s%s' % (CFG_SITE_RECORD, recid, url_suffix),
+                                            lastmod = lastmod,
+                                            changefreq = changefreq,
+                                            priority = priority)
+            if writer.get_number_of_urls() and not writer.can_add_url_node(url_node):
+                writer.close()
+                writer = SitemapWriter(shard, get_record_sitemap_name(shard, len(writers)))
+                writers.append(writer)
+            writer.add_url_node(url_node)
+            last_modification = max(last_modification, lastmod)
+    writer.close()
+    ## parts left over by a previous run
+    remove_record_sitemaps(shard, len(writers))
+    return {'records': len(records),
+            'urls': sum([writer.get_number_of_urls() for writer in writers]),
+            'lastmod': last_modification,
+            'parts': len(writers)}
+
+def generate_sitemaps(collection_names, fulltext_filter='',
+                      records_per_sitemap=RECORDS_PER_SITEMAP, incremental=True):
+    """
+    Generate sitemaps themselves. Return the list of (URL, last
+    modification) of the generated sitemaps.
+
+    The records are split in sitemaps by ranges of RECORDS_PER_SITEMAP
+    recids.  If INCREMENTAL, only the sitemaps of the ranges having
+    records modified (or made public, or hidden) since the previous run
+    are generated again.
+    """
+    run_start = datetime.now()
+    parameters = (sorted(collection_names), fulltext_filter, records_per_sitemap)
+    manifest = None
+    if incremental:
+        manifest = load_sitemap_manifest()
+        if manifest and (manifest['parameters'] != parameters or
+                         get_minimum_timestamp() > manifest['last_run']):
+            write_message("... Parameters changed or recrawling forced, generating all sitemaps")
+            manifest = None
+
+    sitemap_urls = [(url, None) for url in generate_static_sitemaps(collection_names)]
 
-def generate_sitemaps_index(collection_list, fulltext_filter=None):
+    write_message("... Getting all public records...")
+    public_recids = get_all_public_recids(collection_names)
+    if manifest is None:
+        for name in glob.glob(os.path.join(CFG_WEBDIR, 'sitemap-records-*.xml.gz')):
+            os.remove(name)
+        sitemaps = {}
+        recids_to_update = public_recids
+    else:
+        sitemaps = manifest['sitemaps']
+        previous_public_recids = intbitset()
+        previous_public_recids.fastload(manifest['public'])
+        recids_to_update = (public_recids ^ previous_public_recids) | \
+            (get_modified_recids(manifest['last_run']) & public_recids)
+    shards = set([recid // records_per_sitemap for recid in recids_to_update])
+    ## sitemaps removed meanwhile
+    shards.update([shard for shard, sitemap in sitemaps.iteritems()
+                   if not all([os.path.exists(name) for name in get_record_sitemap_names(shard, sitemap)])])
+    shards = sorted(shards)
+    write_message("... Generating urls for %s records in %s sitemaps (%s unchanged)..." % \
+                  (len(recids_to_update), len(shards),
+                   len([shard for shard in sitemaps if shard not in shards])))
+    task_sleep_now_if_required(can_stop_too=True)
+    for i, shard in enumerate(shards):
+        shard_recids = public_recids & intbitset(xrange(shard * records_per_sitemap,
+                                                        (shard + 1) * records_per_sitemap))
+        if shard_recids:
+            sitemaps[shard] = generate_record_sitemap(shard, shard_recids, fulltext_filter)
+        else:
+            sitemaps.pop(shard, None)
+            remove_record_sitemaps(shard)
+        task_update_progress("Sitemap for records %s/%s" % (i + 1, len(shards)))
+        task_sleep_now_if_required(can_stop_too=True)
+
+    store_sitemap_manifest({'last_run': run_start,
+                            'parameters': parameters,
+                            'public': public_recids.fastdump(),
+                            'sitemaps': sitemaps})
+    for shard in sorted(sitemaps):
+        for name in get_record_sitemap_names(shard, sitemaps[shard]):
+            sitemap_urls.append((CFG_SITE_URL + '/' + os.path.basename(name),
+                                 sitemaps[shard]['lastmod']))
+    return sitemap_urls
+
+def generate_sitemaps_index(collection_list, fulltext_filter=None,
+                            records_per_sitemap=RECORDS_PER_SITEMAP, incremental=True):
     """main function. Generates the sitemap index and the sitemaps
     collection_list: list of collection names to add in sitemap
     fulltext_filter: if provided the parser will intergrate only give fulltext
                      types
+    records_per_sitemap, incremental: see generate_sitemaps()
     """
     write_message("Generating all sitemaps...")
+    sitemap_urls = generate_sitemaps(collection_list, fulltext_filter,
+                                     records_per_sitemap, incremental)
     sitemap_index_writer = SitemapIndexWriter(CFG_WEBDIR + '/sitemap-index.xml.gz')
-    generate_sitemaps(sitemap_index_writer, collection_list, fulltext_filter)
+    for url, lastmod in sitemap_urls:
+        sitemap_index_writer.add_url(url, lastmod)
+    sitemap_index_writer.close()
 
 
 def run_export_method(jobname):
@@ -406,8 +591,13 @@ def run_export_method(jobname):
 
     collections = get_config_parameter(jobname=jobname, parameter_name="collection", is_parameter_collection=True)
     fulltext_type = get_config_parameter(jobname=jobname, parameter_name="fulltext_status")
+    try:
+        records_per_sitemap = int(get_config_parameter(jobname=jobname, parameter_name="records_per_sitemap"))
+    except (ConfigParserError, TypeError, ValueError):
+        records_per_sitemap = RECORDS_PER_SITEMAP
+    records_per_sitemap = max(1, min(records_per_sitemap, MAX_RECORDS // 4))
 
-    generate_sitemaps_index(collections, fulltext_type)
+    generate_sitemaps_index(collections, fulltext_type, records_per_sitemap)
 
     write_message("bibexport_sitemap: job %s finished." % jobname)
 
@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+##
+## This file is part of Invenio.
+## Copyright (C) 2014 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""Unit tests for the sitemap exporting method."""
+
+__revision__ = "$Id$"
+
+import gzip
+import os
+import shutil
+import tempfile
+from datetime import datetime
+
+from invenio.testutils import InvenioTestCase, make_test_suite, \
+    run_test_suite
+from invenio import bibexport_method_sitemap
+from invenio.intbitset import intbitset
+
+
+class _SitemapTestCase(InvenioTestCase):
+    """Writes the sitemaps and the manifest in a temporary directory,
+    with the records described by self.records and self.fulltexts."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.records = {}
+        self.fulltexts = {}
+        self.generated = []
+
+        def get_records_last_modification(recids):
+            return [(recid, self.records[recid]) for recid in recids
+                    if recid in self.records]
+
+        def filter_fulltexts(records, fulltext_type=None):
+            return [(recid, lastmod) for recid, lastmod in records
+                    if recid in self.fulltexts]
+
+        self.patch_attributes(bibexport_method_sitemap, (
+                ('CFG_WEBDIR', self.tmpdir),
+                ('CFG_SITE_URL', 'http://example.org'),
+                ('CFG_SITE_RECORD', 'record'),
+                ('_CFG_SITEMAP_MANIFEST_PATH',
+                 os.path.join(self.tmpdir, 'manifest.pickle')),
+                ('get_canonical_and_alternates_urls',
+                 lambda url, drop_ln=True: (url, {})),
+                ('get_minimum_timestamp', lambda: datetime(1970, 1, 1)),
+                ('get_records_last_modification', get_records_last_modification),
+                ('filter_fulltexts', filter_fulltexts),
+                ('filter_comments', lambda records: []),
+                ('filter_reviews', lambda records: []),
+                ('write_message', lambda *args, **kwargs: None),
+                ('task_update_progress', lambda *args, **kwargs: None),
+                ('task_sleep_now_if_required', lambda *args, **kwargs: None)))
+
+    def tearDown(self):
+        self.restore_attributes()
+        shutil.rmtree(self.tmpdir)
+
+    def read_urls(self, name):
+        """Returns the URLs listed in the sitemap NAME."""
+        content = gzip.open(os.path.join(self.tmpdir, name)).read()
+        return [line.strip()[len('<loc>'):-len('</loc>')]
+                for line in content.splitlines() if '<loc>' in line]
+
+
+class ManifestTest(_SitemapTestCase):
+    """Manifest kept between two runs."""
+
+    def test_round_trip(self):
+        """bibexport sitemap - the manifest is stored and loaded back"""
+        manifest = {'last_run': datetime(2014, 1, 2, 3, 4, 5),
+                    'parameters': (['Articles'], '', 100),
+                    'public': intbitset([1, 2, 150]).fastdump(),
+                    'sitemaps': {0: {'records': 2, 'urls': 3,
+                                     'lastmod': datetime(2014, 1, 1),
+                                     'parts': 1}}}
+        bibexport_method_sitemap.store_sitemap_manifest(manifest)
+        self.assertEqual(bibexport_method_sitemap.load_sitemap_manifest(),
+                         manifest)
+        self.assertFalse(os.path.exists(
+            bibexport_method_sitemap._CFG_SITEMAP_MANIFEST_PATH + '.part'))
+
+    def test_missing(self):
+        """bibexport sitemap - there is no manifest before the first run"""
+        self.assertEqual(bibexport_method_sitemap.load_sitemap_manifest(),
+                         None)
+
+    def test_corrupted(self):
+        """bibexport sitemap - a corrupted manifest is ignored"""
+        open(bibexport_method_sitemap._CFG_SITEMAP_MANIFEST_PATH,
+             'w').write('garbage')
+        self.assertEqual(bibexport_method_sitemap.load_sitemap_manifest(),
+                         None)
+
+
+class ShardSplittingTest(_SitemapTestCase):
+    """Sitemaps of the records split to stay within the limits."""
+
+    def setUp(self):
+        _SitemapTestCase.setUp(self)
+        self.patch_attributes(bibexport_method_sitemap, (('MAX_RECORDS', 3),))
+        for recid in range(1, 8):
+            self.records[recid] = datetime(2014, 1, recid)
+
+    def test_split_by_number_of_urls(self):
+        """bibexport sitemap - a shard with too many URLs is split"""
+        self.fulltexts = set([2, 3])
+        sitemap = bibexport_method_sitemap.generate_record_sitemap(
+            0, intbitset(self.records))
+        self.assertEqual(sitemap['parts'], 3)
+        self.assertEqual(sitemap['urls'], 9)
+        self.assertEqual(sitemap['records'], 7)
+        self.assertEqual(sitemap['lastmod'], datetime(2014, 1, 7))
+        urls = []
+        for name in ('sitemap-records-0000.xml.gz',
+                     'sitemap-records-0000-01.xml.gz',
+                     'sitemap-records-0000-02.xml.gz'):
+            self.assertEqual(len(self.read_urls(name)), 3)
+            urls.extend(self.read_urls(name))
+        self.assertEqual(urls[:7], ['http://example.org/record/%s' % recid
+                                    for recid in range(1, 8)])
+        self.assertEqual(urls[7:], ['http://example.org/record/2/files',
+                                    'http://example.org/record/3/files'])
+
+    def test_split_by_size(self):
+        """bibexport sitemap - a shard too big is split"""
+        self.patch_attributes(bibexport_method_sitemap, (('MAX_RECORDS', 50000),
+                                                         ('MAX_SIZE', 400)))
+        sitemap = bibexport_method_sitemap.generate_record_sitemap(
+            0, intbitset(self.records))
+        self.assertTrue(sitemap['parts'] > 1)
+        self.assertEqual(sitemap['urls'], 7)
+        for name in bibexport_method_sitemap.get_record_sitemap_names(0, sitemap):
+            self.assertTrue(os.path.exists(name))
+            self.assertTrue(self.read_urls(name))
+
+    def test_left_over_parts_removed(self):
+        """bibexport sitemap - parts no longer needed are removed"""
+        bibexport_method_sitemap.generate_record_sitemap(
+            0, intbitset(self.records))
+        bibexport_method_sitemap.generate_record_sitemap(
+            1, intbitset(self.records))
+        sitemap = bibexport_method_sitemap.generate_record_sitemap(
+            0, intbitset([1, 2]))
+        self.assertEqual(sitemap['parts'], 1)
+        self.assertEqual(sorted(os.listdir(self.tmpdir)),
+                         ['sitemap-records-0000.xml.gz',
+                          'sitemap-records-0001-01.xml.gz',
+                          'sitemap-records-0001-02.xml.gz',
+                          'sitemap-records-0001.xml.gz'])
+
+
+class IncrementalTest(_SitemapTestCase):
+    """Only the sitemaps of the modified records are generated again."""
+
+    def setUp(self):
+        _SitemapTestCase.setUp(self)
+        self.public = intbitset([1, 2, 15, 25])
+        self.modified = intbitset()
+        for recid in self.public:
+            self.records[recid] = datetime(2014, 1, 1)
+        generate_record_sitemap = bibexport_method_sitemap.generate_record_sitemap
+
+        def generate_record_sitemap_and_log(shard, recids, fulltext_filter=''):
+            self.generated.append(shard)
+            return generate_record_sitemap(shard, recids, fulltext_filter)
+
+        self.patch_attributes(bibexport_method_sitemap, (
+                ('generate_static_sitemaps', lambda collections: []),
+                ('get_all_public_recids', lambda collections: intbitset(self.public)),
+                ('get_modified_recids', lambda since: intbitset(self.modified)),
+                ('generate_record_sitemap', generate_record_sitemap_and_log)))
+
+    def generate(self):
+        """Runs the generation of the sitemaps, by shards of 10 records."""
+        self.generated = []
+        return [url for url, lastmod in bibexport_method_sitemap.generate_sitemaps(
+            ['Articles'], records_per_sitemap=10)]
+
+    def test_unchanged(self):
+        """bibexport sitemap - unchanged shards are not generated again"""
+        self.assertEqual(self.generate(),
+                         ['http://example.org/sitemap-records-0000.xml.gz',
+                          'http://example.org/sitemap-records-0001.xml.gz',
+                          'http://example.org/sitemap-records-0002.xml.gz'])
+        self.assertEqual(self.generated, [0, 1, 2])
+        self.modified = intbitset([15])
+        self.generate()
+        self.assertEqual(self.generated, [1])
+        self.assertEqual(self.read_urls('sitemap-records-0001.xml.gz'),
+                         ['http://example.org/record/15'])
+
+    def test_public_records_changed(self):
+        """bibexport sitemap - shards of records made public or hidden are generated again"""
+        self.generate()
+        self.public = intbitset([1, 2, 16])
+        self.records[16] = datetime(2014, 1, 1)
+        self.assertEqual(self.generate(),
+                         ['http://example.org/sitemap-records-0000.xml.gz',
+                          'http://example.org/sitemap-records-0001.xml.gz'])
+        self.assertEqual(self.generated, [1])
+        self.assertFalse(os.path.exists(os.path.join(
+            self.tmpdir, 'sitemap-records-0002.xml.gz')))
+
+    def test_removed_sitemap(self):
+        """bibexport sitemap - missing sitemaps are generated again"""
+        self.generate()
+        os.remove(os.path.join(self.tmpdir, 'sitemap-records-0002.xml.gz'))
+        self.generate()
+        self.assertEqual(self.generated, [2])
+
+    def test_split_shard_listed(self):
+        """bibexport sitemap - all the parts of a split shard are listed"""
+        self.patch_attributes(bibexport_method_sitemap, (('MAX_RECORDS', 1),))
+        self.assertEqual(self.generate()[:3],
+                         ['http://example.org/sitemap-records-0000.xml.gz',
+                          'http://example.org/sitemap-records-0000-01.xml.gz',
+                          'http://example.org/sitemap-records-0001.xml.gz'])
+        os.remove(os.path.join(self.tmpdir, 'sitemap-records-0000-01.xml.gz'))
+        self.generate()
+        self.assertEqual(self.generated, [0])
+
+
+TEST_SUITE = make_test_suite(ManifestTest,
+                             ShardSplittingTest,
+                             IncrementalTest)
+
+if __name__ == "__main__":
+    run_test_suite(TEST_SUITE)
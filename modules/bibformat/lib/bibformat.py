@@ -41,6 +41,7 @@ import zlib
 from invenio import bibformat_dblayer
 from invenio import bibformat_engine
 from invenio import bibformat_utils
+from invenio.timerutils import timed_phase
 from invenio.config import \
      CFG_SITE_LANG, \
      CFG_SITE_URL, \
@@ -50,6 +51,7 @@ import sys
 
 # Functions to format a single record
 ##
+@timed_phase('format')
 def format_record(recID, of, ln=CFG_SITE_LANG, verbose=0, search_pattern=None,
                   xml_record=None, user_info=None, on_the_fly=False,
                   save_missing=True, force_2nd_pass=False):
@@ -135,6 +137,7 @@ def record_get_xml(recID, format='xm', decompress=zlib.decompress):
 # that relies on format_records to do the formatting.
 ##
 
+@timed_phase('format')
 def format_records(recIDs, of, ln=CFG_SITE_LANG, verbose=0, search_pattern=None,
                    xml_records=None, user_info=None, record_prefix=None,
                    record_separator=None, record_suffix=None, prologue="",
@@ -28,6 +28,7 @@ import zlib
 import time
 
 from invenio.dbquery import run_sql
+from invenio.data_cacher import SQLQueryCacher
 from invenio.dateutils import localtime_to_utc
 
 
@@ -158,12 +159,15 @@ def get_output_format_id(code):
     f_code = code
     if len(code)>6:
         f_code = code[:6]
-    res = run_sql("SELECT id FROM format WHERE code=%s", (f_code.lower(),))
+    res = _query_output_format_id(f_code.lower())
     if len(res)>0:
         return res[0][0]
     else:
         return None
 
+_query_output_format_id = SQLQueryCacher("SELECT id FROM format WHERE code=%s",
+                                         affected_tables=('format', ))
+
 def add_output_format(code, name="", description="", content_type="text/html", visibility=1):
     """
     Add output format into format table.
@@ -182,6 +186,7 @@ def add_output_format(code, name="", description="", content_type="text/html", v
         query = "INSERT INTO format SET code=%s, description=%s, content_type=%s, visibility=%s"
         params = (code.lower(), description, content_type, visibility)
         run_sql(query, params)
+        _query_output_format_id.clear()
         set_output_format_name(code, name)
 
 def remove_output_format(code):
@@ -202,6 +207,7 @@ def remove_output_format(code):
     run_sql(query)
     query = "DELETE FROM format WHERE id='%s'" % output_format_id
     run_sql(query)
+    _query_output_format_id.clear()
 
 def get_output_format_description(code):
     """
@@ -418,6 +424,7 @@ def change_output_format_code(old_code, new_code):
     query = "UPDATE format SET code=%s WHERE id=%s"
     params = (new_code.lower(), output_format_id)
     run_sql(query, params)
+    _query_output_format_id.clear()
 
 def get_preformatted_record(recID, of, decompress=zlib.decompress):
     """
@@ -450,6 +457,33 @@ def get_preformatted_record(recID, of, decompress=zlib.decompress):
     else:
         return None, None
 
+def get_preformatted_records(recIDs, of, decompress=zlib.decompress):
+    """
+    Returns the preformatted records with ids 'recIDs' and format
+    'of', fetched in one query, together with whether they need a 2nd
+    pass.
+
+    @param recIDs: the ids of the records to fetch
+    @param of: the output format code
+    @param decompress: the method used to decompress the preformatted record in database
+    @return: dictionary {recID: (formatted record, needs 2nd pass)} of the
+        records that are preformatted in 'of'
+    """
+    recIDs = list(recIDs)
+    if not recIDs:
+        return {}
+    if of in ('xm', 'recstruct'):
+        run_on_slave = False # for master formats, use DB master
+    else:
+        run_on_slave = True # for other formats, we can use DB slave
+    query = """SELECT id_bibrec, value, needs_2nd_pass FROM bibfmt
+               WHERE format = %%s AND id_bibrec IN (%s)""" % \
+               ', '.join(['%s'] * len(recIDs))
+    params = tuple([of] + recIDs)
+    res = run_sql(query, params, run_on_slave=run_on_slave)
+    return dict((recID, (decompress(value), bool(needs_2nd_pass)))
+                for recID, value, needs_2nd_pass in res)
+
 def get_preformatted_record_date(recID, of):
     """
     Returns the date of the last update of the cache for the considered
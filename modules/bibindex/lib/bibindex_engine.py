@@ -607,6 +607,9 @@ class WordTable:
         # tagToTokenizer mapping. It offers an indirection level necessary for
         # indexing fulltext.
         self.tag_to_words_fnc_map = {}
+        # tokenizers able to prepare their input in the background (e.g.
+        # to extract the text of fulltext documents)
+        self.prefetching_tokenizers = []
         for k in tag_to_tokenizer_map.keys():
             special_tokenizer_for_tag = _TOKENIZERS[tag_to_tokenizer_map[k]](self.stemming_language,
                                                                              self.remove_stopwords,
@@ -614,6 +617,8 @@ class WordTable:
                                                                              self.remove_latex_markup)
             special_tokenizer_function = special_tokenizer_for_tag.get_tokenizing_function(wordtable_type)
             self.tag_to_words_fnc_map[k] = special_tokenizer_function
+            if k in fields_to_index and hasattr(special_tokenizer_for_tag, 'prefetch'):
+                self.prefetching_tokenizers.append(special_tokenizer_for_tag)
 
         if self.stemming_language and self.tablename.startswith('idxWORD'):
             write_message('%s has stemming enabled, language %s' % (self.tablename, self.stemming_language))
@@ -837,6 +842,10 @@ class WordTable:
 
                 write_message(CFG_BIBINDEX_ADDING_RECORDS_STARTED_STR % \
                         (self.tablename, i_low, i_high))
+                # let the tokenizers prepare this chunk (if not done yet)
+                # and the next one while this one is indexed:
+                for tokenizer in self.prefetching_tokenizers:
+                    tokenizer.prefetch(i_low, min(i_high + chunksize, arange[1]))
                 if CFG_CHECK_MYSQL_THREADS:
                     kill_sleepy_mysql_threads()
                 percentage_display = get_percentage_completed(records_done, records_to_go)
@@ -866,6 +875,8 @@ class WordTable:
             if self.index_name == 'fulltext' and CFG_SOLR_URL:
                 solr_commit()
             self.log_progress(time_started, records_done, records_to_go)
+        for tokenizer in self.prefetching_tokenizers:
+            tokenizer.end_prefetch()
 
     def add_recID_range(self, recID1, recID2):
         """Add records from RECID1 to RECID2."""
@@ -29,7 +29,7 @@ import os
 from invenio.dbquery import run_sql, \
     DatabaseError
 from invenio.bibtask import write_message
-from invenio.search_engine_utils import get_fieldvalues
+from invenio.search_engine_utils import get_fieldvalues, get_field_tags
 from invenio.config import \
      CFG_BIBINDEX_CHARS_PUNCTUATION, \
      CFG_BIBINDEX_CHARS_ALPHANUMERIC_SEPARATORS
@@ -221,18 +221,6 @@ def get_index_name_from_index_id(index_id):
     return ''
 
 
-def get_field_tags(field):
-    """Returns a list of MARC tags for the field code 'field'.
-       Returns empty list in case of error.
-       Example: field='author', output=['100__%','700__%']."""
-    out = []
-    query = """SELECT t.value FROM tag AS t, field_tag AS ft, field AS f
-                WHERE f.code=%s AND ft.id_field=f.id AND t.id=ft.id_tag
-                ORDER BY ft.score DESC"""
-    res = run_sql(query, (field,))
-    return [row[0] for row in res]
-
-
 def get_tag_indexes(tag, virtual=True):
     """Returns indexes names and ids corresponding to the given tag
        @param tag: MARC tag in one of the forms:
@@ -39,7 +39,9 @@ from invenio.xapianutils_bibindex_indexer import xapian_add
 from invenio.bibdocfile import bibdocfile_url_p, \
      bibdocfile_url_to_bibdoc, download_url, \
      BibRecDocs, InvenioBibDocFileError
+from invenio.bibdocfile_textextraction import get_text_extraction_queue
 from invenio.bibindex_engine_utils import get_idx_indexer
+from invenio.dbquery import run_sql
 from invenio.bibtask import write_message
 from invenio.errorlib import register_exception
 from invenio.intbitset import intbitset
@@ -67,6 +69,37 @@ class BibIndexFulltextTokenizer(BibIndexDefaultTokenizer):
         """Allows to change verbosity level during indexing"""
         self.verbose = verbose
 
+    def prefetch(self, recID1, recID2):
+        """
+        Start extracting, in the background, the text of the documents of
+        the records RECID1 to RECID2 that are not up to date, so that it is
+        ready when get_words_from_fulltext() needs it.
+        """
+        queue = get_text_extraction_queue()
+        res = run_sql("""SELECT DISTINCT bd.id FROM bibdoc AS bd JOIN bibrec_bibdoc AS brbd ON bd.id=brbd.id_bibdoc
+                         WHERE brbd.id_bibrec BETWEEN %s AND %s AND bd.status<>'DELETED'
+                         AND (bd.text_extraction_date IS NULL OR bd.text_extraction_date<bd.modification_date)""",
+                      (recID1, recID2))
+        for (docid, ) in res:
+            queue.schedule(docid)
+        if res:
+            write_message("... scheduled text extraction of %s documents of records %s-%s" % (len(res), recID1, recID2), verbose=3)
+
+    def end_prefetch(self):
+        """Wait for the texts still being extracted, and report the
+        throughput of each extractor."""
+        queue = get_text_extraction_queue()
+        queue.close()
+        for line in queue.format_statistics():
+            write_message(line)
+        queue.reset_statistics()
+
+    def _wait_for_text(self, docid):
+        """Wait for the text of DOCID, if it is being extracted."""
+        result = get_text_extraction_queue().wait(docid)
+        if result and result[3]:
+            write_message("... text extraction of document %s failed: %s" % (docid, result[3]), verbose=2)
+
     def tokenize_for_words_default(self, phrase):
         """Default tokenize_for_words inherited from default tokenizer"""
         return super(BibIndexFulltextTokenizer, self).tokenize_for_words(phrase)
@@ -102,6 +135,8 @@ class BibIndexFulltextTokenizer(BibIndexDefaultTokenizer):
                         # Adds fulltexts of all files once per records
                         if not recid in fulltext_added:
                             bibrecdocs = BibRecDocs(recid)
+                            for bibdoc_of_record in bibrecdocs.list_bibdocs():
+                                self._wait_for_text(bibdoc_of_record.id)
                             try:
                                 text = bibrecdocs.get_text()
                             except InvenioBibDocFileError:
@@ -120,6 +155,7 @@ class BibIndexFulltextTokenizer(BibIndexDefaultTokenizer):
                 else:
                     text = ""
                     if hasattr(bibdoc, "get_text"):
+                        self._wait_for_text(bibdoc.id)
                         text = bibdoc.get_text()
                     return self.tokenize_for_words_default(text)
             else:
@@ -559,7 +559,8 @@ def task_init(authorization_action="",
     else:
         try:
             try:
-                if task_get_task_param('profile'):
+                if [sort for sort in task_get_task_param('profile') if sort != 'sql']:
+                    ## (profile=sql is taken care of by _task_run)
                     try:
                         from cStringIO import StringIO
                         import pstats
@@ -568,6 +569,8 @@ def task_init(authorization_action="",
                         required_sorts = []
                         profile_dump = []
                         for sort in task_get_task_param('profile'):
+                            if sort == 'sql':
+                                continue
                             if sort not in existing_sorts:
                                 sort = 'cumulative'
                             if sort not in required_sorts:
@@ -1142,6 +1145,10 @@ def _task_run(task_run_fnc):
     _TASK_PARAMS['task_starting_time'] = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
 
     sleeptime = _TASK_PARAMS['sleeptime']
+    sql_profiler = None
+    if 'sql' in task_get_task_param('profile'):
+        from invenio.dbquery_profiler import start_sql_profiling
+        sql_profiler = start_sql_profiling()
     try:
         if callable(task_run_fnc) and task_run_fnc():
             task_update_status("DONE")
@@ -1150,6 +1157,11 @@ def _task_run(task_run_fnc):
         else:
             task_update_status("DONE WITH ERRORS")
     finally:
+        if sql_profiler is not None:
+            from invenio.dbquery_profiler import stop_sql_profiling
+            stop_sql_profiling()
+            write_message(sql_profiler.get_report())
+            sql_profiler.log_summary('%s #%d' % (_TASK_PARAMS['task_name'], _TASK_PARAMS['task_id']))
         task_status = task_read_status()
         if sleeptime:
             argv = task_get_options(_TASK_PARAMS['task_id'], _TASK_PARAMS['task_name'])
@@ -1223,7 +1235,7 @@ def _usage(exitcode=1, msg="", help_specific_usage="", description=""):
     sys.stderr.write("  -V, --version\t\tPrint version information.\n")
     sys.stderr.write("  -v, --verbose=LEVEL\tVerbose level (0=min,"
         " 1=default, 9=max).\n")
-    sys.stderr.write("  --profile=STATS\tPrint profile information. STATS is a comma-separated\n\t\t\tlist of desired output stats (calls, cumulative,\n\t\t\tfile, line, module, name, nfl, pcalls, stdname, time).\n")
+    sys.stderr.write("  --profile=STATS\tPrint profile information. STATS is a comma-separated\n\t\t\tlist of desired output stats (calls, cumulative,\n\t\t\tfile, line, module, name, nfl, pcalls, stdname, time,\n\t\t\tor sql for a summary of the SQL queries).\n")
     sys.stderr.write("  --stop-on-error\tIn case of unrecoverable error stop the bibsched queue.\n")
     sys.stderr.write("  --continue-on-error\tIn case of unrecoverable error don't stop the bibsched queue.\n")
     sys.stderr.write("  --post-process=BIB_TASKLET_NAME[parameters]\tPostprocesses the specified\n\t\t\tbibtasklet with the given parameters between square\n\t\t\tbrackets.\n")
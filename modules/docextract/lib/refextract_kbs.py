@@ -715,6 +715,7 @@ def build_journals_kb(knowledgebase):
         the dictionary are the compiled regex word phrases used for
         searching in the reference lines; The values in the dictionary are
         the replace terms for matches.
+        The last element is a JournalTitlesMatcher of the ordered titles.
     """
     # Initialise vars:
     # dictionary of search and replace phrases from KB:
@@ -766,10 +767,119 @@ def build_journals_kb(knowledgebase):
     # Sort the titles by string length (long - short)
     seek_phrases.sort(_cmp_bystrlen_reverse)
 
+    # Compile all the titles into a single matcher:
+    matcher = JournalTitlesMatcher(seek_phrases)
+
     write_message('Processed journals kb', verbose=3)
 
     # return the raw knowledge base:
-    return kb, standardised_titles, seek_phrases
+    return kb, standardised_titles, seek_phrases, matcher
+
+
+class JournalTitlesMatcher(object):
+    """Finds in a single pass over a reference line the journal titles of
+       the knowledge base which appear in it.
+
+       The search pattern of a title only matches the title itself, so
+       a title which does not appear in the line cannot be matched and its
+       pattern does not need to be run. The titles are compiled into an
+       Aho-Corasick automaton, which finds all of them at once.
+    """
+
+    # Transitions are stored in a single dictionary, keyed by
+    # state * _ALPHABET_SIZE + character.
+    _ALPHABET_SIZE = 0x110000
+
+    def __init__(self, titles):
+        """@param titles: (list) the titles, in the order they have to be
+            searched for.
+        """
+        self.titles = titles
+        # Titles which may only appear in the line once other titles have
+        # been replaced by underscores:
+        self.unfiltered = []
+        goto = {}
+        fail = [0]
+        # positions in titles of the titles ending at a state:
+        ranks = {}
+        children = [[]]
+
+        for rank, title in enumerate(titles):
+            if not title or u'_' in title:
+                self.unfiltered.append(rank)
+                continue
+            state = 0
+            for char in title:
+                code = state * self._ALPHABET_SIZE + ord(char)
+                if code in goto:
+                    state = goto[code]
+                else:
+                    goto[code] = len(fail)
+                    children[state].append((ord(char), len(fail)))
+                    state = len(fail)
+                    fail.append(0)
+                    children.append([])
+            ranks.setdefault(state, []).append(rank)
+
+        # Breadth first, to have the failure link of every state before
+        # the ones of its children. The output link of a state is the
+        # closest state on its failure chain where a title ends.
+        output = {}
+        queue = [child for char, child in children[0]]
+        for state in queue:
+            for char, child in children[state]:
+                queue.append(child)
+                target = fail[state]
+                while target and \
+                        target * self._ALPHABET_SIZE + char not in goto:
+                    target = fail[target]
+                fail[child] = goto.get(target * self._ALPHABET_SIZE + char, 0)
+            if fail[state] in ranks:
+                output[state] = fail[state]
+            elif fail[state] in output:
+                output[state] = output[fail[state]]
+
+        self._goto = goto
+        self._fail = fail
+        self._ranks = ranks
+        self._output = output
+
+    def get_candidates(self, line):
+        """Returns the titles which may be matched in the line, in the
+           order they have to be searched for.
+           @param line: (unicode) the working reference line.
+           @return: (list) of titles.
+        """
+        alphabet_size = self._ALPHABET_SIZE
+        goto = self._goto
+        fail = self._fail
+        ranks = self._ranks
+        output = self._output
+        found = set()
+        candidates = list(self.unfiltered)
+        state = 0
+        for char in line:
+            char = ord(char)
+            while True:
+                next_state = goto.get(state * alphabet_size + char)
+                if next_state is not None:
+                    state = next_state
+                    break
+                if not state:
+                    break
+                state = fail[state]
+
+            if state in ranks:
+                reported = state
+            else:
+                reported = output.get(state)
+            while reported is not None and reported not in found:
+                found.add(reported)
+                candidates.extend(ranks[reported])
+                reported = output.get(reported)
+
+        candidates.sort()
+        return [self.titles[rank] for rank in candidates]
 
 
 def build_collaborations_kb(knowledgebase):
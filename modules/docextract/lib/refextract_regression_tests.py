@@ -26,6 +26,10 @@ They are intended to make sure there is no regression in references parsing.
 
 from invenio.testutils import InvenioTestCase
 import re
+import sys
+import time
+import unittest
+from cStringIO import StringIO
 
 from invenio.testutils import make_test_suite, run_test_suite, InvenioXmlTestCase
 from invenio.refextract_engine import parse_references
@@ -2848,6 +2852,48 @@ class TaskTest(InvenioTestCase):
         from invenio.refextract_task import task_run_core
         task_run_core(1, [])
 
+def benchmark(runs=10, kbs_files=None):
+    """Prints the time refextract takes to parse the references of a paper.
+
+    The paper is made of the reference lines of the tests of RefextractTest,
+    which are parsed with the knowledge bases of the installation unless
+    kbs_files is given.
+    """
+    global _reference_test
+    ref_lines = []
+
+    def record_ref_line(test, ref_line, parsed_reference, ignore_misc=True):
+        ref_lines.append(wash_and_repair_reference_line(ref_line))
+
+    reference_test, _reference_test = _reference_test, record_ref_line
+    try:
+        unittest.TextTestRunner(stream=StringIO(), verbosity=0).run(
+            make_test_suite(RefextractTest))
+    finally:
+        _reference_test = reference_test
+
+    setup_loggers(verbosity=0)
+    start = time.time()
+    parse_references(ref_lines, kbs_files=kbs_files)
+    first_time = time.time() - start
+    timings = []
+    for dummy in range(runs):
+        start = time.time()
+        parse_references(ref_lines, kbs_files=kbs_files)
+        timings.append(time.time() - start)
+    timings.sort()
+
+    print "Paper of %d reference lines, %d runs:" % (len(ref_lines), runs)
+    print "  first run (loading the kbs): %.3f s" % first_time
+    print "  per paper: min %.3f s, median %.3f s, max %.3f s" % \
+        (timings[0], timings[len(timings) // 2], timings[-1])
+    print "  per reference line: median %.2f ms" % \
+        (timings[len(timings) // 2] * 1000 / len(ref_lines))
+
+
 TEST_SUITE = make_test_suite(RefextractTest)
 if __name__ == '__main__':
-    run_test_suite(TEST_SUITE, warn_user=True)
+    if 'benchmark' in sys.argv:
+        benchmark()
+    else:
+        run_test_suite(TEST_SUITE, warn_user=True)
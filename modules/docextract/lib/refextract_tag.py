@@ -1121,6 +1121,9 @@ def identify_journals(line, kb_journals):
         standard periodical TITLEs to be searched for in the line. This
         list of titles has already been ordered and is used to force
         the order of searching.
+       @param periodical_title_matcher: (JournalTitlesMatcher) - finds
+        the TITLEs appearing in the line, which are the only ones searched
+        for.
        @return: (tuple) containing 4 elements:
                         + (dictionary) - the lengths of all titles
                                          matched at each given index
@@ -1135,7 +1138,9 @@ def identify_journals(line, kb_journals):
                                          found in the line.
     """
     periodical_title_search_kb = kb_journals[0]
-    periodical_title_search_keys = kb_journals[2]
+    periodical_title_matcher = kb_journals[3]
+    # The titles which do not appear in the line cannot match:
+    periodical_title_search_keys = periodical_title_matcher.get_candidates(line)
 
     title_matches = {}            # the text matched at the given line
                                   # location (i.e. the title itself)
@@ -34,7 +34,9 @@ from invenio.refextract_tag import identify_ibids, \
                                    find_numeration, \
                                    find_numeration_more
 
-from invenio.refextract_tag import identify_ibids, tag_arxiv
+from invenio.refextract_tag import identify_ibids, tag_arxiv, \
+                                   identify_journals
+from invenio.refextract_kbs import build_journals_kb
 from invenio import refextract_re
 from invenio.refextract_find import get_reference_section_beginning
 from invenio.refextract_api import search_from_reference, extract_journal_reference
@@ -97,6 +99,36 @@ class IbidTest(InvenioTestCase):
         self.assertEqual(r, ({85: u'IBID'}, u'[46] E. SCHRODINGER, SITZUNGSBER. PREUSS. AKAD. WISS. PHYS. MATH. KL. 24, 418(1930); ____, 3, 1(1931)'))
 
 
+class IdentifyJournalsTest(InvenioTestCase):
+    def setUp(self):
+        setup_loggers(verbosity=1)
+        self.kb = build_journals_kb([
+            ("PHYS REV", "Phys.Rev."),
+            ("PHYS REV LETT", "Phys.Rev.Lett."),
+            ("PHYS LETT", "Phys.Lett."),
+            ("NUCL PHYS", "Nucl.Phys."),
+            ("REV MOD PHYS", "Rev.Mod.Phys."),
+        ])
+
+    def test_candidates(self):
+        matcher = self.kb[3]
+        self.assertEqual(matcher.get_candidates(u'PHYS REV LETT 1 AND NUCL PHYS'),
+                         [u'PHYS REV LETT', u'NUCL PHYS', u'PHYS REV'])
+        self.assertEqual(matcher.get_candidates(u'REV MOD PHYSICS'),
+                         [u'REV MOD PHYS'])
+        self.assertEqual(matcher.get_candidates(u'ASTROPHYS J'), [])
+
+    def test_longest_title_first(self):
+        r = identify_journals(u'[1] PHYS REV LETT 19 1264 PHYS REV D 2 ', self.kb)
+        self.assertEqual(r, ({4: u'PHYS REV LETT', 26: u'PHYS REV'},
+                             u'[1] _____________ 19 1264 ________ D 2 ',
+                             {u'PHYS REV LETT': 1, u'PHYS REV': 1}))
+
+    def test_no_title(self):
+        line = u'[1] ASTROPHYS J 2 REV MOD PHYSICS 3 '
+        self.assertEqual(identify_journals(line, self.kb), ({}, line, {}))
+
+
 class FindNumerationTest(InvenioTestCase):
     def setUp(self):
         setup_loggers(verbosity=1)
@@ -404,6 +436,7 @@ class tagArxivTest(InvenioTestCase):
 
 TEST_SUITE = make_test_suite(ReTest,
                              IbidTest,
+                             IdentifyJournalsTest,
                              FindNumerationTest,
                              FindSectionTest,
                              SearchTest,
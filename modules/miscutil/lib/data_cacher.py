@@ -23,8 +23,12 @@ rarely change.
 """
 
 from invenio.dbquery import run_sql, get_table_update_time
+from invenio.config import CFG_MISCUTIL_SQL_CACHED_QUERY_CHECK_INTERVAL
 import time
 
+## All the SQLQueryCacher instances of the process, for statistics
+_SQL_QUERY_CACHERS = []
+
 class InvenioDataCacherError(Exception):
     """Error raised by data cacher."""
     pass
@@ -102,5 +106,102 @@ class SQLDataCacher(DataCacher):
 
         DataCacher.__init__(self, cache_filler, timestamp_verifier)
 
+class SQLQueryCacher(object):
+    """
+    SQLQueryCacher is a read-through cacher system for small lookup
+    queries that are run over and over with different parameters,
+    e.g. "SELECT id FROM collection WHERE name=%s".  The results are
+    cached per process and per parameters, and are all dropped as soon
+    as one of the tables the query depends on is modified.  In order
+    not to replace one query by another, the update time of the tables
+    is checked at most once every
+    CFG_MISCUTIL_SQL_CACHED_QUERY_CHECK_INTERVAL seconds.  As a
+    consequence, do not use it when reading back a value immediately
+    after having modified it, or call clear() in between.
+
+    Usage:
+        >>> _get_colid = SQLQueryCacher("SELECT id FROM collection WHERE name=%s",
+        ...                             affected_tables=('collection', ))
+        >>> res = _get_colid('Articles')
+    """
+    def __init__(self, query, affected_tables=(), n=0,
+                 check_interval=CFG_MISCUTIL_SQL_CACHED_QUERY_CHECK_INTERVAL,
+                 max_size=10000):
+        """ @param query: the query to cache
+            @param affected_tables: the list of tables queried by the query.
+            @param n: number of tuples in result (0 for unbounded)
+            @param check_interval: the minimum number of seconds between
+                two checks of the update time of the affected tables.
+            @param max_size: the maximum number of cached results.
+        """
+        self.query = query
+        self.affected_tables = affected_tables
+        assert(affected_tables)
+        self.n = n
+        self.check_interval = check_interval
+        self.max_size = max_size
+        self.cache = {}
+        self.timestamp = None
+        self.last_check = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        _SQL_QUERY_CACHERS.append(self)
+
+    def __call__(self, *param):
+        """
+        Run the query with the parameters PARAM, unless the results
+        are already cached.
+        """
+        self.recreate_cache_if_needed()
+        try:
+            res = self.cache[param]
+            self.hits += 1
+        except KeyError:
+            self.misses += 1
+            if len(self.cache) >= self.max_size:
+                self.cache.clear()
+            res = self.cache[param] = run_sql(self.query, param, self.n)
+        return res
+
+    def clear(self):
+        """Drop all the cached results."""
+        self.cache.clear()
+        self.last_check = 0
 
+    def recreate_cache_if_needed(self):
+        """
+        Drop all the cached results if one of the affected tables was
+        modified since they were cached.
+        """
+        now = time.time()
+        if now - self.last_check < self.check_interval:
+            return
+        self.last_check = now
+        timestamp = max([get_table_update_time(table)
+            for table in self.affected_tables])
+        if timestamp != self.timestamp:
+            if self.cache:
+                self.invalidations += 1
+                self.cache.clear()
+            self.timestamp = timestamp
+
+    def get_statistics(self):
+        """
+        @return: the query and its number of cache hits, misses and
+            invalidations, as well as the number of cached results.
+        @rtype: dict
+        """
+        return {'query': self.query,
+                'hits': self.hits,
+                'misses': self.misses,
+                'invalidations': self.invalidations,
+                'size': len(self.cache)}
 
+def get_sql_query_cachers_statistics():
+    """
+    @return: the statistics of all the SQLQueryCacher of the current
+        process (see SQLQueryCacher.get_statistics).
+    @rtype: list of dict
+    """
+    return [cacher.get_statistics() for cacher in _SQL_QUERY_CACHERS]
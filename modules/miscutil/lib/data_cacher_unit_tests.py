@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+##
+## This file is part of Invenio.
+## Copyright (C) 2014 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""Unit tests for the data cacher library."""
+
+__revision__ = "$Id$"
+
+from invenio.testutils import InvenioTestCase, make_test_suite, \
+    run_test_suite
+from invenio import data_cacher
+from invenio.data_cacher import SQLQueryCacher, \
+    get_sql_query_cachers_statistics
+
+
+class SQLQueryCacherTest(InvenioTestCase):
+    """Read-through cache of SQL queries, without database."""
+
+    def setUp(self):
+        self.queries = []
+        self.update_times = {'tag': '2014-01-01 00:00:00',
+                             'field': '2014-01-01 00:00:00'}
+
+        def run_sql(query, param=None, n=0):
+            self.queries.append(param)
+            return ((param[0].upper(), ), )
+
+        self.old_run_sql = data_cacher.run_sql
+        self.old_get_table_update_time = data_cacher.get_table_update_time
+        data_cacher.run_sql = run_sql
+        data_cacher.get_table_update_time = self.update_times.get
+        self.cacher = SQLQueryCacher("SELECT name FROM tag WHERE value=%s",
+                                     affected_tables=('tag', 'field'),
+                                     check_interval=0)
+
+    def tearDown(self):
+        data_cacher.run_sql = self.old_run_sql
+        data_cacher.get_table_update_time = self.old_get_table_update_time
+
+    def test_cached(self):
+        """data_cacher - results are cached per parameters"""
+        self.assertEqual(self.cacher('a'), (('A', ), ))
+        self.assertEqual(self.cacher('a'), (('A', ), ))
+        self.assertEqual(self.cacher('b'), (('B', ), ))
+        self.assertEqual(self.queries, [('a', ), ('b', )])
+        statistics = self.cacher.get_statistics()
+        self.assertEqual((statistics['hits'], statistics['misses'],
+                          statistics['size']), (1, 2, 2))
+        self.assertTrue(statistics in get_sql_query_cachers_statistics())
+
+    def test_invalidated_by_table_update(self):
+        """data_cacher - results are dropped when a table is modified"""
+        self.cacher('a')
+        self.update_times['field'] = '2014-01-02 00:00:00'
+        self.cacher('a')
+        self.cacher('a')
+        self.assertEqual(self.queries, [('a', ), ('a', )])
+        self.assertEqual(self.cacher.get_statistics()['invalidations'], 1)
+
+    def test_check_interval(self):
+        """data_cacher - update times are checked once per interval"""
+        self.cacher.check_interval = 3600
+        self.cacher('a')
+        self.update_times['tag'] = '2014-01-02 00:00:00'
+        self.cacher('a')
+        self.assertEqual(self.queries, [('a', )])
+        self.cacher.clear()
+        self.cacher('a')
+        self.assertEqual(self.queries, [('a', ), ('a', )])
+
+    def test_max_size(self):
+        """data_cacher - the cache does not grow beyond max_size"""
+        self.cacher.max_size = 2
+        for value in 'abcde':
+            self.cacher(value)
+        self.assertTrue(self.cacher.get_statistics()['size'] <= 2)
+
+
+TEST_SUITE = make_test_suite(SQLQueryCacherTest)
+
+if __name__ == "__main__":
+    run_test_suite(TEST_SUITE)
@@ -41,12 +41,19 @@ import marshal
 import re
 import atexit
 import os
+import threading
+import weakref
 
 from zlib import compress, decompress
 from thread import get_ident
+from contextlib import contextmanager
 from invenio.config import CFG_ACCESS_CONTROL_LEVEL_SITE, \
     CFG_MISCUTIL_SQL_USE_SQLALCHEMY, \
-    CFG_MISCUTIL_SQL_RUN_SQL_MANY_LIMIT
+    CFG_MISCUTIL_SQL_RUN_SQL_MANY_LIMIT, \
+    CFG_MISCUTIL_SQL_READ_REPLICAS, \
+    CFG_MISCUTIL_SQL_REPLICA_MAX_LAG, \
+    CFG_MISCUTIL_SQL_REPLICA_CHECK_INTERVAL, \
+    CFG_MISCUTIL_SQL_MAX_IDLE_CONNECTIONS
 
 if CFG_MISCUTIL_SQL_USE_SQLALCHEMY:
     try:
@@ -110,6 +117,61 @@ _DB_CONN = {}
 _DB_CONN[CFG_DATABASE_HOST] = {}
 _DB_CONN[CFG_DATABASE_SLAVE] = {}
 
+## Hosts where read-only queries can be sent (see run_sql())
+if CFG_MISCUTIL_SQL_READ_REPLICAS:
+    _READ_REPLICAS = list(CFG_MISCUTIL_SQL_READ_REPLICAS)
+elif CFG_DATABASE_SLAVE:
+    _READ_REPLICAS = [CFG_DATABASE_SLAVE]
+else:
+    _READ_REPLICAS = []
+for _replica in _READ_REPLICAS:
+    _DB_CONN.setdefault(_replica, {})
+
+## dbhost -> (last check time, whether the replica can be used)
+_REPLICA_STATUS = {}
+
+## Threads that accept their queries to be sent to replicas:
+## thread ident -> [nesting level, whether the thread wrote something]
+_REPLICA_OK_THREADS = {}
+
+## Connections left behind by terminated threads, ready to be reused
+## by new threads: dbhost -> list of (pid, connection)
+_IDLE_DB_CONN = {}
+_IDLE_DB_CONN_LOCK = threading.Lock()
+
+## dbhost -> (number of consecutive connection failures, time before
+## which no new connection is attempted)
+_DB_CONNECT_FAILURES = {}
+_DB_CONNECT_MAX_BACKOFF = 30
+
+## Used to be notified when a thread terminates, see _watch_thread()
+_THREAD_LOCAL = threading.local()
+_THREAD_WATCHERS = {}
+
+## SQL profilers active in the current process, per thread
+## (see invenio.dbquery_profiler)
+_SQL_PROFILERS = {}
+
+def get_sql_profiler():
+    """
+    Return the SQL profiler recording the queries run by the current
+    thread, or None if queries are not being profiled.
+    """
+    return _SQL_PROFILERS.get((os.getpid(), get_ident()))
+
+def set_sql_profiler(profiler):
+    """
+    Let PROFILER record every query run by the current thread through
+    run_sql() and run_sql_many().  PROFILER must provide a
+    record_query(sql, param, duration) method.  Pass None in order to
+    stop recording.
+    """
+    thread_ident = (os.getpid(), get_ident())
+    if profiler is None:
+        _SQL_PROFILERS.pop(thread_ident, None)
+    else:
+        _SQL_PROFILERS[thread_ident] = profiler
+
 def get_connection_for_dump_on_slave():
     """
     Return a valid connection, suitable to perform dump operation
@@ -163,27 +225,240 @@ def _db_login(dbhost=CFG_DATABASE_HOST, relogin=0):
                        use_unicode=False, charset='utf8')
     else:
         thread_ident = (os.getpid(), get_ident())
-    if relogin:
-        connection = _DB_CONN[dbhost][thread_ident] = connect(host=dbhost,
-                                         port=int(CFG_DATABASE_PORT),
-                                         db=CFG_DATABASE_NAME,
-                                         user=CFG_DATABASE_USER,
-                                         passwd=CFG_DATABASE_PASS,
-                                         use_unicode=False, charset='utf8')
-        connection.autocommit(True)
-        return connection
-    else:
-        if _DB_CONN[dbhost].has_key(thread_ident):
-            return _DB_CONN[dbhost][thread_ident]
-        else:
-            connection = _DB_CONN[dbhost][thread_ident] = connect(host=dbhost,
-                                             port=int(CFG_DATABASE_PORT),
-                                             db=CFG_DATABASE_NAME,
-                                             user=CFG_DATABASE_USER,
-                                             passwd=CFG_DATABASE_PASS,
-                                             use_unicode=False, charset='utf8')
+    connections = _DB_CONN.setdefault(dbhost, {})
+    if not relogin and connections.has_key(thread_ident):
+        return connections[thread_ident]
+    connection = None
+    if not relogin:
+        connection = _get_idle_connection(dbhost)
+    if connection is None:
+        connection = _connect(dbhost)
+    connections[thread_ident] = connection
+    _watch_thread(thread_ident)
+    return connection
+
+def _connect(dbhost):
+    """
+    Open a new connection to DBHOST.  After a failure, no new attempt
+    is made to connect to the same host for an exponentially growing
+    amount of time (up to _DB_CONNECT_MAX_BACKOFF seconds), so that a
+    database outage does not translate into a connection storm.
+    """
+    failures, retry_after = _DB_CONNECT_FAILURES.get(dbhost, (0, 0))
+    if failures and time.time() < retry_after:
+        raise OperationalError(2003, "Not trying to connect to MySQL server on '%s' after %s failed attempts" % (dbhost, failures))
+    try:
+        connection = connect(host=dbhost,
+                             port=int(CFG_DATABASE_PORT),
+                             db=CFG_DATABASE_NAME,
+                             user=CFG_DATABASE_USER,
+                             passwd=CFG_DATABASE_PASS,
+                             use_unicode=False, charset='utf8')
+    except (OperationalError, InterfaceError):
+        failures += 1
+        _DB_CONNECT_FAILURES[dbhost] = (failures, time.time() +
+            min(_DB_CONNECT_MAX_BACKOFF, 0.1 * 2 ** failures))
+        raise
+    _DB_CONNECT_FAILURES.pop(dbhost, None)
+    connection.autocommit(True)
+    return connection
+
+def _get_idle_connection(dbhost):
+    """
+    Return a working connection to DBHOST left behind by a terminated
+    thread, if any.
+    """
+    idle_connections = _IDLE_DB_CONN.get(dbhost)
+    while idle_connections:
+        try:
+            pid, connection = idle_connections.pop()
+        except IndexError:
+            ## another thread took it in the meantime
+            return None
+        if pid != os.getpid():
+            ## Inherited from the parent process, which may still use
+            ## it: just forget about it.
+            continue
+        try:
+            ## Reset the session state (user variables, temporary
+            ## tables, transactions, locks...) left behind by the
+            ## previous thread.  This also checks that the connection
+            ## is still alive.
+            connection.change_user(CFG_DATABASE_USER, CFG_DATABASE_PASS,
+                                   CFG_DATABASE_NAME)
+            connection.set_character_set('utf8')
             connection.autocommit(True)
             return connection
+        except (OperationalError, InterfaceError):
+            pass
+    return None
+
+class _ThreadWatcher(object):
+    """
+    Stored in thread-local storage, so that it is garbage collected
+    when its thread terminates.
+    """
+    pass
+
+def _watch_thread(thread_ident):
+    """
+    Make sure the connections of the thread THREAD_IDENT are released
+    to the idle connections once the thread terminates.
+    """
+    if getattr(_THREAD_LOCAL, 'thread_ident', None) == thread_ident:
+        return
+    watcher = _ThreadWatcher()
+    _THREAD_LOCAL.watcher = watcher
+    _THREAD_LOCAL.thread_ident = thread_ident
+    _THREAD_WATCHERS[thread_ident] = weakref.ref(watcher,
+        lambda dummy_ref: _release_thread_connections(thread_ident))
+
+def _release_thread_connections(thread_ident):
+    """
+    Move the connections of the terminated thread THREAD_IDENT to the
+    idle connections (keeping at most CFG_MISCUTIL_SQL_MAX_IDLE_CONNECTIONS
+    per host), and close the others.
+    """
+    _THREAD_WATCHERS.pop(thread_ident, None)
+    if thread_ident[0] != os.getpid():
+        ## Connections inherited from the parent process must not be
+        ## touched: they are still used by the parent.
+        return
+    _REPLICA_OK_THREADS.pop(thread_ident, None)
+    _IDLE_DB_CONN_LOCK.acquire()
+    try:
+        for dbhost, connections in _DB_CONN.items():
+            connection = connections.pop(thread_ident, None)
+            if connection is None:
+                continue
+            idle_connections = _IDLE_DB_CONN.setdefault(dbhost, [])
+            if len(idle_connections) < CFG_MISCUTIL_SQL_MAX_IDLE_CONNECTIONS:
+                idle_connections.append((thread_ident[0], connection))
+            else:
+                try:
+                    connection.close()
+                except Exception:
+                    pass
+    finally:
+        _IDLE_DB_CONN_LOCK.release()
+
+_RE_READ_QUERY = re.compile(r'\s*\(?\s*(SELECT|SHOW|DESC|DESCRIBE)\b', re.I)
+## Read queries whose result depends on the connection they are run on
+## or that take locks: they are always run on the master.
+_RE_MASTER_ONLY_READ_QUERY = re.compile(r'FOR\s+UPDATE|LOCK\s+IN\s+SHARE\s+MODE|'
+                                        r'GET_LOCK|RELEASE_LOCK|IS_FREE_LOCK|'
+                                        r'LAST_INSERT_ID|ROW_COUNT|@|\bINTO\b', re.I)
+
+def _is_read_query(sql):
+    """Return True if SQL can be run on a read replica."""
+    return _RE_READ_QUERY.match(sql) is not None and \
+        _RE_MASTER_ONLY_READ_QUERY.search(sql) is None
+
+def _is_replica_available(dbhost):
+    """
+    Return True if the replica DBHOST can be connected to and, when
+    CFG_MISCUTIL_SQL_REPLICA_MAX_LAG is set, if it is not lagging
+    behind the master by more than that.  The check is performed at
+    most every CFG_MISCUTIL_SQL_REPLICA_CHECK_INTERVAL seconds.
+    """
+    now = time.time()
+    last_check, available = _REPLICA_STATUS.get(dbhost, (0, False))
+    if now - last_check < CFG_MISCUTIL_SQL_REPLICA_CHECK_INTERVAL:
+        return available
+    available = False
+    try:
+        cur = _db_login(dbhost).cursor()
+        if CFG_MISCUTIL_SQL_REPLICA_MAX_LAG:
+            ## Note: this needs the REPLICATION CLIENT privilege
+            cur.execute("SHOW SLAVE STATUS")
+            row = cur.fetchone()
+            if row:
+                columns = [column[0] for column in cur.description]
+                lag = dict(zip(columns, row)).get('Seconds_Behind_Master')
+                available = lag is not None and lag <= CFG_MISCUTIL_SQL_REPLICA_MAX_LAG
+            else:
+                ## Not a replica after all
+                available = True
+        else:
+            cur.execute("SELECT 1")
+            available = True
+    except (OperationalError, InterfaceError, ProgrammingError):
+        _db_logout(dbhost)
+    _REPLICA_STATUS[dbhost] = (now, available)
+    return available
+
+def _get_replica():
+    """
+    Return one available read replica, or None.  A given thread always
+    gets the same replica as long as it is available, so that it does
+    not open connections to all of them: only the replica of the thread
+    is checked, and the next ones only if it is not available.
+    """
+    first = get_ident() % len(_READ_REPLICAS)
+    for dbhost in _READ_REPLICAS[first:] + _READ_REPLICAS[:first]:
+        if _is_replica_available(dbhost):
+            return dbhost
+    return None
+
+def _get_dbhost(sql, run_on_slave=False):
+    """
+    Choose where to run SQL: on a read replica if the caller explicitly
+    asked for it, or if SQL only reads and the current thread is in a
+    replica-ok context (see replica_ok_context()) where it did not
+    write anything yet; on the master otherwise.
+    """
+    if not _READ_REPLICAS:
+        return CFG_DATABASE_HOST
+    replica_ok = _REPLICA_OK_THREADS and \
+        _REPLICA_OK_THREADS.get((os.getpid(), get_ident()))
+    if not run_on_slave:
+        if not replica_ok:
+            return CFG_DATABASE_HOST
+        if replica_ok[1]:
+            ## read-your-writes: stick to the master
+            return CFG_DATABASE_HOST
+        if not _is_read_query(sql):
+            replica_ok[1] = True
+            return CFG_DATABASE_HOST
+    return _get_replica() or CFG_DATABASE_HOST
+
+def start_replica_ok():
+    """
+    Declare that the queries run from now on by the current thread may
+    read slightly outdated data, so that they can be sent to a read
+    replica.  As soon as the thread writes something, all its
+    following queries are sent to the master, until
+    stop_replica_ok() is called.  Calls can be nested.
+    """
+    thread_ident = (os.getpid(), get_ident())
+    replica_ok = _REPLICA_OK_THREADS.get(thread_ident)
+    if replica_ok is None:
+        _REPLICA_OK_THREADS[thread_ident] = [1, False]
+    else:
+        replica_ok[0] += 1
+
+def stop_replica_ok():
+    """End the replica-ok context started by start_replica_ok()."""
+    thread_ident = (os.getpid(), get_ident())
+    replica_ok = _REPLICA_OK_THREADS.get(thread_ident)
+    if replica_ok is not None:
+        replica_ok[0] -= 1
+        if replica_ok[0] <= 0:
+            del _REPLICA_OK_THREADS[thread_ident]
+
+@contextmanager
+def replica_ok_context():
+    """
+    Context manager version of start_replica_ok()/stop_replica_ok():
+
+        >>> with replica_ok_context():
+        ...     res = run_sql("SELECT ...")
+    """
+    start_replica_ok()
+    try:
+        yield
+    finally:
+        stop_replica_ok()
 
 def _db_logout(dbhost=CFG_DATABASE_HOST):
     """Close a connection."""
@@ -225,6 +500,12 @@ def run_sql(sql, param=None, n=0, with_desc=False, with_dict=False, run_on_slave
     If INSERT, return last row id.
     Otherwise return SQL result as provided by database.
 
+    @note: Queries are run on the master database, unless
+    run_on_slave is True or the current thread is in a replica-ok
+    context (see replica_ok_context()), in which case read-only
+    queries are run on one of the available read replicas (as
+    defined by CFG_MISCUTIL_SQL_READ_REPLICAS or CFG_DATABASE_SLAVE).
+
     @note: When the site is closed for maintenance (as governed by the
     config variable CFG_ACCESS_CONTROL_LEVEL_SITE), do not attempt
     to run any SQL queries but return empty list immediately.
@@ -234,7 +515,18 @@ def run_sql(sql, param=None, n=0, with_desc=False, with_dict=False, run_on_slave
     the Python DB API 2.0.  The client code can import them from
     this file and catch them.
     """
+    if _SQL_PROFILERS:
+        profiler = get_sql_profiler()
+        if profiler is not None:
+            start = time.time()
+            try:
+                return _run_sql(sql, param, n, with_desc, with_dict, run_on_slave, connection)
+            finally:
+                profiler.record_query(sql, param, time.time() - start)
+    return _run_sql(sql, param, n, with_desc, with_dict, run_on_slave, connection)
 
+def _run_sql(sql, param=None, n=0, with_desc=False, with_dict=False, run_on_slave=False, connection=None):
+    """Run SQL on the server with PARAM and return result.  See run_sql()."""
     if CFG_ACCESS_CONTROL_LEVEL_SITE == 3:
         # do not connect to the database as the site is closed for maintenance:
         return []
@@ -246,9 +538,10 @@ def run_sql(sql, param=None, n=0, with_desc=False, with_dict=False, run_on_slave
     if param:
         param = tuple(param)
 
-    dbhost = CFG_DATABASE_HOST
-    if run_on_slave and CFG_DATABASE_SLAVE:
-        dbhost = CFG_DATABASE_SLAVE
+    if connection is None:
+        dbhost = _get_dbhost(sql, run_on_slave)
+    else:
+        dbhost = CFG_DATABASE_HOST
 
     ### log_sql_query(dbhost, sql, param) ### UNCOMMENT ONLY IF you REALLY want to log all queries
     try:
@@ -268,7 +561,15 @@ def run_sql(sql, param=None, n=0, with_desc=False, with_dict=False, run_on_slave
             rc = cur.execute(sql, param)
             gc.enable()
         except (OperationalError, InterfaceError): # unexpected disconnect, bad malloc error, etc
-            raise
+            if dbhost == CFG_DATABASE_HOST:
+                raise
+            ## The replica is not usable: fall back to the master.
+            _REPLICA_STATUS[dbhost] = (time.time(), False)
+            db = _db_login(CFG_DATABASE_HOST)
+            cur = db.cursor()
+            gc.disable()
+            rc = cur.execute(sql, param)
+            gc.enable()
 
     if string.upper(string.split(sql)[0]) in ("SELECT", "SHOW", "DESC", "DESCRIBE"):
         if n:
@@ -318,9 +619,10 @@ def run_sql_many(query, params, limit=CFG_MISCUTIL_SQL_RUN_SQL_MANY_LIMIT, run_o
         if not query.upper().startswith("SELECT") and not query.upper().startswith("SHOW"):
             return
 
-    dbhost = CFG_DATABASE_HOST
-    if run_on_slave and CFG_DATABASE_SLAVE:
-        dbhost = CFG_DATABASE_SLAVE
+    dbhost = _get_dbhost(query, run_on_slave)
+    profiler = _SQL_PROFILERS and get_sql_profiler()
+    if profiler:
+        start = time.time()
     i = 0
     r = None
     while i < len(params):
@@ -346,6 +648,8 @@ def run_sql_many(query, params, limit=CFG_MISCUTIL_SQL_RUN_SQL_MANY_LIMIT, run_o
         else:
             r += rc
         i += limit
+    if profiler:
+        profiler.record_query(query, params, time.time() - start)
     return r
 
 def run_sql_with_limit(query, param=None, n=0, with_desc=False, wildcard_limit=0, run_on_slave=False):
@@ -384,7 +688,8 @@ def blob_to_string(ablob):
 def log_sql_query(dbhost, sql, param=None):
     """Log SQL query into prefix/var/log/dbquery.log log file.  In order
        to enable logging of all SQL queries, please uncomment one line
-       in run_sql() above. Useful for fine-level debugging only!
+       in _run_sql() above. Useful for fine-level debugging only!
+       See also invenio.dbquery_profiler for aggregated statistics.
     """
     from invenio.config import CFG_LOGDIR
     from invenio.dateutils import convert_datestruct_to_datetext
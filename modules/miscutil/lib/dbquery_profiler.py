@@ -0,0 +1,240 @@
+## This file is part of Invenio.
+## Copyright (C) 2013 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""
+Invenio SQL profiler.
+
+Records every query run through run_sql() and run_sql_many() by the
+current thread, and reports the total number of queries and time spent,
+the slowest queries and the queries that were run many times with the
+same shape (typically N+1 patterns, i.e. one query per record in a
+loop).
+
+Usage:
+
+    >>> profiler = start_sql_profiling()
+    >>> try:
+    ...     do_something()
+    ... finally:
+    ...     stop_sql_profiling()
+    >>> print profiler.get_report()
+
+The web handler enables it for the current request when an authorized
+user adds profile=sql to the URL, and for a random sample of requests
+according to CFG_MISCUTIL_SQL_PROFILING_SAMPLE_RATE.  Bibsched tasks
+enable it with --profile=sql.
+"""
+
+__revision__ = "$Id$"
+
+import os
+import re
+import sys
+import time
+
+from invenio.config import CFG_LOGDIR
+from invenio.dbquery import get_sql_profiler, set_sql_profiler
+from invenio.dateutils import convert_datestruct_to_datetext
+from invenio.jsonutils import json
+
+## Queries sharing the same shape that are run at least this number of
+## times are reported as repeated queries (likely N+1 patterns).
+CFG_SQL_PROFILER_REPEATED_THRESHOLD = 10
+
+## How many queries to list in each section of the report.
+CFG_SQL_PROFILER_REPORT_SIZE = 10
+
+_RE_SQL_STRING = re.compile(r"'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"")
+_RE_SQL_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_RE_SQL_PLACEHOLDER = re.compile(r"%s|%\([^)]+\)s")
+_RE_SQL_VALUES_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+_RE_SQL_SPACES = re.compile(r"\s+")
+
+## Frames belonging to these files are skipped when looking for the
+## caller of a query.
+_SKIPPED_FILES = ('dbquery.py', 'dbquery_profiler.py',
+                  'dbquery.pyc', 'dbquery_profiler.pyc')
+
+def normalize_sql(sql):
+    """
+    Return the shape of a SQL query, i.e. the query where literals,
+    placeholders and lists of values are replaced by a question mark,
+    so that queries differing only by their arguments compare equal.
+
+    @param sql: the query.
+    @type sql: string
+    @return: the normalized query.
+    @rtype: string
+    """
+    sql = _RE_SQL_STRING.sub('?', sql)
+    sql = _RE_SQL_PLACEHOLDER.sub('?', sql)
+    sql = _RE_SQL_NUMBER.sub('?', sql)
+    sql = _RE_SQL_VALUES_LIST.sub('(?)', sql)
+    return _RE_SQL_SPACES.sub(' ', sql).strip()
+
+def _get_caller():
+    """
+    @return: the first frame outside of the database layer, as
+        "filename:lineno:function".
+    @rtype: string
+    """
+    frame = sys._getframe(2)
+    while frame is not None and \
+            os.path.basename(frame.f_code.co_filename) in _SKIPPED_FILES:
+        frame = frame.f_back
+    if frame is None:
+        return '?'
+    return '%s:%s:%s' % (os.path.basename(frame.f_code.co_filename),
+                         frame.f_lineno, frame.f_code.co_name)
+
+class SQLProfiler(object):
+    """
+    Records the queries run by one thread.  See start_sql_profiling().
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.stopped = None
+        ## list of (sql, number of parameters, duration, caller)
+        self.queries = []
+        ## profiler that was installed for this thread before this one
+        ## (e.g. the request timer), and that keeps on being notified
+        self.previous = None
+
+    def record_query(self, sql, param, duration):
+        """
+        Called by run_sql() and run_sql_many() after each query.
+        """
+        self.queries.append((sql, len(param or ()), duration, _get_caller()))
+        if self.previous is not None:
+            self.previous.record_query(sql, param, duration)
+
+    def get_summary(self, size=CFG_SQL_PROFILER_REPORT_SIZE,
+                    threshold=CFG_SQL_PROFILER_REPEATED_THRESHOLD):
+        """
+        @return: a dictionary with the total number of queries, the
+            total time spent in the database, the elapsed time, the
+            slowest queries and the repeated query shapes.
+        @rtype: dict
+        """
+        shapes = {}
+        total_time = 0.0
+        for sql, dummy_nparams, duration, caller in self.queries:
+            total_time += duration
+            shape = normalize_sql(sql)
+            stats = shapes.get(shape)
+            if stats is None:
+                stats = shapes[shape] = {'shape': shape,
+                                         'count': 0,
+                                         'time': 0.0,
+                                         'callers': set()}
+            stats['count'] += 1
+            stats['time'] += duration
+            stats['callers'].add(caller)
+
+        slowest = sorted(self.queries, key=lambda query: query[2],
+                         reverse=True)[:size]
+        repeated = [stats for stats in shapes.itervalues()
+                    if stats['count'] >= threshold]
+        repeated.sort(key=lambda stats: (stats['count'], stats['time']),
+                      reverse=True)
+        for stats in repeated:
+            stats['callers'] = sorted(stats['callers'])
+
+        return {'queries': len(self.queries),
+                'distinct': len(shapes),
+                'time': total_time,
+                'elapsed': (self.stopped or time.time()) - self.started,
+                'slowest': [{'sql': normalize_sql(sql),
+                             'params': nparams,
+                             'time': duration,
+                             'caller': caller}
+                            for sql, nparams, duration, caller in slowest],
+                'repeated': repeated[:size]}
+
+    def get_report(self, size=CFG_SQL_PROFILER_REPORT_SIZE,
+                   threshold=CFG_SQL_PROFILER_REPEATED_THRESHOLD):
+        """
+        @return: a human readable report of the recorded queries.
+        @rtype: string
+        """
+        summary = self.get_summary(size, threshold)
+        out = ["SQL profile: %(queries)s queries (%(distinct)s distinct "
+               "shapes), %(time).3fs in the database, %(elapsed).3fs "
+               "elapsed" % summary]
+        out.append("")
+        out.append("Slowest queries:")
+        for query in summary['slowest']:
+            out.append("  %(time).4fs  %(caller)s  [%(params)s params]" % query)
+            out.append("      %(sql)s" % query)
+        out.append("")
+        out.append("Queries run at least %s times (possible N+1):" % threshold)
+        if not summary['repeated']:
+            out.append("  none")
+        for stats in summary['repeated']:
+            out.append("  %5dx  %.4fs  %s" % (stats['count'], stats['time'],
+                                             ', '.join(stats['callers'])))
+            out.append("      %s" % stats['shape'])
+        return '\n'.join(out)
+
+    def log_summary(self, context, size=CFG_SQL_PROFILER_REPORT_SIZE,
+                    threshold=CFG_SQL_PROFILER_REPEATED_THRESHOLD):
+        """
+        Append the summary of the recorded queries as one JSON line to
+        CFG_LOGDIR/dbquery_profile.log.
+
+        @param context: what was profiled, e.g. the request URI or the
+            bibsched task name.
+        @type context: string
+        """
+        summary = self.get_summary(size, threshold)
+        summary['context'] = context
+        summary['date'] = convert_datestruct_to_datetext(time.localtime())
+        try:
+            log_file = open(os.path.join(CFG_LOGDIR, 'dbquery_profile.log'), 'a')
+            try:
+                log_file.write(json.dumps(summary) + '\n')
+            finally:
+                log_file.close()
+        except IOError:
+            pass
+
+def start_sql_profiling():
+    """
+    Start recording the queries run by the current thread.
+
+    @return: the profiler, which keeps on recording until
+        stop_sql_profiling() is called.
+    @rtype: SQLProfiler
+    """
+    profiler = SQLProfiler()
+    profiler.previous = get_sql_profiler()
+    set_sql_profiler(profiler)
+    return profiler
+
+def stop_sql_profiling():
+    """
+    Stop recording the queries run by the current thread.
+
+    @return: the profiler that was recording, if any.
+    @rtype: SQLProfiler
+    """
+    profiler = get_sql_profiler()
+    if profiler is not None:
+        profiler.stopped = time.time()
+        set_sql_profiler(getattr(profiler, 'previous', None))
+    return profiler
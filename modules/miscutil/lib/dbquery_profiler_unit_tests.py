@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+##
+## This file is part of Invenio.
+## Copyright (C) 2013 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+
+"""Unit tests for the SQL profiler."""
+
+__revision__ = "$Id$"
+
+from invenio.testutils import InvenioTestCase
+from invenio.testutils import make_test_suite, run_test_suite
+
+from invenio.dbquery_profiler import normalize_sql, SQLProfiler
+
+
+class NormalizeSQLTest(InvenioTestCase):
+    """Test the computation of query shapes."""
+
+    def test_normalize_placeholders_and_literals(self):
+        """dbquery_profiler - placeholders and literals are normalized"""
+        self.assertEqual(normalize_sql("SELECT id FROM bibrec WHERE id=%s"),
+                         normalize_sql("SELECT id FROM bibrec WHERE id=123"))
+        self.assertEqual(normalize_sql("SELECT id FROM bib10x WHERE value='a b'"),
+                         "SELECT id FROM bib10x WHERE value=?")
+
+    def test_normalize_lists_and_spaces(self):
+        """dbquery_profiler - value lists and spaces are collapsed"""
+        self.assertEqual(normalize_sql("SELECT a\n  FROM t WHERE id IN (1, 2,3)"),
+                         "SELECT a FROM t WHERE id IN (?)")
+
+
+class SQLProfilerTest(InvenioTestCase):
+    """Test the aggregation of the recorded queries."""
+
+    def test_repeated_queries(self):
+        """dbquery_profiler - repeated query shapes are detected"""
+        profiler = SQLProfiler()
+        for recid in range(12):
+            profiler.record_query("SELECT * FROM bibrec WHERE id=%s", (recid, ), 0.001)
+        profiler.record_query("SELECT * FROM collection", None, 0.5)
+        summary = profiler.get_summary(threshold=10)
+        self.assertEqual(summary['queries'], 13)
+        self.assertEqual(summary['distinct'], 2)
+        self.assertEqual(len(summary['repeated']), 1)
+        self.assertEqual(summary['repeated'][0]['count'], 12)
+        self.assertEqual(summary['slowest'][0]['sql'], "SELECT * FROM collection")
+
+TEST_SUITE = make_test_suite(NormalizeSQLTest, SQLProfilerTest)
+
+if __name__ == "__main__":
+    run_test_suite(TEST_SUITE)
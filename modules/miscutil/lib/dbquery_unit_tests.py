@@ -22,6 +22,7 @@
 __revision__ = "$Id$"
 
 from invenio.testutils import InvenioTestCase
+import os
 
 from invenio import dbquery
 from invenio.testutils import make_test_suite, run_test_suite
@@ -102,7 +103,151 @@ class WashTableColumnNameTest(InvenioTestCase):
         self.assertNotEqual(dbquery.real_escape_string(testcase_injection), testcase_injection)
 
 
-TEST_SUITE = make_test_suite(TableUpdateTimesTest, WashTableColumnNameTest)
+class ReplicaRoutingTest(InvenioTestCase):
+    """Test the choice of the database host a query is run on."""
+
+    def setUp(self):
+        self.old_read_replicas = dbquery._READ_REPLICAS
+        self.old_get_replica = dbquery._get_replica
+        dbquery._READ_REPLICAS = ['replica']
+        dbquery._get_replica = lambda: 'replica'
+
+    def tearDown(self):
+        dbquery._READ_REPLICAS = self.old_read_replicas
+        dbquery._get_replica = self.old_get_replica
+
+    def test_is_read_query(self):
+        """dbquery - detection of queries which can run on a replica"""
+        for sql in ("SELECT id FROM bibrec",
+                    "  select id from bibrec",
+                    "(SELECT 1) UNION (SELECT 2)",
+                    "SHOW TABLES",
+                    "DESCRIBE bibrec"):
+            self.assertTrue(dbquery._is_read_query(sql), sql)
+        for sql in ("INSERT INTO bibrec VALUES (1)",
+                    "UPDATE bibrec SET id=2",
+                    "DELETE FROM bibrec",
+                    "SELECT id FROM bibrec FOR UPDATE",
+                    "SELECT id FROM bibrec LOCK IN SHARE MODE",
+                    "SELECT GET_LOCK('a', 1)",
+                    "SELECT LAST_INSERT_ID()",
+                    "SELECT @a",
+                    "SELECT id INTO @a FROM bibrec",
+                    "SELECTED"):
+            self.assertFalse(dbquery._is_read_query(sql), sql)
+
+    def test_master_by_default(self):
+        """dbquery - queries run on the master outside replica-ok contexts"""
+        self.assertEqual(dbquery._get_dbhost("SELECT 1"),
+                         dbquery.CFG_DATABASE_HOST)
+        self.assertEqual(dbquery._get_dbhost("SELECT 1", run_on_slave=True),
+                         'replica')
+
+    def test_replica_ok_context(self):
+        """dbquery - reads go to the replica until the first write"""
+        dbquery.start_replica_ok()
+        try:
+            self.assertEqual(dbquery._get_dbhost("SELECT 1"), 'replica')
+            self.assertEqual(dbquery._get_dbhost("UPDATE bibrec SET id=1"),
+                             dbquery.CFG_DATABASE_HOST)
+            self.assertEqual(dbquery._get_dbhost("SELECT 1"),
+                             dbquery.CFG_DATABASE_HOST)
+        finally:
+            dbquery.stop_replica_ok()
+        dbquery.start_replica_ok()
+        try:
+            self.assertEqual(dbquery._get_dbhost("SELECT 1"), 'replica')
+        finally:
+            dbquery.stop_replica_ok()
+
+    def test_no_replica(self):
+        """dbquery - everything runs on the master without replicas"""
+        dbquery._READ_REPLICAS = []
+        dbquery.start_replica_ok()
+        try:
+            self.assertEqual(dbquery._get_dbhost("SELECT 1", run_on_slave=True),
+                             dbquery.CFG_DATABASE_HOST)
+        finally:
+            dbquery.stop_replica_ok()
+
+
+class ReplicaChoiceTest(InvenioTestCase):
+    """Test that a thread only checks the replicas it may use."""
+
+    def setUp(self):
+        self.old_read_replicas = dbquery._READ_REPLICAS
+        self.old_is_replica_available = dbquery._is_replica_available
+        self.old_get_ident = dbquery.get_ident
+        self.available = set(['r0', 'r1', 'r2'])
+        self.checked = []
+
+        def is_replica_available(dbhost):
+            self.checked.append(dbhost)
+            return dbhost in self.available
+
+        dbquery._READ_REPLICAS = ['r0', 'r1', 'r2']
+        dbquery._is_replica_available = is_replica_available
+        dbquery.get_ident = lambda: 4
+
+    def tearDown(self):
+        dbquery._READ_REPLICAS = self.old_read_replicas
+        dbquery._is_replica_available = self.old_is_replica_available
+        dbquery.get_ident = self.old_get_ident
+
+    def test_own_replica_only(self):
+        """dbquery - a thread checks its own replica only"""
+        self.assertEqual(dbquery._get_replica(), 'r1')
+        self.assertEqual(self.checked, ['r1'])
+
+    def test_fallback(self):
+        """dbquery - a thread falls back to the next available replica"""
+        self.available = set(['r0'])
+        self.assertEqual(dbquery._get_replica(), 'r0')
+        self.assertEqual(self.checked, ['r1', 'r2', 'r0'])
+        self.available = set()
+        self.assertEqual(dbquery._get_replica(), None)
+
+
+class IdleConnectionsTest(InvenioTestCase):
+    """Test the reuse of the connections of terminated threads."""
+
+    class _Connection(object):
+        def __init__(self):
+            self.calls = []
+        def change_user(self, user, passwd, db):
+            self.calls.append('change_user')
+        def set_character_set(self, charset):
+            self.calls.append('set_character_set')
+        def autocommit(self, value):
+            self.calls.append('autocommit')
+
+    def setUp(self):
+        self.old_idle_connections = dbquery._IDLE_DB_CONN
+        dbquery._IDLE_DB_CONN = {}
+
+    def tearDown(self):
+        dbquery._IDLE_DB_CONN = self.old_idle_connections
+
+    def test_connection_reset(self):
+        """dbquery - reused connections get a fresh session"""
+        connection = self._Connection()
+        dbquery._IDLE_DB_CONN['host'] = [(os.getpid(), connection)]
+        self.assertTrue(dbquery._get_idle_connection('host') is connection)
+        self.assertEqual(connection.calls[0], 'change_user')
+        self.assertEqual(dbquery._get_idle_connection('host'), None)
+
+    def test_parent_connection_not_reused(self):
+        """dbquery - connections of the parent process are not reused"""
+        connection = self._Connection()
+        dbquery._IDLE_DB_CONN['host'] = [(os.getppid(), connection)]
+        self.assertEqual(dbquery._get_idle_connection('host'), None)
+        self.assertEqual(connection.calls, [])
+        self.assertEqual(dbquery._IDLE_DB_CONN['host'], [])
+
+
+TEST_SUITE = make_test_suite(TableUpdateTimesTest, WashTableColumnNameTest,
+                             ReplicaRoutingTest, ReplicaChoiceTest,
+                             IdleConnectionsTest)
 
 if __name__ == "__main__":
     run_test_suite(TEST_SUITE)
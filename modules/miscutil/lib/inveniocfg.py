@@ -186,7 +186,8 @@ Please, update your invenio-local.conf file accordingly.""" % (option_name, new_
                        'CFG_BIBDOCFILE_PREFERRED_MIMETYPES_MAPPING',
                        'CFG_BIBSCHED_NON_CONCURRENT_TASKS',
                        'CFG_REDIS_HOSTS',
-                       'CFG_BIBSCHED_INCOMPATIBLE_TASKS']:
+                       'CFG_BIBSCHED_INCOMPATIBLE_TASKS',
+                       'CFG_OAI_HARVEST_POSTPROCESS_WORKERS']:
         try:
             option_value = option_value[1:-1]
             if option_name == "CFG_BIBEDIT_EXTEND_RECORD_WITH_COLLECTION_TEMPLATE" and option_value.strip().startswith("{"):
@@ -242,7 +243,8 @@ You may want to customise your invenio-local.conf configuration accordingly."""
                        'CFG_OAUTH2_PROVIDERS',
                        'CFG_BIBFORMAT_CACHED_FORMATS',
                        'CFG_BIBEDIT_ADD_TICKET_RT_QUEUES',
-                       'CFG_BIBAUTHORID_ENABLED_REMOTE_LOGIN_SYSTEMS',]:
+                       'CFG_BIBAUTHORID_ENABLED_REMOTE_LOGIN_SYSTEMS',
+                       'CFG_MISCUTIL_SQL_READ_REPLICAS',]:
         out = "["
         for elem in option_value[1:-1].split(","):
             if elem:
@@ -271,7 +273,10 @@ You may want to customise your invenio-local.conf configuration accordingly."""
                        'CFG_BIBMATCH_LOCAL_SLEEPTIME',
                        'CFG_BIBMATCH_REMOTE_SLEEPTIME',
                        'CFG_PLOTEXTRACTOR_DOWNLOAD_TIMEOUT',
-                       'CFG_BIBMATCH_FUZZY_MATCH_VALIDATION_LIMIT']:
+                       'CFG_BIBMATCH_FUZZY_MATCH_VALIDATION_LIMIT',
+                       'CFG_MISCUTIL_SQL_PROFILING_SAMPLE_RATE',
+                       'CFG_WEBSTYLE_SLOW_REQUEST_THRESHOLD',
+                       'CFG_WEBSTYLE_SLOW_REQUEST_SAMPLE_RATE']:
         option_value = float(option_value[1:-1])
 
     ## 3h) special cases: bibmatch validation list
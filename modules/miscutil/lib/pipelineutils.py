@@ -0,0 +1,282 @@
+## This file is part of Invenio.
+## Copyright (C) 2014 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""
+Invenio threaded processing pipelines.
+
+Runs a stream of items (e.g. harvested records) through a chain of
+stages, each stage having its own pool of worker threads and being
+connected to the next one by a bounded queue:
+
+    >>> pipeline = Pipeline([PipelineStage('download', download, workers=4),
+    ...                      PipelineStage('extract', extract, workers=2)])
+    >>> for item, exc_info in pipeline.run(items):
+    ...     save(item)
+    >>> for line in pipeline.format_statistics():
+    ...     write_message(line)
+
+Items are yielded in the order they were given, as soon as all the
+previous ones have gone through the pipeline.  Since the queues are
+bounded, a slow stage (or a slow consumer) holds the previous stages
+back instead of letting items pile up in memory.
+
+The stages are meant for work that releases the GIL, such as running
+external programs, downloading files or querying the database.
+"""
+
+__revision__ = "$Id$"
+
+import sys
+import time
+import Queue
+import threading
+
+## How long the threads of a pipeline block on a queue before checking
+## whether the pipeline was aborted.
+CFG_PIPELINE_POLL_INTERVAL = 0.5
+
+## Marks the end of the stream in the queues.
+_END = None
+
+class PipelineStage(object):
+    """
+    One stage of a Pipeline: FUNCTION is applied to each item by WORKERS
+    threads, and its return value is passed to the next stage.  If
+    FUNCTION raises an exception, the item is not passed to the next
+    stages, and is yielded by Pipeline.run() with the exception.
+    """
+
+    def __init__(self, name, function, workers=1):
+        self.name = name
+        self.function = function
+        self.workers = max(1, workers)
+        self.lock = threading.Lock()
+        self.reset_statistics()
+
+    def reset_statistics(self):
+        """Forget about the items processed so far."""
+        self.count = 0
+        self.errors = 0
+        ## time spent in FUNCTION
+        self.busy_time = 0.0
+        self.max_latency = 0.0
+        ## time spent by the items in the input queue of this stage
+        self.wait_time = 0.0
+        self.first_start = None
+        self.last_end = None
+
+    def process(self, value):
+        """
+        Apply the function of this stage to VALUE, and update the
+        statistics.
+
+        @return: a tuple (new value, exc_info), exc_info being None
+            unless the function raised an exception.
+        """
+        start = time.time()
+        exc_info = None
+        try:
+            value = self.function(value)
+        except Exception:
+            exc_info = sys.exc_info()
+        end = time.time()
+        self.lock.acquire()
+        try:
+            self.count += 1
+            if exc_info is not None:
+                self.errors += 1
+            self.busy_time += end - start
+            self.max_latency = max(self.max_latency, end - start)
+            if self.first_start is None:
+                self.first_start = start
+            self.last_end = end
+        finally:
+            self.lock.release()
+        return value, exc_info
+
+    def get_statistics(self):
+        """
+        @return: the throughput (items per second of wall-clock time
+            while the stage was active) and latency statistics of this
+            stage.
+        @rtype: dict
+        """
+        elapsed = 0.0
+        if self.first_start is not None:
+            elapsed = self.last_end - self.first_start
+        count = self.count or 1
+        return {'name': self.name,
+                'workers': self.workers,
+                'count': self.count,
+                'errors': self.errors,
+                'elapsed': elapsed,
+                'throughput': elapsed and self.count / elapsed or 0.0,
+                'avg_latency': self.busy_time / count,
+                'max_latency': self.max_latency,
+                'avg_wait': self.wait_time / count,
+                'utilization': elapsed and \
+                    self.busy_time / (elapsed * self.workers) or 0.0}
+
+class Pipeline(object):
+    """
+    A chain of PipelineStage objects connected by queues of at most
+    QUEUE_SIZE items.  See run().
+    """
+
+    def __init__(self, stages, queue_size=100):
+        self.stages = stages
+        self.queue_size = queue_size
+        self.aborted = False
+
+    def _put(self, queue, envelope):
+        """Put ENVELOPE in QUEUE, unless the pipeline is aborted."""
+        while not self.aborted:
+            try:
+                queue.put(envelope, True, CFG_PIPELINE_POLL_INTERVAL)
+                return True
+            except Queue.Full:
+                continue
+        return False
+
+    def _get(self, queue):
+        """Get the next envelope from QUEUE, or _END if aborted."""
+        while not self.aborted:
+            try:
+                return queue.get(True, CFG_PIPELINE_POLL_INTERVAL)
+            except Queue.Empty:
+                continue
+        return _END
+
+    def _feed(self, items, queue, nb_workers, errors):
+        """Put ITEMS, numbered, in the first queue."""
+        try:
+            try:
+                for index, item in enumerate(items):
+                    if not self._put(queue, [index, item, None, time.time()]):
+                        return
+            except Exception:
+                errors.append(sys.exc_info())
+        finally:
+            for dummy in range(nb_workers):
+                self._put(queue, _END)
+
+    def _work(self, stage, in_queue, out_queue, nb_next_workers, running):
+        """Process the items of IN_QUEUE with STAGE until the end of the
+        stream, and pass them to OUT_QUEUE."""
+        while True:
+            envelope = self._get(in_queue)
+            if envelope is _END:
+                break
+            if envelope[2] is None:
+                stage.lock.acquire()
+                stage.wait_time += time.time() - envelope[3]
+                stage.lock.release()
+                envelope[1], envelope[2] = stage.process(envelope[1])
+            envelope[3] = time.time()
+            if not self._put(out_queue, envelope):
+                break
+        ## the last worker of the stage to finish ends the stream of the
+        ## next stage
+        stage.lock.acquire()
+        try:
+            running[0] -= 1
+            last_p = running[0] == 0
+        finally:
+            stage.lock.release()
+        if last_p:
+            for dummy in range(nb_next_workers):
+                self._put(out_queue, _END)
+
+    def run(self, items):
+        """
+        Run ITEMS through the stages of the pipeline.
+
+        @param items: an iterable, which is consumed by a separate
+            thread as the first stage needs more items.
+        @return: a generator of tuples (item, exc_info), in the order of
+            ITEMS, where item is the value returned by the last stage,
+            and exc_info is None, or, if one of the stages raised an
+            exception, item is the value the stage was given and
+            exc_info is sys.exc_info() for the exception.
+        """
+        self.aborted = False
+        queues = [Queue.Queue(self.queue_size) for dummy in self.stages]
+        queues.append(Queue.Queue(self.queue_size))
+        feed_errors = []
+        threads = [threading.Thread(target=self._feed,
+                                    args=(items, queues[0],
+                                          self.stages and self.stages[0].workers or 1,
+                                          feed_errors))]
+        for i, stage in enumerate(self.stages):
+            if i + 1 < len(self.stages):
+                nb_next_workers = self.stages[i + 1].workers
+            else:
+                nb_next_workers = 1
+            running = [stage.workers]
+            for dummy in range(stage.workers):
+                threads.append(threading.Thread(target=self._work,
+                                                args=(stage, queues[i],
+                                                      queues[i + 1],
+                                                      nb_next_workers,
+                                                      running)))
+        for thread in threads:
+            thread.setDaemon(True)
+            thread.start()
+
+        ## the items come out of order: keep them until the previous
+        ## ones are out too
+        pending = {}
+        next_index = 0
+        try:
+            while True:
+                envelope = self._get(queues[-1])
+                if envelope is _END:
+                    break
+                pending[envelope[0]] = envelope
+                while next_index in pending:
+                    envelope = pending.pop(next_index)
+                    next_index += 1
+                    yield envelope[1], envelope[2]
+        finally:
+            ## also stops the threads if the consumer gives up early
+            self.aborted = True
+        if feed_errors:
+            raise feed_errors[0][0], feed_errors[0][1], feed_errors[0][2]
+
+    def get_statistics(self):
+        """
+        @return: the statistics of each stage, see
+            PipelineStage.get_statistics().
+        @rtype: list of dict
+        """
+        return [stage.get_statistics() for stage in self.stages]
+
+    def format_statistics(self):
+        """
+        @return: one human readable line of statistics per stage.
+        @rtype: list of string
+        """
+        lines = []
+        for stats in self.get_statistics():
+            stats['utilization'] *= 100
+            lines.append("stage %(name)s: %(count)d items (%(errors)d errors) "
+                         "in %(elapsed).2fs with %(workers)d workers, "
+                         "%(throughput).2f items/s, latency avg "
+                         "%(avg_latency).3fs max %(max_latency).3fs, queue "
+                         "wait avg %(avg_wait).3fs, utilization "
+                         "%(utilization).0f%%" % stats)
+        return lines
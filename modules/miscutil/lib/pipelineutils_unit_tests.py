@@ -0,0 +1,85 @@
+## This file is part of Invenio.
+## Copyright (C) 2014 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""Unit tests for the threaded processing pipelines."""
+
+__revision__ = "$Id$"
+
+import time
+import random
+
+from invenio.testutils import InvenioTestCase
+from invenio.testutils import make_test_suite, run_test_suite
+
+from invenio.pipelineutils import Pipeline, PipelineStage
+
+def _slow_double(value):
+    """Double VALUE, taking a random time."""
+    time.sleep(random.random() / 100)
+    return value * 2
+
+def _fail_on_seven(value):
+    """Raise an exception for 7."""
+    if value == 7:
+        raise ValueError(value)
+    return value + 1
+
+class PipelineTest(InvenioTestCase):
+    """Test running items through a pipeline."""
+
+    def test_order_kept(self):
+        """pipelineutils - items come out in order through several workers"""
+        pipeline = Pipeline([PipelineStage('double', _slow_double, workers=4),
+                             PipelineStage('again', _slow_double, workers=3)],
+                            queue_size=2)
+        result = list(pipeline.run(iter(range(50))))
+        self.assertEqual(result, [(i * 4, None) for i in range(50)])
+        stats = pipeline.get_statistics()
+        self.assertEqual([stage['count'] for stage in stats], [50, 50])
+        self.assertEqual(len(pipeline.format_statistics()), 2)
+
+    def test_errors(self):
+        """pipelineutils - failing items skip the next stages"""
+        pipeline = Pipeline([PipelineStage('fail', _fail_on_seven, workers=2),
+                             PipelineStage('double', _slow_double)])
+        result = list(pipeline.run(range(10)))
+        self.assertEqual([value for value, dummy in result],
+                         [(i + 1) * 2 for i in range(7)] + [7] +
+                         [(i + 1) * 2 for i in range(8, 10)])
+        self.assertEqual(result[7][1][0], ValueError)
+        self.assertEqual([stage['errors'] for stage in pipeline.get_statistics()],
+                         [1, 0])
+        self.assertEqual(pipeline.get_statistics()[1]['count'], 9)
+
+    def test_early_exit(self):
+        """pipelineutils - the consumer may stop early"""
+        pipeline = Pipeline([PipelineStage('double', _slow_double, workers=2)],
+                            queue_size=1)
+        for value, dummy in pipeline.run(xrange(1000000)):
+            if value == 10:
+                break
+        self.failUnless(pipeline.aborted)
+
+    def test_empty(self):
+        """pipelineutils - empty input and no stages"""
+        self.assertEqual(list(Pipeline([PipelineStage('double', _slow_double)]).run([])), [])
+        self.assertEqual(list(Pipeline([]).run([1, 2])), [(1, None), (2, None)])
+
+TEST_SUITE = make_test_suite(PipelineTest)
+
+if __name__ == "__main__":
+    run_test_suite(TEST_SUITE)
@@ -169,8 +169,10 @@ def make_single_directory(to_dir, dirname):
         try:
             os.mkdir(new_dir)
         except OSError:
-            write_message('Failed to make new dir...')
-            return to_dir
+            if not os.path.isdir(new_dir):
+                # (it may have been created by another thread meanwhile)
+                write_message('Failed to make new dir...')
+                return to_dir
 
     return new_dir
 
@@ -516,7 +516,27 @@ def build_and_run_web_test_suite():
 
 class InvenioTestCase(unittest.TestCase):
     "Invenio Test Case class."
-    pass
+
+    def patch_attributes(self, target, values):
+        """Sets the attributes of TARGET, e.g. a module, to VALUES, a
+        sequence of (name, value) pairs, until restore_attributes() is
+        called.  Typically called in setUp() to replace the configuration
+        or the functions accessing the database, and undone in tearDown().
+        """
+        if not hasattr(self, '_patched_attributes'):
+            self._patched_attributes = []
+        for name, value in values:
+            self._patched_attributes.append((target, name,
+                                             getattr(target, name)))
+            setattr(target, name, value)
+
+    def restore_attributes(self):
+        """Gives back their values to the attributes set by
+        patch_attributes(), the last ones set first."""
+        patched_attributes = getattr(self, '_patched_attributes', [])
+        while patched_attributes:
+            target, name, value = patched_attributes.pop()
+            setattr(target, name, value)
 
 
 try:
@@ -0,0 +1,285 @@
+## This file is part of Invenio.
+## Copyright (C) 2013 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""
+Invenio request phase timer.
+
+Breaks down the time spent serving one request (or running any other
+unit of work) into named phases, and counts the SQL queries run in the
+meantime.  Handlers and core functions annotate their phases either
+with a decorator:
+
+    >>> @timed_phase('format')
+    ... def format_records(recIDs, of):
+    ...     ...
+
+or with a context manager:
+
+    >>> with timed_phase('session'):
+    ...     uid = getUid(req)
+
+The timer itself is started and stopped by the caller owning the unit
+of work, e.g. the WSGI handler:
+
+    >>> timer = start_request_timer()
+    >>> try:
+    ...     serve_request()
+    ... finally:
+    ...     stop_request_timer()
+    >>> print timer.get_server_timing_header()
+
+When no timer has been started (the default, unless
+CFG_WEBSTYLE_REQUEST_TIMING is set), the cost of an annotated phase is
+one dictionary truth test.  Nested phases are accounted exclusively:
+the time spent in an inner phase is not counted in the outer one, so
+that the phases add up to the time spent in annotated code.  A phase
+re-entered while already running (e.g. a recursive function) is only
+counted once.
+"""
+
+__revision__ = "$Id$"
+
+import os
+import time
+from thread import get_ident
+
+from functools import wraps
+
+from invenio.config import CFG_LOGDIR
+from invenio.dbquery import get_sql_profiler, set_sql_profiler
+from invenio.dateutils import convert_datestruct_to_datetext
+from invenio.jsonutils import json
+
+## (pid, thread id) -> RequestTimer
+_REQUEST_TIMERS = {}
+
+class RequestTimer(object):
+    """
+    Accumulates the time spent in each phase by one thread.  See
+    start_request_timer().
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.stopped = None
+        ## phase name -> [number of times entered, total time]
+        self.phases = {}
+        ## phase names, in the order they were first entered
+        self.order = []
+        ## running phases, as [name, time of the last (re)start]
+        self.stack = []
+        self.sql_queries = 0
+        self.sql_time = 0.0
+        ## SQL profiler that was installed before this timer, if any
+        self.previous = None
+
+    def start_phase(self, name):
+        """
+        Enter phase NAME, pausing the currently running phase.
+
+        @return: False if NAME was already running, in which case the
+            matching stop_phase() call must be skipped.
+        @rtype: bool
+        """
+        now = time.time()
+        for running_name, dummy_start in self.stack:
+            if running_name == name:
+                return False
+        if self.stack:
+            self._add_time(self.stack[-1][0], now - self.stack[-1][1])
+        self.stack.append([name, now])
+        stats = self.phases.get(name)
+        if stats is None:
+            stats = self.phases[name] = [0, 0.0]
+            self.order.append(name)
+        stats[0] += 1
+        return True
+
+    def stop_phase(self, name):
+        """
+        Leave phase NAME, resuming the phase that was running before.
+        """
+        now = time.time()
+        while self.stack:
+            running_name, start = self.stack.pop()
+            self._add_time(running_name, now - start)
+            if running_name == name:
+                break
+        if self.stack:
+            self.stack[-1][1] = now
+
+    def _add_time(self, name, duration):
+        """Account DURATION seconds to phase NAME."""
+        self.phases[name][1] += duration
+
+    def record_query(self, sql, param, duration):
+        """
+        Called by run_sql() and run_sql_many() after each query.
+        """
+        self.sql_queries += 1
+        self.sql_time += duration
+        if self.previous is not None:
+            self.previous.record_query(sql, param, duration)
+
+    def get_elapsed(self):
+        """
+        @return: the time elapsed since the timer was started, in
+            seconds.
+        @rtype: float
+        """
+        return (self.stopped or time.time()) - self.started
+
+    def get_summary(self):
+        """
+        @return: a dictionary with the elapsed time, the time spent in
+            each phase, and the number of SQL queries and the time spent
+            running them.
+        @rtype: dict
+        """
+        now = time.time()
+        phases = {}
+        for name in self.order:
+            count, duration = self.phases[name]
+            phases[name] = {'count': count, 'time': duration}
+        if self.stack:
+            ## account for the phase still running
+            phases[self.stack[-1][0]]['time'] += now - self.stack[-1][1]
+        return {'elapsed': (self.stopped or now) - self.started,
+                'phases': phases,
+                'sql_queries': self.sql_queries,
+                'sql_time': self.sql_time}
+
+    def get_server_timing_header(self):
+        """
+        @return: the phase breakdown as the value of a Server-Timing
+            HTTP header (durations in milliseconds), e.g.
+            'session;dur=2.1, search;dur=40.3, sql;desc="12 queries";dur=8.0,
+            total;dur=61.2'.
+        @rtype: string
+        """
+        summary = self.get_summary()
+        metrics = ['%s;dur=%.1f' % (name, summary['phases'][name]['time'] * 1000)
+                   for name in self.order]
+        metrics.append('sql;desc="%s queries";dur=%.1f' % (
+            summary['sql_queries'], summary['sql_time'] * 1000))
+        metrics.append('total;dur=%.1f' % (summary['elapsed'] * 1000))
+        return ', '.join(metrics)
+
+    def log_summary(self, context, log_name='slow_requests.log', **extra):
+        """
+        Append the phase breakdown as one JSON line to
+        CFG_LOGDIR/LOG_NAME.
+
+        @param context: what was timed, e.g. the request URI.
+        @type context: string
+        @param extra: additional fields to log, e.g. the HTTP status.
+        """
+        summary = self.get_summary()
+        summary.update(extra)
+        summary['context'] = context
+        summary['date'] = convert_datestruct_to_datetext(time.localtime())
+        try:
+            log_file = open(os.path.join(CFG_LOGDIR, log_name), 'a')
+            try:
+                log_file.write(json.dumps(summary) + '\n')
+            finally:
+                log_file.close()
+        except IOError:
+            pass
+
+def get_request_timer():
+    """
+    @return: the timer of the current thread, or None if no timer was
+        started.
+    @rtype: RequestTimer
+    """
+    return _REQUEST_TIMERS.get((os.getpid(), get_ident()))
+
+def start_request_timer():
+    """
+    Start timing the phases of the current thread.  The timer also
+    counts the SQL queries, while letting any running SQL profiler see
+    them too.
+
+    @return: the timer, which keeps on running until
+        stop_request_timer() is called.
+    @rtype: RequestTimer
+    """
+    timer = RequestTimer()
+    timer.previous = get_sql_profiler()
+    set_sql_profiler(timer)
+    _REQUEST_TIMERS[(os.getpid(), get_ident())] = timer
+    return timer
+
+def stop_request_timer():
+    """
+    Stop timing the phases of the current thread.
+
+    @return: the timer that was running, if any.
+    @rtype: RequestTimer
+    """
+    timer = _REQUEST_TIMERS.pop((os.getpid(), get_ident()), None)
+    if timer is not None:
+        timer.stopped = time.time()
+        while timer.stack:
+            timer.stop_phase(timer.stack[-1][0])
+        if get_sql_profiler() is timer:
+            set_sql_profiler(timer.previous)
+    return timer
+
+class timed_phase(object):
+    """
+    Account the time spent in a block of code, or in a function, to the
+    phase NAME of the current request timer, if any.  Usable both as a
+    context manager and as a decorator.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        ## timers where this block actually started the phase (a
+        ## decorator instance may be shared by several threads)
+        self._started = {}
+
+    def __enter__(self):
+        if _REQUEST_TIMERS:
+            timer = get_request_timer()
+            if timer is not None and timer.start_phase(self.name):
+                self._started[get_ident()] = timer
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._started:
+            timer = self._started.pop(get_ident(), None)
+            if timer is not None:
+                timer.stop_phase(self.name)
+        return False
+
+    def __call__(self, func):
+        name = self.name
+
+        @wraps(func)
+        def timed_func(*args, **kwargs):
+            if not _REQUEST_TIMERS:
+                return func(*args, **kwargs)
+            timer = get_request_timer()
+            if timer is None or not timer.start_phase(name):
+                return func(*args, **kwargs)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                timer.stop_phase(name)
+        return timed_func
@@ -0,0 +1,78 @@
+## This file is part of Invenio.
+## Copyright (C) 2013 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""Unit tests for the request phase timer."""
+
+__revision__ = "$Id$"
+
+from invenio.testutils import InvenioTestCase
+from invenio.testutils import make_test_suite, run_test_suite
+
+from invenio.dbquery import get_sql_profiler
+from invenio.timerutils import timed_phase, get_request_timer, \
+    start_request_timer, stop_request_timer
+
+
+@timed_phase('outer')
+def _outer(depth=0):
+    """Recursive function calling an inner phase."""
+    if depth < 2:
+        return _outer(depth + 1)
+    with timed_phase('inner'):
+        return depth
+
+
+class RequestTimerTest(InvenioTestCase):
+    """Test the accounting of phases."""
+
+    def tearDown(self):
+        stop_request_timer()
+
+    def test_no_timer(self):
+        """timerutils - phases are no-ops without a running timer"""
+        self.assertEqual(get_request_timer(), None)
+        self.assertEqual(_outer(), 2)
+
+    def test_nested_and_recursive_phases(self):
+        """timerutils - nested phases and recursion are counted once"""
+        timer = start_request_timer()
+        self.assertEqual(_outer(), 2)
+        timer.record_query("SELECT 1", None, 0.25)
+        stop_request_timer()
+        summary = timer.get_summary()
+        self.assertEqual(summary['phases']['outer']['count'], 1)
+        self.assertEqual(summary['phases']['inner']['count'], 1)
+        self.assertEqual(summary['sql_queries'], 1)
+        self.assertEqual(timer.stack, [])
+        self.failUnless(summary['elapsed'] >=
+                        summary['phases']['outer']['time'] +
+                        summary['phases']['inner']['time'])
+        header = timer.get_server_timing_header()
+        self.failUnless(header.startswith('outer;dur='))
+        self.failUnless('sql;desc="1 queries"' in header)
+
+    def test_sql_profiler_restored(self):
+        """timerutils - the timer installs and removes itself as SQL profiler"""
+        timer = start_request_timer()
+        self.assertEqual(get_sql_profiler(), timer)
+        stop_request_timer()
+        self.assertEqual(get_sql_profiler(), None)
+
+TEST_SUITE = make_test_suite(RequestTimerTest)
+
+if __name__ == "__main__":
+    run_test_suite(TEST_SUITE)
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+##
+## This file is part of Invenio.
+## Copyright (C) 2014 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+from invenio.dbquery import run_sql
+
+depends_on = ['invenio_2014_02_10_oaiREPOSITORYSNAPSHOT']
+
+def info():
+    return "New aidTORTOISEJOBS table for the job queue of bibauthorid disambiguation runs"
+
+def do_upgrade():
+    run_sql("""
+CREATE TABLE IF NOT EXISTS `aidTORTOISEJOBS` (
+  `id` bigint(15) unsigned NOT NULL AUTO_INCREMENT,
+  `run` varchar(64) NOT NULL,
+  `stage` varchar(32) NOT NULL,
+  `surname` varchar(255) NOT NULL,
+  `size` int(11) unsigned NOT NULL default 0,
+  `status` ENUM('pending', 'running', 'done', 'failed') NOT NULL default 'pending',
+  `attempts` tinyint(3) unsigned NOT NULL default 0,
+  `host` varchar(255) NULL default NULL,
+  `pid` int(11) unsigned NULL default NULL,
+  `heartbeat` datetime NULL default NULL,
+  `finished` datetime NULL default NULL,
+  `peak_memory` bigint(15) unsigned NULL default NULL,
+  `message` text,
+  PRIMARY KEY (`id`),
+  UNIQUE KEY `run-stage-surname-b` (`run`, `stage`, `surname`(200)),
+  INDEX `status-b` (`run`, `stage`, `status`),
+  INDEX `stage-surname-b` (`stage`, `surname`(100))
+) ENGINE=MyISAM;
+""")
+
+def estimate():
+    """  Estimate running time of upgrade in seconds (optional). """
+    return 1
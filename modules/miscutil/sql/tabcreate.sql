@@ -3220,6 +3220,15 @@ CREATE TABLE IF NOT EXISTS oaiREPOSITORY (
   PRIMARY KEY (id)
 ) ENGINE=MyISAM;
 
+CREATE TABLE IF NOT EXISTS oaiREPOSITORYSNAPSHOT (
+  setSpec varchar(255) NOT NULL default '',
+  setDefinitions text NOT NULL default '',
+  last_run datetime NOT NULL default '1970-01-01',
+  pending tinyint(1) NOT NULL default '0',
+  tasks text NOT NULL default '',
+  PRIMARY KEY (setSpec, pending)
+) ENGINE=MyISAM;
+
 CREATE TABLE IF NOT EXISTS oaiHARVEST (
   id mediumint(9) unsigned NOT NULL auto_increment,
   baseurl varchar(255) NOT NULL default '',
@@ -4528,6 +4537,26 @@ CREATE TABLE IF NOT EXISTS `aidRESULTS` (
   INDEX `rec-b` (`bibrec`)
 ) ENGINE=MYISAM;
 
+CREATE TABLE IF NOT EXISTS `aidTORTOISEJOBS` (
+  `id` bigint(15) unsigned NOT NULL AUTO_INCREMENT,
+  `run` varchar(64) NOT NULL,
+  `stage` varchar(32) NOT NULL,
+  `surname` varchar(255) NOT NULL,
+  `size` int(11) unsigned NOT NULL default 0,
+  `status` ENUM('pending', 'running', 'done', 'failed') NOT NULL default 'pending',
+  `attempts` tinyint(3) unsigned NOT NULL default 0,
+  `host` varchar(255) NULL default NULL,
+  `pid` int(11) unsigned NULL default NULL,
+  `heartbeat` datetime NULL default NULL,
+  `finished` datetime NULL default NULL,
+  `peak_memory` bigint(15) unsigned NULL default NULL,
+  `message` text,
+  PRIMARY KEY (`id`),
+  UNIQUE KEY `run-stage-surname-b` (`run`, `stage`, `surname`(200)),
+  INDEX `status-b` (`run`, `stage`, `status`),
+  INDEX `stage-surname-b` (`stage`, `surname`(100))
+) ENGINE=MyISAM;
+
 CREATE TABLE IF NOT EXISTS `aidPERSONIDDATA` (
   `personid` BIGINT( 16 ) UNSIGNED NOT NULL ,
   `tag` VARCHAR( 64 ) NOT NULL ,
@@ -4906,5 +4935,7 @@ INSERT INTO upgrade (upgrade, applied) VALUES ('invenio_2013_09_16_aidPERSONIDDA
 INSERT INTO upgrade (upgrade, applied) VALUES ('invenio_2013_12_04_seqSTORE_larger_value',NOW());
 INSERT INTO upgrade (upgrade, applied) VALUES ('invenio_2014_01_22_redis_sessions',NOW());
 INSERT INTO upgrade (upgrade, applied) VALUES ('invenio_2014_01_24_seqSTORE_larger_value',NOW());
+INSERT INTO upgrade (upgrade, applied) VALUES ('invenio_2014_02_10_oaiREPOSITORYSNAPSHOT',NOW());
+INSERT INTO upgrade (upgrade, applied) VALUES ('invenio_2014_03_03_aidTORTOISEJOBS',NOW());
 
 -- end of file
@@ -399,6 +399,7 @@ DROP TABLE IF EXISTS collection;
 DROP TABLE IF EXISTS collectionname;
 DROP TABLE IF EXISTS collectionboxname;
 DROP TABLE IF EXISTS oaiREPOSITORY;
+DROP TABLE IF EXISTS oaiREPOSITORYSNAPSHOT;
 DROP TABLE IF EXISTS oaiHARVEST;
 DROP TABLE IF EXISTS oaiHARVESTLOG;
 DROP TABLE IF EXISTS bibHOLDINGPEN;
@@ -520,6 +521,7 @@ DROP TABLE IF EXISTS aidINVERTEDLISTS;
 DROP TABLE IF EXISTS aidPERSONIDDATA;
 DROP TABLE IF EXISTS aidPERSONIDPAPERS;
 DROP TABLE IF EXISTS aidRESULTS;
+DROP TABLE IF EXISTS aidTORTOISEJOBS;
 DROP TABLE IF EXISTS xtrJOB;
 DROP TABLE IF EXISTS bsrMETHOD;
 DROP TABLE IF EXISTS bsrMETHODNAME;
@@ -38,6 +38,9 @@ import tempfile
 import urlparse
 import random
 import traceback
+import threading
+import Queue
+import functools
 
 from invenio.config import \
      CFG_BINDIR, \
@@ -47,6 +50,10 @@ from invenio.config import \
      CFG_SITE_URL, \
      CFG_OAI_FAILED_HARVESTING_STOP_QUEUE, \
      CFG_OAI_FAILED_HARVESTING_EMAILS_ADMIN, \
+     CFG_OAI_HARVEST_MAX_CONCURRENT_REPOSITORIES, \
+     CFG_OAI_HARVEST_RECORDS_PER_FILE, \
+     CFG_OAI_HARVEST_POSTPROCESS_WORKERS, \
+     CFG_OAI_HARVEST_POSTPROCESS_QUEUE_SIZE, \
      CFG_SITE_SUPPORT_EMAIL, \
      CFG_TMPDIR
 from invenio.oai_harvest_config import InvenioOAIHarvestWarning
@@ -87,6 +94,7 @@ from invenio.oai_harvest_utils import get_nb_records_in_file, \
                                       generate_harvest_report, \
                                       record_collect_oai_identifiers
 from invenio.webuser import email_valid_p
+from invenio.pipelineutils import Pipeline, PipelineStage
 from invenio.mailutils import send_email
 
 import invenio.template
@@ -139,23 +147,19 @@ def task_run_core():
     # 2: error (admin intervention needed)
     error_happened_p = 0
 
-    j = 0
     for repository in reposlist:
-        j += 1
-        current_progress = "(%i/%i)" % (j, len(reposlist))
-        task_sleep_now_if_required()
         if repository['arguments']:
             repository['arguments'] = deserialize_via_marshal(repository['arguments'])
 
+    # Harvest phase: the repositories are harvested concurrently, and
+    # each of them is post-processed here as soon as it is harvested
+    for repository, harvest_start_time, harvested_files_list, error_code in \
+            harvest_repositories(reposlist, filepath_prefix, identifiers, datelist):
+        task_sleep_now_if_required()
         write_message("running with post-processes: %s" % (repository["postprocess"],))
 
         downloaded_material_dict = {}
 
-        # Harvest phase
-        harvested_files_list = []
-        harvestpath = "%s_%d_%s_" % (filepath_prefix, j, time.strftime("%Y%m%d%H%M%S"))
-        harvest_start_time = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
-        harvested_files_list, error_code = harvest_step(repository, harvestpath, identifiers, datelist, current_progress)
         if harvested_files_list == None or len(harvested_files_list) < 1:
             if error_code:
                 error_happened_p = error_code
@@ -181,21 +185,13 @@ def task_run_core():
         if 'c' in repository["postprocess"]:
             post_process_functions.append(convert_step)
 
-        # Fulltext?
-        if 't' in repository["postprocess"]:
-            post_process_functions.append(fulltext_step)
-
-        # Plotextract?
-        if 'p' in repository["postprocess"]:
-            post_process_functions.append(plotextract_step)
-
-        # Refextract?
-        if 'r' in repository["postprocess"]:
-            post_process_functions.append(refextract_step)
-
-        # Authorlist?
-        if 'a' in repository["postprocess"]:
-            post_process_functions.append(authorlist_step)
+        # Fulltext, plotextract, refextract, authorlist? They are run
+        # together, record by record
+        record_modes = [mode for mode in RECORD_POSTPROCESS_ORDER
+                        if mode in repository["postprocess"]]
+        if record_modes:
+            post_process_functions.append(functools.partial(record_postprocess_step,
+                                                            modes=record_modes))
 
         # Filter?
         if 'f' in repository["postprocess"]:
@@ -275,6 +271,83 @@ def task_run_core():
         return True
 
 
+def harvest_repositories(reposlist, filepath_prefix, identifiers, dates,
+                         max_workers=CFG_OAI_HARVEST_MAX_CONCURRENT_REPOSITORIES):
+    """
+    Harvest the given repositories, at most 'max_workers' of them at the
+    same time, each one in its own thread.
+
+    Only the harvest step runs in the worker threads: this generator
+    yields a tuple (repository, harvest_start_time, file_list,
+    error_code) for each repository as soon as it has been harvested,
+    in order of completion, so that the caller can post-process it (and
+    sleep or stop the task if required) while the other repositories
+    are still being harvested.
+
+    Failing to fetch or store the records of a repository is reported
+    by its error_code; any other exception raised while harvesting is
+    raised again by this generator (in the calling thread).
+    """
+    def harvest_one(j, repository):
+        """Harvest the J-th repository."""
+        current_progress = "(%i/%i)" % (j, len(reposlist))
+        harvestpath = "%s_%d_%s_" % (filepath_prefix, j, time.strftime("%Y%m%d%H%M%S"))
+        harvest_start_time = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
+        try:
+            harvested_files_list, error_code = harvest_step(repository, harvestpath, \
+                                                            identifiers, dates, \
+                                                            current_progress)
+        except oai_harvest_getter.InvenioOAIRequestError:
+            # exception already dealt with, just noting the error.
+            harvested_files_list, error_code = [], 1
+        except EnvironmentError:
+            register_exception()
+            harvested_files_list, error_code = [], 1
+        return repository, harvest_start_time, harvested_files_list, error_code
+
+    nb_workers = max(1, min(max_workers, len(reposlist)))
+    if nb_workers == 1:
+        # No need for threads: harvest one repository after the other
+        for j, repository in enumerate(reposlist):
+            yield harvest_one(j + 1, repository)
+        return
+
+    todo = Queue.Queue()
+    for j, repository in enumerate(reposlist):
+        todo.put((j + 1, repository))
+    done = Queue.Queue()
+
+    def harvest_worker():
+        """Harvest repositories until there are none left."""
+        while True:
+            try:
+                j, repository = todo.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                done.put((harvest_one(j, repository), None))
+            except:
+                # To be raised again by the main thread
+                done.put((None, sys.exc_info()))
+
+    for dummy in range(nb_workers):
+        worker = threading.Thread(target=harvest_worker)
+        worker.setDaemon(True)
+        worker.start()
+    for dummy in reposlist:
+        while True:
+            # Wait with a timeout, so that the task can still handle
+            # the signals sent by BibSched meanwhile
+            try:
+                result, exc_info = done.get(True, 1)
+                break
+            except Queue.Empty:
+                continue
+        if exc_info is not None:
+            raise exc_info[0], exc_info[1], exc_info[2]
+        yield result
+
+
 def harvest_by_identifiers(repository, identifiers, harvestpath):
     """
     Harvest an OAI repository by identifiers.
@@ -457,153 +530,139 @@ def convert_step(repository, active_files_list, *args, **kwargs):
     return updated_files_list, final_exit_code
 
 
-def plotextract_step(repository, active_files_list, downloaded_material_dict, *args, **kwargs):
+def record_postprocess_step(repository, active_files_list, downloaded_material_dict,
+                            modes="", *args, **kwargs):
     """
-    Performs the plotextraction step.
+    Performs the record-level post-processes given in MODES (among 't'
+    fulltext, 'p' plotextract, 'r' refextract and 'a' authorlist, which
+    are applied in this order).
+
+    The records of all the active files are run through a pipeline
+    where each post-process has its own pool of worker threads (see
+    CFG_OAI_HARVEST_POSTPROCESS_WORKERS), so that several records are
+    downloaded and processed at the same time.  Each file is written as
+    soon as all its records are processed.  The throughput and latency
+    of each post-process are written to the task log at the end.
     """
-    write_message("plotextraction step started")
-    if not repository["arguments"]['p_extraction-source']:
-        # No plotextractor type chosen, exit with failure
-        write_message("Error: No plotextractor source type chosen!")
-        return [], 1
-
-    final_exit_code = 0
+    modes = [mode for mode in RECORD_POSTPROCESS_ORDER if mode in modes]
+    stages = []
+    for mode in modes:
+        function = get_record_postprocess_function(mode, repository, downloaded_material_dict)
+        if function is None:
+            return [], 1
+        stages.append(PipelineStage(RECORD_POSTPROCESS_NAMES[mode], function,
+                                    CFG_OAI_HARVEST_POSTPROCESS_WORKERS.get(mode, 1)))
+    if not stages:
+        return active_files_list, 0
+    step_name = "/".join([stage.name for stage in stages])
+    suffix = RECORD_POSTPROCESS_SUFFIXES[modes[-1]]
+    write_message("%s step started" % (step_name,))
+
+    def read_records():
+        """Yield the records of the active files, one file after the other."""
+        for active_file in active_files_list:
+            try:
+                recs_fd = open(active_file, 'r')
+                try:
+                    records = recs_fd.read()
+                finally:
+                    recs_fd.close()
+            except IOError:
+                write_message("Error opening active file '%s'. Skipping.." % (active_file,))
+                continue
+            for record_xml in REGEXP_RECORD.findall(records):
+                yield {'file': active_file,
+                       'xml': record_xml,
+                       'exitcode': 0,
+                       'errors': []}
 
-    # Download tarball for each harvested/converted record, then run plotextrator.
-    # Update converted xml files with generated xml or add it for upload
     updated_files_list = []
-    i = 0
-    for active_file in active_files_list:
-        i += 1
+    final_exit_code = 0
+    pipeline = Pipeline(stages, CFG_OAI_HARVEST_POSTPROCESS_QUEUE_SIZE)
+    results = pipeline.run(read_records())
+    # the next processed record, when it belongs to the next file
+    result = None
+    for i, active_file in enumerate(active_files_list):
         task_sleep_now_if_required()
-        task_update_progress("Extracting plots from harvested material from %s (%i/%i)" % \
-                             (repository["name"], i, len(active_files_list)))
-        updated_file = "%s.plotextracted" % (os.path.splitext(active_file)[0],)
+        task_update_progress("Post-processing (%s) material harvested from %s (%i/%i)" % \
+                             (step_name, repository["name"], i + 1, len(active_files_list)))
+        updated_xml = ['<?xml version="1.0" encoding="UTF-8"?>', '<collection>']
+        exitcode = 0
+        all_err_msg = []
+        while True:
+            if result is None:
+                try:
+                    result = results.next()
+                except StopIteration:
+                    break
+            record, exc_info = result
+            if record['file'] != active_file:
+                # first record of the next file
+                break
+            result = None
+            if exc_info is not None:
+                exitcode = 1
+                all_err_msg.append("Error processing record %s:\n%s" % \
+                                   (record.get('identifier'),
+                                    "".join(traceback.format_exception(*exc_info))))
+            elif record['exitcode']:
+                exitcode = record['exitcode']
+            all_err_msg.extend(record['errors'])
+            updated_xml.append("<record>\n%s\n</record>" % (record['xml'],))
+        updated_xml.append('</collection>')
+        updated_file = "%s.%s" % (os.path.splitext(active_file)[0], suffix)
         updated_files_list.append(updated_file)
-        (exitcode, err_msg) = call_plotextractor(active_file,
-                                                 updated_file,
-                                                 downloaded_material_dict,
-                                                 repository["arguments"]['p_extraction-source'],
-                                                 repository["id"])
+        file_fd = open(updated_file, 'w')
+        file_fd.write("\n".join(updated_xml))
+        file_fd.close()
         if exitcode == 0:
-            if err_msg != "":
-                write_message("plots from %s was extracted, but with some errors:\n%s" % \
-                          (active_file, err_msg))
+            if all_err_msg:
+                write_message("%s of %s was done, but with some errors:\n%s" % \
+                              (step_name, active_file, "\n".join(all_err_msg)))
             else:
-                write_message("plots from %s was successfully extracted" % \
-                              (active_file,))
+                write_message("%s of %s was successfully done" % \
+                              (step_name, active_file))
         else:
-            write_message("an error occurred while extracting plots from %s:\n%s" % \
-                          (active_file, err_msg))
+            write_message("an error occurred during %s of %s:\n%s" % \
+                          (step_name, active_file, "\n".join(all_err_msg)))
             final_exit_code = 1
-            continue
 
+    for line in pipeline.format_statistics():
+        write_message(line)
+    write_message("%s step ended" % (step_name,))
     return updated_files_list, final_exit_code
 
 
+def plotextract_step(repository, active_files_list, downloaded_material_dict, *args, **kwargs):
+    """
+    Performs the plotextraction step.
+    """
+    return record_postprocess_step(repository, active_files_list,
+                                   downloaded_material_dict, modes="p")
+
+
 def refextract_step(repository, active_files_list, downloaded_material_dict, *args, **kwargs):
     """
     Performs the reference extraction step.
     """
-    updated_files_list = []
-    final_exit_code = 0
-    i = 0
-    write_message("refextraction step started")
-    for active_file in active_files_list:
-        i += 1
-        task_sleep_now_if_required()
-        task_update_progress("Extracting references from material harvested from %s (%i/%i)" % \
-                             (repository["name"], i, len(active_files_list)))
-        updated_file = "%s.refextracted" % (os.path.splitext(active_file)[0],)
-        updated_files_list.append(updated_file)
-        (exitcode, err_msg) = call_refextract(active_file,
-                                              updated_file,
-                                              downloaded_material_dict,
-                                              repository["arguments"],
-                                              repository["id"])
-        if exitcode == 0:
-            if err_msg != "":
-                write_message("references from %s was extracted, but with some errors:\n%s" % \
-                              (active_file, err_msg))
-            else:
-                write_message("references from %s was successfully extracted" % \
-                              (active_file,))
-        else:
-            write_message("an error occurred while extracting references from %s:\n%s" % \
-                          (active_file, err_msg))
-            final_exit_code = 1
-            continue
-
-    return updated_files_list, final_exit_code
+    return record_postprocess_step(repository, active_files_list,
+                                   downloaded_material_dict, modes="r")
 
 
 def authorlist_step(repository, active_files_list, downloaded_material_dict, *args, **kwargs):
     """
     Performs the special authorlist extraction step (Mostly INSPIRE/CERN related).
     """
-    write_message("authorlist extraction step started")
-    updated_files_list = []
-    final_exit_code = 0
-    i = 0
-    for active_file in active_files_list:
-        i += 1
-        task_sleep_now_if_required()
-        task_update_progress("Extracting any authorlists from material harvested from %s (%i/%i)" % \
-                             (repository["name"], i, len(active_files_list)))
-        updated_file = "%s.authextracted" % (os.path.splitext(active_file)[0],)
-        updated_files_list.append(updated_file)
-        (exitcode, err_msg) = call_authorlist_extract(active_file,
-                                                      updated_file,
-                                                      downloaded_material_dict,
-                                                      repository["arguments"].get('a_rt-queue', ""),
-                                                      repository["arguments"].get('a_stylesheet', "authorlist2marcxml.xsl"),
-                                                      repository["id"])
-        if exitcode == 0:
-            if err_msg != "":
-                write_message("authorlists from %s was extracted, but with some errors:\n%s" % \
-                              (active_file, err_msg))
-            else:
-                write_message("any authorlists from %s was successfully extracted" % \
-                              (active_file,))
-        else:
-            write_message("an error occurred while extracting authorlists from %s:\n%s" % \
-                          (active_file, err_msg))
-            final_exit_code = 1
-            continue
-
-    return updated_files_list, final_exit_code
+    return record_postprocess_step(repository, active_files_list,
+                                   downloaded_material_dict, modes="a")
 
 
 def fulltext_step(repository, active_files_list, downloaded_material_dict, *args, **kwargs):
     """
     Performs the fulltext download step.
     """
-    write_message("full-text attachment step started")
-    updated_files_list = []
-    final_exit_code = 0
-    i = 0
-    for active_file in active_files_list:
-        i += 1
-        task_sleep_now_if_required()
-        task_update_progress("Attaching fulltext to records harvested from %s (%i/%i)" % \
-                             (repository["name"], i, len(active_files_list)))
-        updated_file = "%s.fulltext" % (os.path.splitext(active_file)[0],)
-        updated_files_list.append(updated_file)
-        (exitcode, err_msg) = call_fulltext(active_file,
-                                            updated_file,
-                                            downloaded_material_dict,
-                                            repository["arguments"].get('t_doctype', ""),
-                                            repository["id"])
-        if exitcode == 0:
-            write_message("fulltext from %s was successfully attached" % \
-                          (active_file,))
-        else:
-            write_message("an error occurred while attaching fulltext to %s:\n%s" % \
-                          (active_file, err_msg))
-            final_exit_code = 1
-            continue
-
-    return updated_files_list, final_exit_code
+    return record_postprocess_step(repository, active_files_list,
+                                   downloaded_material_dict, modes="t")
 
 
 def filter_step(repository, active_files_list, *args, **kwargs):
@@ -722,7 +781,8 @@ def oai_harvest_get(prefix, baseurl, harvestpath,
             sets = [oai_set.strip() for oai_set in setspecs.split(' ')]
 
         harvested_files = oai_harvest_getter.harvest(network_location, path, http_param_dict, method, harvestpath,
-                                   sets, secure, user, password, cert_file, key_file)
+                                   sets, secure, user, password, cert_file, key_file,
+                                   records_per_file=CFG_OAI_HARVEST_RECORDS_PER_FILE)
         if verb == "ListRecords":
             remove_duplicates(harvested_files)
         return harvested_files
@@ -745,19 +805,292 @@ def call_bibconvert(config, harvestpath, convertpath):
                           args=(CFG_BINDIR, config, harvestpath), filename_out=convertpath)
     return (exitcode, cmd_stderr)
 
-def call_plotextractor(active_file, extracted_file,
-                       downloaded_files, plotextractor_types, source_id):
+def get_harvested_record_identifier(record):
     """
-    Function that generates proper MARCXML containing harvested plots for
-    each record.
+    Return the OAI identifier of a harvested record, as found in its
+    MARCXML, looking it up only once per record.
 
-    @param active_file: path to the currently processed file
-    @param extracted_file: path to the file where the final results will be saved
+    @param record: dict with the MARCXML of the record (without its
+        enclosing record tags) in 'xml'.
+    """
+    if 'identifier' not in record:
+        id_list = record_collect_oai_identifiers("<record>" + record['xml'] + "</record>")
+        # We bet on the first one.
+        identifier = None
+        for oai_id in id_list or []:
+            if "oai" in oai_id.lower():
+                identifier = oai_id
+                break
+        write_message("OAI identifier found in record: %s" % (identifier,), verbose=6)
+        record['identifier'] = identifier
+    return record['identifier']
+
+def plotextract_record(record, downloaded_files, plotextractor_types, source_id):
+    """
+    Add the plots extracted from the tarball of a harvested record to it.
+
+    @param record: dict with the path to the file the record comes from
+        in 'file', its MARCXML in 'xml', its exitcode in 'exitcode' and
+        its list of error messages in 'errors', which are all updated.
     @param downloaded_files: dict of identifier -> dict mappings for downloaded material.
     @param plotextractor_types: list of names of which plotextractor(s) to use (latex or pdf)
         (pdf is currently ignored).
     @param source_id: the repository identifier
 
+    @return: the record
+    """
+    identifier = get_harvested_record_identifier(record)
+    if identifier not in downloaded_files:
+        downloaded_files[identifier] = {}
+    if not oaiharvest_templates.tmpl_should_process_record_with_mode(record['xml'], 'p', source_id):
+        # We skip this record
+        return record
+    if 'latex' in plotextractor_types:
+        current_exitcode = 0
+        # Run LaTeX plotextractor
+        if "tarball" not in downloaded_files[identifier]:
+            current_exitcode, err_msg, tarball, dummy = \
+                        plotextractor_harvest(identifier, record['file'], selection=["tarball"])
+            if current_exitcode != 0:
+                record['errors'].append(err_msg)
+            else:
+                downloaded_files[identifier]["tarball"] = tarball
+        if current_exitcode == 0:
+            plotextracted_xml_path = process_single(downloaded_files[identifier]["tarball"])
+            if plotextracted_xml_path != None:
+                # We store the path to the directory the tarball contents live
+                downloaded_files[identifier]["tarball-extracted"] = os.path.split(plotextracted_xml_path)[0]
+                # Read and grab MARCXML from plotextractor run
+                plotsxml_fd = open(plotextracted_xml_path, 'r')
+                plotextracted_xml = plotsxml_fd.read()
+                plotsxml_fd.close()
+                re_list = REGEXP_RECORD.findall(plotextracted_xml)
+                if re_list != []:
+                    # Add final FFT info from LaTeX plotextractor to record.
+                    record['xml'] += "\n" + re_list[0]
+    return record
+
+def get_refextract_flags(arguments):
+    """
+    Return the command line flags of refextract for the given
+    post-process arguments (r_format, r_kb-journal-file,
+    r_kb-rep-no-file).
+    """
+    flags = []
+    if arguments.get('r_format'):
+        flags.append("--%s" % (arguments['r_format'],))
+    elif CFG_INSPIRE_SITE:
+        flags.append("--inspire")
+    if arguments.get('r_kb-journal-file'):
+        flags.append("--kb-journal '%s'" % (arguments['r_kb-journal-file'],))
+    if arguments.get('r_kb-rep-no-file'):
+        flags.append("--kb-report-number '%s'" % (arguments['r_kb-rep-no-file'],))
+    return " ".join(flags)
+
+def refextract_record(record, downloaded_files, flag, source_id):
+    """
+    Add the references extracted from the fulltext of a harvested
+    record to it, downloading the fulltext-pdf if necessary.
+
+    @param record: the record, see plotextract_record().
+    @param downloaded_files: dict of identifier -> dict mappings for downloaded material.
+    @param flag: refextract command line flags, see get_refextract_flags().
+    @param source_id: the repository identifier
+
+    @return: the record
+    """
+    identifier = get_harvested_record_identifier(record)
+    if identifier not in downloaded_files:
+        downloaded_files[identifier] = {}
+    if not oaiharvest_templates.tmpl_should_process_record_with_mode(record['xml'], 'p', source_id):
+        # We skip this record
+        return record
+    current_exitcode = 0
+    if "pdf" not in downloaded_files[identifier]:
+        current_exitcode, err_msg, dummy, pdf = \
+                    plotextractor_harvest(identifier, record['file'], selection=["pdf"])
+        if current_exitcode != 0:
+            record['errors'].append(err_msg)
+        else:
+            downloaded_files[identifier]["pdf"] = pdf
+    if current_exitcode == 0:
+        current_exitcode, cmd_stdout, err_msg = run_shell_command(cmd="%s/refextract %s -f '%s'" % \
+                                            (CFG_BINDIR, flag, downloaded_files[identifier]["pdf"]))
+        if err_msg != "" or current_exitcode != 0:
+            record['exitcode'] = current_exitcode
+            record['errors'].append("Error extracting references from id: %s\nError:%s" % \
+                                    (identifier, err_msg))
+        else:
+            references_xml = REGEXP_REFS.search(cmd_stdout)
+            if references_xml:
+                record['xml'] += "\n" + references_xml.group(1)
+    return record
+
+def authorlist_record(record, downloaded_files, queue, stylesheet, source_id):
+    """
+    Replace the authors of a harvested record by the ones found in any
+    authorlist of its tarball, converted using a XSLT stylesheet.
+
+    @param record: the record, see plotextract_record().
+    @param downloaded_files: dict of identifier -> dict mappings for downloaded material.
+    @param queue: name of the RT queue
+    @param stylesheet: the stylesheet converting authorlists to MARCXML
+    @param source_id: the repository identifier
+
+    @return: the record
+    """
+    record_xml = record['xml']
+    if not oaiharvest_templates.tmpl_should_process_record_with_mode(record_xml, 'p', source_id):
+        # We skip this record
+        return record
+    identifier = get_harvested_record_identifier(record)
+
+    # Grab BibRec instance of current record for later amending
+    existing_record, status_code, dummy1 = create_record("<record>%s</record>" % (record_xml,))
+    if status_code == 0:
+        record['errors'].append("Error parsing record, skipping authorlist extraction of: %s\n" % \
+                                (identifier,))
+        return record
+    if identifier not in downloaded_files:
+        downloaded_files[identifier] = {}
+    current_exitcode = 0
+    if "tarball" not in downloaded_files[identifier]:
+        current_exitcode, err_msg, tarball, dummy = \
+                    plotextractor_harvest(identifier, record['file'], selection=["tarball"])
+        if current_exitcode != 0:
+            record['errors'].append(err_msg)
+        else:
+            downloaded_files[identifier]["tarball"] = tarball
+    if current_exitcode == 0:
+        current_exitcode, err_msg, authorlist_xml_path = authorlist_extract(downloaded_files[identifier]["tarball"], \
+                                                                            identifier, downloaded_files, stylesheet)
+        if current_exitcode != 0:
+            record['exitcode'] = current_exitcode
+            record['errors'].append("Error extracting authors from id: %s\nError:%s" % \
+                                    (identifier, err_msg))
+        elif authorlist_xml_path is not None:
+            ## Authorlist found
+            # Read and create BibRec
+            xml_fd = open(authorlist_xml_path, 'r')
+            author_xml = xml_fd.read()
+            xml_fd.close()
+            authorlist_records = create_records(author_xml)
+            if len(authorlist_records) == 1:
+                if authorlist_records[0][0] == None:
+                    record['errors'].append("Error parsing authorlist record for id: %s" % \
+                                            (identifier,))
+                    return record
+                authorlist_bibrec = authorlist_records[0][0]
+                # Convert any LaTeX symbols in authornames
+                translate_fieldvalues_from_latex(authorlist_bibrec, '100', code='a')
+                translate_fieldvalues_from_latex(authorlist_bibrec, '700', code='a')
+                # Look for any UNDEFINED fields in authorlist
+                key = "UNDEFINED"
+                matching_fields = record_find_matching_fields(key, authorlist_bibrec, tag='100') \
+                                  + record_find_matching_fields(key, authorlist_bibrec, tag='700')
+                if len(matching_fields) > 0:
+                    # UNDEFINED found. Create ticket in author queue
+                    ticketid = create_authorlist_ticket(matching_fields, \
+                                                        identifier, queue)
+                    if ticketid:
+                        write_message("authorlist RT ticket %d submitted for %s" % (ticketid, identifier))
+                    else:
+                        record['errors'].append("Error while submitting RT ticket for %s" % (identifier,))
+                # Replace 100,700 fields of original record with extracted fields
+                record_delete_fields(existing_record, '100')
+                record_delete_fields(existing_record, '700')
+                first_author = record_get_field_instances(authorlist_bibrec, '100')
+                additional_authors = record_get_field_instances(authorlist_bibrec, '700')
+                record_add_fields(existing_record, '100', first_author)
+                record_add_fields(existing_record, '700', additional_authors)
+
+    record['xml'] = REGEXP_RECORD.search(record_xml_output(existing_record)).group(1)
+    return record
+
+def fulltext_record(record, downloaded_files, doctype, source_id):
+    """
+    Attach the fulltext-pdf of a harvested record to it with a FFT tag,
+    downloading it if necessary.
+
+    @param record: the record, see plotextract_record().
+    @param downloaded_files: dict of identifier -> dict mappings for downloaded material.
+    @param doctype: doctype of downloaded file in BibDocFile
+    @param source_id: the repository identifier
+
+    @return: the record
+    """
+    identifier = get_harvested_record_identifier(record)
+    if identifier not in downloaded_files:
+        downloaded_files[identifier] = {}
+    if not oaiharvest_templates.tmpl_should_process_record_with_mode(record['xml'], 'p', source_id):
+        # We skip this record
+        return record
+    current_exitcode = 0
+    if "pdf" not in downloaded_files[identifier]:
+        current_exitcode, err_msg, dummy, pdf = \
+                    plotextractor_harvest(identifier, record['file'], selection=["pdf"])
+        if current_exitcode != 0:
+            record['errors'].append(err_msg)
+        else:
+            downloaded_files[identifier]["pdf"] = pdf
+    if current_exitcode == 0:
+        fulltext_xml = """  <datafield tag="FFT" ind1=" " ind2=" ">
+    <subfield code="a">%(url)s</subfield>
+    <subfield code="t">%(doctype)s</subfield>
+  </datafield>""" % {'url': downloaded_files[identifier]["pdf"],
+                     'doctype': doctype}
+        record['xml'] += "\n" + fulltext_xml
+    return record
+
+## the record-level post-processes, in the order they are applied, with
+## the name of their step and the suffix of the files they write
+RECORD_POSTPROCESS_ORDER = ['t', 'p', 'r', 'a']
+RECORD_POSTPROCESS_NAMES = {'t': 'fulltext',
+                            'p': 'plotextraction',
+                            'r': 'refextraction',
+                            'a': 'authorlist extraction'}
+RECORD_POSTPROCESS_SUFFIXES = {'t': 'fulltext',
+                               'p': 'plotextracted',
+                               'r': 'refextracted',
+                               'a': 'authextracted'}
+
+def get_record_postprocess_function(mode, repository, downloaded_files):
+    """
+    Return the function applying the record-level post-process MODE
+    (see RECORD_POSTPROCESS_ORDER) of the given repository to one
+    harvested record, or None if the post-process is misconfigured.
+    """
+    arguments = repository["arguments"]
+    source_id = repository["id"]
+    if mode == 't':
+        return lambda record: fulltext_record(record, downloaded_files,
+                                              arguments.get('t_doctype', ""),
+                                              source_id)
+    elif mode == 'p':
+        if not arguments.get('p_extraction-source'):
+            # No plotextractor type chosen, exit with failure
+            write_message("Error: No plotextractor source type chosen!")
+            return None
+        return lambda record: plotextract_record(record, downloaded_files,
+                                                 arguments['p_extraction-source'],
+                                                 source_id)
+    elif mode == 'r':
+        flag = get_refextract_flags(arguments)
+        return lambda record: refextract_record(record, downloaded_files,
+                                                flag, source_id)
+    elif mode == 'a':
+        return lambda record: authorlist_record(record, downloaded_files,
+                                                arguments.get('a_rt-queue', ""),
+                                                arguments.get('a_stylesheet', "authorlist2marcxml.xsl"),
+                                                source_id)
+    return None
+
+def call_record_function(active_file, extracted_file, function):
+    """
+    Apply FUNCTION to each record of the file at 'active_file', one
+    after the other, and save the resulting collection in the file at
+    'extracted_file'.
+
     @return: exitcode and any error messages as: (exitcode, err_msg)
     """
     all_err_msg = []
@@ -767,53 +1100,19 @@ def call_plotextractor(active_file, extracted_file,
     records = recs_fd.read()
     recs_fd.close()
 
-    # Find all record
+    # Find all records
     record_xmls = REGEXP_RECORD.findall(records)
     updated_xml = ['<?xml version="1.0" encoding="UTF-8"?>']
     updated_xml.append('<collection>')
     for record_xml in record_xmls:
-        current_exitcode = 0
-
-        id_list = record_collect_oai_identifiers("<record>" + record_xml + "</record>")
-        # We bet on the first one.
-        identifier = None
-        for oai_id in id_list:
-            if "oai" in oai_id.lower():
-                identifier = oai_id
-                break
-        write_message("OAI identifier found in record: %s" % (identifier,), verbose=6)
-
-        if identifier not in downloaded_files:
-            downloaded_files[identifier] = {}
-        updated_xml.append("<record>")
-        updated_xml.append(record_xml)
-        if not oaiharvest_templates.tmpl_should_process_record_with_mode(record_xml, 'p', source_id):
-            # We skip this record
-            updated_xml.append("</record>")
-            continue
-        if 'latex' in plotextractor_types:
-            # Run LaTeX plotextractor
-            if "tarball" not in downloaded_files[identifier]:
-                current_exitcode, err_msg, tarball, dummy = \
-                            plotextractor_harvest(identifier, active_file, selection=["tarball"])
-                if current_exitcode != 0:
-                    all_err_msg.append(err_msg)
-                else:
-                    downloaded_files[identifier]["tarball"] = tarball
-            if current_exitcode == 0:
-                plotextracted_xml_path = process_single(downloaded_files[identifier]["tarball"])
-                if plotextracted_xml_path != None:
-                    # We store the path to the directory the tarball contents live
-                    downloaded_files[identifier]["tarball-extracted"] = os.path.split(plotextracted_xml_path)[0]
-                    # Read and grab MARCXML from plotextractor run
-                    plotsxml_fd = open(plotextracted_xml_path, 'r')
-                    plotextracted_xml = plotsxml_fd.read()
-                    plotsxml_fd.close()
-                    re_list = REGEXP_RECORD.findall(plotextracted_xml)
-                    if re_list != []:
-                        # Add final FFT info from LaTeX plotextractor to record.
-                        updated_xml.append(re_list[0])
-        updated_xml.append("</record>")
+        record = function({'file': active_file,
+                           'xml': record_xml,
+                           'exitcode': 0,
+                           'errors': []})
+        if record['exitcode']:
+            exitcode = record['exitcode']
+        all_err_msg.extend(record['errors'])
+        updated_xml.append("<record>\n%s\n</record>" % (record['xml'],))
     updated_xml.append('</collection>')
     # Write to file
     file_fd = open(extracted_file, 'w')
@@ -823,6 +1122,25 @@ def call_plotextractor(active_file, extracted_file,
         return exitcode, "\n".join(all_err_msg)
     return exitcode, ""
 
+def call_plotextractor(active_file, extracted_file,
+                       downloaded_files, plotextractor_types, source_id):
+    """
+    Function that generates proper MARCXML containing harvested plots for
+    each record.
+
+    @param active_file: path to the currently processed file
+    @param extracted_file: path to the file where the final results will be saved
+    @param downloaded_files: dict of identifier -> dict mappings for downloaded material.
+    @param plotextractor_types: list of names of which plotextractor(s) to use (latex or pdf)
+        (pdf is currently ignored).
+    @param source_id: the repository identifier
+
+    @return: exitcode and any error messages as: (exitcode, err_msg)
+    """
+    return call_record_function(active_file, extracted_file,
+                                lambda record: plotextract_record(record, downloaded_files,
+                                                                  plotextractor_types, source_id))
+
 def call_refextract(active_file, extracted_file,
                     downloaded_files, arguments, source_id):
     """
@@ -838,76 +1156,10 @@ def call_refextract(active_file, extracted_file,
     @param source_id: the repository identifier
     @return: exitcode and any error messages as: (exitcode, all_err_msg)
     """
-    all_err_msg = []
-    exitcode = 0
-
-    flags = []
-    if arguments.get('r_format'):
-        flags.append("--%s" % (arguments['r_format'],))
-    elif CFG_INSPIRE_SITE:
-        flags.append("--inspire")
-    if arguments.get('r_kb-journal-file'):
-        flags.append("--kb-journal '%s'" % (arguments['r_kb-journal-file'],))
-    if arguments.get('r_kb-rep-no-file'):
-        flags.append("--kb-report-number '%s'" % (arguments['r_kb-rep-no-file'],))
-
-    flag = " ".join(flags)
-    # Read in active file
-    recs_fd = open(active_file, 'r')
-    records = recs_fd.read()
-    recs_fd.close()
-
-    # Find all record
-    record_xmls = REGEXP_RECORD.findall(records)
-    updated_xml = ['<?xml version="1.0" encoding="UTF-8"?>']
-    updated_xml.append('<collection>')
-    for record_xml in record_xmls:
-        current_exitcode = 0
-
-        id_list = record_collect_oai_identifiers("<record>" + record_xml + "</record>")
-        # We bet on the first one.
-        identifier = None
-        for oai_id in id_list:
-            if "oai" in oai_id.lower():
-                identifier = oai_id
-                break
-        write_message("OAI identifier found in record: %s" % (identifier,), verbose=6)
-
-        if identifier not in downloaded_files:
-            downloaded_files[identifier] = {}
-        updated_xml.append("<record>")
-        updated_xml.append(record_xml)
-        if not oaiharvest_templates.tmpl_should_process_record_with_mode(record_xml, 'p', source_id):
-            # We skip this record
-            updated_xml.append("</record>")
-            continue
-        if "pdf" not in downloaded_files[identifier]:
-            current_exitcode, err_msg, dummy, pdf = \
-                        plotextractor_harvest(identifier, active_file, selection=["pdf"])
-            if current_exitcode != 0:
-                all_err_msg.append(err_msg)
-            else:
-                downloaded_files[identifier]["pdf"] = pdf
-        if current_exitcode == 0:
-            current_exitcode, cmd_stdout, err_msg = run_shell_command(cmd="%s/refextract %s -f '%s'" % \
-                                                (CFG_BINDIR, flag, downloaded_files[identifier]["pdf"]))
-            if err_msg != "" or current_exitcode != 0:
-                exitcode = current_exitcode
-                all_err_msg.append("Error extracting references from id: %s\nError:%s" % \
-                         (identifier, err_msg))
-            else:
-                references_xml = REGEXP_REFS.search(cmd_stdout)
-                if references_xml:
-                    updated_xml.append(references_xml.group(1))
-        updated_xml.append("</record>")
-    updated_xml.append('</collection>')
-    # Write to file
-    file_fd = open(extracted_file, 'w')
-    file_fd.write("\n".join(updated_xml))
-    file_fd.close()
-    if len(all_err_msg) > 0:
-        return exitcode, "\n".join(all_err_msg)
-    return exitcode, ""
+    flag = get_refextract_flags(arguments)
+    return call_record_function(active_file, extracted_file,
+                                lambda record: refextract_record(record, downloaded_files,
+                                                                 flag, source_id))
 
 def call_authorlist_extract(active_file, extracted_file,
                             downloaded_files, queue, stylesheet, source_id):
@@ -933,105 +1185,9 @@ def call_authorlist_extract(active_file, extracted_file,
     @return: exitcode and any error messages as: (exitcode, all_err_msg)
     @rtype: tuple
     """
-    all_err_msg = []
-    exitcode = 0
-
-    # Read in active file
-    recs_fd = open(active_file, 'r')
-    records = recs_fd.read()
-    recs_fd.close()
-
-    # Find all records
-    record_xmls = REGEXP_RECORD.findall(records)
-    updated_xml = ['<?xml version="1.0" encoding="UTF-8"?>']
-    updated_xml.append('<collection>')
-    for record_xml in record_xmls:
-        current_exitcode = 0
-        if not oaiharvest_templates.tmpl_should_process_record_with_mode(record_xml, 'p', source_id):
-            # We skip this record
-            updated_xml.append("<record>")
-            updated_xml.append(record_xml)
-            updated_xml.append("</record>")
-            continue
-
-        id_list = record_collect_oai_identifiers("<record>" + record_xml + "</record>")
-        # We bet on the first one.
-        identifier = None
-        for oai_id in id_list:
-            if "oai" in oai_id.lower():
-                identifier = oai_id
-                break
-        write_message("OAI identifier found in record: %s" % (identifier,), verbose=6)
-
-        # Grab BibRec instance of current record for later amending
-        existing_record, status_code, dummy1 = create_record("<record>%s</record>" % (record_xml,))
-        if status_code == 0:
-            all_err_msg.append("Error parsing record, skipping authorlist extraction of: %s\n" % \
-                               (identifier,))
-            updated_xml.append("<record>%s</record>" % (record_xml,))
-            continue
-        if identifier not in downloaded_files:
-            downloaded_files[identifier] = {}
-        if "tarball" not in downloaded_files[identifier]:
-            current_exitcode, err_msg, tarball, dummy = \
-                        plotextractor_harvest(identifier, active_file, selection=["tarball"])
-            if current_exitcode != 0:
-                all_err_msg.append(err_msg)
-            else:
-                downloaded_files[identifier]["tarball"] = tarball
-        if current_exitcode == 0:
-            current_exitcode, err_msg, authorlist_xml_path = authorlist_extract(downloaded_files[identifier]["tarball"], \
-                                                                                identifier, downloaded_files, stylesheet)
-            if current_exitcode != 0:
-                exitcode = current_exitcode
-                all_err_msg.append("Error extracting authors from id: %s\nError:%s" % \
-                         (identifier, err_msg))
-            elif authorlist_xml_path is not None:
-                ## Authorlist found
-                # Read and create BibRec
-                xml_fd = open(authorlist_xml_path, 'r')
-                author_xml = xml_fd.read()
-                xml_fd.close()
-                authorlist_record = create_records(author_xml)
-                if len(authorlist_record) == 1:
-                    if authorlist_record[0][0] == None:
-                        all_err_msg.append("Error parsing authorlist record for id: %s" % \
-                             (identifier,))
-                        continue
-                    authorlist_record = authorlist_record[0][0]
-                    # Convert any LaTeX symbols in authornames
-                    translate_fieldvalues_from_latex(authorlist_record, '100', code='a')
-                    translate_fieldvalues_from_latex(authorlist_record, '700', code='a')
-                    # Look for any UNDEFINED fields in authorlist
-                    key = "UNDEFINED"
-                    matching_fields = record_find_matching_fields(key, authorlist_record, tag='100') \
-                                      + record_find_matching_fields(key, authorlist_record, tag='700')
-                    if len(matching_fields) > 0:
-                        # UNDEFINED found. Create ticket in author queue
-                        ticketid = create_authorlist_ticket(matching_fields, \
-                                                            identifier, queue)
-                        if ticketid:
-                            write_message("authorlist RT ticket %d submitted for %s" % (ticketid, identifier))
-                        else:
-                            all_err_msg.append("Error while submitting RT ticket for %s" % (identifier,))
-                    # Replace 100,700 fields of original record with extracted fields
-                    record_delete_fields(existing_record, '100')
-                    record_delete_fields(existing_record, '700')
-                    first_author = record_get_field_instances(authorlist_record, '100')
-                    additional_authors = record_get_field_instances(authorlist_record, '700')
-                    record_add_fields(existing_record, '100', first_author)
-                    record_add_fields(existing_record, '700', additional_authors)
-
-        updated_xml.append(record_xml_output(existing_record))
-    updated_xml.append('</collection>')
-    # Write to file
-    file_fd = open(extracted_file, 'w')
-    file_fd.write("\n".join(updated_xml))
-    file_fd.close()
-
-    if len(all_err_msg) > 0:
-        return exitcode, "\n".join(all_err_msg)
-    return exitcode, ""
+    return call_record_function(active_file, extracted_file,
+                                lambda record: authorlist_record(record, downloaded_files,
+                                                                 queue, stylesheet, source_id))
 
 def call_fulltext(active_file, extracted_file,
                   downloaded_files, doctype, source_id):
@@ -1047,61 +1203,9 @@ def call_fulltext(active_file, extracted_file,
 
     @return: exitcode and any error messages as: (exitcode, err_msg)
     """
-    all_err_msg = []
-    exitcode = 0
-    # Read in active file
-    recs_fd = open(active_file, 'r')
-    records = recs_fd.read()
-    recs_fd.close()
-
-    # Find all records
-    record_xmls = REGEXP_RECORD.findall(records)
-    updated_xml = ['<?xml version="1.0" encoding="UTF-8"?>']
-    updated_xml.append('<collection>')
-    for record_xml in record_xmls:
-        current_exitcode = 0
-
-        id_list = record_collect_oai_identifiers("<record>" + record_xml + "</record>")
-        # We bet on the first one.
-        identifier = None
-        for oai_id in id_list:
-            if "oai" in oai_id.lower():
-                identifier = oai_id
-                break
-        write_message("OAI identifier found in record: %s" % (identifier,), verbose=6)
-
-        if identifier not in downloaded_files:
-            downloaded_files[identifier] = {}
-        updated_xml.append("<record>")
-        updated_xml.append(record_xml)
-        if not oaiharvest_templates.tmpl_should_process_record_with_mode(record_xml, 'p', source_id):
-            # We skip this record
-            updated_xml.append("</record>")
-            continue
-        if "pdf" not in downloaded_files[identifier]:
-            current_exitcode, err_msg, dummy, pdf = \
-                        plotextractor_harvest(identifier, active_file, selection=["pdf"])
-            if current_exitcode != 0:
-                all_err_msg.append(err_msg)
-            else:
-                downloaded_files[identifier]["pdf"] = pdf
-        if current_exitcode == 0:
-            fulltext_xml = """  <datafield tag="FFT" ind1=" " ind2=" ">
-    <subfield code="a">%(url)s</subfield>
-    <subfield code="t">%(doctype)s</subfield>
-  </datafield>""" % {'url': downloaded_files[identifier]["pdf"],
-                     'doctype': doctype}
-            updated_xml.append(fulltext_xml)
-        updated_xml.append("</record>")
-    updated_xml.append('</collection>')
-    # Write to file
-    file_fd = open(extracted_file, 'w')
-    file_fd.write("\n".join(updated_xml))
-    file_fd.close()
-
-    if len(all_err_msg) > 0:
-        return exitcode, "\n".join(all_err_msg)
-    return exitcode, ""
+    return call_record_function(active_file, extracted_file,
+                                lambda record: fulltext_record(record, downloaded_files,
+                                                               doctype, source_id))
 
 
 def authorlist_extract(tarball_path, identifier, downloaded_files, stylesheet):
@@ -1163,6 +1267,26 @@ def authorlist_extract(tarball_path, identifier, downloaded_files, stylesheet):
     return 0, "", None
 
 
+## Downloads are shared by all the post-processing threads, so that
+## they start at least CFG_PLOTEXTRACTOR_DOWNLOAD_TIMEOUT seconds apart.
+_DOWNLOAD_LOCK = threading.Lock()
+_LAST_DOWNLOAD_TIME = [0]
+
+def wait_for_download_slot():
+    """
+    Sleep until CFG_PLOTEXTRACTOR_DOWNLOAD_TIMEOUT seconds have passed
+    since the previous download, of any thread, was started.
+    """
+    _DOWNLOAD_LOCK.acquire()
+    try:
+        delay = _LAST_DOWNLOAD_TIME[0] + CFG_PLOTEXTRACTOR_DOWNLOAD_TIMEOUT - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        _LAST_DOWNLOAD_TIME[0] = time.time()
+    finally:
+        _DOWNLOAD_LOCK.release()
+
+
 def plotextractor_harvest(identifier, active_file, selection=["pdf", "tarball"]):
     """
     Function that calls plotextractor library to download selected material,
@@ -1182,8 +1306,8 @@ def plotextractor_harvest(identifier, active_file, selection=["pdf", "tarball"])
     # to let harvested material in same folder structure
     active_name = "_".join(active_name.split('_')[:-2]) + "_material"
     extract_path = make_single_directory(active_dir, active_name)
+    wait_for_download_slot()
     tarball, pdf = harvest_single(identifier, extract_path, selection)
-    time.sleep(CFG_PLOTEXTRACTOR_DOWNLOAD_TIMEOUT)
     if tarball == None and "tarball" in selection:
         all_err_msg.append("Error harvesting tarball from id: %s %s" % \
                      (identifier, extract_path))
@@ -35,6 +35,7 @@ try:
     import base64
     import tempfile
     import os
+    import threading
 except ImportError, e:
     print "Error: %s" % e
     sys.exit(1)
@@ -61,6 +62,10 @@ http_response_status_code = {
     "503" : "Service Unavailable"
 }
 
+## precompile some often-used regexp for speed reasons:
+REGEXP_RESUMPTION_TOKEN = re.compile('<resumptionToken.*>(.+)</resumptionToken>', re.DOTALL)
+REGEXP_RECORD_TAG = re.compile(r'<(/?)record\b[^>]*?(/?)>')
+
 def http_param_resume(http_param_dict, resumptionToken):
     "Change parameter dictionary for harvest resumption"
 
@@ -76,15 +81,189 @@ def http_request_parameters(http_param_dict, method="POST"):
 
     return urllib.urlencode(http_param_dict)
 
+def get_resumption_token(harvested_data):
+    """Return the resumption token found in the given OAI answer, or
+    None if this is the last answer of the session."""
+    rt_obj = REGEXP_RESUMPTION_TOKEN.search(harvested_data)
+    if rt_obj is not None:
+        return rt_obj.group(1)
+    return None
+
+class OAI_Prefetcher(threading.Thread):
+    """Perform one OAI_Request in a background thread, so that the next
+    answer of a session is downloaded while the current one is being
+    processed.  The answer (or the exception raised while fetching it)
+    is given back by result()."""
+
+    def __init__(self, *request_args):
+        threading.Thread.__init__(self)
+        self.setDaemon(True)
+        self.request_args = request_args
+        self.harvested_data = None
+        self.exc_info = None
+
+    def run(self):
+        try:
+            self.harvested_data = OAI_Request(*self.request_args)
+        except (StandardError, InvenioOAIRequestError):
+            self.exc_info = sys.exc_info()
+
+    def result(self):
+        """Wait for the request to be done and return its answer."""
+        if self.ident is not None:
+            # started in the background (not simply run())
+            self.join()
+        if self.exc_info is not None:
+            raise self.exc_info[0], self.exc_info[1], self.exc_info[2]
+        return self.harvested_data
+
+def OAI_Session_answers(server, script, http_param_dict, method="POST",
+                        secure=False, user=None, password=None,
+                        cert_file=None, key_file=None, prefetch=True):
+    """Generator yielding the successive answers of one OAI session (1
+    request, which might lead to multiple answers because of resumption
+    tokens).
+
+    If 'prefetch' is True, the request for the next answer is sent in a
+    background thread as soon as its resumption token is known, i.e.
+    before yielding the current answer to the caller, so that
+    downloading the next answer and processing the current one
+    overlap.
+    """
+    harvested_data = OAI_Request(server, script,
+                                 http_request_parameters(http_param_dict, method), method,
+                                 secure, user, password, key_file, cert_file)
+    while True:
+        resumption_token = get_resumption_token(harvested_data)
+        next_request = None
+        if resumption_token:
+            http_param_dict = http_param_resume(http_param_dict, resumption_token)
+            next_request = OAI_Prefetcher(server, script,
+                                          http_request_parameters(http_param_dict, method), method,
+                                          secure, user, password, key_file, cert_file)
+            if prefetch:
+                next_request.start()
+        yield harvested_data
+        if next_request is None:
+            break
+        if not prefetch:
+            next_request.run()
+        harvested_data = next_request.result()
+
+def split_oai_records(harvested_data, verb="ListRecords"):
+    """Split an OAI answer into its header, the list of its top-level
+    <record> elements and its footer.
+
+    Nested <record> elements (e.g. the MARCXML record embedded in the
+    metadata of an OAI record) are kept inside their OAI record.
+
+    Returns a tuple (header, records, footer), or None if the answer
+    does not contain the list of records of the given verb.
+    """
+    start_tag = "<%s>" % verb
+    end_tag = "</%s>" % verb
+    start = harvested_data.find(start_tag)
+    if start == -1:
+        return None
+    start += len(start_tag)
+    end = harvested_data.rfind(end_tag)
+    if end == -1:
+        end = len(harvested_data)
+    records = []
+    depth = 0
+    record_start = None
+    for match in REGEXP_RECORD_TAG.finditer(harvested_data, start, end):
+        if match.group(2):
+            # empty element <record/>
+            continue
+        if not match.group(1):
+            if depth == 0:
+                record_start = match.start()
+            depth += 1
+        elif depth > 0:
+            depth -= 1
+            if depth == 0:
+                records.append(harvested_data[record_start:match.end()])
+    return harvested_data[:start], records, harvested_data[end:]
+
+class OAI_RecordSplitter(object):
+    """Regroup the records of the successive answers of OAI sessions
+    into files of at most 'records_per_file' records.
+
+    Each answer is split as soon as it is received, and each file is
+    written as soon as it is full, so that the harvested records never
+    need to be held in memory or on disk twice.  Every file is a valid
+    OAI answer, made of the header of the first answer contributing to
+    it, its records, and the closing tags.  Answers that do not list
+    records (e.g. errors, or other verbs) are saved untouched in their
+    own file.
+
+    If 'records_per_file' is 0, each answer is saved in its own file.
+    """
+
+    def __init__(self, output, verb="ListRecords", records_per_file=0,
+                 file_nbr=0):
+        self.output_path, self.output_name = os.path.split(output)
+        self.verb = verb
+        self.records_per_file = records_per_file
+        self.file_nbr = file_nbr
+        self.harvested_files = []
+        self.header = None
+        self.records = []
+
+    def add_answer(self, harvested_data):
+        """Split one answer and write the files that are full."""
+        if harvested_data.lower().find('<' + self.verb.lower()) == -1:
+            # No records in output? Do not create a file. Warn the user.
+            sys.stderr.write("\n<!--\n*** WARNING: NO RECORDS IN THE HARVESTED DATA: "
+                             + "\n" + repr(harvested_data) + "\n***\n-->\n")
+            return
+        parts = None
+        if self.records_per_file > 0:
+            parts = split_oai_records(harvested_data, self.verb)
+        if parts is None:
+            self.write_file(harvested_data)
+            return
+        header, records, dummy_footer = parts
+        for record in records:
+            if self.header is None:
+                self.header = header
+            self.records.append(record)
+            if len(self.records) >= self.records_per_file:
+                self.flush()
+
+    def flush(self):
+        """Write the pending records, if any, to a new file."""
+        if self.records:
+            self.write_file("%s\n%s\n</%s>\n</OAI-PMH>\n" % \
+                            (self.header, "\n".join(self.records), self.verb))
+        self.header = None
+        self.records = []
+
+    def write_file(self, data):
+        """Save DATA in the next harvested file."""
+        output_fd, output_filename = tempfile.mkstemp(suffix="_%07d.harvested" % (self.file_nbr,), \
+                                                      prefix=self.output_name, dir=self.output_path)
+        os.write(output_fd, data)
+        os.close(output_fd)
+        self.harvested_files.append(output_filename)
+        self.file_nbr += 1
+
 def OAI_Session(server, script, http_param_dict , method="POST", output="",
                 resume_request_nbr=0, secure=False, user=None, password=None,
-                cert_file=None, key_file=None):
+                cert_file=None, key_file=None, records_per_file=0,
+                prefetch=True):
     """Handle one OAI session (1 request, which might lead
     to multiple answers because of resumption tokens)
 
     If output filepath is given, each answer of the oai repository is saved
     in corresponding filepath, with a unique number appended at the end.
-    This number starts at 'resume_request_nbr'.
+    This number starts at 'resume_request_nbr'.  If 'records_per_file'
+    is given, the records of the answers are regrouped into files of at
+    most this number of records instead (see OAI_RecordSplitter).
+
+    The next answer is downloaded while the current one is being saved
+    unless 'prefetch' is False.
 
     Returns a tuple containing an int corresponding to the last created 'resume_request_nbr' and
     a list of harvested files.
@@ -94,41 +273,28 @@ def OAI_Session(server, script, http_param_dict , method="POST", output="",
     sys.stderr.write("%s - %s\n" % (server,
         http_request_parameters(http_param_dict)))
 
-    output_path, output_name = os.path.split(output)
-    harvested_files = []
-    i = resume_request_nbr
-    while True:
-        harvested_data = OAI_Request(server, script,
-                                     http_request_parameters(http_param_dict, method), method,
-                                     secure, user, password, cert_file, key_file)
-        if output:
+    splitter = None
+    if output:
+        splitter = OAI_RecordSplitter(output, http_param_dict['verb'],
+                                      records_per_file, resume_request_nbr)
+    for harvested_data in OAI_Session_answers(server, script, http_param_dict,
+                                              method, secure, user, password,
+                                              cert_file, key_file, prefetch):
+        if splitter is not None:
             # Write results to a file specified by 'output'
-            if harvested_data.lower().find('<'+http_param_dict['verb'].lower()) > -1:
-                output_fd, output_filename = tempfile.mkstemp(suffix="_%07d.harvested" % (i,), \
-                                                              prefix=output_name, dir=output_path)
-                os.write(output_fd, harvested_data)
-                os.close(output_fd)
-                harvested_files.append(output_filename)
-            else:
-                # No records in output? Do not create a file. Warn the user.
-                sys.stderr.write("\n<!--\n*** WARNING: NO RECORDS IN THE HARVESTED DATA: "
-                                 +  "\n" + repr(harvested_data) + "\n***\n-->\n")
+            splitter.add_answer(harvested_data)
         else:
             sys.stdout.write(harvested_data)
 
-        rt_obj = re.search('<resumptionToken.*>(.+)</resumptionToken>',
-            harvested_data, re.DOTALL)
-        if rt_obj is not None and rt_obj != "":
-            http_param_dict = http_param_resume(http_param_dict, rt_obj.group(1))
-            i = i + 1
-        else:
-            break
-
-    return i, harvested_files
+    if splitter is None:
+        return resume_request_nbr, []
+    splitter.flush()
+    return max(resume_request_nbr, splitter.file_nbr - 1), splitter.harvested_files
 
 def harvest(server, script, http_param_dict , method="POST", output="",
             sets=None, secure=False, user=None, password=None,
-            cert_file=None, key_file=None):
+            cert_file=None, key_file=None, records_per_file=0,
+            prefetch=True):
     """
     Handle multiple OAI sessions (multiple requests, which might lead to
     multiple answers).
@@ -186,6 +352,13 @@ http_param_dict - *dict* the URL parameters to send to the OAI script
                   key in case the server to harvest requires
                   certificate-based authentication
                   (If provided, 'key_file' must also be provided)
+
+records_per_file - *int* regroup the harvested records into files of at
+                  most this number of records (0: one file per answer
+                  of the server)
+
+       prefetch - *bool* if the next answer of the server should be
+                  downloaded while the current one is being saved
     """
     if sets:
         resume_request_nbr = 0
@@ -194,7 +367,7 @@ http_param_dict - *dict* the URL parameters to send to the OAI script
             http_param_dict['set'] = set
             resume_request_nbr, harvested_files = OAI_Session(server, script, http_param_dict, method,
                             output, resume_request_nbr, secure, user, password,
-                            cert_file, key_file)
+                            cert_file, key_file, records_per_file, prefetch)
             resume_request_nbr += 1
             all_harvested_files.extend(harvested_files)
         return all_harvested_files
@@ -202,7 +375,8 @@ http_param_dict - *dict* the URL parameters to send to the OAI script
         dummy, harvested_files = OAI_Session(server, script, http_param_dict, method,
                     output, secure=secure, user=user,
                     password=password, cert_file=cert_file,
-                    key_file=key_file)
+                    key_file=key_file, records_per_file=records_per_file,
+                    prefetch=prefetch)
         return harvested_files
 
 def OAI_Request(server, script, params, method="POST", secure=False,
@@ -0,0 +1,186 @@
+## -*- mode: python; coding: utf-8; -*-
+##
+## This file is part of Invenio.
+## Copyright (C) 2014 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""Unit tests for the OAI harvest getter, run against a stub OAI server."""
+
+__revision__ = "$Id$"
+
+import os
+import cgi
+import shutil
+import tempfile
+import threading
+import BaseHTTPServer
+
+from invenio.testutils import InvenioTestCase
+from invenio.testutils import make_test_suite, run_test_suite
+
+from invenio import oai_harvest_getter
+
+def stub_oai_record(number):
+    """Return an OAI record embedding a MARCXML record."""
+    return '<record><header><identifier>oai:stub:%(n)s</identifier></header>' \
+           '<metadata><record xmlns="http://www.loc.gov/MARC21/slim">' \
+           '<controlfield tag="001">%(n)s</controlfield></record></metadata>' \
+           '</record>' % {'n': number}
+
+def stub_oai_answer(page, nb_pages, records_per_page):
+    """Return the PAGE-th answer to ListRecords."""
+    records = [stub_oai_record(page * records_per_page + i)
+               for i in range(records_per_page)]
+    if page + 1 < nb_pages:
+        token = '<resumptionToken>%s</resumptionToken>' % (page + 1,)
+    else:
+        token = '<resumptionToken/>'
+    return '<?xml version="1.0" encoding="UTF-8"?>\n<OAI-PMH>' \
+           '<responseDate>2014-01-01T00:00:00Z</responseDate>' \
+           '<ListRecords>%s%s</ListRecords></OAI-PMH>' % \
+           (''.join(records), token)
+
+class StubOAIRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Serve the answers of the stub OAI server."""
+
+    def do_POST(self):
+        params = cgi.parse_qs(self.rfile.read(int(self.headers['Content-Length'])))
+        page = int(params.get('resumptionToken', ['0'])[0])
+        self.server.requests.append(page)
+        data = stub_oai_answer(page, self.server.nb_pages,
+                               self.server.records_per_page)
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/xml')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+class StubOAIServer(BaseHTTPServer.HTTPServer):
+    """A local OAI server answering ListRecords in NB_PAGES pages."""
+
+    def __init__(self, nb_pages=3, records_per_page=3):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0),
+                                           StubOAIRequestHandler)
+        self.nb_pages = nb_pages
+        self.records_per_page = records_per_page
+        self.requests = []
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.setDaemon(True)
+        self.thread.start()
+
+    def get_location(self):
+        """Return the host:port of the server."""
+        return '%s:%s' % self.server_address
+
+    def stop(self):
+        """Stop serving."""
+        self.shutdown()
+        self.server_close()
+
+class OAIHarvestGetterTest(InvenioTestCase):
+    """Test harvesting from the stub OAI server."""
+
+    def setUp(self):
+        self.server = StubOAIServer()
+        self.tmpdir = tempfile.mkdtemp()
+        self.http_proxy = os.environ.pop('http_proxy', None)
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.tmpdir)
+        if self.http_proxy is not None:
+            os.environ['http_proxy'] = self.http_proxy
+
+    def _harvest(self, **kwargs):
+        """Harvest the stub server and return the records of each file."""
+        files = oai_harvest_getter.harvest(self.server.get_location(), '/oai2d',
+                                           {'verb': 'ListRecords',
+                                            'metadataPrefix': 'marcxml'},
+                                           output=os.path.join(self.tmpdir, 'stub'),
+                                           **kwargs)
+        result = []
+        for filename in files:
+            data = open(filename).read()
+            self.failUnless(data.strip().endswith('</ListRecords></OAI-PMH>') or
+                            data.strip().endswith('</ListRecords>\n</OAI-PMH>'))
+            header, records, dummy_footer = \
+                oai_harvest_getter.split_oai_records(data)
+            self.failUnless(header.startswith('<?xml'))
+            result.append(records)
+        return result
+
+    def test_one_file_per_answer(self):
+        """oaiharvest - one file per answer of the server"""
+        files = self._harvest()
+        self.assertEqual([len(records) for records in files], [3, 3, 3])
+        self.assertEqual(self.server.requests, [0, 1, 2])
+
+    def test_records_per_file(self):
+        """oaiharvest - records split into files of a given size"""
+        files = self._harvest(records_per_file=4)
+        self.assertEqual([len(records) for records in files], [4, 4, 1])
+        self.assertEqual(sum(files, []),
+                         [stub_oai_record(i) for i in range(9)])
+
+    def test_without_prefetch(self):
+        """oaiharvest - same records harvested without prefetching"""
+        self.assertEqual(self._harvest(records_per_file=2, prefetch=False),
+                         self._harvest(records_per_file=2))
+
+    def test_concurrent_sessions(self):
+        """oaiharvest - concurrent sessions on several servers"""
+        other_server = StubOAIServer(nb_pages=2, records_per_page=5)
+        results = {}
+        def harvest_server(server):
+            results[server] = oai_harvest_getter.harvest(
+                server.get_location(), '/oai2d',
+                {'verb': 'ListRecords', 'metadataPrefix': 'marcxml'},
+                output=os.path.join(self.tmpdir, 'stub%s' % id(server)))
+        try:
+            threads = [threading.Thread(target=harvest_server, args=(server,))
+                       for server in (self.server, other_server)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            other_server.stop()
+        self.assertEqual(len(results[self.server]), 3)
+        self.assertEqual(len(results[other_server]), 2)
+
+class SplitOAIRecordsTest(InvenioTestCase):
+    """Test splitting OAI answers into records."""
+
+    def test_nested_records(self):
+        """oaiharvest - nested MARCXML records are kept in their OAI record"""
+        header, records, footer = oai_harvest_getter.split_oai_records(
+            stub_oai_answer(0, 2, 2))
+        self.failUnless(header.endswith('<ListRecords>'))
+        self.assertEqual(records, [stub_oai_record(0), stub_oai_record(1)])
+        self.assertEqual(footer, '</ListRecords></OAI-PMH>')
+
+    def test_no_records(self):
+        """oaiharvest - answers without records are not split"""
+        self.assertEqual(oai_harvest_getter.split_oai_records(
+            '<OAI-PMH><error code="noRecordsMatch"/></OAI-PMH>'), None)
+
+TEST_SUITE = make_test_suite(OAIHarvestGetterTest, SplitOAIRecordsTest)
+
+if __name__ == "__main__":
+    run_test_suite(TEST_SUITE)
@@ -20,12 +20,16 @@
 __revision__ = "$Id$"
 
 import cPickle
+import errno
 import os
 import re
 import time
 import tempfile
+import struct
 import sys
 import datetime
+from array import array
+from bisect import bisect_right
 if sys.hexversion < 0x2050000:
     from glob import glob as iglob
 else:
@@ -62,6 +66,7 @@ from invenio.htmlutils import X, EscapedXMLString
 from invenio.dbquery import run_sql, wash_table_column_name
 from invenio.search_engine import record_exists, get_all_restricted_recids, get_all_field_values, search_unit_in_bibxxx, get_record, search_pattern
 from invenio.bibformat import format_record
+from invenio.bibformat_dblayer import get_preformatted_records
 from invenio.bibrecord import record_get_field_instances
 from invenio.errorlib import register_exception
 from invenio.oai_repository_config import CFG_OAI_REPOSITORY_GLOBAL_SET_SPEC
@@ -164,6 +169,44 @@ def get_field(recid, field):
 
     return [row[0] for row in run_sql(query, (recid, field))]
 
+def get_field_for_recids(recids, field):
+    """
+    Gets the values of field 'field' for all the records 'recids' at
+    once.  'field' may contain SQL wildcards (e.g. '980__%').
+
+    @return: dictionary {recid: list of values} for the records having
+        the field.
+    @rtype: dict
+    """
+    recids = list(recids)
+    if not recids:
+        return {}
+
+    digit = field[0:2]
+
+    bibbx = "bib%sx" % digit
+    bibx  = "bibrec_bib%sx" % digit
+    if '%' in field:
+        tag_condition = "bx.tag LIKE %s"
+    else:
+        tag_condition = "bx.tag=%s"
+    query = "SELECT bibx.id_bibrec, bx.value FROM %s AS bx, %s AS bibx WHERE bibx.id_bibrec IN (%s) AND bx.id=bibx.id_bibxxx AND %s" % (wash_table_column_name(bibbx), wash_table_column_name(bibx), ', '.join(['%s'] * len(recids)), tag_condition)
+
+    ret = {}
+    for recid, value in run_sql(query, tuple(recids + [field])):
+        ret.setdefault(recid, []).append(value)
+    return ret
+
+def get_modification_dates(recids):
+    """Returns the dates of last modification in UTC of all the records
+    'recids' at once, as a dictionary {recid: date}.
+    """
+    recids = list(recids)
+    if not recids:
+        return {}
+    res = run_sql("SELECT id, DATE_FORMAT(modification_date,'%%Y-%%m-%%d %%H:%%i:%%s') FROM bibrec WHERE id IN (%s)" % ', '.join(['%s'] * len(recids)), tuple(recids))
+    return dict((recid, localtime_to_utc(date)) for recid, date in res if date)
+
 def get_modification_date(recid):
     """Returns the date of last modification for the record 'recid'.
     Return empty string if no record or modification date in UTC.
@@ -302,72 +345,112 @@ def print_record(recid, prefix='marcxml', verb='ListRecords', set_spec=None, set
       then return nothing.
 
     """
+    return ''.join(oai_print_records([recid], prefix, verb, set_spec, set_last_updated))
 
-    record_exists_result = record_exists(recid) == 1
-    if record_exists_result:
-        sets = get_field(recid, CFG_OAI_SET_FIELD)
-        if set_spec is not None and not set_spec in sets and not [set_ for set_ in sets if set_.startswith("%s:" % set_spec)]:
-            ## the record is not in the requested set, and is not
-            ## in any subset
-            record_exists_result = False
+def oai_print_records(recids, prefix='marcxml', verb='ListRecords', set_spec=None, set_last_updated=None):
+    """
+    Yield, in order, the output of print_record() for each of the
+    records 'recids' (see print_record()).
 
-    if record_exists_result:
-        status = None
-    else:
-        status = 'deleted'
+    Everything needed is fetched for all the records at once: their
+    existence, deletion status, OAI identifiers, set specs, datestamps,
+    provenance and, for ListRecords, their preformatted metadata.
+    Only records without preformatted metadata are formatted one by
+    one.
+    """
+    recids = [int(recid) for recid in recids]
+    if not recids:
+        return
 
-    if not record_exists_result and CFG_OAI_DELETED_POLICY not in ('persistent', 'transient'):
-        return ""
+    existing_recids = intbitset(run_sql("SELECT id FROM bibrec WHERE id IN (%s)" % ', '.join(['%s'] * len(recids)), tuple(recids)))
+    collections = get_field_for_recids(existing_recids, '980__%')
+    all_sets = get_field_for_recids(existing_recids, CFG_OAI_SET_FIELD)
+    all_idents = get_field_for_recids(recids, CFG_OAI_ID_FIELD)
+    datestamps = get_modification_dates(recids)
 
-    idents = get_field(recid, CFG_OAI_ID_FIELD)
-    if not idents:
-        return ""
-    ## FIXME: Move these checks in a bibtask
-    #try:
-        #assert idents, "No OAI ID for record %s, please do your checks!" % recid
-    #except AssertionError, err:
-        #register_exception(alert_admin=True)
-        #return ""
-    #try:
-        #assert len(idents) == 1, "More than OAI ID found for recid %s. Considering only the first one, but please do your checks: %s" % (recid, idents)
-    #except AssertionError, err:
-        #register_exception(alert_admin=True)
-    ident = idents[0]
-
-    header_body = EscapedXMLString('')
-    header_body += X.identifier()(ident)
-    if set_last_updated:
-        header_body += X.datestamp()(max(get_modification_date(recid), set_last_updated))
-    else:
-        header_body += X.datestamp()(get_modification_date(recid))
-    for set_spec in get_field(recid, CFG_OAI_SET_FIELD):
-        if set_spec and set_spec != CFG_OAI_REPOSITORY_GLOBAL_SET_SPEC:
-            # Print only if field not empty
-            header_body += X.setSpec()(set_spec)
+    live_recids = []
+    for recid in existing_recids:
+        dbcollids = collections.get(recid, [])
+        if "DELETED" in dbcollids or (CFG_CERN_SITE and "DUMMY" in dbcollids):
+            continue
+        sets = all_sets.get(recid, [])
+        if set_spec is not None and not set_spec in sets and not [set_ for set_ in sets if set_.startswith("%s:" % set_spec)]:
+            ## the record is not in the requested set, and is not
+            ## in any subset
+            continue
+        live_recids.append(recid)
+    live_recids = intbitset(live_recids)
+
+    if verb != 'ListIdentifiers':
+        output_format = CFG_OAI_METADATA_FORMATS[prefix][0]
+        preformatted = get_preformatted_records(live_recids, output_format)
+        ## Only records harvested from elsewhere have a provenance.
+        provenance_recids = get_field_for_recids(live_recids, CFG_BIBUPLOAD_EXTERNAL_OAIID_TAG[:5] + CFG_OAI_PROVENANCE_BASEURL_SUBFIELD)
+
+    for recid in recids:
+        record_exists_result = recid in live_recids
+        if record_exists_result:
+            status = None
+        else:
+            status = 'deleted'
+
+        if not record_exists_result and CFG_OAI_DELETED_POLICY not in ('persistent', 'transient'):
+            continue
+
+        idents = all_idents.get(recid)
+        if not idents:
+            continue
+        ## FIXME: Move these checks in a bibtask
+        #try:
+            #assert idents, "No OAI ID for record %s, please do your checks!" % recid
+        #except AssertionError, err:
+            #register_exception(alert_admin=True)
+            #return ""
+        #try:
+            #assert len(idents) == 1, "More than OAI ID found for recid %s. Considering only the first one, but please do your checks: %s" % (recid, idents)
+        #except AssertionError, err:
+            #register_exception(alert_admin=True)
+        ident = idents[0]
+
+        header_body = EscapedXMLString('')
+        header_body += X.identifier()(ident)
+        if set_last_updated:
+            header_body += X.datestamp()(max(datestamps.get(recid, ""), set_last_updated))
+        else:
+            header_body += X.datestamp()(datestamps.get(recid, ""))
+        for a_set_spec in all_sets.get(recid, []):
+            if a_set_spec and a_set_spec != CFG_OAI_REPOSITORY_GLOBAL_SET_SPEC:
+                # Print only if field not empty
+                header_body += X.setSpec()(a_set_spec)
 
-    header = X.header(status=status)(header_body)
+        header = X.header(status=status)(header_body)
 
-    if verb == 'ListIdentifiers':
-        return header
-    else:
-        if record_exists_result:
-            metadata_body = format_record(recid, CFG_OAI_METADATA_FORMATS[prefix][0])
-            metadata = X.metadata(body=metadata_body)
-            provenance_body = get_record_provenance(recid)
-            if provenance_body:
-                provenance = X.about(body=provenance_body)
+        if verb == 'ListIdentifiers':
+            yield header
+        else:
+            if record_exists_result:
+                metadata_body, needs_2nd_pass = preformatted.get(recid, (None, None))
+                if metadata_body is None or needs_2nd_pass:
+                    metadata_body = format_record(recid, output_format)
+                metadata = X.metadata(body=metadata_body)
+                if recid in provenance_recids:
+                    provenance_body = get_record_provenance(recid)
+                else:
+                    provenance_body = ''
+                if provenance_body:
+                    provenance = X.about(body=provenance_body)
+                else:
+                    provenance = ''
+                rights_body = get_record_rights(recid)
+                if rights_body:
+                    rights = X.about(body=rights_body)
+                else:
+                    rights = ''
             else:
+                metadata = ''
                 provenance = ''
-            rights_body = get_record_rights(recid)
-            if rights_body:
-                rights = X.about(body=rights_body)
-            else:
                 rights = ''
-        else:
-            metadata = ''
-            provenance = ''
-            rights = ''
-        return X.record()(header, metadata, provenance, rights)
+            yield X.record()(header, metadata, provenance, rights)
 
 def oai_list_metadata_formats(argd):
     """Generates response to oai_list_metadata_formats verb."""
@@ -398,17 +481,14 @@ def oai_list_records_or_identifiers(req, argd):
     if argd.get('resumptionToken'):
         resumption_token_was_specified = True
         try:
-            cache = oai_cache_load(argd['resumptionToken'])
-            last_recid = cache['last_recid']
-            argd = cache['argd']
-            complete_list = cache['complete_list']
-            complete_list = filter_out_based_on_date_range(complete_list, argd.get('from', ''), argd.get('until', ''))
+            recid_list, last_recid = oai_resumption_token_load(argd['resumptionToken'])
         except Exception, e:
             # Ignore cache not found errors
             if not isinstance(e, IOError) or e.errno != 2:
                 register_exception(alert_admin=True)
             req.write(oai_error(argd, [("badResumptionToken", "ResumptionToken expired or invalid: %s" % argd['resumptionToken'])]))
             return
+        argd = recid_list.argd
     else:
         last_recid = 0
         complete_list = oai_get_recid_list(argd.get('set', ""), argd.get('from', ""), argd.get('until', ""))
@@ -416,33 +496,35 @@ def oai_list_records_or_identifiers(req, argd):
         if not complete_list: # noRecordsMatch error
             req.write(oai_error(argd, [("noRecordsMatch", "no records correspond to the request")]))
             return
+        recid_list = OAIRecidList.create(argd.get('set', ''), argd, complete_list)
 
-    cursor = 0
-    for cursor, recid in enumerate(complete_list):
-        ## Let's fast-forward the cursor to point after the last recid that was
+    try:
+        ## Let's seek the cursor to point after the last recid that was
         ## disseminated successfully
-        if recid > last_recid:
-            break
-
+        cursor = recid_list.seek(last_recid)
+        page = recid_list.get_page(cursor, CFG_OAI_LOAD)
+        complete_list_size = len(recid_list)
+    finally:
+        recid_list.close()
+
+    ## Records restricted since the list was built are not disseminated.
+    restricted_recids = get_all_restricted_recids()
     set_last_updated = get_set_last_update(argd.get('set', ""))
 
-    req.write(oai_header(argd, verb))
-    for recid in list(complete_list)[cursor:cursor+CFG_OAI_LOAD]:
-        req.write(print_record(recid, argd['metadataPrefix'], verb=verb, set_spec=argd.get('set'), set_last_updated=set_last_updated))
-
-    if list(complete_list)[cursor+CFG_OAI_LOAD:]:
-        resumption_token = oai_generate_resumption_token(argd.get('set', ''))
-        cache = {
-            'argd': argd,
-            'last_recid': recid,
-            'complete_list': complete_list.fastdump(),
-        }
-        oai_cache_dump(resumption_token, cache)
+    ## The whole page is assembled first, and written at once.
+    out = [oai_header(argd, verb)]
+    out.extend(oai_print_records([recid for recid in page if recid not in restricted_recids],
+                                 argd['metadataPrefix'], verb=verb, set_spec=argd.get('set'),
+                                 set_last_updated=set_last_updated))
+    req.write(''.join(out))
+
+    if cursor + len(page) < complete_list_size:
+        resumption_token = recid_list.get_resumption_token(page[-1])
         expdate = oai_get_response_date(CFG_OAI_EXPIRE)
-        req.write(X.resumptionToken(expirationDate=expdate, cursor=cursor, completeListSize=len(complete_list))(resumption_token))
+        req.write(X.resumptionToken(expirationDate=expdate, cursor=cursor, completeListSize=complete_list_size)(resumption_token))
     elif resumption_token_was_specified:
         ## Since a resumptionToken was used we shall put a last empty resumptionToken
-        req.write(X.resumptionToken(cursor=cursor, completeListSize=len(complete_list))(""))
+        req.write(X.resumptionToken(cursor=cursor, completeListSize=complete_list_size)(""))
     req.write(oai_footer(verb))
     oai_cache_gc()
 
@@ -641,11 +723,129 @@ def oai_get_recid_list(set_spec="", fromdate="", untildate=""):
             ret -= search_unit_in_bibxxx(p='DUMMY', f='980__%', type='e')
     return filter_out_based_on_date_range(ret, fromdate, untildate, set_spec)
 
-def oai_generate_resumption_token(set_spec):
-    """Generates unique ID for resumption token management."""
-    fd, name = tempfile.mkstemp(dir=os.path.join(CFG_CACHEDIR, 'RTdata'), prefix='%s___' % set_spec)
-    os.close(fd)
-    return os.path.basename(name)
+class OAIRecidList(object):
+    """
+    The list of recids answering a ListRecords or ListIdentifiers
+    request, as computed when the harvest started.
+
+    The list is stored once per harvest in CFG_CACHEDIR/RTdata and is
+    shared by all the resumption tokens of the harvest, which only add
+    the last disseminated recid to the name of the list (see
+    get_resumption_token()).  The file contains the arguments of the
+    original request, followed by the sorted recids as an array of
+    machine integers, so that serving a page only reads the page
+    itself, and seeking to a given recid is a binary search on the
+    file.
+    """
+
+    _header = struct.Struct('!I')
+    _itemsize = array('i').itemsize
+
+    def __init__(self, name):
+        """
+        Open the stored list NAME.
+
+        @raise IOError: if the list does not exist (anymore).
+        @raise ValueError: if NAME is not a valid list name.
+        """
+        rtdata = os.path.abspath(os.path.join(CFG_CACHEDIR, 'RTdata'))
+        self.path = os.path.abspath(os.path.join(rtdata, name))
+        if os.path.dirname(self.path) != rtdata:
+            raise ValueError("Invalid path")
+        self.name = name
+        self.file = open(self.path, 'rb')
+        try:
+            header_size = self._header.size
+            metadata_size = self._header.unpack(self.file.read(header_size))[0]
+            metadata = cPickle.loads(self.file.read(metadata_size))
+        except (struct.error, cPickle.UnpicklingError, EOFError), err:
+            self.file.close()
+            raise ValueError("Invalid list %s: %s" % (name, err))
+        self.argd = metadata['argd']
+        self.size = metadata['size']
+        self.offset = header_size + metadata_size
+        ## the list expires CFG_OAI_EXPIRE after it was last used
+        os.utime(self.path, None)
+
+    def create(set_spec, argd, recids):
+        """
+        Store RECIDS, the result of the request ARGD, as a new list.
+
+        @param recids: the recids.
+        @type recids: intbitset
+        @return: the stored list.
+        @rtype: OAIRecidList
+        """
+        fd, path = tempfile.mkstemp(dir=os.path.join(CFG_CACHEDIR, 'RTdata'), prefix='%s___' % set_spec)
+        list_file = os.fdopen(fd, 'wb')
+        try:
+            metadata = cPickle.dumps({'argd': argd, 'size': len(recids)}, -1)
+            list_file.write(OAIRecidList._header.pack(len(metadata)))
+            list_file.write(metadata)
+            array('i', recids.tolist()).tofile(list_file)
+        finally:
+            list_file.close()
+        return OAIRecidList(os.path.basename(path))
+    create = staticmethod(create)
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, index):
+        """
+        @return: the recid at position INDEX of the list (needed by
+            bisect).
+        """
+        if not 0 <= index < self.size:
+            raise IndexError(index)
+        return self.get_page(index, 1)[0]
+
+    def get_page(self, cursor, size):
+        """
+        @return: the (at most) SIZE recids starting from position CURSOR.
+        @rtype: array
+        """
+        self.file.seek(self.offset + cursor * self._itemsize)
+        page = array('i')
+        page.fromstring(self.file.read(min(size, self.size - cursor) * self._itemsize))
+        return page
+
+    def seek(self, last_recid):
+        """
+        @return: the position of the first recid greater than
+            LAST_RECID.
+        @rtype: int
+        """
+        if last_recid <= 0:
+            return 0
+        return bisect_right(self, last_recid)
+
+    def get_resumption_token(self, last_recid):
+        """
+        @return: the resumption token to continue the harvest after
+            LAST_RECID.
+        @rtype: string
+        """
+        return '%s.%s' % (self.name, last_recid)
+
+    def close(self):
+        """Close the underlying file."""
+        self.file.close()
+
+def oai_resumption_token_load(resumption_token):
+    """
+    Restores the state of a harvest from RESUMPTION_TOKEN.
+
+    @return: the list of recids of the harvest and the last recid that
+        was disseminated.
+    @rtype: (OAIRecidList, int)
+    @raise IOError: if the token expired or is malformed.
+    @raise ValueError: if the token points outside of the cache.
+    """
+    name, dummy, last_recid = resumption_token.rpartition('.')
+    if not name or not last_recid.isdigit():
+        raise IOError(errno.ENOENT, "Malformed resumption token", resumption_token)
+    return OAIRecidList(name), int(last_recid)
 
 def oai_delete_resumption_tokens_for_set(set_spec):
     """
@@ -660,21 +860,6 @@ def oai_delete_resumption_tokens_for_set(set_spec):
     for name in iglob(os.path.join(CFG_CACHEDIR, 'RTdata', '___*')):
         os.remove(name)
 
-def oai_cache_dump(resumption_token, cache):
-    """
-    Given a resumption_token and the cache, stores the cache.
-    """
-    cPickle.dump(cache, open(os.path.join(CFG_CACHEDIR, 'RTdata', resumption_token), 'w'), -1)
-
-def oai_cache_load(resumption_token):
-    """
-    Restores the cache from the resumption_token.
-    """
-    fullpath = os.path.join(CFG_CACHEDIR, 'RTdata', resumption_token)
-    if os.path.dirname(os.path.abspath(fullpath)) != os.path.abspath(os.path.join(CFG_CACHEDIR, 'RTdata')):
-        raise ValueError("Invalid path")
-    return cPickle.load(open(fullpath))
-
 def oai_cache_gc():
     """
     OAI Cache Garbage Collector.
@@ -23,11 +23,14 @@
 __revision__ = "$Id$"
 
 from invenio.testutils import InvenioTestCase
+import os
 import re
 
 from cStringIO import StringIO
 
 from invenio import oai_repository_server
+from invenio import oai_repository_updater
+from invenio.intbitset import intbitset
 from invenio.testutils import make_test_suite, run_test_suite
 
 class TestVerbs(InvenioTestCase):
@@ -80,8 +83,181 @@ class TestErrorCodes(InvenioTestCase):
 
         self.assertNotEqual([], [code for (code, dummy_text) in oai_repository_server.check_argd({'verb': 'ListRecords', 'resumptionToken': ''}) if code == 'badResumptionToken'])
 
+class TestRecidList(InvenioTestCase):
+    """Test the stored lists of recids behind resumption tokens."""
+
+    def setUp(self):
+        self.recid_list = oai_repository_server.OAIRecidList.create(
+            'unittest', {'verb': 'ListRecords'}, intbitset(range(1, 3000, 3)))
+
+    def tearDown(self):
+        self.recid_list.close()
+        os.remove(self.recid_list.path)
+
+    def test_paging(self):
+        """oairepository - seeking and paging through a stored list"""
+        self.assertEqual(len(self.recid_list), 1000)
+        self.assertEqual(self.recid_list.seek(0), 0)
+        cursor = self.recid_list.seek(10)
+        self.assertEqual(cursor, 4)
+        self.assertEqual(list(self.recid_list.get_page(cursor, 3)), [13, 16, 19])
+        self.assertEqual(list(self.recid_list.get_page(999, 3)), [2998])
+
+    def test_resumption_token(self):
+        """oairepository - resuming from a token"""
+        token = self.recid_list.get_resumption_token(2995)
+        recid_list, last_recid = oai_repository_server.oai_resumption_token_load(token)
+        try:
+            self.assertEqual(recid_list.argd, {'verb': 'ListRecords'})
+            self.assertEqual(recid_list.seek(last_recid), 999)
+        finally:
+            recid_list.close()
+        self.assertRaises(IOError, oai_repository_server.oai_resumption_token_load, 'foobar')
+        self.assertRaises(ValueError, oai_repository_server.oai_resumption_token_load, '../foobar.1')
+
+class TestAffectedRecids(InvenioTestCase):
+    """Test the records considered by incremental updater runs."""
+
+    def setUp(self):
+        ## Collection 'A' holds 1-99, 'B' 100-199; the pattern 'foo'
+        ## matches the even records, 'bar' the multiples of 3.
+        self.collections = {'A': intbitset(range(1, 100)),
+                            'B': intbitset(range(100, 200))}
+        self.patterns = {'foo': intbitset(range(0, 200, 2)),
+                         'bar': intbitset(range(0, 200, 3))}
+        self.definitions = {'setA': ['c=A;p1=foo;f1=;m1=;op1=a;p2=bar;f2=;m2=;op2=a;p3=;f3=;m3=;'],
+                            'setB': ['c=B;p1=foo;f1=;m1=;op1=n;p2=bar;f2=;m2=;op2=a;p3=;f3=;m3=;']}
+        self.exported = {'setA': intbitset([6, 12]),
+                         'setB': intbitset([102, 104])}
+        self.modified = intbitset([5, 6, 7, 12, 102, 103, 104, 150])
+        self.revisions = [(5, 'admin'), (6, 'oairepository'), (12, 'admin'),
+                          (7, 'oairepository'), (7, 'admin'),
+                          (150, 'oairepository')]
+        self.searched = []
+        self.patch_attributes(oai_repository_updater, (
+            ('get_collection_reclist', lambda coll: self.collections.get(coll, intbitset())),
+            ('get_set_definitions', lambda set_spec: [oai_repository_updater.parse_set_definition(definition) for definition in self.definitions[set_spec]]),
+            ('search_unit_in_bibxxx', lambda p, f, type: self.exported.get(p, intbitset())),
+            ('get_modified_records_since', lambda last_run: intbitset(self.modified)),
+            ('perform_request_search', self.perform_request_search),
+            ('run_sql', lambda query, params=None: self.revisions),
+            ('write_message', lambda *args, **kwargs: None)))
+
+    def tearDown(self):
+        self.restore_attributes()
+
+    def perform_request_search(self, c, p1, f1, m1, op1, p2, f2, m2, op2, p3, f3, m3, ap, of='id'):
+        self.searched.append(c)
+        recids = self.patterns[p1] & self.patterns[p2]
+        if op1 == 'n':
+            recids = self.patterns[p1] - self.patterns[p2]
+        recids &= self.collections[c[0]]
+        if of == 'intbitset':
+            return recids
+        return list(recids)
+
+    def test_search_within(self):
+        """oairepository - set definitions evaluated within some records"""
+        set_def = oai_repository_updater.parse_set_definition(self.definitions['setB'][0])
+        within = oai_repository_updater.search_set_definition_within
+        self.assertEqual(within(set_def, intbitset(range(0, 200))),
+                         intbitset(range(100, 200, 2)) - intbitset(range(0, 200, 3)))
+        self.assertEqual(within(set_def, intbitset([102, 104, 105])), intbitset([104]))
+        self.assertEqual(self.searched, [['B'], ['B']])
+        self.searched = []
+        self.assertEqual(within(set_def, intbitset([5, 6])), intbitset())
+        self.assertEqual(self.searched, [])
+
+    def test_unchanged_definitions(self):
+        """oairepository - incremental run with unchanged sets"""
+        snapshot = {'setA': 'x', 'setB': 'y'}
+        affected_recids, recids_for_set = oai_repository_updater.get_affected_recids_since('2014-01-01 00:00:00', snapshot, snapshot)
+        self.assertEqual(affected_recids, intbitset([5, 7, 12, 102, 103, 104]))
+        self.assertEqual(recids_for_set, {'setA': intbitset([12]),
+                                          'setB': intbitset([104])})
+
+    def test_changed_definition(self):
+        """oairepository - incremental run with a modified set"""
+        affected_recids, recids_for_set = oai_repository_updater.get_affected_recids_since(
+            '2014-01-01 00:00:00', {'setA': 'x', 'setB': 'y'}, {'setA': 'x', 'setB': 'z'})
+        should_recids = intbitset([recid for recid in range(100, 200)
+                                   if recid % 2 == 0 and recid % 3])
+        self.assertEqual(affected_recids, should_recids | intbitset([5, 7, 12, 102, 103]))
+        self.assertEqual(recids_for_set, {'setA': intbitset([12]),
+                                          'setB': should_recids})
+
+    def test_nothing_modified(self):
+        """oairepository - incremental run when only the updater ran"""
+        self.modified = intbitset([6, 150])
+        snapshot = {'setA': 'x', 'setB': 'y'}
+        self.assertEqual(oai_repository_updater.get_affected_recids_since('2014-01-01 00:00:00', snapshot, snapshot),
+                         (intbitset(), {}))
+        self.assertEqual(self.searched, [])
+
+class TestLastRunSnapshot(InvenioTestCase):
+    """Test that a run is only remembered once its uploads are done."""
+
+    def setUp(self):
+        self.rows = []
+        self.statuses = {}
+        self.patch_attributes(oai_repository_updater, (
+            ('run_sql', self.run_sql),
+            ('write_message', lambda *args, **kwargs: None)))
+
+    def tearDown(self):
+        self.restore_attributes()
+
+    def run_sql(self, query, params=()):
+        """Runs the queries of the updater on self.rows and self.statuses."""
+        if query.startswith("SELECT id, status FROM schTASK"):
+            return [(task_id, self.statuses[task_id]) for task_id in params
+                    if task_id in self.statuses]
+        if query.startswith("SELECT tasks"):
+            return [(row[4], ) for row in self.rows if row[3]][:1]
+        if query.startswith("SELECT setSpec"):
+            return [row[:3] for row in self.rows if not row[3]]
+        if query.startswith("INSERT"):
+            self.rows.append(params)
+        elif query.startswith("DELETE"):
+            pending = query.endswith("pending=1")
+            everything = not query.endswith("pending=0") and not pending
+            self.rows = [row for row in self.rows
+                         if not everything and bool(row[3]) != pending]
+        elif query.startswith("UPDATE"):
+            self.rows = [row[:3] + (0, '') for row in self.rows]
+
+    def test_without_uploads(self):
+        """oairepository - run without uploads remembered at once"""
+        oai_repository_updater.save_last_run_snapshot('2014-01-01 00:00:00', {'setA': 'x'})
+        self.assertEqual(oai_repository_updater.get_last_run_snapshot(),
+                         ('2014-01-01 00:00:00', {'setA': 'x'}))
+
+    def test_uploads_done(self):
+        """oairepository - run remembered once its uploads are done"""
+        oai_repository_updater.save_last_run_snapshot('2014-01-01 00:00:00', {'setA': 'x'})
+        oai_repository_updater.save_last_run_snapshot('2014-01-02 00:00:00', {'setA': 'y'}, [5, 6])
+        self.statuses = {5: 'DONE', 6: 'RUNNING'}
+        self.assertEqual(oai_repository_updater.get_last_run_snapshot(),
+                         ('2014-01-01 00:00:00', {'setA': 'x'}))
+        del self.statuses[5]
+        self.statuses[6] = 'DONE'
+        self.assertEqual(oai_repository_updater.get_last_run_snapshot(),
+                         ('2014-01-02 00:00:00', {'setA': 'y'}))
+        self.assertEqual(len(self.rows), 1)
+
+    def test_uploads_failed(self):
+        """oairepository - run forgotten when its uploads failed"""
+        oai_repository_updater.save_last_run_snapshot('2014-01-02 00:00:00', {'setA': 'y'}, [5, 6])
+        self.statuses = {5: 'DONE', 6: 'ERROR'}
+        self.assertEqual(oai_repository_updater.get_last_run_snapshot(), (None, {}))
+        self.assertEqual(self.rows, [])
+
+
 TEST_SUITE = make_test_suite(TestVerbs,
-                             TestErrorCodes)
+                             TestErrorCodes,
+                             TestRecidList,
+                             TestAffectedRecids,
+                             TestLastRunSnapshot)
 
 if __name__ == "__main__":
     run_test_suite(TEST_SUITE)
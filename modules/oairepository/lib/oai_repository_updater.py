@@ -44,7 +44,8 @@ from invenio.config import \
      CFG_TMPSHAREDDIR
 from invenio.oai_repository_config import CFG_OAI_REPOSITORY_MARCXML_SIZE, \
      CFG_OAI_REPOSITORY_GLOBAL_SET_SPEC
-from invenio.search_engine import perform_request_search, get_record, search_unit_in_bibxxx
+from invenio.search_engine import perform_request_search, get_record, \
+     search_unit_in_bibxxx, get_collection_reclist
 from invenio.intbitset import intbitset
 from invenio.dbquery import run_sql
 from invenio.bibtask import \
@@ -54,7 +55,8 @@ from invenio.bibtask import \
      task_update_progress, \
      task_init, \
      task_sleep_now_if_required, \
-     task_low_level_submission
+     task_low_level_submission, \
+     get_modified_records_since
 from invenio.bibrecord import \
      record_get_field_value, \
      record_get_field_values, \
@@ -117,7 +119,15 @@ def all_set_specs():
 
     return [row[0] for row in res]
 
-def get_recids_for_set_spec(set_spec):
+## The user submitting the bibupload tasks of oairepositoryupdater
+CFG_OAI_REPOSITORY_UPDATER_USER = 'oairepository'
+
+## The statuses of the bibupload tasks that have not run to completion yet
+CFG_OAI_REPOSITORY_UPDATER_PENDING_STATUSES = ('WAITING', 'SCHEDULED',
+    'RUNNING', 'CONTINUING', 'ABOUT TO SLEEP', 'SLEEPING', 'ABOUT TO STOP',
+    'NOW STOP', 'STOPPED')
+
+def get_recids_for_set_spec(set_spec, restrict_to=None):
     """
     Returns the list (as intbitset) of recids belonging to 'set'
 
@@ -125,10 +135,16 @@ def get_recids_for_set_spec(set_spec):
 
       set_spec - *str* the set_spec for which we would like to get the
                  recids
+
+   restrict_to - *intbitset* if given, only these recids are
+                 considered (see search_set_definition_within())
     """
     recids = intbitset()
 
     for set_def in get_set_definitions(set_spec):
+        if restrict_to is not None:
+            recids |= search_set_definition_within(set_def, restrict_to)
+            continue
         new_recids = perform_request_search(c=[coll.strip() \
                                                for coll in set_def['c'].split(',')],
                                             p1=set_def['p1'],
@@ -148,6 +164,37 @@ def get_recids_for_set_spec(set_spec):
 
     return recids
 
+def search_set_definition_within(set_def, recids):
+    """
+    Returns the recids among RECIDS matching the set definition SET_DEF
+    (as returned by parse_set_definition()).  The search is only run if
+    some of RECIDS belong to the collections of the set.
+
+    @return: intbitset
+    """
+    colls = [coll.strip() for coll in set_def['c'].split(',') if coll.strip()]
+    colls = colls or [CFG_SITE_NAME]
+    candidates = intbitset()
+    for coll in colls:
+        candidates |= get_collection_reclist(coll)
+    candidates &= recids
+    if not candidates:
+        return candidates
+    return candidates & perform_request_search(c=colls,
+                                               p1=set_def['p1'],
+                                               f1=set_def['f1'],
+                                               m1=set_def['m1'],
+                                               op1=set_def['op1'],
+                                               p2=set_def['p2'],
+                                               f2=set_def['f2'],
+                                               m2=set_def['m2'],
+                                               op2=set_def['op2'],
+                                               p3=set_def['p3'],
+                                               f3=set_def['f3'],
+                                               m3=set_def['m3'],
+                                               of='intbitset',
+                                               ap=0)
+
 def get_set_name_for_set_spec(set_spec):
     """
     Returns the OAI setName of a setSpec.
@@ -283,23 +330,87 @@ def repository_size():
     """Read repository size"""
     return len(search_unit_in_bibxxx(p="*", f=CFG_OAI_SET_FIELD, type="e"))
 
-### MAIN ###
-def oairepositoryupdater_task():
-    """Main business logic code of oai_archive"""
-    no_upload = task_get_option("no_upload")
-    report = task_get_option("report")
+def get_set_definitions_snapshot():
+    """
+    Returns the current definitions of all the sets, as a dictionary
+    {setSpec: definitions}, where definitions is a string that changes
+    whenever the records belonging to the set might change.
+    """
+    definitions = {}
+    res = run_sql("SELECT setSpec, setDefinition FROM oaiREPOSITORY")
+    for set_spec, set_definition in res:
+        if not set_spec:
+            set_spec = CFG_OAI_REPOSITORY_GLOBAL_SET_SPEC
+        definitions.setdefault(set_spec, []).append(set_definition)
+    return dict((set_spec, '\n'.join(sorted(set_definitions)))
+                for set_spec, set_definitions in definitions.iteritems())
 
-    if report > 1:
-        print_repository_status(verbose=report)
-        return True
+def get_last_run_snapshot():
+    """
+    Returns the time of the last run that updated the repository and
+    the set definitions that were used by it (see
+    get_set_definitions_snapshot()).  The runs whose uploads have not
+    been successfully processed yet are not considered (see
+    confirm_last_run_snapshot()).
+
+    @return: (last run, snapshot), or (None, {}) if the repository has
+        never been updated.
+    """
+    confirm_last_run_snapshot()
+    res = run_sql("SELECT setSpec, setDefinitions, DATE_FORMAT(last_run, '%Y-%m-%d %H:%i:%s') FROM oaiREPOSITORYSNAPSHOT WHERE pending=0")
+    if not res:
+        return None, {}
+    return min(row[2] for row in res), dict((row[0], row[1]) for row in res)
 
-    initial_snapshot = {}
-    for set_spec in all_set_specs():
-        initial_snapshot[set_spec] = get_set_definitions(set_spec)
-    write_message("Initial set snapshot: %s" % pformat(initial_snapshot), verbose=2)
+def save_last_run_snapshot(last_run, snapshot, task_ids=()):
+    """
+    Remember that the repository was updated at LAST_RUN according to
+    the set definitions SNAPSHOT.  If the corrections were submitted
+    to the bibupload tasks TASK_IDS, the snapshot is only kept as
+    pending until these tasks are done.
+    """
+    if task_ids:
+        run_sql("DELETE FROM oaiREPOSITORYSNAPSHOT WHERE pending=1")
+    else:
+        run_sql("DELETE FROM oaiREPOSITORYSNAPSHOT")
+    tasks = ','.join(str(task_id) for task_id in task_ids)
+    for set_spec, set_definitions in snapshot.iteritems():
+        run_sql("INSERT INTO oaiREPOSITORYSNAPSHOT (setSpec, setDefinitions, last_run, pending, tasks) VALUES (%s, %s, %s, %s, %s)", (set_spec, set_definitions, last_run, task_ids and 1 or 0, tasks))
 
-    task_update_progress("Fetching records to process")
+def confirm_last_run_snapshot():
+    """
+    Replaces the snapshot of the last run by the pending one, if the
+    bibupload tasks of the pending snapshot are done.  If some of them
+    failed, the pending snapshot is dropped, so that the records are
+    considered again by the next run.
+    """
+    res = run_sql("SELECT tasks FROM oaiREPOSITORYSNAPSHOT WHERE pending=1 LIMIT 1")
+    if not res:
+        return
+    task_ids = [int(task_id) for task_id in res[0][0].split(',') if task_id]
+    statuses = {}
+    if task_ids:
+        statuses = dict(run_sql("SELECT id, status FROM schTASK WHERE id IN (%s)" % ','.join(['%s'] * len(task_ids)), task_ids))
+    ## Tasks no longer in the queue were garbage collected, and only
+    ## the done ones are.
+    statuses = [statuses.get(task_id, 'DONE') for task_id in task_ids]
+    if [status for status in statuses if status not in ('DONE', 'ACK DONE')
+        and status not in CFG_OAI_REPOSITORY_UPDATER_PENDING_STATUSES]:
+        write_message("The bibupload tasks %s of the last run failed: their records will be considered again" % res[0][0])
+        run_sql("DELETE FROM oaiREPOSITORYSNAPSHOT WHERE pending=1")
+    elif [status for status in statuses if status in CFG_OAI_REPOSITORY_UPDATER_PENDING_STATUSES]:
+        write_message("The bibupload tasks %s of the last run are not done yet" % res[0][0], verbose=2)
+    else:
+        run_sql("DELETE FROM oaiREPOSITORYSNAPSHOT WHERE pending=0")
+        run_sql("UPDATE oaiREPOSITORYSNAPSHOT SET pending=0, tasks=''")
+
+def get_affected_recids():
+    """
+    Evaluates all the set definitions over the whole repository.
 
+    @return: the recids that may need to be updated and the recids that
+        should belong to each set, as (intbitset, {setSpec: intbitset}).
+    """
     recids_with_oaiid = search_unit_in_bibxxx(p='*', f=CFG_OAI_ID_FIELD, type='e')
     write_message("%s recids have an OAI ID" % len(recids_with_oaiid), verbose=2)
 
@@ -333,10 +444,99 @@ def oairepositoryupdater_task():
 
     ## Let's add records with missing OAI ID
     all_affected_recids |= missing_oaiid | no_more_exported_recids
+    return all_affected_recids, recids_for_set
+
+def get_affected_recids_since(last_run, last_snapshot, snapshot):
+    """
+    Evaluates the set definitions only for the records that changed
+    since LAST_RUN, and for the records of the sets whose definitions
+    changed since then (i.e. differ between LAST_SNAPSHOT and
+    SNAPSHOT, including sets that were added or removed).
+
+    The records that were modified since LAST_RUN only by the uploads
+    of oairepositoryupdater itself are not considered modified.
+
+    @return: same as get_affected_recids(), but where the recids of
+        each set are restricted to the affected recids.
+    """
+    affected_recids = get_modified_records_since(last_run)
+    write_message("%s recids were modified since %s" % (len(affected_recids), last_run), verbose=2)
+    own_recids = get_recids_only_updated_by_oairepository_since(last_run) & affected_recids
+    if own_recids:
+        affected_recids -= own_recids
+        write_message("%s of them were only updated by oairepositoryupdater" % len(own_recids), verbose=2)
+
+    recids_for_set = {}
+    for set_spec in set(last_snapshot) | set(snapshot):
+        if last_snapshot.get(set_spec) == snapshot.get(set_spec):
+            continue
+        ## Records entering or leaving the set.
+        current_recids = search_unit_in_bibxxx(p=set_spec, f=CFG_OAI_SET_FIELD, type='e')
+        if set_spec in snapshot:
+            recids_for_set[set_spec] = get_recids_for_set_spec(set_spec)
+            changed_recids = recids_for_set[set_spec] ^ current_recids
+        else:
+            changed_recids = current_recids
+        write_message("The definition of %s changed: %s recids should be updated" % (set_spec, len(changed_recids)), verbose=2)
+        affected_recids |= changed_recids
+
+    if affected_recids:
+        for set_spec in snapshot:
+            if set_spec in recids_for_set:
+                recids_for_set[set_spec] &= affected_recids
+            else:
+                recids_for_set[set_spec] = get_recids_for_set_spec(set_spec, restrict_to=affected_recids)
+    return affected_recids, recids_for_set
+
+def get_recids_only_updated_by_oairepository_since(last_run):
+    """
+    Returns the recids (as intbitset) all of whose revisions since
+    LAST_RUN were uploaded by oairepositoryupdater, i.e. whose only
+    changes are the OAI identifiers and sets it corrected.
+    """
+    own_recids = intbitset()
+    other_recids = intbitset()
+    for recid, job_person in run_sql("SELECT id_bibrec, job_person FROM hstRECORD WHERE job_date >= %s", (last_run, )):
+        if job_person == CFG_OAI_REPOSITORY_UPDATER_USER:
+            own_recids.add(recid)
+        else:
+            other_recids.add(recid)
+    return own_recids - other_recids
+
+### MAIN ###
+def oairepositoryupdater_task():
+    """Main business logic code of oai_archive"""
+    no_upload = task_get_option("no_upload")
+    report = task_get_option("report")
+
+    if report > 1:
+        print_repository_status(verbose=report)
+        return True
+
+    initial_snapshot = {}
+    for set_spec in all_set_specs():
+        initial_snapshot[set_spec] = get_set_definitions(set_spec)
+    write_message("Initial set snapshot: %s" % pformat(initial_snapshot), verbose=2)
+
+    task_update_progress("Fetching records to process")
+
+    ## Records modified from now on will be considered by the next run.
+    this_run = run_sql("SELECT DATE_FORMAT(NOW(), '%Y-%m-%d %H:%i:%s')")[0][0]
+    snapshot = get_set_definitions_snapshot()
+    last_run, last_snapshot = get_last_run_snapshot()
+    if task_get_option("incremental") and last_run is not None:
+        write_message("Considering only the changes since %s" % last_run)
+        all_affected_recids, recids_for_set = get_affected_recids_since(last_run, last_snapshot, snapshot)
+    else:
+        if task_get_option("incremental"):
+            write_message("No previous run is known: considering the whole repository")
+        all_affected_recids, recids_for_set = get_affected_recids()
     write_message("%s recids should updated" % (len(all_affected_recids)), verbose=2)
 
     if not all_affected_recids:
         write_message("Nothing to do!")
+        if not no_upload:
+            save_last_run_snapshot(this_run, snapshot)
         return True
 
     # Prepare to save results in a tmp file
@@ -348,6 +548,7 @@ def oairepositoryupdater_task():
     oai_out.write("<collection>")
 
     tot = 0
+    task_ids = []
     # Iterate over the recids
     for i, recid in enumerate(all_affected_recids):
         task_sleep_now_if_required(can_stop_too=True)
@@ -386,6 +587,10 @@ def oairepositoryupdater_task():
              if recid in _recids)
         write_message("Record %s now belongs to these oai_sets: %s" % (recid, ", ".join(updated_oai_sets)), verbose=3)
 
+        if not current_oai_sets and not updated_oai_sets:
+            write_message("Record %s is not exported, let's move on!" % recid, verbose=3)
+            continue # Jump to next recid
+
         updated_previous_oai_sets = set(_set for _set in (current_previous_oai_sets - updated_oai_sets) |
              (current_oai_sets - updated_oai_sets))
         write_message("Record %s now doesn't belong anymore to these oai_sets: %s" % (recid, ", ".join(updated_previous_oai_sets)), verbose=3)
@@ -414,9 +619,9 @@ def oairepositoryupdater_task():
             write_message("Wrote to file %s" % filename)
             if not no_upload:
                 if task_get_option("notimechange"):
-                    task_low_level_submission('bibupload', 'oairepository', '-c', filename, '-n')
+                    task_ids.append(task_low_level_submission('bibupload', CFG_OAI_REPOSITORY_UPDATER_USER, '-c', filename, '-n'))
                 else:
-                    task_low_level_submission('bibupload', 'oairepository', '-c', filename)
+                    task_ids.append(task_low_level_submission('bibupload', CFG_OAI_REPOSITORY_UPDATER_USER, '-c', filename))
             # Prepare to save results in a tmp file
             (fd, filename) = mkstemp(dir=CFG_TMPSHAREDDIR,
                                         prefix='oairepository_' + \
@@ -435,12 +640,15 @@ def oairepositoryupdater_task():
         if not no_upload:
             task_sleep_now_if_required(can_stop_too=True)
             if task_get_option("notimechange"):
-                task_low_level_submission('bibupload', 'oairepository', '-c', filename, '-n')
+                task_ids.append(task_low_level_submission('bibupload', CFG_OAI_REPOSITORY_UPDATER_USER, '-c', filename, '-n'))
             else:
-                task_low_level_submission('bibupload', 'oairepository', '-c', filename)
+                task_ids.append(task_low_level_submission('bibupload', CFG_OAI_REPOSITORY_UPDATER_USER, '-c', filename))
     else:
         os.remove(filename)
 
+    if not no_upload:
+        ## The changes are only remembered as done once the uploads are.
+        save_last_run_snapshot(this_run, snapshot, task_ids)
     return True
 
 #########################
@@ -485,6 +693,8 @@ field. Please revise your configuration for the variables
                 "   $ oairepositoryupdater \n"
                 " Expose records according to sets defined in OAI Repository admin interface and update them every day\n"
                 "   $ oairepositoryupdater -s24\n"
+                " Expose records modified since the last run, and records of modified sets, every hour\n"
+                "   $ oairepositoryupdater -i -s1h\n"
                 " Print OAI repository status\n"
                 "   $ oairepositoryupdater -r\n"
                 " Print OAI repository detailed status\n"
@@ -493,12 +703,15 @@ field. Please revise your configuration for the variables
                 " -r --report\t\tOAI repository status\n"
                 " -d --detailed-report\t\tOAI repository detailed status\n"
                 " -n --no-process\tDo no upload the modifications\n"
+                " -i --incremental\tOnly consider the records modified since the last run\n"
+                "\t\t\tand the records of the sets whose definition changed\n"
                 " --notimechange\tDo not update record modification_date\n"
                 "NOTE: --notimechange should be used with care, basically only the first time a new set is added.",
-            specific_params=("rdn", [
+            specific_params=("rdni", [
                 "report",
                 "detailed-report",
                 "no-process",
+                "incremental",
                 "notimechange"]),
             task_submit_elaborate_specific_parameter_fnc=
                 task_submit_elaborate_specific_parameter,
@@ -512,6 +725,8 @@ def task_submit_elaborate_specific_parameter(key, _value, _opts, _args):
         task_set_option("report", 2)
     elif key in ("-n", "--no-process"):
         task_set_option("no_upload", 1)
+    elif key in ("-i", "--incremental"):
+        task_set_option("incremental", 1)
     elif key in ("--notimechange",):
         task_set_option("notimechange", 1)
     else:
@@ -35,7 +35,9 @@ from invenio.access_control_config import CFG_WEBACCESS_WARNING_MSGS, CFG_WEBACC
 from invenio.webuser import collect_user_info
 from invenio.access_control_firerole import deserialize, load_role_definition, acc_firerole_extract_emails
 from invenio.urlutils import make_canonical_urlargd
+from invenio.timerutils import timed_phase
 
+@timed_phase('access')
 def acc_authorize_action(req, name_action, authorized_if_no_roles=False, **arguments):
     """
     Given the request object (or the user_info dictionary, or the uid), checks
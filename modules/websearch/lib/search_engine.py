@@ -95,6 +95,7 @@ from invenio.search_engine_config import \
      CFG_WEBSEARCH_IDXPAIRS_EXACT_SEARCH
 from invenio.search_engine_utils import (get_fieldvalues,
                                          get_fieldvalues_alephseq_like,
+                                         get_field_tags,
                                          record_exists)
 from invenio.bibrecord import create_record, record_xml_output
 from invenio.bibrank_record_sorter import (get_bibrank_methods,
@@ -112,7 +113,8 @@ from invenio.bibindex_engine_utils import get_idx_indexer
 from invenio.bibformat import format_record, format_records, get_output_format_content_type, create_excel
 from invenio.bibrank_downloads_grapher import create_download_history_graph_and_box
 from invenio.bibknowledge import get_kbr_values
-from invenio.data_cacher import DataCacher
+from invenio.data_cacher import DataCacher, SQLQueryCacher
+from invenio.timerutils import timed_phase
 from invenio.websearch_external_collections import print_external_results_overview, perform_external_collection_search
 from invenio.access_control_admin import acc_get_action_id
 from invenio.access_control_config import VIEWRESTRCOLL, \
@@ -736,19 +738,24 @@ def get_index_id_from_field(field):
         field = 'global' # empty string field means 'global' index (field 'anyfield')
 
     # first look in the index table:
-    res = run_sql("""SELECT id FROM idxINDEX WHERE name=%s""", (field,))
+    res = _query_index_id_from_name(field)
     if res:
         out = res[0][0]
         return out
 
     # not found in the index table, now look in the field table:
-    res = run_sql("""SELECT w.id FROM idxINDEX AS w, idxINDEX_field AS wf, field AS f
-                      WHERE f.code=%s AND wf.id_field=f.id AND w.id=wf.id_idxINDEX
-                      LIMIT 1""", (field,))
+    res = _query_index_id_from_field(field)
     if res:
         out = res[0][0]
     return out
 
+_query_index_id_from_name = SQLQueryCacher("""SELECT id FROM idxINDEX WHERE name=%s""",
+                                           affected_tables=('idxINDEX', ))
+_query_index_id_from_field = SQLQueryCacher("""SELECT w.id FROM idxINDEX AS w, idxINDEX_field AS wf, field AS f
+                                               WHERE f.code=%s AND wf.id_field=f.id AND w.id=wf.id_idxINDEX
+                                               LIMIT 1""",
+                                            affected_tables=('idxINDEX', 'idxINDEX_field', 'field'))
+
 def get_words_from_pattern(pattern):
     """
     Returns list of whitespace-separated words from pattern, removing any
@@ -1781,11 +1788,14 @@ def is_hosted_collection(coll):
 def get_colID(c):
     "Return collection ID for collection name C.  Return None if no match found."
     colID = None
-    res = run_sql("SELECT id FROM collection WHERE name=%s", (c,), 1)
+    res = _query_colID(c)
     if res:
         colID = res[0][0]
     return colID
 
+_query_colID = SQLQueryCacher("SELECT id FROM collection WHERE name=%s",
+                              affected_tables=('collection', ), n=1)
+
 def get_coll_normalised_name(c):
     """Returns normalised collection name (case sensitive) for collection name
        C (case insensitive).
@@ -1801,11 +1811,7 @@ def get_coll_ancestors(coll):
     coll_ancestors = []
     coll_ancestor = coll
     while 1:
-        res = run_sql("""SELECT c.name FROM collection AS c
-                          LEFT JOIN collection_collection AS cc ON c.id=cc.id_dad
-                          LEFT JOIN collection AS ccc ON ccc.id=cc.id_son
-                          WHERE ccc.name=%s ORDER BY cc.id_dad ASC LIMIT 1""",
-                      (coll_ancestor,))
+        res = _query_coll_dad(coll_ancestor)
         if res:
             coll_name = res[0][0]
             coll_ancestors.append(coll_name)
@@ -1816,6 +1822,12 @@ def get_coll_ancestors(coll):
     coll_ancestors.reverse()
     return coll_ancestors
 
+_query_coll_dad = SQLQueryCacher("""SELECT c.name FROM collection AS c
+                                    LEFT JOIN collection_collection AS cc ON c.id=cc.id_dad
+                                    LEFT JOIN collection AS ccc ON ccc.id=cc.id_son
+                                    WHERE ccc.name=%s ORDER BY cc.id_dad ASC LIMIT 1""",
+                                 affected_tables=('collection', 'collection_collection'))
+
 def get_coll_sons(coll, coll_type='r', public_only=1):
     """Return a list of sons (first-level descendants) of type 'coll_type' for collection 'coll'.
        If public_only, then return only non-restricted son collections.
@@ -1996,6 +2008,7 @@ def browse_in_bibwords(req, p, f, ln=CFG_SITE_LANG):
     ))
     return
 
+@timed_phase('search')
 def search_pattern(req=None, p=None, f=None, m=None, ap=0, of="id", verbose=0, ln=CFG_SITE_LANG, display_nearest_terms_box=True, wl=0):
     """Search for complex pattern 'p' within field 'f' according to
        matching type 'm'.  Return hitset of recIDs.
@@ -2201,6 +2214,7 @@ def search_pattern(req=None, p=None, f=None, m=None, ap=0, of="id", verbose=0, l
         write_warning("Search stage 3: execution took %.2f seconds." % (t2 - t1), req=req)
     return hitset_in_any_collection
 
+@timed_phase('search')
 def search_pattern_parenthesised(req=None, p=None, f=None, m=None, ap=0, of="id", verbose=0, ln=CFG_SITE_LANG, display_nearest_terms_box=True, wl=0):
     """Search for complex pattern 'p' containing parenthesis within field 'f' according to
        matching type 'm'.  Return hitset of recIDs.
@@ -2953,6 +2967,7 @@ def search_unit_citedby_excluding_selfcites(query):
     else:
         return intbitset([])
 
+@timed_phase('search')
 def intersect_results_with_collrecs(req, hitset_in_any_collection, colls, of="hb", verbose=0, ln=CFG_SITE_LANG, display_nearest_terms_box=True):
     """Return dict of hitsets given by intersection of hitset with the collection universes."""
 
@@ -3623,11 +3638,14 @@ def get_tag_name(tag_value, prolog="", epilog=""):
        Return empty string in case of failure.
        Example: input='100__%', output=first author'."""
     out = ""
-    res = run_sql("SELECT name FROM tag WHERE value=%s", (tag_value,))
+    res = _query_tag_name(tag_value)
     if res:
         out = prolog + res[0][0] + epilog
     return out
 
+_query_tag_name = SQLQueryCacher("SELECT name FROM tag WHERE value=%s",
+                                 affected_tables=('tag', ))
+
 def get_fieldcodes():
     """Returns a list of field codes that may have been passed as 'search options' in URL.
        Example: output=['subject','division']."""
@@ -3646,19 +3664,6 @@ def get_field_name(code):
     else:
         return ""
 
-def get_field_tags(field):
-    """Returns a list of MARC tags for the field code 'field'.
-       Returns empty list in case of error.
-       Example: field='author', output=['100__%','700__%']."""
-    out = []
-    query = """SELECT t.value FROM tag AS t, field_tag AS ft, field AS f
-                WHERE f.code=%s AND ft.id_field=f.id AND t.id=ft.id_tag
-                ORDER BY ft.score DESC"""
-    res = run_sql(query, (field, ))
-    for val in res:
-        out.append(val[0])
-    return out
-
 def get_fieldvalues_alephseq_like(recID, tags_in, can_see_hidden=False):
     """Return buffer of ALEPH sequential-like textual format with fields found
        in the list TAGS_IN for record RECID.
@@ -4061,6 +4066,7 @@ def get_tags_from_sort_fields(sort_fields):
     return tags, ''
 
 
+@timed_phase('rank')
 def rank_records(req, rank_method_code, rank_limit_relevance, hitset_global, pattern=None, verbose=0, sort_order='d', of='hb', ln=CFG_SITE_LANG, rg=None, jrec=None, field='', sorting_methods=SORTING_METHODS):
     """Initial entry point for ranking records, acts like a dispatcher.
        (i) rank_method_code is in bsrMETHOD, bibsort buckets can be used;
@@ -4110,6 +4116,7 @@ def sort_records_latest(recIDs, jrec, rg, sort_order):
         recIDs.reverse()
     return slice_records(recIDs, jrec, rg)
 
+@timed_phase('sort')
 def sort_records(req, recIDs, sort_field='', sort_order='d', sort_pattern='', verbose=0, of='hb', ln=CFG_SITE_LANG, rg=None, jrec=None, sorting_methods=SORTING_METHODS):
     """Initial entry point for sorting records, acts like a dispatcher.
        (i) sort_field is in the bsrMETHOD, and thus, the BibSort has sorted the data for this field, so we can use the cache;
@@ -4373,6 +4380,7 @@ def get_interval_for_records_to_sort(nb_found, jrec=None, rg=None):
 
     return irec_min, irec_max
 
+@timed_phase('print')
 def print_records(req, recIDs, jrec=1, rg=CFG_WEBSEARCH_DEF_RECORDS_IN_GROUPS, format='hb', ot='', ln=CFG_SITE_LANG,
                   relevances=[], relevances_prologue="(", relevances_epilogue="%%)",
                   decompress=zlib.decompress, search_pattern='', print_records_prologue_p=True,
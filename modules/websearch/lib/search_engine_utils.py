@@ -24,6 +24,7 @@
 from invenio.config import (CFG_BIBFORMAT_HIDDEN_TAGS,
                             CFG_CERN_SITE)
 from invenio.dbquery import run_sql
+from invenio.data_cacher import SQLQueryCacher
 from invenio.intbitset import intbitset
 
 def get_fieldvalues(recIDs, tag, repetitive_values=True, sort=True, split_by=0):
@@ -201,3 +202,14 @@ def record_exists(recID):
         else:
             out = 1 # exists fine
     return out
+
+def get_field_tags(field):
+    """Returns a list of MARC tags for the field code 'field'.
+       Returns empty list in case of error.
+       Example: field='author', output=['100__%','700__%']."""
+    return [row[0] for row in _query_field_tags(field)]
+
+_query_field_tags = SQLQueryCacher("""SELECT t.value FROM tag AS t, field_tag AS ft, field AS f
+                                      WHERE f.code=%s AND ft.id_field=f.id AND t.id=ft.id_tag
+                                      ORDER BY ft.score DESC""",
+                                   affected_tables=('tag', 'field_tag', 'field'))
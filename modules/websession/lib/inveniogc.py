@@ -37,6 +37,7 @@ try:
     from invenio.bibtask_config import CFG_BIBSCHED_LOGDIR
     from invenio.access_control_mailcookie import mail_cookie_gc
     from invenio.bibdocfile import BibDoc
+    from invenio.bibdocfile_textextraction import text_cache_gc
     from invenio.bibsched import gc_tasks
     from invenio.websubmit_config import CFG_WEBSUBMIT_TMP_VIDEO_PREFIX
     from invenio.dateutils import convert_datestruct_to_datetext
@@ -92,6 +93,9 @@ CFG_MAX_ATIME_RM_WEBSUBMIT_CKEDITOR_FILE = 28
 CFG_MAX_ATIME_BIBEDIT_TMP = 3
 # After how many days to remove submitted XML files related to BibEdit
 CFG_MAX_ATIME_BIBEDIT_XML = 3
+# After how many days to remove the cached texts extracted from
+# documents, once no document uses them anymore
+CFG_MAX_ATIME_RM_TEXT_CACHE = 28
 
 def gc_exec_command(command):
     """ Exec the command logging in appropriate way its output."""
@@ -267,6 +271,11 @@ def clean_cache():
     write_message("""%s webjournal cache file pruned out of %s.""" % (count, len(filenames)))
     write_message("""CLEANING OF OLD CACHED WEBJOURNAL FILES FINISHED""")
 
+    write_message("""CLEANING OF UNUSED CACHED TEXTS OF DOCUMENTS STARTED""")
+    count, size = text_cache_gc(CFG_MAX_ATIME_RM_TEXT_CACHE * 24 * 3600)
+    write_message("""%s cached texts pruned (%s bytes).""" % (count, size))
+    write_message("""CLEANING OF UNUSED CACHED TEXTS OF DOCUMENTS FINISHED""")
+
 
 def clean_bibxxx():
     """
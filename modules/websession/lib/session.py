@@ -32,6 +32,7 @@ import random
 import re
 import sys
 import os
+import zlib
 if sys.hexversion < 0x2060000:
     from md5 import md5
 else:
@@ -45,7 +46,10 @@ from invenio.config import (CFG_WEBSESSION_EXPIRY_LIMIT_REMEMBER,
                             CFG_SITE_SECURE_URL,
                             CFG_WEBSESSION_IPADDR_CHECK_SKIP_BITS,
                             CFG_WEBSEARCH_PREV_NEXT_HIT_FOR_GUESTS,
-                            CFG_WEBSESSION_STORAGE)
+                            CFG_WEBSESSION_STORAGE,
+                            CFG_WEBSESSION_LAZY_LOADING,
+                            CFG_WEBSESSION_EXPIRY_REFRESH_INTERVAL,
+                            CFG_WEBSESSION_MAX_SIZE)
 from invenio.websession_config import (CFG_WEBSESSION_COOKIE_NAME,
                                       CFG_WEBSESSION_ONE_DAY,
                                       CFG_WEBSESSION_CLEANUP_CHANCE)
@@ -60,6 +64,14 @@ if CFG_WEBSEARCH_PREV_NEXT_HIT_FOR_GUESTS:
 else:
     _CFG_SESSION_NON_USEFUL_KEYS = ('uid', 'user_info', 'websearch-last-query', 'websearch-last-query-hits')
 
+## Keys that are dropped from a session that does not fit within
+## CFG_WEBSESSION_MAX_SIZE (they only cache the last search results).
+_CFG_SESSION_DROPPABLE_KEYS = ('websearch-last-query-hits', 'websearch-last-query')
+
+## Prefix of a session object stored in compressed form.  A pickle
+## can never start with this character.
+_COMPRESSED_SESSION_MARKER = 'Z'
+
 def get_session(req, sid=None):
     """
     Obtain a session.
@@ -117,6 +129,9 @@ class InvenioSessionBase(dict):
         self._https_ip = None
         self.__need_https = False
         self._cleanup_function = None
+        self._load_pending = False
+        self._stored_digest = None
+        self._stored_accessed = 0
 
         dict.__init__(self)
 
@@ -143,21 +158,17 @@ class InvenioSessionBase(dict):
                     self._sid = None
 
         if self._sid:
-            # attempt to load ourselves
-            if self.load():
+            if CFG_WEBSESSION_LAZY_LOADING:
+                # we will load ourselves as soon as somebody looks
+                # into the session
+                self._load_pending = True
+                self._new = 0
+            elif self.load():
+                # we managed to load ourselves
                 self._new = 0
 
         if self._new:
-            # make a new session
-            self._sid = _new_sid(self._req)
-            remote_ip = self._req.remote_ip
-            if self._req.is_https():
-                self._https_ip = remote_ip
-            else:
-                self._http_ip = remote_ip
-            self._created = time.time()
-            self._timeout = CFG_WEBSESSION_EXPIRY_LIMIT_DEFAULT * \
-                CFG_WEBSESSION_ONE_DAY
+            self._init_new_session()
 
         self._accessed = time.time()
 
@@ -172,6 +183,45 @@ class InvenioSessionBase(dict):
             for cookie in self.make_cookies():
                 self._req.set_cookie(cookie)
 
+    def _init_new_session(self):
+        """
+        Make a new session.
+        """
+        self._new = 1
+        self._sid = _new_sid(self._req)
+        remote_ip = self._req.remote_ip
+        if self._req.is_https():
+            self._https_ip = remote_ip
+        else:
+            self._http_ip = remote_ip
+        self._created = time.time()
+        self._timeout = CFG_WEBSESSION_EXPIRY_LIMIT_DEFAULT * \
+            CFG_WEBSESSION_ONE_DAY
+
+    def _ensure_loaded(self):
+        """
+        Load the session from the storage, in case this was postponed
+        because of CFG_WEBSESSION_LAZY_LOADING.  If the stored session
+        turns out to be expired or invalid, a new session is created
+        instead.
+        """
+        if self._load_pending:
+            self._load_pending = False
+            if not self.load():
+                self._init_new_session()
+                if not self.__need_https or self._req.is_https():
+                    for cookie in self.make_cookies():
+                        self._req.set_cookie(cookie)
+            self._accessed = time.time()
+
+    def is_loaded(self):
+        """
+        @return: False if the session has not been fetched yet from the
+            storage (see CFG_WEBSESSION_LAZY_LOADING).
+        @rtype: bool
+        """
+        return not self._load_pending
+
     def get_dirty(self):
         """
         Is this session dirty?
@@ -197,6 +247,82 @@ class InvenioSessionBase(dict):
             dict.__delitem__(self, key)
             self._dirty = True
 
+    ## The following methods are overridden only in order to
+    ## transparently load the session the first time it is looked into.
+
+    def __getitem__(self, key):
+        self._ensure_loaded()
+        return dict.__getitem__(self, key)
+
+    def __contains__(self, key):
+        self._ensure_loaded()
+        return dict.__contains__(self, key)
+
+    def __iter__(self):
+        self._ensure_loaded()
+        return dict.__iter__(self)
+
+    def __len__(self):
+        self._ensure_loaded()
+        return dict.__len__(self)
+
+    def get(self, key, default=None):
+        self._ensure_loaded()
+        return dict.get(self, key, default)
+
+    def has_key(self, key):
+        self._ensure_loaded()
+        return dict.has_key(self, key)
+
+    def keys(self):
+        self._ensure_loaded()
+        return dict.keys(self)
+
+    def values(self):
+        self._ensure_loaded()
+        return dict.values(self)
+
+    def items(self):
+        self._ensure_loaded()
+        return dict.items(self)
+
+    def iterkeys(self):
+        self._ensure_loaded()
+        return dict.iterkeys(self)
+
+    def itervalues(self):
+        self._ensure_loaded()
+        return dict.itervalues(self)
+
+    def iteritems(self):
+        self._ensure_loaded()
+        return dict.iteritems(self)
+
+    def copy(self):
+        self._ensure_loaded()
+        return dict.copy(self)
+
+    def setdefault(self, key, default=None):
+        self._ensure_loaded()
+        return dict.setdefault(self, key, default)
+
+    def pop(self, key, *default):
+        self._ensure_loaded()
+        return dict.pop(self, key, *default)
+
+    def popitem(self):
+        self._ensure_loaded()
+        return dict.popitem(self)
+
+    def update(self, *args, **kwargs):
+        self._ensure_loaded()
+        return dict.update(self, *args, **kwargs)
+
+    def clear(self):
+        ## No need to load a session that is going to be emptied.
+        self._load_pending = False
+        return dict.clear(self)
+
     def set_remember_me(self, remember_me=True):
         """
         Set/Unset the L{_remember_me} flag.
@@ -225,7 +351,7 @@ class InvenioSessionBase(dict):
         invalid = False
         res = self.load_from_storage(self._sid)
         if res:
-            session_dict = cPickle.loads(blob_to_string(res))
+            session_dict = _loads_session(blob_to_string(res))
             remote_ip = self._req.remote_ip
             if self._req.is_https():
                 if session_dict['_https_ip'] is not None:
@@ -271,8 +397,64 @@ class InvenioSessionBase(dict):
         self._timeout  = session_dict["_timeout"]
         self._remember_me = session_dict["_remember_me"]
         self.update(session_dict["_data"])
+        if CFG_WEBSESSION_EXPIRY_REFRESH_INTERVAL:
+            self._stored_accessed = self._accessed
+            self._stored_digest = self._get_digest()
         return 1
 
+    def _get_digest(self):
+        """
+        @return: a digest of everything that is stored with the session,
+            apart from the last access timestamp.
+        @rtype: string
+        """
+        return md5(cPickle.dumps((self.copy(),
+                                  self._created,
+                                  self._timeout,
+                                  self._http_ip,
+                                  self._https_ip,
+                                  self._remember_me), -1)).digest()
+
+    def _is_refresh_needed(self):
+        """
+        @return: True if the session has to be written back to the
+            storage: i.e. if its content changed since it was loaded, or
+            if its expiry date has not been refreshed since more than
+            CFG_WEBSESSION_EXPIRY_REFRESH_INTERVAL minutes.
+        @rtype: bool
+        """
+        if not CFG_WEBSESSION_EXPIRY_REFRESH_INTERVAL or \
+                self._stored_digest is None:
+            return True
+        if self._accessed - self._stored_accessed >= \
+                CFG_WEBSESSION_EXPIRY_REFRESH_INTERVAL * 60:
+            return True
+        return self._get_digest() != self._stored_digest
+
+    def _serialize(self, session_dict):
+        """
+        Serialize the session, enforcing CFG_WEBSESSION_MAX_SIZE.
+
+        @param session_dict: the session to serialize. Note that
+            droppable keys might be removed from its C{_data}.
+        @type session_dict: dict
+        @return: the serialized session, or None if it is too big to be
+            stored.
+        @rtype: string
+        """
+        if not CFG_WEBSESSION_MAX_SIZE:
+            return _dumps_session(session_dict)
+        session_object = _dumps_session(session_dict, compress=True)
+        if len(session_object) > CFG_WEBSESSION_MAX_SIZE:
+            for key in _CFG_SESSION_DROPPABLE_KEYS:
+                session_dict['_data'].pop(key, None)
+                dict.pop(self, key, None)
+            session_object = _dumps_session(session_dict, compress=True)
+            if len(session_object) > CFG_WEBSESSION_MAX_SIZE:
+                self._req.log_error("InvenioSession: session %s of %s bytes exceeds CFG_WEBSESSION_MAX_SIZE, not stored." % (self._sid, len(session_object)))
+                return None
+        return session_object
+
     def is_useful(self):
         """
         Return True if the session contains some key considered
@@ -287,8 +469,13 @@ class InvenioSessionBase(dict):
         """
         Save the session to the database.
         """
+        if self._load_pending:
+            ## Nobody looked into the session during this request, hence
+            ## nothing could have changed.
+            self._dirty = False
+            return
         uid = self.get('uid', -1)
-        if (not self.__need_https or self._req.is_https()) and not self._invalid and self._sid and self._dirty and (uid > 0 or self.is_useful()):
+        if (not self.__need_https or self._req.is_https()) and not self._invalid and self._sid and self._dirty and (uid > 0 or self.is_useful()) and self._is_refresh_needed():
             ## We store something only for real users or useful sessions.
             session_dict = {"_data" : self.copy(),
                     "_created" : self._created,
@@ -298,15 +485,19 @@ class InvenioSessionBase(dict):
                     "_https_ip" : self._https_ip,
                     "_remember_me" : self._remember_me
             }
-            session_object = cPickle.dumps(session_dict, -1)
-
-            self.save_in_storage(self._sid,
-                                 session_object,
-                                 self._timeout,
-                                 uid)
-
-            for cookie in self.make_cookies():
-                self._req.set_cookie(cookie)
+            session_object = self._serialize(session_dict)
+
+            if session_object is not None:
+                self.save_in_storage(self._sid,
+                                     session_object,
+                                     self._timeout,
+                                     uid)
+                if CFG_WEBSESSION_EXPIRY_REFRESH_INTERVAL:
+                    self._stored_accessed = self._accessed
+                    self._stored_digest = self._get_digest()
+
+                for cookie in self.make_cookies():
+                    self._req.set_cookie(cookie)
         ## No more dirty :-)
         self._dirty = False
 
@@ -383,6 +574,7 @@ class InvenioSessionBase(dict):
         @return: True if the session has just been created.
         @rtype: bool
         """
+        self._ensure_loaded()
         return not not self._new
 
     def sid(self):
@@ -390,6 +582,7 @@ class InvenioSessionBase(dict):
         @return: the session identifier.
         @rtype: 32 hexadecimal string
         """
+        self._ensure_loaded()
         return self._sid
 
     def created(self):
@@ -397,6 +590,7 @@ class InvenioSessionBase(dict):
         @return: the UNIX timestamp for when the session has been created.
         @rtype: double
         """
+        self._ensure_loaded()
         return self._created
 
     def last_accessed(self):
@@ -405,6 +599,7 @@ class InvenioSessionBase(dict):
             accessed.
         @rtype: double
         """
+        self._ensure_loaded()
         return self._accessed
 
     def timeout(self):
@@ -413,6 +608,7 @@ class InvenioSessionBase(dict):
             after which the session is invalid.
         @rtype: double
         """
+        self._ensure_loaded()
         return self._timeout
 
     def set_timeout(self, secs):
@@ -422,6 +618,7 @@ class InvenioSessionBase(dict):
         @param secs: the number of seconds.
         @type secs: double
         """
+        self._ensure_loaded()
         self._timeout = secs
 
     def cleanup(self):
@@ -554,6 +751,36 @@ def _new_sid(req):
         remote_ip)
     ).hexdigest()
 
+def _dumps_session(session_dict, compress=False):
+    """
+    Serialize a session.
+
+    @param session_dict: the session data and metadata.
+    @type session_dict: dict
+    @param compress: whether to compress the serialized session.
+    @type compress: bool
+    @return: the serialized session.
+    @rtype: string
+    """
+    session_object = cPickle.dumps(session_dict, -1)
+    if compress:
+        return _COMPRESSED_SESSION_MARKER + zlib.compress(session_object, 1)
+    return session_object
+
+def _loads_session(session_object):
+    """
+    Deserialize a session serialized with L{_dumps_session}, be it
+    compressed or not.
+
+    @param session_object: the serialized session.
+    @type session_object: string
+    @return: the session data and metadata.
+    @rtype: dict
+    """
+    if session_object.startswith(_COMPRESSED_SESSION_MARKER):
+        session_object = zlib.decompress(session_object[1:])
+    return cPickle.loads(session_object)
+
 def _mkip(ip):
     """
     Compute a numerical value for a dotted IP
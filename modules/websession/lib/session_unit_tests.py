@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+##
+## This file is part of Invenio.
+## Copyright (C) 2014 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""Unit tests for the session handling library."""
+
+__revision__ = "$Id$"
+
+import cPickle
+import time
+
+from invenio.testutils import InvenioTestCase, make_test_suite, \
+    run_test_suite
+from invenio import session
+
+
+class _FakeRequest(object):
+    """Just enough of a request for a session."""
+
+    def __init__(self):
+        self.remote_ip = '127.0.0.1'
+        self.headers_in = {}
+        self.cookies = []
+        self.errors = []
+
+    def is_https(self):
+        return False
+
+    def set_cookie(self, cookie):
+        self.cookies.append(cookie)
+
+    def register_cleanup(self, callback, data=None):
+        pass
+
+    def log_error(self, message):
+        self.errors.append(message)
+
+
+class _MemorySession(session.InvenioSessionBase):
+    """Session kept in a dictionary, counting the storage accesses."""
+
+    storage = {}
+    loads = 0
+    saves = 0
+
+    def load_from_storage(self, sid):
+        _MemorySession.loads += 1
+        return self.storage.get(sid)
+
+    def delete_from_storage(self, sid):
+        self.storage.pop(sid, None)
+
+    def save_in_storage(self, sid, session_object, timeout, uid):
+        _MemorySession.saves += 1
+        self.storage[sid] = session_object
+
+
+class _SessionTestCase(InvenioTestCase):
+    """Saves and restores the configuration of the session module."""
+
+    config = {}
+
+    def setUp(self):
+        self.old_config = {}
+        for name, value in (('CFG_WEBSESSION_LAZY_LOADING', False),
+                            ('CFG_WEBSESSION_EXPIRY_REFRESH_INTERVAL', 0),
+                            ('CFG_WEBSESSION_MAX_SIZE', 0),
+                            ('CFG_WEBSESSION_EXPIRY_LIMIT_DEFAULT', 2),
+                            ('CFG_WEBSESSION_IPADDR_CHECK_SKIP_BITS', 0)):
+            self.old_config[name] = getattr(session, name)
+            setattr(session, name, self.config.get(name, value))
+        _MemorySession.storage.clear()
+        _MemorySession.loads = _MemorySession.saves = 0
+        self.req = _FakeRequest()
+
+    def tearDown(self):
+        for name, value in self.old_config.items():
+            setattr(session, name, value)
+
+    def make_stored_session(self, **data):
+        """Stores a session of a logged in user and returns its sid."""
+        a_session = _MemorySession(_FakeRequest())
+        a_session['uid'] = 5
+        for key, value in data.items():
+            a_session[key] = value
+        a_session.save()
+        _MemorySession.loads = _MemorySession.saves = 0
+        return a_session.sid()
+
+
+class LazyLoadingTest(_SessionTestCase):
+    """Session loaded the first time it is looked into."""
+
+    config = {'CFG_WEBSESSION_LAZY_LOADING': True}
+
+    def test_not_loaded_until_used(self):
+        """session - lazy loading postpones reading the storage"""
+        sid = self.make_stored_session(foo='bar')
+        a_session = _MemorySession(self.req, sid)
+        self.assertFalse(a_session.is_loaded())
+        self.assertEqual(_MemorySession.loads, 0)
+        self.assertEqual(a_session['foo'], 'bar')
+        self.assertTrue(a_session.is_loaded())
+        self.assertEqual(a_session.get('uid'), 5)
+        self.assertEqual(_MemorySession.loads, 1)
+
+    def test_unused_session_not_saved(self):
+        """session - lazy loading skips storing unread sessions"""
+        sid = self.make_stored_session()
+        a_session = _MemorySession(self.req, sid)
+        a_session.dirty = True
+        a_session.save()
+        self.assertEqual(_MemorySession.loads, 0)
+        self.assertEqual(_MemorySession.saves, 0)
+
+    def test_missing_session_replaced(self):
+        """session - lazy loading of an unknown session makes a new one"""
+        sid = 'a' * 32
+        a_session = _MemorySession(self.req, sid)
+        self.assertEqual(a_session.get('uid'), None)
+        self.assertNotEqual(a_session.sid(), sid)
+        self.assertTrue(a_session.is_new())
+        self.assertTrue(self.req.cookies)
+
+
+class ExpiryRefreshTest(_SessionTestCase):
+    """Unchanged sessions are written back once in a while only."""
+
+    config = {'CFG_WEBSESSION_EXPIRY_REFRESH_INTERVAL': 10}
+
+    def test_unchanged_session_not_saved(self):
+        """session - an unchanged session is not stored again"""
+        a_session = _MemorySession(self.req, self.make_stored_session())
+        a_session.dirty = True
+        a_session.save()
+        self.assertEqual(_MemorySession.saves, 0)
+
+    def test_changed_session_saved(self):
+        """session - a changed session is stored"""
+        a_session = _MemorySession(self.req, self.make_stored_session())
+        a_session['foo'] = 'bar'
+        a_session.save()
+        self.assertEqual(_MemorySession.saves, 1)
+        a_session.dirty = True
+        a_session.save()
+        self.assertEqual(_MemorySession.saves, 1)
+
+    def test_expiry_refreshed(self):
+        """session - an unchanged session is stored after the interval"""
+        a_session = _MemorySession(self.req, self.make_stored_session())
+        a_session._stored_accessed -= 11 * 60
+        a_session.dirty = True
+        a_session.save()
+        self.assertEqual(_MemorySession.saves, 1)
+
+
+class MaxSizeTest(_SessionTestCase):
+    """Sessions bigger than CFG_WEBSESSION_MAX_SIZE."""
+
+    config = {'CFG_WEBSESSION_MAX_SIZE': 2000}
+
+    def random_data(self, size):
+        """Data which does not compress."""
+        import random
+        generator = random.Random(0)
+        return ''.join([chr(generator.randint(0, 255)) for dummy in range(size)])
+
+    def test_compressed(self):
+        """session - sessions are stored compressed"""
+        sid = self.make_stored_session(foo='bar' * 1000)
+        session_object = _MemorySession.storage[sid]
+        self.assertTrue(session_object.startswith(
+            session._COMPRESSED_SESSION_MARKER))
+        self.assertTrue(len(session_object) < 2000)
+        self.assertEqual(_MemorySession(self.req, sid)['foo'], 'bar' * 1000)
+
+    def test_droppable_keys_dropped(self):
+        """session - cached search results are dropped from big sessions"""
+        sid = self.make_stored_session(**{
+            'foo': 'bar',
+            'websearch-last-query-hits': self.random_data(3000)})
+        a_session = _MemorySession(self.req, sid)
+        self.assertEqual(a_session['foo'], 'bar')
+        self.assertFalse('websearch-last-query-hits' in a_session)
+
+    def test_too_big_not_stored(self):
+        """session - sessions too big are not stored"""
+        a_session = _MemorySession(self.req)
+        a_session['uid'] = 5
+        a_session['foo'] = self.random_data(3000)
+        a_session.save()
+        self.assertEqual(_MemorySession.saves, 0)
+        self.assertTrue(self.req.errors)
+
+    def test_uncompressed_readable(self):
+        """session - sessions stored uncompressed can be read"""
+        sid = 'b' * 32
+        now = time.time()
+        _MemorySession.storage[sid] = cPickle.dumps({
+            '_data': {'uid': 5, 'foo': 'bar'}, '_created': now,
+            '_accessed': now, '_timeout': 3600, '_http_ip': None,
+            '_https_ip': None, '_remember_me': False}, -1)
+        a_session = _MemorySession(self.req, sid)
+        self.assertEqual(a_session['foo'], 'bar')
+        self.assertFalse(a_session.is_new())
+
+
+TEST_SUITE = make_test_suite(LazyLoadingTest,
+                             ExpiryRefreshTest,
+                             MaxSizeTest)
+
+if __name__ == "__main__":
+    run_test_suite(TEST_SUITE)
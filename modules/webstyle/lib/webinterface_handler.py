@@ -39,10 +39,13 @@ import sys
 import re
 import os
 import gc
+import random
 
 from invenio import webinterface_handler_config as apache
 from invenio.config import CFG_SITE_URL, CFG_SITE_SECURE_URL, CFG_TMPDIR, \
-    CFG_SITE_RECORD, CFG_ACCESS_CONTROL_LEVEL_SITE
+    CFG_SITE_RECORD, CFG_ACCESS_CONTROL_LEVEL_SITE, \
+    CFG_MISCUTIL_SQL_PROFILING_SAMPLE_RATE, \
+    CFG_MISCUTIL_SQL_REPLICA_OK_FOR_GUESTS
 from invenio.messages import wash_language
 from invenio.urlutils import redirect_to_url
 from invenio.errorlib import register_exception
@@ -52,6 +55,8 @@ from invenio.webinterface_handler_wsgi_utils import StringField
 from invenio.session import get_session
 from invenio import web_api_key
 from invenio.access_control_engine import acc_authorize_action
+from invenio.dbquery import replica_ok_context
+from invenio.timerutils import timed_phase
 
 
 ## The following variable is True if the installation make any difference
@@ -271,6 +276,18 @@ class WebInterfaceDirectory(object):
         raise TraversalError()
 
 
+def _traverse(root, req, path, do_head, guest_p):
+    """
+    Traverse ROOT following PATH, letting guests GET and HEAD requests
+    use the read replicas if CFG_MISCUTIL_SQL_REPLICA_OK_FOR_GUESTS.
+    """
+    if CFG_MISCUTIL_SQL_REPLICA_OK_FOR_GUESTS and guest_p and \
+            req.method in ('GET', 'HEAD'):
+        with replica_ok_context():
+            return root._traverse(req, path, do_head, guest_p)
+    return root._traverse(req, path, do_head, guest_p)
+
+
 def create_handler(root):
     """ Return a handler function that will dispatch apache requests
     through the URL layout passed in parameter."""
@@ -284,6 +301,8 @@ def create_handler(root):
         can provide profile=algorithm_name. You can add more than one
         profile requirement like ?profile=time&profile=cumulative.
         The list of available algorithm is displayed at the end of the profile.
+        Use profile=sql in order to display the SQL queries run by the
+        request instead.
         """
         args = {}
         if req.args:
@@ -301,6 +320,21 @@ def create_handler(root):
         # Profiler enabled?
         if 'profile' in args:
 
+            if 'sql' in args.get('profile', []):
+                from invenio.dbquery_profiler import start_sql_profiling, \
+                    stop_sql_profiling
+                profiler = start_sql_profiling()
+                try:
+                    ret = _handler(req)
+                finally:
+                    stop_sql_profiling()
+                ## Do not corrupt JSON, XML, file downloads...
+                if (req.content_type or '').startswith('text/html'):
+                    req.write("\n<pre>%s</pre>" % cgi.escape(profiler.get_report()))
+                else:
+                    req.log_error(profiler.get_report())
+                return ret
+
             if 'memory' in args.get('profile', []):
                 gc.set_debug(gc.DEBUG_LEAK)
                 ret = _handler(req)
@@ -395,7 +429,8 @@ def create_handler(root):
                 else:
                     setUid(req=req, uid=uid)
 
-        guest_p = isGuestUser(getUid(req), run_on_slave=False)
+        with timed_phase('session'):
+            guest_p = isGuestUser(getUid(req), run_on_slave=False)
 
         uri = req.uri
         if uri == '/':
@@ -427,10 +462,10 @@ def create_handler(root):
 
         try:
             if req.header_only and not RE_SPECIAL_URI.match(req.uri):
-                return root._traverse(req, path, True, guest_p)
+                return _traverse(root, req, path, True, guest_p)
             else:
                 ## bibdocfile have a special treatment for HEAD
-                return root._traverse(req, path, False, guest_p)
+                return _traverse(root, req, path, False, guest_p)
         except TraversalError:
             raise apache.SERVER_RETURN, apache.HTTP_NOT_FOUND
         except apache.SERVER_RETURN:
@@ -456,6 +491,26 @@ def create_handler(root):
 
         # Serve an error by default.
         raise apache.SERVER_RETURN, apache.HTTP_NOT_FOUND
+
+    def _sql_sampler(req):
+        """ This handler wraps the profiler handler in order to log
+        the SQL profile of a random sample of requests, according to
+        CFG_MISCUTIL_SQL_PROFILING_SAMPLE_RATE.
+        """
+        if random.random() >= CFG_MISCUTIL_SQL_PROFILING_SAMPLE_RATE:
+            return _profiler(req)
+        from invenio.dbquery_profiler import start_sql_profiling, \
+            stop_sql_profiling
+        profiler = start_sql_profiling()
+        try:
+            return _profiler(req)
+        finally:
+            ## profile=sql might have replaced our profiler
+            stop_sql_profiling()
+            profiler.log_summary(req.unparsed_uri)
+
+    if CFG_MISCUTIL_SQL_PROFILING_SAMPLE_RATE > 0:
+        return _sql_sampler
     return _profiler
 
 
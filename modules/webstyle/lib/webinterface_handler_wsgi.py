@@ -24,6 +24,7 @@ import re
 import cgi
 import gc
 import inspect
+import random
 import socket
 from fnmatch import fnmatch
 from urlparse import urlparse, urlunparse
@@ -47,8 +48,12 @@ from invenio.webinterface_handler_config import \
     HTTP_NOT_FOUND, HTTP_INTERNAL_SERVER_ERROR
 from invenio.config import CFG_WEBDIR, CFG_SITE_LANG, \
     CFG_WEBSTYLE_HTTP_STATUS_ALERT_LIST, CFG_DEVEL_SITE, CFG_SITE_URL, \
-    CFG_SITE_SECURE_URL, CFG_WEBSTYLE_REVERSE_PROXY_IPS
+    CFG_SITE_SECURE_URL, CFG_WEBSTYLE_REVERSE_PROXY_IPS, \
+    CFG_WEBSTYLE_REQUEST_TIMING, CFG_WEBSTYLE_SLOW_REQUEST_THRESHOLD, \
+    CFG_WEBSTYLE_SLOW_REQUEST_SAMPLE_RATE
 from invenio.errorlib import register_exception, get_pretty_traceback
+from invenio.timerutils import timed_phase, get_request_timer, \
+    start_request_timer, stop_request_timer
 
 ## Static files are usually handled directly by the webserver (e.g. Apache)
 ## However in case WSGI is required to handle static files too (such
@@ -56,6 +61,9 @@ from invenio.errorlib import register_exception, get_pretty_traceback
 ## turned on (it is done automatically by wsgi_handler_test).
 CFG_WSGI_SERVE_STATIC_FILES = False
 
+## Block size used when files are streamed through wsgi.file_wrapper.
+CFG_WSGI_FILE_BLOCK_SIZE = 64 * 1024
+
 
 ## Magic regexp to search for usage of CFG_SITE_URL within src/href or
 ## any src usage of an external website
@@ -89,6 +97,32 @@ class InputProcessed(object):
         raise EOFError('The wsgi.input stream has already been consumed')
     readline = readlines = __iter__ = read
 
+class FileRangeWrapper(object):
+    """
+    Iterate over THE_LEN bytes of FILELIKE, from its current position.
+    Used as WSGI response, in place of wsgi.file_wrapper, when the server
+    would send the file until its end.
+    """
+    def __init__(self, filelike, the_len, blksize=CFG_WSGI_FILE_BLOCK_SIZE):
+        self.filelike = filelike
+        self.remaining = the_len
+        self.blksize = blksize
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        if self.remaining <= 0:
+            raise StopIteration
+        data = self.filelike.read(min(self.blksize, self.remaining))
+        if not data:
+            raise StopIteration
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.filelike.close()
+
 class SimulatedModPythonRequest(object):
     """
     mod_python like request object.
@@ -108,6 +142,7 @@ class SimulatedModPythonRequest(object):
         self.__filename = None
         self.__disposition_type = None
         self.__bytes_sent = 0
+        self.__response_iterable = None
         self.__allowed_methods = []
         self.__cleanups = []
         self.headers_out = self.__headers
@@ -196,6 +231,10 @@ class SimulatedModPythonRequest(object):
 
     def flush(self):
         self.send_http_header()
+        if self.__buffer and self.__response_iterable is not None:
+            ## Something is written after a file: the file must be
+            ## written first.
+            self._write_response_iterable()
         if self.__buffer:
             self.__bytes_sent += len(self.__buffer)
             try:
@@ -234,6 +273,12 @@ class SimulatedModPythonRequest(object):
             self.__tainted = True
             if self.__allowed_methods and self.__status.startswith('405 ') or self.__status.startswith('501 '):
                 self.__headers['Allow'] = ', '.join(self.__allowed_methods)
+            if CFG_WEBSTYLE_REQUEST_TIMING:
+                ## Only the phases completed so far can be reported,
+                ## the complete breakdown goes to the slow request log.
+                timer = get_request_timer()
+                if timer is not None:
+                    self.__headers['Server-Timing'] = timer.get_server_timing_header()
 
             ## See: <http://www.python.org/dev/peps/pep-0333/#the-write-callable>
             #print self.__low_level_headers
@@ -298,11 +343,54 @@ class SimulatedModPythonRequest(object):
     def get_wsgi_status(self):
         return self.__status
 
+    def get_response_iterable(self):
+        """
+        @return: the iterable to be returned to the WSGI server as the
+            body of the response, if the body is a file (see sendfile()),
+            or None.
+        """
+        return self.__response_iterable
+
+    def discard_response_iterable(self):
+        """Close the file to be returned by sendfile(), if any, e.g.
+        because an error page is returned instead."""
+        response_iterable, self.__response_iterable = self.__response_iterable, None
+        if response_iterable is not None and hasattr(response_iterable, 'close'):
+            response_iterable.close()
+
+    def _write_response_iterable(self):
+        """Write the pending file to the client through the write callable."""
+        response_iterable, self.__response_iterable = self.__response_iterable, None
+        try:
+            for chunk in response_iterable:
+                self.__write(chunk)
+        finally:
+            response_iterable.close()
+
     def sendfile(self, path, offset=0, the_len=-1):
         try:
             self.send_http_header()
-            file_to_send = open(path)
+            file_to_send = open(path, 'rb')
             file_to_send.seek(offset)
+            if self.__response_iterable is None and not self.__bytes_sent \
+                    and not self.__buffer and not self.track_writings:
+                ## Nothing else is part of the body: the file is returned
+                ## to the WSGI server, which can send it without copying
+                ## it in Python (e.g. with sendfile(2) under mod_wsgi).
+                size = os.fstat(file_to_send.fileno()).st_size
+                if the_len < 0 or offset + the_len >= size:
+                    the_len = max(0, size - offset)
+                    until_eof = True
+                else:
+                    until_eof = False
+                file_wrapper = self.__environ.get('wsgi.file_wrapper')
+                ## mod_wsgi sends no more than the Content-Length
+                if file_wrapper is not None and (until_eof or 'mod_wsgi.version' in self.__environ):
+                    self.__response_iterable = file_wrapper(file_to_send, CFG_WSGI_FILE_BLOCK_SIZE)
+                else:
+                    self.__response_iterable = FileRangeWrapper(file_to_send, the_len)
+                self.__bytes_sent += the_len
+                return self.__bytes_sent
             file_wrapper = FileWrapper(file_to_send)
             count = 0
             if the_len < 0:
@@ -478,6 +566,8 @@ def application(environ, start_response):
     ## Needed for mod_wsgi, see: <http://code.google.com/p/modwsgi/wiki/ApplicationIssues>
     req = SimulatedModPythonRequest(environ, start_response)
     #print 'Starting mod_python simulation'
+    if CFG_WEBSTYLE_REQUEST_TIMING:
+        start_request_timer()
     try:
         try:
             if (CFG_FULL_HTTPS or (CFG_HAS_HTTPS_SUPPORT and get_session(req).need_https)) and not req.is_https():
@@ -516,6 +606,7 @@ def application(environ, start_response):
         except SERVER_RETURN, status:
             status = int(str(status))
             if status not in (OK, DONE):
+                req.discard_response_iterable()
                 req.status = status
                 req.headers_out['content-type'] = 'text/html'
                 admin_to_be_alerted = alert_admin_for_server_status_p(status,
@@ -529,6 +620,7 @@ def application(environ, start_response):
                 req.flush()
         except:
             register_exception(req=req, alert_admin=True)
+            req.discard_response_iterable()
             if not req.response_sent_p:
                 req.status = HTTP_INTERNAL_SERVER_ERROR
                 req.headers_out['content-type'] = 'text/html'
@@ -549,9 +641,10 @@ def application(environ, start_response):
                     ## We save the session only if it's safe to do it, i.e.
                     ## if we well had a valid session.
                     session.dirty = True
-                    session.save()
-                if 'user_info' in req._session:
-                    del req._session['user_info']
+                    with timed_phase('session'):
+                        session.save()
+                if session.is_loaded() and 'user_info' in session:
+                    del session['user_info']
             finally:
                 del session
         except Exception:
@@ -570,16 +663,45 @@ def application(environ, start_response):
             ## For the same reason we can delete the user_info.
             delattr(req, '_user_info')
 
-        for (callback, data) in req.get_cleanups():
-            callback(data)
+        try:
+            for (callback, data) in req.get_cleanups():
+                callback(data)
+        finally:
+            ## Never leave the timer of this request behind for the
+            ## next request of the thread.
+            if CFG_WEBSTYLE_REQUEST_TIMING:
+                log_slow_request(req, stop_request_timer())
 
         ## as suggested in
         ## <http://www.python.org/doc/2.3.5/lib/module-gc.html>
         gc.enable()
         gc.collect()
         del gc.garbage[:]
+    response_iterable = req.get_response_iterable()
+    if response_iterable is not None:
+        return response_iterable
     return []
 
+def log_slow_request(req, timer):
+    """
+    Log the phase breakdown of the request if it took longer than
+    CFG_WEBSTYLE_SLOW_REQUEST_THRESHOLD, for a sample of
+    CFG_WEBSTYLE_SLOW_REQUEST_SAMPLE_RATE of the slow requests.
+    """
+    if timer is None or not CFG_WEBSTYLE_SLOW_REQUEST_THRESHOLD:
+        return
+    if timer.get_elapsed() < CFG_WEBSTYLE_SLOW_REQUEST_THRESHOLD:
+        return
+    if random.random() >= CFG_WEBSTYLE_SLOW_REQUEST_SAMPLE_RATE:
+        return
+    try:
+        timer.log_summary(req.unparsed_uri,
+                          method=req.method,
+                          status=req.status,
+                          remote_ip=req.remote_ip)
+    except Exception:
+        register_exception(req=req)
+
 def generate_error_page(req, admin_was_alerted=True, page_already_started=False):
     """
     Returns an iterable with the error page to be sent to the user browser.
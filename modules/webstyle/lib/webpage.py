@@ -35,6 +35,8 @@ from invenio.webuser import \
      create_adminactivities_menu, \
      getUid
 
+from invenio.timerutils import timed_phase
+
 import invenio.template
 webstyle_templates = invenio.template.load('webstyle')
 
@@ -60,6 +62,7 @@ def create_navtrailbox_body(title,
                                                     prolog = prolog,
                                                     epilog = epilog)
 
+@timed_phase('page')
 def page(title, body, navtrail="", description="", keywords="",
          metaheaderadd="", uid=None,
          cdspageheaderadd="", cdspageboxlefttopadd="",